@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------------------
+import pytest
+
+from integrations.dar_helper import address_cache
+
+# --------------------------------------------------------------------------------------
+# Fixtures
+# --------------------------------------------------------------------------------------
+
+
+@pytest.fixture(autouse=True)
+def dar_cache_in_memory(monkeypatch):
+    """Keep the DAR address cache of the tests in memory, not in the checkout."""
+    load_settings = address_cache._load_settings
+    monkeypatch.setattr(
+        address_cache,
+        "_load_settings",
+        lambda: {**load_settings(), "dar.cache_file": ":memory:"},
+    )
+    address_cache.get_resolver.cache_clear()
+    yield
+    address_cache.get_resolver.cache_clear()
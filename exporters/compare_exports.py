@@ -7,12 +7,22 @@ producerede filer og melde tilbage om hvilke forskelle der er er fundet. I den
 ideele verden findes der ingen forskelle. I øjeblikket (maj 2020) er der dog enkelte
 forskelle som stammer fra en bug i MO som i enkelte tilfælde udregner et forkert
 primærengagement.
+
+Filerne læses række for række ind i et midlertidigt SQLite indeks på disken, så
+også eksporter som er større end hukommelsen kan sammenlignes. Rækker som findes
+uændret i begge filer parres på en hash af rækken, de resterende rækker parres på
+`id_key`, og forskellen rapporteres som fjernede, tilføjede og ændrede rækker.
 """
 
 import csv
+import hashlib
 import json
 import logging
 import pathlib
+import sqlite3
+import tempfile
+
+import click
 
 
 LOG_LEVEL = logging.DEBUG
@@ -20,81 +30,269 @@ LOG_FILE = 'export_compare.log'
 
 logger = logging.getLogger('mo_lora_compare')
 
-for name in logging.root.manager.loggerDict:
-    if name in ('mo_lora_compare'):
-        logging.getLogger(name).setLevel(LOG_LEVEL)
-    else:
-        logging.getLogger(name).setLevel(logging.ERROR)
+INSERT_BATCH_SIZE = 10000
+
+DEFAULT_TESTS = [
+    ('plan2learn_organisation.csv', 'AfdelingsID'),
+    ('plan2learn_engagement.csv', 'EngagementId'),
+    ('plan2learn_stillingskode.csv', 'StillingskodeID'),
+    ('plan2learn_bruger.csv', 'BrugerId'),
+    ('viborg_externe.csv', 'Tjenestenummer')
+]
+
 
-logging.basicConfig(
-    format='%(levelname)s %(asctime)s %(name)s %(message)s',
-    level=LOG_LEVEL,
-    filename=LOG_FILE
-)
+def setup_logging():
+    for name in logging.root.manager.loggerDict:
+        if name in ('mo_lora_compare'):
+            logging.getLogger(name).setLevel(LOG_LEVEL)
+        else:
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    logging.basicConfig(
+        format='%(levelname)s %(asctime)s %(name)s %(message)s',
+        level=LOG_LEVEL,
+        filename=LOG_FILE
+    )
 
 
-cfg_file = pathlib.Path.cwd() / 'settings' / 'settings.json'
-if not cfg_file.is_file():
-    raise Exception('No setting file')
-SETTINGS = json.loads(cfg_file.read_text())
+def load_settings():
+    cfg_file = pathlib.Path.cwd() / 'settings' / 'settings.json'
+    if not cfg_file.is_file():
+        raise Exception('No setting file')
+    return json.loads(cfg_file.read_text())
 
 
-def load_csv(file_name):
+def read_csv(file_name):
     logger.info('Load {}'.format(file_name))
-    rows = []
     with open(file_name) as csvfile:
         reader = csv.DictReader(csvfile, delimiter=';')
-        for row in reader:
-            rows.append(row)
-    return rows
+        yield from reader
 
 
-def compare_exports(lc_rows, mo_rows, id_key=None):
-    not_found = []
+def row_hash(row):
+    """Hash a row independently of the order of its fields.
 
-    for row in lc_rows:
-        if row in mo_rows:
-            mo_rows.remove(row)
-        else:
-            not_found.append(row)
-
-    if id_key:
-        for mo_row in mo_rows:
-            for lc_row in lc_rows:
-                if mo_row[id_key] == lc_row[id_key]:
-                    mo_set = set(mo_row.items())
-                    lc_set = set(lc_row.items())
-                    msg = 'Diff in {}: {}'
-                    print(msg.format(lc_row[id_key], mo_set ^ lc_set))
-                    logger.info(msg.format(lc_row[id_key], mo_set ^ lc_set))
-
-    if mo_rows or not_found:
-        logger.info('lc rows not found in mo_rows: {}'.format(not_found))
-        logger.info('Remaining mo_rows: {}'.format(mo_rows))
-        logger.info('MO rows: {}'.format(len(mo_rows)))
-        logger.info('lc rows: {}'.format(len(not_found)))
-        print('MO rows: {}'.format(len(mo_rows)))
-        print('lc rows: {}'.format(len(not_found)))
+    Example:
+        >>> row_hash({'a': '1', 'b': '2'}) == row_hash({'b': '2', 'a': '1'})
+        True
+        >>> row_hash({'a': '1', 'b': '2'}) == row_hash({'a': '2', 'b': '1'})
+        False
+    """
+    serialized = json.dumps(row, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def field_changes(old_row, new_row):
+    """Find the fields that differ between two rows.
+
+    Example:
+        >>> field_changes({'a': '1', 'b': '2'}, {'a': '1', 'b': '3', 'c': ''})
+        {'b': ['2', '3'], 'c': [None, '']}
+    """
+    fields = list(old_row) + [field for field in new_row if field not in old_row]
+    return {
+        field: [old_row.get(field), new_row.get(field)]
+        for field in fields
+        if old_row.get(field) != new_row.get(field)
+    }
+
+
+class ExportDiff(object):
+    """
+    Keyed diff of two exports of the same kind, backed by a temporary SQLite
+    database. The rows of the first export are compared to the rows of the
+    second; rows only found in the first are reported as removed and rows only
+    found in the second as added. Identical rows are matched on their hash,
+    taking duplicates into account, and the remaining rows are paired on
+    `id_key` and reported as changed. Without an `id_key` no rows are paired,
+    and every difference is reported as a removed and an added row.
+    """
+
+    def __init__(self, id_key=None, db_dir=None):
+        self.id_key = id_key
+        self._tmp_dir = tempfile.TemporaryDirectory(dir=db_dir)
+        db_path = pathlib.Path(self._tmp_dir.name) / 'compare.db'
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute(
+            'CREATE TABLE rows (side INTEGER, seq INTEGER, key TEXT, hash TEXT, '
+            'row TEXT)'
+        )
+
+    def close(self):
+        self.conn.close()
+        self._tmp_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _index(self, side, rows):
+        batch = []
+        for seq, row in enumerate(rows):
+            key = row.get(self.id_key) if self.id_key else None
+            batch.append(
+                (side, seq, key, row_hash(row), json.dumps(row, ensure_ascii=False))
+            )
+            if len(batch) >= INSERT_BATCH_SIZE:
+                self.conn.executemany('INSERT INTO rows VALUES (?, ?, ?, ?, ?)', batch)
+                batch = []
+        self.conn.executemany('INSERT INTO rows VALUES (?, ?, ?, ?, ?)', batch)
+
+    def load(self, old_rows, new_rows):
+        """Index the rows of both exports, given as iterables of dicts."""
+        self._index(0, old_rows)
+        self._index(1, new_rows)
+        self.conn.executescript("""
+            CREATE INDEX rows_hash ON rows (hash, side);
+
+            -- Number duplicate rows, so each copy is matched at most once
+            CREATE TABLE numbered AS
+            SELECT side, seq, key, hash, row,
+                   row_number() OVER (PARTITION BY side, hash ORDER BY seq) AS n
+            FROM rows;
+            CREATE INDEX numbered_hash ON numbered (hash, n, side);
+
+            -- Rows without an identical copy in the other export
+            CREATE TABLE unmatched AS
+            SELECT side, seq, key, row,
+                   row_number() OVER (PARTITION BY side, key ORDER BY seq) AS n
+            FROM numbered AS this
+            WHERE NOT EXISTS (
+                SELECT 1 FROM numbered AS other
+                WHERE other.hash = this.hash AND other.n = this.n
+                  AND other.side != this.side
+            );
+            CREATE INDEX unmatched_key ON unmatched (key, n, side);
+        """)
+
+    def _paired(self):
+        if self.id_key:
+            return """
+                EXISTS (
+                    SELECT 1 FROM unmatched AS other
+                    WHERE other.key = this.key AND other.n = this.n
+                      AND other.side != this.side
+                )
+            """
+        return '0'
+
+    def removed(self):
+        """Rows only found in the first export, in file order."""
+        query = 'SELECT row FROM unmatched AS this WHERE side = 0 AND NOT {} ' \
+                'ORDER BY seq'
+        for (row,) in self.conn.execute(query.format(self._paired())):
+            yield json.loads(row)
+
+    def added(self):
+        """Rows only found in the second export, in file order."""
+        query = 'SELECT row FROM unmatched AS this WHERE side = 1 AND NOT {} ' \
+                'ORDER BY seq'
+        for (row,) in self.conn.execute(query.format(self._paired())):
+            yield json.loads(row)
+
+    def changed(self):
+        """Pairs of rows with the same `id_key`, with their field changes."""
+        if not self.id_key:
+            return
+        query = """
+            SELECT old.key, old.row, new.row
+            FROM unmatched AS old
+            JOIN unmatched AS new
+              ON new.key = old.key AND new.n = old.n AND new.side = 1
+            WHERE old.side = 0
+            ORDER BY old.seq
+        """
+        for key, old_row, new_row in self.conn.execute(query):
+            old_row = json.loads(old_row)
+            new_row = json.loads(new_row)
+            yield key, old_row, new_row, field_changes(old_row, new_row)
+
+    def entries(self):
+        """The full diff as machine-readable dicts."""
+        for row in self.removed():
+            yield {'type': 'removed', 'row': row}
+        for row in self.added():
+            yield {'type': 'added', 'row': row}
+        for key, old_row, new_row, changes in self.changed():
+            yield {'type': 'changed', 'key': key, 'changes': changes}
+
+    def summary(self):
+        summary = {'removed': 0, 'added': 0, 'changed': 0, 'identical': 0}
+        for entry in self.entries():
+            summary[entry['type']] += 1
+        (summary['identical'],) = self.conn.execute(
+            'SELECT count(*) FROM numbered WHERE side = 0'
+        ).fetchone()
+        summary['identical'] -= summary['removed'] + summary['changed']
+        return summary
+
+
+def compare_exports(lc_file, mo_file, id_key=None, output=None):
+    """Compare the export made from LoRa cache to the export made from MO.
+
+    Args:
+        lc_file: CSV file exported using the LoRa cache backend.
+        mo_file: CSV file exported using the MO backend.
+        id_key: Column identifying a row, used to pair changed rows.
+        output: Optional file object, receives the diff as JSON lines.
+
+    Returns:
+        A dict counting the removed, added, changed and identical rows.
+    """
+    with ExportDiff(id_key) as diff:
+        diff.load(read_csv(lc_file), read_csv(mo_file))
+
+        for entry in diff.entries():
+            if entry['type'] == 'changed':
+                msg = 'Diff in {}: {}'.format(entry['key'], entry['changes'])
+                print(msg)
+                logger.info(msg)
+            elif entry['type'] == 'removed':
+                logger.info('lc row not found in mo rows: {}'.format(entry['row']))
+            else:
+                logger.info('Remaining mo row: {}'.format(entry['row']))
+            if output:
+                output.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        summary = diff.summary()
+
+    if summary['removed'] or summary['added'] or summary['changed']:
+        logger.info('Summary: {}'.format(summary))
+        print('MO rows: {}'.format(summary['added']))
+        print('lc rows: {}'.format(summary['removed']))
+        print('Changed rows: {}'.format(summary['changed']))
     else:
         print('The files are identical')
     print()
+    return summary
 
-if __name__ == '__main__':
-    dest_folder = pathlib.Path(SETTINGS['mora.folder.query_export'])
+
+@click.command()
+@click.argument('files', nargs=2, required=False, type=click.Path(exists=True))
+@click.option('--id-key', help='Column used to pair changed rows.')
+@click.option('--output', type=click.File('w'),
+              help='Write the diff to this file as JSON lines.')
+def cli(files, id_key, output):
+    """Compare two exports, or all known exports if no files are given."""
+    setup_logging()
+    if files:
+        lc_file, mo_file = files
+        compare_exports(lc_file, mo_file, id_key, output)
+        return
+
+    settings = load_settings()
+    dest_folder = pathlib.Path(settings['mora.folder.query_export'])
 
     lora_root = dest_folder
     mo_root = dest_folder / 'mo_generated'
 
-    tests = [
-        ('plan2learn_organisation.csv', 'AfdelingsID', None),
-        ('plan2learn_engagement.csv', 'EngagementId', None),
-        ('plan2learn_stillingskode.csv', 'StillingskodeID', None),
-        ('plan2learn_bruger.csv', 'BrugerId', None),
-        ('viborg_externe.csv', 'Tjenestenummer', None)
-    ]
-
-    for test in tests:
-        print('Testing {}'.format(test[0]))
-        lc_rows = load_csv(str(lora_root / test[0]))
-        mo_rows = load_csv(str(mo_root / test[0]))
-        compare_exports(lc_rows, mo_rows, test[1])
+    for file_name, test_id_key in DEFAULT_TESTS:
+        print('Testing {}'.format(file_name))
+        compare_exports(str(lora_root / file_name), str(mo_root / file_name),
+                        test_id_key, output)
+
+
+if __name__ == '__main__':
+    cli()
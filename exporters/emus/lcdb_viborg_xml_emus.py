@@ -10,8 +10,9 @@
 
 import logging
 import sys
-import io
+import json
 import collections
+import contextlib
 import datetime
 import time
 import requests
@@ -24,7 +25,8 @@ from exporters.emus import config
 import click
 from tqdm import tqdm
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import and_
+from sqlalchemy.orm.exc import MultipleResultsFound
+from sqlalchemy import event
 
 from anytree import Node, PreOrderIter
 
@@ -57,6 +59,103 @@ def get_session(engine):
     return sessionmaker(bind=engine, autoflush=False)()
 
 
+class QueryReport:
+    """Count the queries sent to an engine, and time the phases of the export.
+    """
+
+    def __init__(self, engine):
+        self.queries = 0
+        self.phases = []
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *_):
+        self.queries += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_time = time.monotonic()
+        start_queries = self.queries
+        try:
+            yield
+        finally:
+            self.phases.append((
+                name,
+                time.monotonic() - start_time,
+                self.queries - start_queries,
+            ))
+
+    def report(self):
+        lines = ["%s: %.2fs, %d queries" % phase for phase in self.phases]
+        lines.append("total: %.2fs, %d queries" % (
+            sum(seconds for _, seconds, _ in self.phases), self.queries
+        ))
+        return "\n".join(lines)
+
+
+def group_by(rows, key):
+    groups = collections.defaultdict(list)
+    for row in rows:
+        groups[key(row)].append(row)
+    return groups
+
+
+def one_or_none(rows):
+    """Like Query.one_or_none, but for rows already read."""
+    if len(rows) > 1:
+        raise MultipleResultsFound(
+            "Multiple rows were found when one or none was required"
+        )
+    return rows[0] if rows else None
+
+
+class EmusData:
+    """All rows used by the export, read with one query per table and grouped
+    in memory by unit and user, so the number of queries does not depend on the
+    number of units and employees.
+
+    Rows are read in table order, which is the order the queries per unit or
+    user used to return them in.
+    """
+
+    def __init__(self, session):
+        def rows(model):
+            return session.query(model).order_by(model.id).all()
+
+        self.username_itsystem_uuid = session.query(ItSystem.uuid).filter(
+            ItSystem.navn == "Active Directory"
+        ).scalar()
+
+        self.users = {bruger.uuid: bruger for bruger in rows(Bruger)}
+
+        engagements = rows(Engagement)
+        self.engagements_by_unit = group_by(engagements, lambda e: e.enhed_uuid)
+        self.engagements_by_user = group_by(engagements, lambda e: e.bruger_uuid)
+
+        managers = rows(Leder)
+        self.managers_by_unit = group_by(managers, lambda m: m.enhed_uuid)
+        self.managers = {}
+        for manager in managers:
+            self.managers.setdefault(manager.uuid, manager)
+        self.responsibilities = group_by(
+            rows(LederAnsvar), lambda r: r.leder_uuid
+        )
+
+        self.usernames = {}
+        for itforbindelse in rows(ItForbindelse):
+            if itforbindelse.it_system_uuid == self.username_itsystem_uuid:
+                self.usernames.setdefault(
+                    itforbindelse.bruger_uuid, itforbindelse.brugernavn
+                )
+
+        addresses = rows(Adresse)
+        self.user_addresses = group_by(
+            addresses, lambda a: (a.bruger_uuid, a.adressetype_scope)
+        )
+        self.unit_addresses = group_by(
+            addresses, lambda a: (a.enhed_uuid, a.adressetype_titel)
+        )
+
+
 def engagement_count(nodes, ou):
     ouid = ou.uuid
     while ouid:
@@ -110,28 +209,30 @@ def get_dar_address(db_address):
     }
 
 
-def read_ou_tree(session, org, nodes={}, parent=None):
-    """Recursively find all sub-ou's beneath current node
+def read_ou_tree(session, org):
+    """Find all sub-ou's beneath the top org unit
     :param org: The top org unit to start the tree from
-    :param nodes: Dict with all modes in the tree
-    :param parent: The parent of the current node, None if this is root
     :return: A dict with all nodes in tree, top node is named 'root'
     """
-
-    if parent is None:
-        org_unit = session.query(Enhed).filter(Enhed.uuid == org).one()
-        parent = nodes[org] = nodes['root'] = Node(org, unit=org_unit)
-
-
-    units = session.query(Enhed).filter(Enhed.forældreenhed_uuid == org)
-    for unit in units:
-        uuid = unit.uuid
-        nodes[uuid] = Node(uuid, parent=parent, unit=unit)
-        nodes = read_ou_tree(session, uuid, nodes, nodes[uuid])
+    units = session.query(Enhed).order_by(Enhed.id).all()
+    children = group_by(units, lambda unit: unit.forældreenhed_uuid)
+
+    org_unit = one_or_none([unit for unit in units if unit.uuid == org])
+    if org_unit is None:
+        raise ValueError("Top org unit {} not found".format(org))
+    nodes = {}
+    nodes[org] = nodes['root'] = Node(org, unit=org_unit)
+
+    queue = [org]
+    while queue:
+        parent = queue.pop()
+        for unit in children[parent]:
+            nodes[unit.uuid] = Node(unit.uuid, parent=nodes[parent], unit=unit)
+            queue.append(unit.uuid)
     return nodes
 
 
-def export_ou_emus(session, nodes, emus_file=sys.stdout):
+def export_ou_emus(data, nodes, emus_file=sys.stdout):
     """
         we need uuid, validity, name, parent_uuid, manager, street, zip, city, phone
         for
@@ -147,32 +248,27 @@ def export_ou_emus(session, nodes, emus_file=sys.stdout):
                         ou.uuid)
             continue
 
-        manager = session.query(Leder).filter(
-            Leder.uuid == ou.leder_uuid
-        ).first()
+        manager = data.managers.get(ou.leder_uuid)
 
         manager_uuid = manager.bruger_uuid if manager else ''
         # Ensure that managers actually have an engagement
         if manager_uuid:
-            entrydate, _ = get_manager_dates(session, manager_uuid)
+            entrydate, _ = get_manager_dates(data, manager_uuid)
             if entrydate is None:
                 logger.info("skipping manager %s with no current employment (for ou)", manager_uuid)
                 manager_uuid = ''
 
         # manager_uuid = ou.leder_uuid or ''
 
-        street_address = session.query(Adresse).filter(and_(
-            Adresse.adressetype_titel == 'Postadresse',
-            Adresse.enhed_uuid == ou.uuid,
-        )).one_or_none()
+        street_address = one_or_none(
+            data.unit_addresses[(ou.uuid, 'Postadresse')]
+        )
         address = get_dar_address(street_address)
         fra = ou.startdato or ''
         til = ou.slutdato or ''
         over_uuid = ou.forældreenhed_uuid or ''
-        phone = session.query(Adresse.værdi).filter(and_(
-            Adresse.adressetype_titel == 'Telefon',
-            Adresse.enhed_uuid == ou.uuid,
-        )).scalar()
+        phone = one_or_none(data.unit_addresses[(ou.uuid, 'Telefon')])
+        phone = phone.værdi if phone else None
 
         row = {
             'uuid': ou.uuid,
@@ -212,11 +308,8 @@ def export_ou_emus(session, nodes, emus_file=sys.stdout):
             emus_file.write("</orgUnit>\n")
 
 
-def get_e_address(e_uuid, scope, session, settings):
-    candidates = session.query(Adresse).filter(and_(
-        Adresse.adressetype_scope == scope,
-        Adresse.bruger_uuid == e_uuid,
-    )).all()
+def get_e_address(e_uuid, scope, data, settings):
+    candidates = data.user_addresses[(e_uuid, scope)]
 
     if scope == "Telefon":
         priority_list = settings["EMUS_PHONE_PRIORITY"]
@@ -232,28 +325,23 @@ def get_e_address(e_uuid, scope, session, settings):
         return {} # like mora_helpers
 
 
-def build_engagement_row(session, settings, ou, engagement):
+def build_engagement_row(data, settings, ou, engagement):
     entrydate = engagement.startdato
     leavedate = engagement.slutdato
 
-    employee = session.query(Bruger).filter(
-        Bruger.uuid == engagement.bruger_uuid
-    ).one()
+    employee = data.users[engagement.bruger_uuid]
 
     firstname = employee.fornavn
     lastname = employee.efternavn
 
-    username = session.query(ItForbindelse.brugernavn).filter(and_(
-        ItForbindelse.bruger_uuid == engagement.bruger_uuid,
-        ItForbindelse.it_system_uuid == settings["username-itsystem-uuid"]
-    )).limit(1).scalar()
+    username = data.usernames.get(engagement.bruger_uuid)
 
-    _phone_obj = get_e_address(engagement.bruger_uuid, 'Telefon', session, settings)
+    _phone_obj = get_e_address(engagement.bruger_uuid, 'Telefon', data, settings)
     _phone = None
     if _phone_obj:
         _phone = _phone_obj.værdi
 
-    _email_obj = get_e_address(engagement.bruger_uuid, 'E-mail', session, settings)
+    _email_obj = get_e_address(engagement.bruger_uuid, 'E-mail', data, settings)
     _email = None
     if _email_obj:
         _email = _email_obj.værdi
@@ -281,7 +369,7 @@ def build_engagement_row(session, settings, ou, engagement):
     return row
 
 
-def get_manager_dates(session, bruger_uuid):
+def get_manager_dates(data, bruger_uuid):
     """Man kan tydeligvis ikke regne med at chefens datoer
     på lederobjektet er korrekte. Derfor ser vi lige på
     om chefen fortsat er ansat, inden vi rapporterer.
@@ -289,9 +377,7 @@ def get_manager_dates(session, bruger_uuid):
     # TODO: XXX: Hvorfor kan man ikke det, og burde vi ikke fikse det?
     startdate = '9999-12-31'
     enddate = '0000-00-00'
-    for engagement in session.query(Engagement).filter(
-        Engagement.bruger_uuid == bruger_uuid
-    ).all():
+    for engagement in data.engagements_by_user[bruger_uuid]:
         if engagement.slutdato and enddate != '':
             # Enddate is finite, check if it is later than current
             if engagement.slutdato > enddate:
@@ -310,35 +396,30 @@ def get_manager_dates(session, bruger_uuid):
     return startdate, enddate
 
 
-def build_manager_rows(session, settings, ou, manager):
+def build_manager_rows(data, settings, ou, manager):
     # render manager returns a list as a manager will typically have more
     # responsibility areas and musskema requires one for each
 
     rows = []
 
-    bruger = session.query(Bruger).filter(
-        Bruger.uuid == manager.bruger_uuid
-    ).one()
+    bruger = data.users[manager.bruger_uuid]
 
     firstname = bruger.fornavn
     lastname = bruger.efternavn
 
-    entrydate, leavedate = get_manager_dates(session, bruger.uuid)
+    entrydate, leavedate = get_manager_dates(data, bruger.uuid)
     if entrydate is None:
         logger.info("skipping manager %s with no current employment (for user)", manager.uuid)
         return []
 
-    username = session.query(ItForbindelse.brugernavn).filter(and_(
-        ItForbindelse.bruger_uuid == bruger.uuid,
-        ItForbindelse.it_system_uuid == settings["username-itsystem-uuid"]
-    )).limit(1).scalar()
+    username = data.usernames.get(bruger.uuid)
 
-    _phone_obj = get_e_address(bruger.uuid, 'Telefon', session, settings)
+    _phone_obj = get_e_address(bruger.uuid, 'Telefon', data, settings)
     _phone = None
     if _phone_obj:
         _phone = _phone_obj.værdi
 
-    _email_obj = get_e_address(bruger.uuid, 'E-mail', session, settings)
+    _email_obj = get_e_address(bruger.uuid, 'E-mail', data, settings)
     _email = None
     if _email_obj:
         _email = _email_obj.værdi
@@ -347,9 +428,7 @@ def build_manager_rows(session, settings, ou, manager):
     # empty a couple of fields, change client and employee_id
     # and manipulate from and to
 
-    for responsibility in session.query(LederAnsvar).filter(
-        LederAnsvar.leder_uuid == manager.uuid,
-    ).all():
+    for responsibility in data.responsibilities[manager.uuid]:
         if not responsibility.lederansvar_uuid == settings[
                 "EMUS_RESPONSIBILITY_CLASS"
         ]:
@@ -404,90 +483,113 @@ def discarded(settings, engagement):
     return False
 
 
-def export_e_emus(session, settings, nodes, emus_file):
+def exported_engagements(data, settings, nodes):
+    """Find the exported engagements of each unit, and count them for the unit
+    and its parents, as units without engagements are left out of the export.
+    """
+    engagements_by_unit = {}
+    for node in PreOrderIter(nodes['root']):
+        ou = node.unit
+        engagements = data.engagements_by_unit[ou.uuid]
+        engagements = filterfalse(hourly_paid, engagements)
+        engagements = filterfalse(partial(discarded, settings), engagements)
+        engagements_by_unit[ou.uuid] = list(engagements)
+        for engagement in engagements_by_unit[ou.uuid]:
+            engagement_count(nodes, ou)
+    return engagements_by_unit
+
+
+def write_employee_row(emus_file, fieldnames, last_changed, r):
+    emus_file.write("<employee id=\"%s\" client=\"%s\" lastChanged=\"%s\">\n" % (
+        r["employee_id"],
+        r["client"],
+        last_changed,
+    ))
+    for fn in fieldnames:
+        emus_file.write("<%s>%s</%s>\n" % (fn, escape(r.get(fn, '')), fn))
+    emus_file.write("</employee>\n")
+
+
+def export_e_emus(data, settings, nodes, engagements_by_unit, emus_file):
     fieldnames = ['personUUID', 'entryDate', 'leaveDate', 'cpr', 'firstName',
                   'lastName', 'workPhone', 'workContract', 'workContractText',
                   'positionId', 'position', "orgUnit", 'email', "username"]
-    manager_rows = []
-    engagement_rows = []
-
-    settings["username-itsystem-uuid"] = session.query(ItSystem.uuid).filter(
-        ItSystem.navn == "Active Directory"
-    ).scalar()
-
+    write_row = partial(
+        write_employee_row,
+        emus_file,
+        fieldnames,
+        datetime.datetime.now().strftime("%Y-%m-%d"),
+    )
+    engagement_rows = 0
+    manager_rows = 0
+
+    settings["username-itsystem-uuid"] = data.username_itsystem_uuid
+
+    # normal engagements - original export
     for node in tqdm(PreOrderIter(nodes['root']), total=len(nodes), desc="export e"):
         ou = node.unit
-
-        # normal engagements - original export
-        engagements = session.query(Engagement).filter(
-            Engagement.enhed_uuid == ou.uuid
-        ).all()
-        engagements = filterfalse(hourly_paid, engagements)
-        engagements = filterfalse(partial(discarded, settings), engagements)
-        for engagement in engagements:
+        for engagement in engagements_by_unit[ou.uuid]:
             logger.info("adding engagement %s", engagement.uuid)
-            engagement_rows.append(build_engagement_row(session, settings,
-                                                        ou, engagement))
-            engagement_count(nodes, ou)
+            write_row(build_engagement_row(data, settings, ou, engagement))
+            engagement_rows += 1
 
-        # manager engagements - above mentioned musskema adaptation
-        for manager in session.query(Leder).filter(
-            Leder.enhed_uuid == ou.uuid
-        ).all():
+    # manager engagements - above mentioned musskema adaptation
+    for node in tqdm(PreOrderIter(nodes['root']), total=len(nodes), desc="export m"):
+        ou = node.unit
+        for manager in data.managers_by_unit[ou.uuid]:
             if manager.bruger_uuid is None:
                 logger.info("skipping vacant manager %s", manager.uuid)
                 continue  # vacant manager
-            else:
-                # extend, as there can be zero or one
-                manager_rows.extend(build_manager_rows(session, settings,
-                                                       ou, manager))
+            # there can be zero or more rows
+            for row in build_manager_rows(data, settings, ou, manager):
+                write_row(row)
+                manager_rows += 1
 
-    if not len(manager_rows):
+    if not manager_rows:
         logger.error("no managers found - did You forget to"
                      " specify correct EMUS_RESPONSIBILITY_CLASS")
-    rows = engagement_rows + manager_rows
-    logger.info("writing %d engagement rows and %d manager rows to file",
-                len(engagement_rows), len(manager_rows))
-
-    last_changed = datetime.datetime.now().strftime("%Y-%m-%d")
-    for r in rows:
-        emus_file.write("<employee id=\"%s\" client=\"%s\" lastChanged=\"%s\">\n" % (
-            r["employee_id"],
-            r["client"],
-            last_changed,
-        ))
-        for fn in fieldnames:
-            emus_file.write("<%s>%s</%s>\n" % (fn, escape(r.get(fn, '')), fn))
-        emus_file.write("</employee>\n")
+    logger.info("wrote %d engagement rows and %d manager rows to file",
+                engagement_rows, manager_rows)
 
 
-def main(emus_xml_file, settings):
-    session = get_session(get_engine())
-    nodes = read_ou_tree(session, settings["MORA_ROOT_ORG_UNIT_UUID"])
+def main(emus_xml_file, settings, engine=None):
+    engine = engine or get_engine()
+    report = QueryReport(engine)
+    session = get_session(engine)
 
-    # Write employees to temp file, counting to determine if ou included
-    temp_file = io.StringIO()
-    export_e_emus(session, settings, nodes, temp_file)
+    with report.phase("read units"):
+        nodes = read_ou_tree(session, settings["MORA_ROOT_ORG_UNIT_UUID"])
+    with report.phase("read rows"):
+        data = EmusData(session)
+    # Count engagements to determine if ou included
+    with report.phase("count engagements"):
+        engagements_by_unit = exported_engagements(data, settings, nodes)
 
     # Begin the xml file
     emus_xml_file.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
     emus_xml_file.write("<OS2MO>\n")
 
     # write included units to xml-file
-    export_ou_emus(session, nodes, temp_file)
+    with report.phase("export units"):
+        export_ou_emus(data, nodes, emus_xml_file)
 
     # Write employees to xml file
-    emus_xml_file.write(temp_file.getvalue())
+    with report.phase("export employees"):
+        export_e_emus(data, settings, nodes, engagements_by_unit, emus_xml_file)
 
     # End xml file
     emus_xml_file.write("</OS2MO>")
 
+    logger.info("timings and queries:\n%s", report.report())
+    return report
+
 
 @click.command()
 @click.argument('filename')
 def cli(filename):
     with open(filename, "w", encoding="utf-8") as emus_f:
-        main(emus_xml_file=emus_f, settings=config.settings)
+        report = main(emus_xml_file=emus_f, settings=config.settings)
+    click.echo(report.report(), err=True)
 
 
 if __name__ == '__main__':
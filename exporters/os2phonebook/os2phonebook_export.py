@@ -3,12 +3,13 @@ import json
 import logging
 import pathlib
 import time
-from itertools import starmap
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, starmap
 from functools import wraps, partial
 from operator import attrgetter
 
 import click
-from aiohttp import BasicAuth, ClientSession, TCPConnector
+from aiohttp import BasicAuth, ClientSession
 from more_itertools import side_effect
 
 from exporters.sql_export.lc_for_jobs_db import get_engine
@@ -22,16 +23,24 @@ from exporters.sql_export.sql_table_defs import (
     KLE,
     DARAdresse
 )
-from sqlalchemy import create_engine, event, or_
+from sqlalchemy import event, or_
 from sqlalchemy.orm import sessionmaker
 
-from integrations.dar_helper.dar_helper import dar_fetch
 from ra_utils.async_to_sync import async_to_sync
 
 
 LOG_LEVEL = logging.DEBUG
 LOG_FILE = "os2phonebook_export.log"
 
+da_address_types = {
+    "DAR": "DAR",
+    "Telefon": "PHONE",
+    "E-mail": "EMAIL",
+    "EAN": "EAN",
+    "P-nummer": "PNUMBER",
+    "Url": "WWW",
+}
+
 logger = logging.getLogger("os2phonebook_export")
 
 
@@ -91,9 +100,86 @@ def cli():
     pass
 
 
+def run_concurrently(functions):
+    """Run functions concurrently in threads, and return their results in order."""
+    with ThreadPoolExecutor(max_workers=len(functions)) as executor:
+        futures = [executor.submit(function) for function in functions]
+        return [future.result() for future in futures]
+
+
+def run_queries(Session, queries):
+    """Run queries concurrently, each on its own session and thus connection.
+
+    Args:
+        Session: Session factory.
+        queries: Dictionary from name to a function taking a session and
+            returning the query result.
+
+    Returns:
+        Dictionary from name to query result.
+    """
+    def run(query):
+        session = Session()
+        try:
+            return query(session)
+        finally:
+            session.close()
+
+    results = run_concurrently([partial(run, query) for query in queries.values()])
+    return dict(zip(queries.keys(), results))
+
+
+def load_settings():
+    cfg_file = pathlib.Path.cwd() / "settings" / "settings.json"
+    if not cfg_file.is_file():
+        raise Exception("No setting file")
+    return json.loads(cfg_file.read_text())
+
+
+def chunked(entry_map, chunk_size):
+    """Split entry_map into dictionaries of at most chunk_size entries.
+
+    A chunk_size of 0 or None yields entry_map as is.
+
+    Example:
+        >>> list(chunked({"a": 1, "b": 2, "c": 3}, 2))
+        [{'a': 1, 'b': 2}, {'c': 3}]
+        >>> list(chunked({"a": 1}, 0))
+        [{'a': 1}]
+    """
+    if not chunk_size:
+        yield entry_map
+        return
+    items = iter(entry_map.items())
+    while True:
+        chunk = dict(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_json(path, entry_map):
+    # json.dump writes the document in chunks as it is encoded
+    with open(path, "w") as out:
+        json.dump(entry_map, out)
+
+
+chunk_size_option = click.option(
+    "--chunk-size",
+    default=0,
+    type=int,
+    help="Push this many entries per request, 0 sends everything at once.",
+)
+
+
 @cli.command()
-def generate_json():
-    # TODO: Async database access
+@click.option(
+    "--push/--no-push",
+    default=False,
+    help="Push the generated JSON directly to OS2Phonebook.",
+)
+@chunk_size_option
+def generate_json(push, chunk_size):
     engine = get_engine()
     # Prepare session
     Session = sessionmaker(bind=engine, autoflush=False)
@@ -152,49 +238,40 @@ def generate_json():
             employee_map[bruger_uuid][entry_type].append(entry)
         return employee_map
 
-    def enrich_org_units_with_engagements(org_unit_map):
+    def enrich_org_units_with_engagements(org_unit_map, engagements):
         def gen_engagement(engagement, bruger):
             return {
                 "title": engagement.stillingsbetegnelse_titel,
                 "name": bruger.fornavn + " " + bruger.efternavn,
                 "uuid": bruger.uuid,
             }
-        engagements = session.query(Engagement, Bruger).filter(
-            Engagement.bruger_uuid == Bruger.uuid
-        ).all()
         return enrich_org_unit_with_x(
             org_unit_map, "engagements", gen_engagement, engagements
         )
 
-    def enrich_org_units_with_associations(org_unit_map):
+    def enrich_org_units_with_associations(org_unit_map, associations):
         def gen_association(tilknytning, bruger):
             return {
                 "title": tilknytning.tilknytningstype_titel,
                 "name": bruger.fornavn + " " + bruger.efternavn,
                 "uuid": bruger.uuid,
             }
-        associations = session.query(Tilknytning, Bruger).filter(
-            Tilknytning.bruger_uuid == Bruger.uuid
-        ).all()
         return enrich_org_unit_with_x(
             org_unit_map, "associations", gen_association, associations
         )
 
-    def enrich_org_units_with_management(org_unit_map):
+    def enrich_org_units_with_management(org_unit_map, managements):
         def gen_management(leder, bruger):
             return {
                 "title": leder.ledertype_titel,
                 "name": bruger.fornavn + " " + bruger.efternavn,
                 "uuid": bruger.uuid,
             }
-        managements = session.query(Leder, Bruger).filter(
-            Leder.bruger_uuid == Bruger.uuid
-        ).all()
         return enrich_org_unit_with_x(
             org_unit_map, "management", gen_management, managements
         )
 
-    def enrich_org_units_with_kles(org_unit_map):
+    def enrich_org_units_with_kles(org_unit_map, kles):
         def gen_kle(kle):
             return kle.enhed_uuid, {
                 "title": kle.kle_nummer_titel,
@@ -207,7 +284,6 @@ def generate_json():
             filter_missing_entry, org_unit_map, "KLE"
         ))
 
-        kles = session.query(KLE).all()
         kles = filter(lambda kle: kle.kle_aspekt_titel == 'Udførende', kles)
         kles = map(gen_kle, kles)
         kles = filter(missing_entry_filter, kles)
@@ -259,7 +335,7 @@ def generate_json():
         # Add parent to queue for bulk fetching later (if any)
         queue_org_unit(enhed.forældreenhed_uuid)
 
-    def fetch_employees():
+    def fetch_employees(brugere):
         def employee_to_dict(employee):
             return {
                 "uuid": employee.uuid,
@@ -282,51 +358,39 @@ def generate_json():
         def create_uuid_tuple(entry):
             return entry["uuid"], entry
 
-        employees = map(employee_to_dict, session.query(Bruger).all())
+        employees = map(employee_to_dict, brugere)
         employee_map = dict(map(create_uuid_tuple, employees))
         return employee_map
 
-    def enrich_employees_with_engagements(employee_map):
+    def enrich_employees_with_engagements(employee_map, engagements):
         def gen_engagement(engagement, enhed):
             return {
                 "title": engagement.stillingsbetegnelse_titel,
                 "name": enhed.navn,
                 "uuid": enhed.uuid,
             }
-        engagements = session.query(Engagement, Enhed).filter(
-            Engagement.enhed_uuid == Enhed.uuid
-        ).all()
         return enrich_employees_with_x(
             employee_map, "engagements", gen_engagement, engagements
         )
 
-    def enrich_employees_with_associations(employee_map):
+    def enrich_employees_with_associations(employee_map, associations):
         def gen_association(tilknytning, enhed):
             return {
                 "title": tilknytning.tilknytningstype_titel,
                 "name": enhed.navn,
                 "uuid": enhed.uuid,
             }
-        associations = session.query(Tilknytning, Enhed).filter(
-            Tilknytning.enhed_uuid == Enhed.uuid
-        ).all()
         return enrich_employees_with_x(
             employee_map, "associations", gen_association, associations
         )
 
-    def enrich_employees_with_management(employee_map):
+    def enrich_employees_with_management(employee_map, managements):
         def gen_management(leder, enhed):
             return {
                 "title": leder.ledertype_titel,
                 "name": enhed.navn,
                 "uuid": enhed.uuid,
             }
-        managements = session.query(Leder, Enhed).filter(
-            Leder.enhed_uuid == Enhed.uuid
-        ).filter(
-            # Filter vacant leders
-            Leder.bruger_uuid != None
-        ).all()
         return enrich_employees_with_x(
             employee_map, "management", gen_management, managements
         )
@@ -361,32 +425,17 @@ def generate_json():
         }
         return filtered_map
 
-    def enrich_org_units_with_addresses(org_unit_map):
-        # Enrich with adresses
-        queryset = session.query(Adresse).filter(Adresse.enhed_uuid != None)
-
+    def enrich_org_units_with_addresses(org_unit_map, addresses):
         return address_helper(
-            queryset, org_unit_map, lambda address: address.enhed_uuid
+            addresses, org_unit_map, lambda address: address.enhed_uuid
         )
 
-    def enrich_employees_with_addresses(employee_map):
-        # Enrich with adresses
-        queryset = session.query(Adresse).filter(Adresse.bruger_uuid != None)
-
+    def enrich_employees_with_addresses(employee_map, addresses):
         return address_helper(
-            queryset, employee_map, lambda address: address.bruger_uuid
+            addresses, employee_map, lambda address: address.bruger_uuid
         )
 
-    def address_helper(queryset, entry_map, address_to_uuid):
-        da_address_types = {
-            "DAR": "DAR",
-            "Telefon": "PHONE",
-            "E-mail": "EMAIL",
-            "EAN": "EAN",
-            "P-nummer": "PNUMBER",
-            "Url": "WWW",
-        }
-
+    def address_helper(addresses, entry_map, address_to_uuid):
         dawa_queue = {}
 
         def process_address(address):
@@ -413,22 +462,18 @@ def generate_json():
 
             entry_map[entry_uuid]["addresses"][atype].append(formatted_address)
 
-        queryset = queryset.filter(
-            # Only include address types we care about
-            Adresse.adressetype_scope.in_(da_address_types.keys())
-        ).filter(
-            # Do not include secret addresses
-            or_(Adresse.synlighed_titel == None, Adresse.synlighed_titel != "Hemmelig")
-        )
-        for address in queryset.all():
+        for address in addresses:
             process_address(address)
 
         uuids = set(dawa_queue.keys())
-        queryset = session.query(DARAdresse).filter(DARAdresse.uuid.in_(uuids))
-        betegnelser = map(attrgetter('betegnelse'), queryset.all())
-        betegnelser = filter(lambda x: x is not None, betegnelser)
-        for value in betegnelser:
-            for address in dawa_queue[dar_uuid]:
+        dar_addresses = session.query(DARAdresse).filter(
+            DARAdresse.uuid.in_(uuids)
+        ).all()
+        for dar_address in dar_addresses:
+            value = dar_address.betegnelse
+            if value is None:
+                continue
+            for address in dawa_queue[dar_address.uuid]:
                 entry_uuid = address_to_uuid(address)
                 atype = da_address_types[address.adressetype_scope]
 
@@ -441,82 +486,131 @@ def generate_json():
                     formatted_address
                 )
 
-        found = set(map(attrgetter('uuid'), queryset.all()))
+        found = set(map(attrgetter('uuid'), dar_addresses))
         missing = uuids - found
         if missing:
             print(missing, "not found in DAWA")
 
         return entry_map
 
+    def addresses_query(owner_column):
+        def query(session):
+            return session.query(Adresse).filter(
+                owner_column != None
+            ).filter(
+                # Only include address types we care about
+                Adresse.adressetype_scope.in_(da_address_types.keys())
+            ).filter(
+                # Do not include secret addresses
+                or_(
+                    Adresse.synlighed_titel == None,
+                    Adresse.synlighed_titel != "Hemmelig"
+                )
+            ).all()
+        return query
+
+    # Queries
+    # --------
+    # None of the queries depend on each other, so they are all run concurrently
+    # on separate connections, while the results are processed in order below.
+    with elapsedtime("queries"):
+        results = run_queries(Session, {
+            "brugere": lambda session: session.query(Bruger).all(),
+            "employee_engagements": lambda session: session.query(
+                Engagement, Enhed
+            ).filter(Engagement.enhed_uuid == Enhed.uuid).all(),
+            "employee_associations": lambda session: session.query(
+                Tilknytning, Enhed
+            ).filter(Tilknytning.enhed_uuid == Enhed.uuid).all(),
+            "employee_managements": lambda session: session.query(
+                Leder, Enhed
+            ).filter(Leder.enhed_uuid == Enhed.uuid).filter(
+                # Filter vacant leders
+                Leder.bruger_uuid != None
+            ).all(),
+            "employee_addresses": addresses_query(Adresse.bruger_uuid),
+            "unit_engagements": lambda session: session.query(
+                Engagement, Bruger
+            ).filter(Engagement.bruger_uuid == Bruger.uuid).all(),
+            "unit_associations": lambda session: session.query(
+                Tilknytning, Bruger
+            ).filter(Tilknytning.bruger_uuid == Bruger.uuid).all(),
+            "unit_managements": lambda session: session.query(
+                Leder, Bruger
+            ).filter(Leder.bruger_uuid == Bruger.uuid).all(),
+            "kles": lambda session: session.query(KLE).all(),
+            "unit_addresses": addresses_query(Adresse.enhed_uuid),
+        })
+
     # Employees
     # ----------
     employee_map = None
     with elapsedtime("fetch_employees"):
-        employee_map = fetch_employees()
-    # NOTE: These 3 queries can run in parallel
+        employee_map = fetch_employees(results["brugere"])
     with elapsedtime("enrich_employees_with_engagements"):
-        employee_map = enrich_employees_with_engagements(employee_map)
+        employee_map = enrich_employees_with_engagements(
+            employee_map, results["employee_engagements"]
+        )
     with elapsedtime("enrich_employees_with_associations"):
-        employee_map = enrich_employees_with_associations(employee_map)
+        employee_map = enrich_employees_with_associations(
+            employee_map, results["employee_associations"]
+        )
     with elapsedtime("enrich_employees_with_management"):
-        employee_map = enrich_employees_with_management(employee_map)
+        employee_map = enrich_employees_with_management(
+            employee_map, results["employee_managements"]
+        )
     # Filter off employees without engagements, assoications and management
     with elapsedtime("filter_employees"):
         employee_map = filter_employees(employee_map)
     with elapsedtime("enrich_employees_with_addresses"):
-        employee_map = enrich_employees_with_addresses(employee_map)
+        employee_map = enrich_employees_with_addresses(
+            employee_map, results["employee_addresses"]
+        )
 
     # Org Units
     # ----------
     with elapsedtime("fetch_parent_org_units"):
         fetch_parent_org_units()
-    # NOTE: These 3 queries can run in parallel
     with elapsedtime("enrich_org_units_with_engagements"):
-        org_unit_map = enrich_org_units_with_engagements(org_unit_map)
+        org_unit_map = enrich_org_units_with_engagements(
+            org_unit_map, results["unit_engagements"]
+        )
     with elapsedtime("enrich_org_units_with_associations"):
-        org_unit_map = enrich_org_units_with_associations(org_unit_map)
+        org_unit_map = enrich_org_units_with_associations(
+            org_unit_map, results["unit_associations"]
+        )
     with elapsedtime("enrich_org_units_with_management"):
-        org_unit_map = enrich_org_units_with_management(org_unit_map)
+        org_unit_map = enrich_org_units_with_management(
+            org_unit_map, results["unit_managements"]
+        )
     with elapsedtime("enrich_org_units_with_kles"):
-        org_unit_map = enrich_org_units_with_kles(org_unit_map)
+        org_unit_map = enrich_org_units_with_kles(org_unit_map, results["kles"])
     with elapsedtime("enrich_org_units_with_addresses"):
-        org_unit_map = enrich_org_units_with_addresses(org_unit_map)
+        org_unit_map = enrich_org_units_with_addresses(
+            org_unit_map, results["unit_addresses"]
+        )
 
     print("Processing took", query_counter.count, "queries")
 
     # Write files
     # ------------
-    # TODO: Asyncio to write both files at once?
-    with open("tmp/employees.json", "w") as employees_out:
-        json.dump(employee_map, employees_out)
+    with elapsedtime("write_json"):
+        run_concurrently([
+            partial(write_json, "tmp/employees.json", employee_map),
+            partial(write_json, "tmp/org_units.json", org_unit_map),
+        ])
 
-    with open("tmp/org_units.json", "w") as org_units_out:
-        json.dump(org_unit_map, org_units_out)
+    if push:
+        push_to_os2phonebook(load_settings(), employee_map, org_unit_map, chunk_size)
 
 
-@cli.command()
 @async_to_sync
-async def transfer_json():
-    # Load settings file
-    settings = None
-    with elapsedtime("loading_settings"):
-        cfg_file = pathlib.Path.cwd() / "settings" / "settings.json"
-        if not cfg_file.is_file():
-            raise Exception("No setting file")
-        settings = json.loads(cfg_file.read_text())
-    # Load JSON
-    employee_map = {}
-    org_unit_map = {}
-    # TODO: Asyncio to write both files at once?
-    with elapsedtime("loading_employees"):
-        with open("tmp/employees.json", "r") as employees_in:
-            employee_map = json.load(employees_in)
-    with elapsedtime("loading_org_units"):
-        with open("tmp/org_units.json", "r") as org_units_in:
-            org_unit_map = json.load(org_units_in)
-    print("employees:", len(employee_map))
-    print("org units:", len(org_unit_map))
-    # Transfer JSON
+async def push_to_os2phonebook(settings, employee_map, org_unit_map, chunk_size=0):
+    """Push employees and org units to OS2Phonebook.
+
+    Both endpoints are pushed concurrently. With a chunk_size, each endpoint
+    receives a request per chunk_size entries, instead of one document.
+    """
     base_url = settings.get(
         "exporters.os2phonebook_base_url", "http://localhost:8000/api/"
     )
@@ -530,13 +624,14 @@ async def transfer_json():
     )
     basic_auth = BasicAuth(username, password)
 
-    async def push_updates(url, payload):
-        async with aiohttp_session.post(
-            base_url + url, json=payload, auth=basic_auth
-        ) as response:
-            if response.status != 200:
-                logger.warning("OS2Phonebook returned non-200 status code")
-            print(await response.text())
+    async def push_updates(url, entry_map):
+        for payload in chunked(entry_map, chunk_size):
+            async with aiohttp_session.post(
+                base_url + url, json=payload, auth=basic_auth
+            ) as response:
+                if response.status != 200:
+                    logger.warning("OS2Phonebook returned non-200 status code")
+                print(await response.text())
 
     with elapsedtime("push_x"):
         async with ClientSession() as aiohttp_session:
@@ -546,6 +641,32 @@ async def transfer_json():
             )
 
 
+@cli.command()
+@chunk_size_option
+def transfer_json(chunk_size):
+    # Load settings file
+    settings = None
+    with elapsedtime("loading_settings"):
+        settings = load_settings()
+    # Load JSON
+    employee_map = {}
+    org_unit_map = {}
+
+    def read_json(path):
+        with open(path, "r") as json_in:
+            return json.load(json_in)
+
+    with elapsedtime("loading_json"):
+        employee_map, org_unit_map = run_concurrently([
+            partial(read_json, "tmp/employees.json"),
+            partial(read_json, "tmp/org_units.json"),
+        ])
+    print("employees:", len(employee_map))
+    print("org units:", len(org_unit_map))
+    # Transfer JSON
+    push_to_os2phonebook(settings, employee_map, org_unit_map, chunk_size)
+
+
 if __name__ == "__main__":
     for name in logging.root.manager.loggerDict:
         if name in ("os2phonebook_export", "LoraCache", "SqlExport"):
@@ -13,6 +13,7 @@ import pathlib
 import datetime
 
 import click
+from collections import defaultdict
 from anytree import PreOrderIter
 from operator import itemgetter
 from functools import partial
@@ -43,24 +44,43 @@ logging.basicConfig(
 
 SETTINGS = load_settings()
 
-ACTIVE_JOB_FUNCTIONS = []  # Liste over aktive engagementer som skal eksporteres.
+ACTIVE_JOB_FUNCTIONS = set()  # Mængde af aktive engagementer som skal eksporteres.
+
+
+class CacheIndex(object):
+    """
+    Lookups into the LoRa caches, built with a single pass over each of them.
+    The entries of each lookup are kept in the order of the caches, so the
+    exports produce the same rows in the same order as scanning the caches.
+    """
+
+    def __init__(self, lc, lc_historic):
+        # All validities of the historic engagements, per unit
+        self.engagements_by_unit = defaultdict(list)
+        # Historic engagements, per user of the first validity
+        self.engagements_by_user = defaultdict(list)
+        for eng in lc_historic.engagements.values():
+            self.engagements_by_user[eng[0]['user']].append(eng)
+            for engv in eng:
+                self.engagements_by_unit[engv['unit']].append(engv)
+
+        # All validities of the historic addresses, per user and scope
+        self.addresses_by_user_scope = defaultdict(list)
+        for address in flatten(lc_historic.addresses.values()):
+            key = (address['user'], address['scope'])
+            self.addresses_by_user_scope[key].append(address)
+
+        # The last DAR address of each unit
+        self.dar_address_by_unit = {}
+        for raw_address in lc.addresses.values():
+            if raw_address[0]['scope'] == 'DAR':
+                self.dar_address_by_unit[raw_address[0]['unit']] = (
+                    raw_address[0]['value']
+                )
 
 
-def get_e_address(e_uuid, scope, lc, lc_historic, settings):
-    # Iterator of all addresses in LoRa
-    lora_addresses = lc_historic.addresses.values()
-    lora_addresses = flatten(lora_addresses)
-    # Iterator of all addresses for the current user
-    lora_addresses = filter(
-        lambda address: address['user'] == e_uuid,
-        lora_addresses
-    )
-    # Iterator of all addresses for current user and correct scope
-    lora_addresses = filter(
-        lambda address: address['scope'] == scope,
-        lora_addresses
-    )
-    candidates = lora_addresses
+def get_e_address(e_uuid, scope, lc, index, settings):
+    candidates = index.addresses_by_user_scope[(e_uuid, scope)]
 
     if scope == "Telefon":
         priority_list = settings.get("plan2learn.phone.priority", [])
@@ -110,12 +130,8 @@ allowed_engagement_types = SETTINGS[
 ]
 
 
-def export_bruger_lc(node, used_cprs, lc, lc_historic):
-    # TODO: If this is to run faster, we need to pre-sort into units,
-    # to avoid iterating all engagements for each unit.
-    lora_engagements = lc_historic.engagements.values()
-    lora_engagements = flatten(lora_engagements)
-    lora_engagements = filter(lambda engv: engv['unit'] == node.name, lora_engagements)
+def export_bruger_lc(node, used_cprs, lc, index):
+    lora_engagements = index.engagements_by_unit[node.name]
     lora_engagements = filter(
         lambda engv: engv['engagement_type'] in allowed_engagement_types,
         lora_engagements
@@ -131,12 +147,12 @@ def export_bruger_lc(node, used_cprs, lc, lc_historic):
         used_cprs.add(cpr)
         name = user['navn']
 
-        _phone_obj = get_e_address(user_uuid, 'Telefon', lc, lc_historic, SETTINGS)
+        _phone_obj = get_e_address(user_uuid, 'Telefon', lc, index, SETTINGS)
         _phone = None
         if _phone_obj:
             _phone = _phone_obj['value']
 
-        _email_obj = get_e_address(user_uuid, 'E-mail', lc, lc_historic, SETTINGS)
+        _email_obj = get_e_address(user_uuid, 'E-mail', lc, index, SETTINGS)
         _email = None
         if _email_obj:
             _email = _email_obj['value']
@@ -179,10 +195,10 @@ def export_bruger_mo(node, used_cprs, mh):
     return rows, used_cprs
 
 
-def export_bruger(mh, nodes, lc, lc_historic):
+def export_bruger(mh, nodes, lc, index):
     #  fieldnames = ['BrugerId', 'CPR', 'Navn', 'E-mail', 'Mobil', 'Stilling']
-    if lc and lc_historic:
-        bruger_exporter = partial(export_bruger_lc, lc=lc, lc_historic=lc_historic)
+    if lc and index:
+        bruger_exporter = partial(export_bruger_lc, lc=lc, index=index)
     else:
         bruger_exporter = partial(export_bruger_mo, mh=mh)
 
@@ -206,7 +222,7 @@ def _split_dar(address):
     return gade, post, by
 
 
-def export_organisation(mh, nodes, filename, lc=None):
+def export_organisation(mh, nodes, filename, lc=None, index=None):
     fieldnames = ['AfdelingsID', 'Afdelingsnavn', 'Parentid', 'Gade', 'Postnr', 'By']
 
     rows = []
@@ -216,37 +232,32 @@ def export_organisation(mh, nodes, filename, lc=None):
 
     for node in PreOrderIter(nodes['root']):
         if lc:
-            for unit in lc.units.values():
-                # Units are never terminated, we can safely take first value
-                unitv = unit[0]
-                if unitv['uuid'] != node.name:
-                    continue
+            if node.name not in lc.units:
+                continue
+            # Units are never terminated, we can safely take first value
+            unitv = lc.units[node.name][0]
 
-                level_uuid = unitv['level']
-                level_titel = lc.classes[level_uuid]
-                too_deep = SETTINGS['integrations.SD_Lon.import.too_deep']
-                if level_titel['title'] in too_deep:
-                    continue
+            level_uuid = unitv['level']
+            level_titel = lc.classes[level_uuid]
+            too_deep = SETTINGS['integrations.SD_Lon.import.too_deep']
+            if level_titel['title'] in too_deep:
+                continue
 
-                over_uuid = unitv['parent'] if unitv['parent'] else ''
+            over_uuid = unitv['parent'] if unitv['parent'] else ''
 
-                address = None
-                for raw_address in lc.addresses.values():
-                    if raw_address[0]['unit'] == unitv['uuid']:
-                        if raw_address[0]['scope'] == 'DAR':
-                            address = raw_address[0]['value']
+            address = index.dar_address_by_unit.get(unitv['uuid'])
 
-                gade, post, by = _split_dar(address)
-                eksporterede_afdelinger.append(unit[0]['uuid'])
-                row = {
-                    'AfdelingsID': unit[0]['uuid'],
-                    'Afdelingsnavn': unit[0]['name'],
-                    'Parentid': over_uuid,
-                    'Gade': gade,
-                    'Postnr': post,
-                    'By': by
-                }
-                rows.append(row)
+            gade, post, by = _split_dar(address)
+            eksporterede_afdelinger.append(unitv['uuid'])
+            row = {
+                'AfdelingsID': unitv['uuid'],
+                'Afdelingsnavn': unitv['name'],
+                'Parentid': over_uuid,
+                'Gade': gade,
+                'Postnr': post,
+                'By': by
+            }
+            rows.append(row)
 
         else:
             ou = mh.read_ou(node.name)
@@ -275,7 +286,7 @@ def export_organisation(mh, nodes, filename, lc=None):
 
 
 def export_engagement(mh, filename, eksporterede_afdelinger, brugere_rows,
-                      lc, lc_historic):
+                      lc, index):
     fieldnames = ['EngagementId', 'BrugerId', 'AfdelingsId', 'AktivStatus',
                   'StillingskodeId', 'Primær', 'Engagementstype',
                   'StartdatoEngagement']
@@ -286,25 +297,27 @@ def export_engagement(mh, filename, eksporterede_afdelinger, brugere_rows,
 
     rows = []
 
-    # Keep a list of exported engagements to avoid exporting the same engagment
+    # Keep a set of exported engagements to avoid exporting the same engagment
     # multiple times if it has multiple rows in MO.
-    exported_engagements = []
+    exported_engagements = set()
+    eksporterede_afdelinger = set(eksporterede_afdelinger)
 
     err_msg = 'Skipping {}, due to non-allowed engagement type'
-    if lc and lc_historic:
+    if lc and index:
+        brugere_by_uuid = defaultdict(list)
+        for bruger in brugere_rows:
+            brugere_by_uuid[bruger['BrugerId']].append(bruger)
+
         for employee_effects in lc.users.values():
-            for eng in lc_historic.engagements.values():
+            # As this is not the historic cache, there should only be one user
+            employee = employee_effects[0]
+
+            for eng in index.engagements_by_user[employee['uuid']]:
                 # We can consistenly access index 0, the historic export
                 # is for the purpose of catching future engagements, not
                 # to catch all validities
                 engv = eng[0]
 
-                # As this is not the historic cache, there should only be one user
-                employee = employee_effects[0]
-
-                if engv['user'] != employee['uuid']:
-                    continue
-
                 if engv['unit'] not in eksporterede_afdelinger:
                     msg = 'Unit {} is not included in the export'
                     logger.info(msg.format(engv['unit']))
@@ -316,7 +329,7 @@ def export_engagement(mh, filename, eksporterede_afdelinger, brugere_rows,
 
                 if engv['uuid'] in exported_engagements:
                     continue
-                exported_engagements.append(engv['uuid'])
+                exported_engagements.add(engv['uuid'])
 
                 valid_from = datetime.datetime.strptime(
                     engv['from_date'], '%Y-%m-%d'
@@ -350,20 +363,19 @@ def export_engagement(mh, filename, eksporterede_afdelinger, brugere_rows,
                         primary = False
                 if primary:
                     primær = 1
-                    for bruger in brugere_rows:
-                        if bruger['BrugerId'] == employee['uuid']:
-                            udvidelse_2 = engv['extensions'].get('udvidelse_2')
-                            if udvidelse_2:
-                                bruger['Stilling'] = udvidelse_2
-                            else:
-                                job_function = engv['job_function']
-                                stilling = lc.classes[job_function]['title']
-                                bruger['Stilling'] = stilling
+                    for bruger in brugere_by_uuid[employee['uuid']]:
+                        udvidelse_2 = engv['extensions'].get('udvidelse_2')
+                        if udvidelse_2:
+                            bruger['Stilling'] = udvidelse_2
+                        else:
+                            job_function = engv['job_function']
+                            stilling = lc.classes[job_function]['title']
+                            bruger['Stilling'] = stilling
                 else:
                     primær = 0
 
                 stilingskode_id = engv['job_function']
-                ACTIVE_JOB_FUNCTIONS.append(stilingskode_id)
+                ACTIVE_JOB_FUNCTIONS.add(stilingskode_id)
                 eng_type = lc.classes[engv['engagement_type']]['title']
 
                 row = {
@@ -398,7 +410,7 @@ def export_engagement(mh, filename, eksporterede_afdelinger, brugere_rows,
 
                 if eng['uuid'] in exported_engagements:
                     continue
-                exported_engagements.append(eng['uuid'])
+                exported_engagements.add(eng['uuid'])
                 logger.info('New line in file: {}'.format(eng))
 
                 valid_from = datetime.datetime.strptime(
@@ -444,7 +456,7 @@ def export_engagement(mh, filename, eksporterede_afdelinger, brugere_rows,
                     primær = 0
 
                 stilingskode_id = eng['job_function']['uuid']
-                ACTIVE_JOB_FUNCTIONS.append(stilingskode_id)
+                ACTIVE_JOB_FUNCTIONS.add(stilingskode_id)
 
                 row = {
                     'EngagementId': eng['uuid'],
@@ -507,6 +519,7 @@ def export_stillingskode(mh, nodes, filename, lc=None):
 def export_leder(mh, nodes, filename, eksporterede_afdelinger, lc=None):
     fieldnames = ['BrugerId', 'AfdelingsID', 'AktivStatus', 'Titel']
     rows = []
+    eksporterede_afdelinger = set(eksporterede_afdelinger)
     for node in PreOrderIter(nodes['root']):
         if node.name not in eksporterede_afdelinger:
             # Denne afdeling er ikke med i afdelingseksport.
@@ -560,27 +573,31 @@ def main(speedup, dry_run=False):
                                 skip_past=True)
         lc_historic.populate_cache(dry_run=dry_run, skip_associations=True)
         # Here we should de-activate read-only mode
+
+        # Index the caches once, rather than scanning them for every unit,
+        # user and address
+        index = CacheIndex(lc, lc_historic)
     else:
         lc = None
-        lc_historic = None
+        index = None
 
     # Todo: We need the nodes structure to keep a consistent output,
     # consider if the 70 seconds is worth the implementation time of
     # reading this from cache.
     nodes = mh.read_ou_tree(root_unit)
 
-    brugere_rows = export_bruger(mh, nodes, lc, lc_historic)
+    brugere_rows = export_bruger(mh, nodes, lc, index)
     print('Bruger: {}s'.format(time.time() - t))
     logger.info('Bruger: {}s'.format(time.time() - t))
 
     filename = str(dest_folder / 'plan2learn_organisation.csv')
-    eksporterede_afdelinger = export_organisation(mh, nodes, filename, lc)
+    eksporterede_afdelinger = export_organisation(mh, nodes, filename, lc, index)
     print('Organisation: {}s'.format(time.time() - t))
     logger.info('Organisation: {}s'.format(time.time() - t))
 
     filename = str(dest_folder / 'plan2learn_engagement.csv')
     brugere_rows = export_engagement(mh, filename, eksporterede_afdelinger,
-                                     brugere_rows, lc, lc_historic)
+                                     brugere_rows, lc, index)
     print('Engagement: {}s'.format(time.time() - t))
     logger.info('Engagement: {}s'.format(time.time() - t))
 
@@ -0,0 +1,189 @@
+"""
+Compact records for the validities held by LoraCache.
+
+A full history cache holds millions of validities. Storing each of them as a
+dict repeats the same ten or so keys in every one of them, so instead they are
+stored in classes with :code:`__slots__`. The records are mutable mappings, so
+existing consumers can keep treating them as dicts, e.g. :code:`record['uuid']`,
+:code:`record.get('parent')`, :code:`record.items()` and comparison with dicts.
+
+The uuids and user keys of the records are interned, such that every record
+referring to the same unit or class shares a single string.
+"""
+import sys
+from collections.abc import MutableMapping
+
+_intern = sys.intern
+
+
+class Record(MutableMapping):
+    """Base class of the records, see :code:`record_type`."""
+
+    __slots__ = ('_extra',)
+    _fields = ()
+    _field_set = frozenset()
+    _interned = frozenset()
+
+    def __init__(self, **values):
+        interned = self._interned
+        for key, value in values.items():
+            if key in interned and value is not None:
+                value = _intern(value)
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        try:
+            return self._extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, value)
+            return
+        try:
+            self._extra[key] = value
+        except AttributeError:
+            self._extra = {key: value}
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        try:
+            del self._extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key in self._fields:
+            if hasattr(self, key):
+                yield key
+        yield from getattr(self, '_extra', ())
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def record_type(name, fields, interned=(), optional=()):
+    """Create a record class.
+
+    :param name: Name of the class.
+    :param fields: The keys of the records.
+    :param interned: The keys of string values which should be interned.
+    :param optional: Keys which are set later on, e.g. by derived data
+        calculations, and which are absent until then.
+
+    Example:
+        >>> Unit = record_type('Unit', ['uuid', 'name'], optional=['location'])
+        >>> unit = Unit(uuid='abc', name='Enhed')
+        >>> unit == {'uuid': 'abc', 'name': 'Enhed'}
+        True
+        >>> 'location' in unit
+        False
+        >>> unit['location'] = 'Kommune\\\\Enhed'
+        >>> unit.get('location')
+        'Kommune\\\\Enhed'
+    """
+    fields = tuple(fields) + tuple(optional)
+    return type(name, (Record,), {
+        '__module__': __name__,
+        '__slots__': fields,
+        '_fields': fields,
+        '_field_set': frozenset(fields),
+        '_interned': frozenset(interned),
+    })
+
+
+UserRecord = record_type(
+    'UserRecord',
+    ['uuid', 'cpr', 'user_key', 'fornavn', 'efternavn', 'navn',
+     'kaldenavn_fornavn', 'kaldenavn_efternavn', 'kaldenavn',
+     'from_date', 'to_date'],
+    interned=['uuid', 'user_key', 'from_date', 'to_date'],
+)
+
+UnitRecord = record_type(
+    'UnitRecord',
+    ['uuid', 'user_key', 'name', 'unit_type', 'level', 'parent',
+     'from_date', 'to_date'],
+    interned=['uuid', 'user_key', 'unit_type', 'level', 'parent',
+              'from_date', 'to_date'],
+    optional=['location', 'manager_uuid', 'acting_manager_uuid'],
+)
+
+AddressRecord = record_type(
+    'AddressRecord',
+    ['uuid', 'user', 'unit', 'value', 'scope', 'dar_uuid', 'adresse_type',
+     'visibility', 'from_date', 'to_date'],
+    interned=['uuid', 'user', 'unit', 'scope', 'dar_uuid', 'adresse_type',
+              'visibility', 'from_date', 'to_date'],
+)
+
+EngagementRecord = record_type(
+    'EngagementRecord',
+    ['uuid', 'user', 'unit', 'fraction', 'user_key', 'engagement_type',
+     'primary_type', 'job_function', 'extensions', 'from_date', 'to_date'],
+    interned=['uuid', 'user', 'unit', 'user_key', 'engagement_type',
+              'primary_type', 'job_function', 'from_date', 'to_date'],
+    optional=['primary_boolean'],
+)
+
+AssociationRecord = record_type(
+    'AssociationRecord',
+    ['uuid', 'user', 'unit', 'user_key', 'association_type',
+     'from_date', 'to_date'],
+    interned=['uuid', 'user', 'unit', 'user_key', 'association_type',
+              'from_date', 'to_date'],
+)
+
+RoleRecord = record_type(
+    'RoleRecord',
+    ['uuid', 'user', 'unit', 'role_type', 'from_date', 'to_date'],
+    interned=['uuid', 'user', 'unit', 'role_type', 'from_date', 'to_date'],
+)
+
+LeaveRecord = record_type(
+    'LeaveRecord',
+    ['uuid', 'user', 'user_key', 'leave_type', 'from_date', 'to_date'],
+    interned=['uuid', 'user', 'user_key', 'leave_type', 'from_date', 'to_date'],
+)
+
+ITConnectionRecord = record_type(
+    'ITConnectionRecord',
+    ['uuid', 'user', 'unit', 'username', 'itsystem', 'from_date', 'to_date'],
+    interned=['uuid', 'user', 'unit', 'itsystem', 'from_date', 'to_date'],
+)
+
+KLERecord = record_type(
+    'KLERecord',
+    ['uuid', 'unit', 'kle_number', 'kle_aspect', 'user_key',
+     'from_date', 'to_date'],
+    interned=['uuid', 'unit', 'kle_number', 'kle_aspect', 'user_key',
+              'from_date', 'to_date'],
+)
+
+RelatedRecord = record_type(
+    'RelatedRecord',
+    ['uuid', 'unit1_uuid', 'unit2_uuid', 'from_date', 'to_date'],
+    interned=['uuid', 'unit1_uuid', 'unit2_uuid', 'from_date', 'to_date'],
+)
+
+ManagerRecord = record_type(
+    'ManagerRecord',
+    ['uuid', 'user', 'unit', 'manager_type', 'manager_level',
+     'manager_responsibility', 'from_date', 'to_date'],
+    interned=['uuid', 'user', 'unit', 'manager_type', 'manager_level',
+              'from_date', 'to_date'],
+)
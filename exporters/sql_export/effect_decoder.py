@@ -0,0 +1,180 @@
+"""
+Fast decoding of LoRa effects for LoraCache.
+
+This is a drop-in replacement for :code:`lora_utils.get_effects` and the date
+handling in :code:`LoraCache`, tuned for decoding every registration in LoRa:
+
+ * Timestamps are parsed once per distinct raw string, rather than once for
+   every entry in every effect.
+ * The validity of each entry is computed once per object, rather than once per
+   effect.
+ * "Now" is read once per cache run, rather than once per effect.
+"""
+import datetime
+from collections import defaultdict
+
+import dateutil.parser
+import dateutil.tz
+
+DEFAULT_TIMEZONE = dateutil.tz.gettz('Europe/Copenhagen')
+
+_MAX = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+_MIN = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+class EffectDecoder:
+    """
+    Split LoRa objects into effects and find their MO validities.
+
+    :param full_history: Return every validity, rather than only the current.
+    :param skip_past: Skip validities which have ended.
+    :param now: The time to compare validities to, defaults to the time the
+        decoder is created.
+    """
+
+    def __init__(self, full_history, skip_past, now=None):
+        self.full_history = full_history
+        self.skip_past = skip_past
+        self.now = now or datetime.datetime.now(DEFAULT_TIMEZONE)
+        self._timestamps = {}
+        self._from_dates = {}
+        self._to_dates = {}
+
+    def parse_timestamp(self, timestamp):
+        """Parse a LoRa timestamp, like :code:`lora_utils` does.
+
+        Example:
+            >>> decoder = EffectDecoder(full_history=True, skip_past=False)
+            >>> decoder.parse_timestamp('2020-01-01 00:00:00+01')
+            datetime.datetime(2020, 1, 1, 0, 0, tzinfo=tzoffset(None, 3600))
+            >>> decoder.parse_timestamp('infinity').year
+            9999
+        """
+        try:
+            return self._timestamps[timestamp]
+        except KeyError:
+            pass
+        if timestamp == 'infinity':
+            dt = _MAX
+        elif timestamp == '-infinity':
+            dt = _MIN
+        else:
+            dt = dateutil.parser.isoparse(timestamp)
+            if not dt.tzinfo:
+                dt = dt.replace(tzinfo=datetime.timezone.utc)
+        self._timestamps[timestamp] = dt
+        return dt
+
+    def get_effects(self, obj, relevant, additional=None):
+        """
+        Split a LoRa registration into effects, yielding the same start, end
+        and effect tuples as :code:`lora_utils.get_effects`.
+
+        :param obj: A LoRa registration.
+        :param relevant: The attributes to split on.
+        :param additional: Additional attributes to include in the effects.
+        """
+        everything = defaultdict(tuple)
+        for group in relevant:
+            everything[group] += relevant[group]
+        for group in additional or {}:
+            everything[group] += additional[group]
+
+        parse = self.parse_timestamp
+
+        def with_validity(entries):
+            return [
+                (parse(entry['virkning']['from']), parse(entry['virkning']['to']),
+                 entry)
+                for entry in entries
+            ]
+
+        # Parse the validity of every entry once
+        validities = {
+            group: {
+                key: with_validity(obj[group][key])
+                for key in everything[group]
+                if key in obj[group]
+            }
+            for group in everything
+            if group in obj
+        }
+
+        # Extract all beginning and end timestamps of the relevant entries
+        chunks = set()
+        for group, keys in relevant.items():
+            if group not in obj:
+                continue
+            for key in keys:
+                for start, end, _ in validities[group].get(key, ()):
+                    chunks.add(start)
+                    chunks.add(end)
+        chunks = sorted(chunks)
+
+        for start, end in zip(chunks, chunks[1:]):
+            effect = {
+                group: {
+                    key: [
+                        entry
+                        for entry_start, entry_end, entry in entries
+                        if entry_start < end and entry_end > start
+                    ]
+                    for key, entries in group_validities.items()
+                }
+                for group, group_validities in validities.items()
+            }
+            if any(k for g in effect.values() for k in g.values()):
+                yield start, end, effect
+
+    def _from_date(self, dt_from):
+        try:
+            return self._from_dates[dt_from]
+        except KeyError:
+            pass
+        dt_from_local = dt_from.astimezone(DEFAULT_TIMEZONE)
+        result = dt_from_local, dt_from_local.date().isoformat()
+        self._from_dates[dt_from] = result
+        return result
+
+    def _to_date(self, dt_to):
+        try:
+            return self._to_dates[dt_to]
+        except KeyError:
+            pass
+        if dt_to.replace(tzinfo=None) == datetime.datetime.max:
+            result = None, None
+        else:
+            dt_to_local = dt_to.astimezone(DEFAULT_TIMEZONE)
+            # MO considers end-dates inclusive, we need to subtract a day
+            to_date = (dt_to_local.date() - datetime.timedelta(days=1)).isoformat()
+            result = dt_to_local, to_date
+        self._to_dates[dt_to] = result
+        return result
+
+    def from_to(self, effect):
+        """
+        Finds to and from date from an effect-row as returned by  iterating over the
+        result of get_effects().
+        :param effect: The effect to analyse.
+        :return: from_date and to_date. To date can be None, which should be
+        interpreted as an infinite validity. In non-historic exports, both values
+        can be None, meaning that this row is not the actual-state value.
+        """
+        dt_from, from_date = self._from_date(effect[0])
+        dt_to, to_date = self._to_date(effect[1])
+
+        now = self.now
+        if to_date is None:
+            # In this case, make sure dt_to is bigger than now
+            dt_to = now + datetime.timedelta(days=1)
+
+        # If this is an actual state export, we should only return a value if
+        # the row is valid today.
+        if not self.full_history:
+            if not dt_from < now < dt_to:
+                return None, None
+
+        if self.skip_past:
+            if dt_to < now:
+                return None, None
+        return from_date, to_date
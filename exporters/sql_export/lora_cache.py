@@ -6,7 +6,6 @@ import logging
 import pathlib
 import datetime
 import dateutil
-import lora_utils
 import requests
 from operator import itemgetter
 from itertools import starmap
@@ -18,7 +17,14 @@ import click
 from more_itertools import bucket
 
 from os2mo_helpers.mora_helpers import MoraHelper
+from os2mo_helpers.request_metrics import hooks
 from integrations.dar_helper import dar_helper
+from exporters.sql_export.cache_records import (
+    AddressRecord, AssociationRecord, EngagementRecord, ITConnectionRecord,
+    KLERecord, LeaveRecord, ManagerRecord, RelatedRecord, RoleRecord,
+    UnitRecord, UserRecord
+)
+from exporters.sql_export.effect_decoder import EffectDecoder
 
 logger = logging.getLogger("LoraCache")
 
@@ -29,6 +35,24 @@ PICKLE_PROTOCOL = pickle.DEFAULT_PROTOCOL
 LOG_LEVEL = logging.DEBUG
 LOG_FILE = 'lora_cache.log'
 
+ORGANISATION_FUNCTION_URL = '/organisation/organisationfunktion'
+
+LORA_HOOKS = hooks('lora')
+
+# The organisation functions in the cache, by funktionsnavn:
+# (cache attribute, decoder method, progress unit)
+ORGANISATION_FUNCTIONS = {
+    'Adresse': ('addresses', '_decode_address', 'address'),
+    'Engagement': ('engagements', '_decode_engagement', 'engagement'),
+    'Tilknytning': ('associations', '_decode_association', 'association'),
+    'Rolle': ('roles', '_decode_role', 'role'),
+    'Orlov': ('leaves', '_decode_leave', 'leave'),
+    'IT-system': ('it_connections', '_decode_it_connection', 'it connection'),
+    'KLE': ('kles', '_decode_kle', 'KLE'),
+    'Relateret Enhed': ('related', '_decode_related', 'related'),
+    'Leder': ('managers', '_decode_manager', 'manager'),
+}
+
 
 class LoraCache:
 
@@ -47,6 +71,7 @@ class LoraCache:
 
         self.full_history = full_history
         self.skip_past = skip_past
+        self._decoder = EffectDecoder(full_history, skip_past)
         self.org_uuid = self._read_org_uuid()
 
     def _load_settings(self):
@@ -70,7 +95,7 @@ class LoraCache:
         exit()
 
     def _get_effects(self, lora_object, relevant):
-        effects = lora_utils.get_effects(
+        effects = self._decoder.get_effects(
             lora_object['registreringer'][0],
             relevant=relevant,
             additional=self.additional
@@ -79,13 +104,13 @@ class LoraCache:
         # in the case of non-historic export, this could be handy in some
         # situations, eg ad->mo sync
         # if self.full_history:
-        #     effects = lora_utils.get_effects(lora_object['registreringer'][0],
-        #                                      relevant=relevant,
-        #                                      additional=self.additional)
+        #     effects = self._decoder.get_effects(lora_object['registreringer'][0],
+        #                                         relevant=relevant,
+        #                                         additional=self.additional)
         # else:
-        #     effects = lora_utils.get_effects(lora_object['registreringer'][0],
-        #                                      relevant=self.additional,
-        #                                      additional=relevant)
+        #     effects = self._decoder.get_effects(lora_object['registreringer'][0],
+        #                                         relevant=self.additional,
+        #                                         additional=relevant)
         return effects
 
     def _from_to_from_effect(self, effect):
@@ -96,36 +121,11 @@ class LoraCache:
         :return: from_date and to_date. To date can be None, which should be
         interpreted as an infinite validity. In non-historic exports, both values
         can be None, meaning that this row is not the actual-state value.
-        """
-        dt_from = dateutil.parser.isoparse(str(effect[0]))
-        dt_from = dt_from.astimezone(DEFAULT_TIMEZONE)
-        from_date = dt_from.date().isoformat()
 
-        if effect[1].replace(tzinfo=None) == datetime.datetime.max:
-            to_date = None
-        else:
-            dt_to = dateutil.parser.isoparse(str(effect[1]))
-            dt_to = dt_to.astimezone(DEFAULT_TIMEZONE)
-            # MO considers end-dates inclusive, we need to subtract a day
-            to_date = (dt_to.date() - datetime.timedelta(days=1)).isoformat()
-
-        now = datetime.datetime.now(DEFAULT_TIMEZONE)
-        # If this is an actual state export, we should only return a value if
-        # the row is valid today.
-        if not self.full_history:
-            if to_date is None:
-                # In this case, make sure dt_to is bigger than now
-                dt_to = now + datetime.timedelta(days=1)
-            if not dt_from < now < dt_to:
-                from_date = to_date = None
-
-        if self.skip_past:
-            if to_date is None:
-                # In this case, make sure dt_to is bigger than now
-                dt_to = now + datetime.timedelta(days=1)
-            if dt_to < now:
-                from_date = to_date = None
-        return from_date, to_date
+        Timestamps are parsed and compared to the time the cache run started,
+        see :code:`EffectDecoder`.
+        """
+        return self._decoder.from_to(effect)
 
     def _perform_lora_lookup(self, url, params, skip_history=False, unit="it"):
         """
@@ -148,7 +148,9 @@ class LoraCache:
             if not self.skip_past:
                 params['virkningFra'] = '-infinity'
 
-        response = requests.get(self.settings['mox.base'] + url, params=params)
+        response = requests.get(
+            self.settings['mox.base'] + url, params=params, hooks=LORA_HOOKS
+        )
         data = response.json()
         total = len(data["results"][0])
 
@@ -159,7 +161,9 @@ class LoraCache:
 
         with tqdm(total=total, desc="Fetching " + unit, unit=unit) as pbar:
             while True:
-                response = requests.get(self.settings['mox.base'] + url, params=params)
+                response = requests.get(
+                    self.settings['mox.base'] + url, params=params, hooks=LORA_HOOKS
+                )
                 data = response.json()
                 results = data['results']
                 data_list = []
@@ -282,20 +286,20 @@ class LoraCache:
                 kaldenavn_fornavn = udv.get('kaldenavn_fornavn', '')
                 kaldenavn_efternavn = udv.get('kaldenavn_efternavn', '')
                 users[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'cpr': cpr,
-                        'user_key': user_key,
-                        'fornavn': fornavn,
-                        'efternavn': efternavn,
-                        'navn': ' '.join([fornavn, efternavn]).strip(),
-                        'kaldenavn_fornavn': kaldenavn_fornavn,
-                        'kaldenavn_efternavn': kaldenavn_efternavn,
-                        'kaldenavn': ' '.join([kaldenavn_fornavn,
-                                               kaldenavn_efternavn]).strip(),
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+                    UserRecord(
+                        uuid=uuid,
+                        cpr=cpr,
+                        user_key=user_key,
+                        fornavn=fornavn,
+                        efternavn=efternavn,
+                        navn=' '.join([fornavn, efternavn]).strip(),
+                        kaldenavn_fornavn=kaldenavn_fornavn,
+                        kaldenavn_efternavn=kaldenavn_efternavn,
+                        kaldenavn=' '.join([kaldenavn_fornavn,
+                                            kaldenavn_efternavn]).strip(),
+                        from_date=from_date,
+                        to_date=to_date
+                    )
                 )
         return users
 
@@ -341,119 +345,171 @@ class LoraCache:
                 else:
                     level = None
                 units[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'user_key': egenskaber['brugervendtnoegle'],
-                        'name': egenskaber['enhedsnavn'],
-                        'unit_type': relationer['enhedstype'][0]['uuid'],
-                        'level': level,
-                        'parent': parent,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+                    UnitRecord(
+                        uuid=uuid,
+                        user_key=egenskaber['brugervendtnoegle'],
+                        name=egenskaber['enhedsnavn'],
+                        unit_type=relationer['enhedstype'][0]['uuid'],
+                        level=level,
+                        parent=parent,
+                        from_date=from_date,
+                        to_date=to_date
+                    )
                 )
         return units
 
+    def _cache_lora_organisation_function(self, funktionsnavn):
+        """
+        Read and decode the organisation functions with a given funktionsnavn.
+        :param funktionsnavn: One of the keys of ORGANISATION_FUNCTIONS.
+        :return: Dict from uuid to validities.
+        """
+        _, decoder, unit = ORGANISATION_FUNCTIONS[funktionsnavn]
+        decode = getattr(self, decoder)
+        params = {'gyldighed': 'Aktiv', 'funktionsnavn': funktionsnavn}
+        lora_objects = self._perform_lora_lookup(
+            ORGANISATION_FUNCTION_URL, params, unit=unit
+        )
+        cache = {}
+        for lora_object in tqdm(lora_objects, desc="Processing " + unit, unit=unit):
+            decode(lora_object, cache)
+        return cache
+
+    def _cache_lora_organisation_functions(self, skip_associations=False):
+        """
+        Read and decode all organisation functions in a single scan of LoRa,
+        rather than scanning once for every funktionsnavn.
+        :param skip_associations: Do not decode associations.
+        :return: Dict from cache attribute, e.g. 'engagements', to the same dict
+        as the corresponding _cache_lora_* method returns.
+        """
+        funktionsnavne = set(ORGANISATION_FUNCTIONS)
+        if skip_associations:
+            funktionsnavne.remove('Tilknytning')
+        decoders = {
+            funktionsnavn: getattr(self, ORGANISATION_FUNCTIONS[funktionsnavn][1])
+            for funktionsnavn in funktionsnavne
+        }
+        caches = {funktionsnavn: {} for funktionsnavn in funktionsnavne}
+
+        params = {'gyldighed': 'Aktiv'}
+        lora_objects = self._perform_lora_lookup(
+            ORGANISATION_FUNCTION_URL, params, unit="organisation function"
+        )
+        for lora_object in tqdm(lora_objects, desc="Processing organisation function",
+                                unit="organisation function"):
+            egenskaber = (lora_object['registreringer'][0]['attributter']
+                          .get('organisationfunktionegenskaber', []))
+            # An object matches a funktionsnavn filter if any of its
+            # validities has it
+            for funktionsnavn in {egenskab.get('funktionsnavn')
+                                  for egenskab in egenskaber}:
+                if funktionsnavn in decoders:
+                    decoders[funktionsnavn](lora_object, caches[funktionsnavn])
+
+        return {
+            ORGANISATION_FUNCTIONS[funktionsnavn][0]: cache
+            for funktionsnavn, cache in caches.items()
+        }
+
     def _cache_lora_address(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Adresse'}
+        return self._cache_lora_organisation_function('Adresse')
 
-        url = '/organisation/organisationfunktion'
+    def _decode_address(self, address, addresses):
         relevant = {
             'relationer': ('tilknyttedeenheder', 'tilknyttedebrugere',
                            'adresser', 'organisatoriskfunktionstype', 'opgaver'),
             'attributter': ('organisationfunktionegenskaber',)
         }
-        address_list = self._perform_lora_lookup(url, params, unit="address")
-
-        addresses = {}
-        for address in tqdm(address_list, desc="Processing address", unit="address"):
-            uuid = address['id']
-            addresses[uuid] = []
 
-            effects = self._get_effects(address, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
-                relationer = effect[2]['relationer']
+        uuid = address['id']
+        addresses[uuid] = []
 
-                if 'tilknyttedeenheder' in relationer and len(relationer['tilknyttedeenheder']) > 0:
-                    unit_uuid = relationer['tilknyttedeenheder'][0]['uuid']
-                    user_uuid = None
-                elif 'tilknyttedebrugere' in relationer and len(relationer['tilknyttedebrugere']) > 0:
-                    user_uuid = relationer['tilknyttedebrugere'][0]['uuid']
-                    unit_uuid = None
-                else:
-                    # Skip if address is not attached to anything
-                    continue
+        effects = self._get_effects(address, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
+            relationer = effect[2]['relationer']
+
+            if 'tilknyttedeenheder' in relationer and len(relationer['tilknyttedeenheder']) > 0:
+                unit_uuid = relationer['tilknyttedeenheder'][0]['uuid']
+                user_uuid = None
+            elif 'tilknyttedebrugere' in relationer and len(relationer['tilknyttedebrugere']) > 0:
+                user_uuid = relationer['tilknyttedebrugere'][0]['uuid']
+                unit_uuid = None
+            else:
+                # Skip if address is not attached to anything
+                continue
 
-                dar_uuid = None
-                value_raw = relationer['adresser'][0]['urn']
-                address_type = relationer['adresser'][0]['objekttype']
-                if address_type == 'EMAIL':
-                    scope = 'E-mail'
-                    skip_len = len('urn:mailto:')
-                    value = value_raw[skip_len:]
-                elif address_type == 'WWW':
-                    scope = 'Url'
-                    skip_len = len('urn:magenta.dk:www:')
-                    value = value_raw[skip_len:]
-                elif address_type == 'PHONE':
-                    scope = 'Telefon'
-                    skip_len = len('urn:magenta.dk:telefon:')
-                    value = value_raw[skip_len:]
-                elif address_type == 'PNUMBER':
-                    scope = 'P-nummer'
-                    skip_len = len('urn:dk:cvr:produktionsenhed:')
-                    value = value_raw[skip_len:]
-                elif address_type == 'EAN':
-                    scope = 'EAN'
-                    skip_len = len('urn:magenta.dk:ean:')
-                    value = value_raw[skip_len:]
-                elif address_type == 'TEXT':
-                    scope = 'Text'
-                    skip_len = len('urn:text:')
-                    value = urllib.parse.unquote(value_raw[skip_len:])
-                elif address_type == 'DAR':
-                    scope = 'DAR'
-                    skip_len = len('urn:dar:')
-                    dar_uuid = value_raw[skip_len:]
-                    value = None
-
-                    if self.dar_map is not None:
-                        self.dar_map[dar_uuid].append(uuid)
-                else:
-                    print('Ny type: {}'.format(address_type))
-                    msg = 'Unknown addresse type: {}, value: {}'
-                    logger.error(msg.format(address_type, value_raw))
-                    raise('Unknown address type: {}'.format(address_type))
-
-                address_type_class = (relationer['organisatoriskfunktionstype']
-                                      [0]['uuid'])
-
-                synlighed = None
-                if relationer.get('opgaver'):
-                    if relationer['opgaver'][0]['objekttype'] == 'synlighed':
-                        synlighed = relationer['opgaver'][0]['uuid']
-
-                addresses[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'user': user_uuid,
-                        'unit': unit_uuid,
-                        'value': value,
-                        'scope': scope,
-                        'dar_uuid': dar_uuid,
-                        'adresse_type': address_type_class,
-                        'visibility': synlighed,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+            dar_uuid = None
+            value_raw = relationer['adresser'][0]['urn']
+            address_type = relationer['adresser'][0]['objekttype']
+            if address_type == 'EMAIL':
+                scope = 'E-mail'
+                skip_len = len('urn:mailto:')
+                value = value_raw[skip_len:]
+            elif address_type == 'WWW':
+                scope = 'Url'
+                skip_len = len('urn:magenta.dk:www:')
+                value = value_raw[skip_len:]
+            elif address_type == 'PHONE':
+                scope = 'Telefon'
+                skip_len = len('urn:magenta.dk:telefon:')
+                value = value_raw[skip_len:]
+            elif address_type == 'PNUMBER':
+                scope = 'P-nummer'
+                skip_len = len('urn:dk:cvr:produktionsenhed:')
+                value = value_raw[skip_len:]
+            elif address_type == 'EAN':
+                scope = 'EAN'
+                skip_len = len('urn:magenta.dk:ean:')
+                value = value_raw[skip_len:]
+            elif address_type == 'TEXT':
+                scope = 'Text'
+                skip_len = len('urn:text:')
+                value = urllib.parse.unquote(value_raw[skip_len:])
+            elif address_type == 'DAR':
+                scope = 'DAR'
+                skip_len = len('urn:dar:')
+                dar_uuid = value_raw[skip_len:]
+                value = None
+
+                if self.dar_map is not None:
+                    self.dar_map[dar_uuid].append(uuid)
+            else:
+                print('Ny type: {}'.format(address_type))
+                msg = 'Unknown addresse type: {}, value: {}'
+                logger.error(msg.format(address_type, value_raw))
+                raise('Unknown address type: {}'.format(address_type))
+
+            address_type_class = (relationer['organisatoriskfunktionstype']
+                                  [0]['uuid'])
+
+            synlighed = None
+            if relationer.get('opgaver'):
+                if relationer['opgaver'][0]['objekttype'] == 'synlighed':
+                    synlighed = relationer['opgaver'][0]['uuid']
+
+            addresses[uuid].append(
+                AddressRecord(
+                    uuid=uuid,
+                    user=user_uuid,
+                    unit=unit_uuid,
+                    value=value,
+                    scope=scope,
+                    dar_uuid=dar_uuid,
+                    adresse_type=address_type_class,
+                    visibility=synlighed,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-        return addresses
+            )
 
     def _cache_lora_engagements(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Engagement'}
+        return self._cache_lora_organisation_function('Engagement')
+
+    def _decode_engagement(self, engagement, engagements):
         relevant = {
             'relationer': ('opgaver', 'tilknyttedeenheder', 'tilknyttedebrugere',
                            'organisatoriskfunktionstype', 'primær'),
@@ -461,393 +517,369 @@ class LoraCache:
                             'organisationfunktionudvidelser'),
             'tilstande': ('organisationfunktiongyldighed',)
         }
-        url = '/organisation/organisationfunktion'
-        engagements = {}
-        engagement_list = self._perform_lora_lookup(url, params, unit="engagement")
-        for engagement in tqdm(engagement_list, desc="Processing engagement", unit="engagement"):
-            uuid = engagement['id']
-
-            effects = self._get_effects(engagement, relevant)
-            engagement_effects = []
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
 
-                # Todo, this should be consistently implemented for all objects
-                gyldighed = effect[2]['tilstande']['organisationfunktiongyldighed']
-                if not gyldighed:
-                    continue
-                if not gyldighed[0]['gyldighed'] == 'Aktiv':
-                    continue
+        uuid = engagement['id']
+
+        effects = self._get_effects(engagement, relevant)
+        engagement_effects = []
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
 
-                attr = effect[2]['attributter']
-                rel = effect[2]['relationer']
+            # Todo, this should be consistently implemented for all objects
+            gyldighed = effect[2]['tilstande']['organisationfunktiongyldighed']
+            if not gyldighed:
+                continue
+            if not gyldighed[0]['gyldighed'] == 'Aktiv':
+                continue
 
-                if not rel['organisatoriskfunktionstype']:
-                    msg = 'Missing in organisatoriskfunktionstype in {}'
-                    logger.error(msg.format(engagement))
-                    continue
+            attr = effect[2]['attributter']
+            rel = effect[2]['relationer']
+
+            if not rel['organisatoriskfunktionstype']:
+                msg = 'Missing in organisatoriskfunktionstype in {}'
+                logger.error(msg.format(engagement))
+                continue
 
-                user_key = (attr['organisationfunktionegenskaber'][0]
-                            ['brugervendtnoegle'])
+            user_key = (attr['organisationfunktionegenskaber'][0]
+                        ['brugervendtnoegle'])
 
-                engagement_type = rel['organisatoriskfunktionstype'][0]['uuid']
+            engagement_type = rel['organisatoriskfunktionstype'][0]['uuid']
 
-                primary_type = None
-                primær = rel.get('primær')
-                if primær:
-                    primary_type = primær[0]['uuid']
+            primary_type = None
+            primær = rel.get('primær')
+            if primær:
+                primary_type = primær[0]['uuid']
 
-                try:
-                    job_function = rel['opgaver'][0]['uuid']
-                except:
-                    continue
+            try:
+                job_function = rel['opgaver'][0]['uuid']
+            except:
+                continue
 
-                user_uuid = rel['tilknyttedebrugere'][0]['uuid']
-                unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+            user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+            unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+
+            udvidelser = {}
+            udv_raw = attr.get('organisationfunktionudvidelser')
+            if isinstance(udv_raw, list):
+                if len(udv_raw) == 1:
+                    udvidelser = udv_raw[0]
+                if len(udv_raw) > 1:
+                    msg = 'Ugyldig organisationfunktionudvidelser: {}'
+                    raise Exception(msg.format(udv_raw))
+            fraction = udvidelser.get('fraktion')
+            extensions = {
+                'udvidelse_1': udvidelser.get('udvidelse_1'),
+                'udvidelse_2': udvidelser.get('udvidelse_2'),
+                'udvidelse_3': udvidelser.get('udvidelse_3'),
+                'udvidelse_4': udvidelser.get('udvidelse_4'),
+                'udvidelse_5': udvidelser.get('udvidelse_5'),
+                'udvidelse_6': udvidelser.get('udvidelse_6'),
+                'udvidelse_7': udvidelser.get('udvidelse_7'),
+                'udvidelse_8': udvidelser.get('udvidelse_8'),
+                'udvidelse_9': udvidelser.get('udvidelse_9'),
+                'udvidelse_10': udvidelser.get('udvidelse_10')
+            }
 
-                udvidelser = {}
-                udv_raw = attr.get('organisationfunktionudvidelser')
-                if isinstance(udv_raw, list):
-                    if len(udv_raw) == 1:
-                        udvidelser = udv_raw[0]
-                    if len(udv_raw) > 1:
-                        msg = 'Ugyldig organisationfunktionudvidelser: {}'
-                        raise Exception(msg.format(udv_raw))
-                fraction = udvidelser.get('fraktion')
-                extensions = {
-                    'udvidelse_1': udvidelser.get('udvidelse_1'),
-                    'udvidelse_2': udvidelser.get('udvidelse_2'),
-                    'udvidelse_3': udvidelser.get('udvidelse_3'),
-                    'udvidelse_4': udvidelser.get('udvidelse_4'),
-                    'udvidelse_5': udvidelser.get('udvidelse_5'),
-                    'udvidelse_6': udvidelser.get('udvidelse_6'),
-                    'udvidelse_7': udvidelser.get('udvidelse_7'),
-                    'udvidelse_8': udvidelser.get('udvidelse_8'),
-                    'udvidelse_9': udvidelser.get('udvidelse_9'),
-                    'udvidelse_10': udvidelser.get('udvidelse_10')
-                }
-
-                engagement_effects.append(
-                    {
-                        'uuid': uuid,
-                        'user': user_uuid,
-                        'unit': unit_uuid,
-                        'fraction': fraction,
-                        'user_key': user_key,
-                        'engagement_type': engagement_type,
-                        'primary_type': primary_type,
-                        'job_function': job_function,
-                        'extensions': extensions,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+            engagement_effects.append(
+                EngagementRecord(
+                    uuid=uuid,
+                    user=user_uuid,
+                    unit=unit_uuid,
+                    fraction=fraction,
+                    user_key=user_key,
+                    engagement_type=engagement_type,
+                    primary_type=primary_type,
+                    job_function=job_function,
+                    extensions=extensions,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-            if engagement_effects:
-                engagements[uuid] = engagement_effects
-        return engagements
+            )
+        if engagement_effects:
+            engagements[uuid] = engagement_effects
 
     def _cache_lora_associations(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Tilknytning'}
+        return self._cache_lora_organisation_function('Tilknytning')
+
+    def _decode_association(self, association, associations):
         relevant = {
             'relationer': ('tilknyttedeenheder', 'tilknyttedebrugere',
                            'organisatoriskfunktionstype'),
             'attributter': ('organisationfunktionegenskaber',)
         }
-        url = '/organisation/organisationfunktion'
-        associations = {}
-        association_list = self._perform_lora_lookup(url, params, unit="association")
-        for association in tqdm(association_list, desc="Processing association", unit="association"):
-            uuid = association['id']
-            associations[uuid] = []
-
-            effects = self._get_effects(association, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
 
-                attr = effect[2]['attributter']
-                rel = effect[2]['relationer']
+        uuid = association['id']
+        associations[uuid] = []
 
-                if rel['tilknyttedeenheder']:
-                    unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
-                else:
-                    unit_uuid = None
-                    logger.error('Error: Unable to find unit in {}'.format(uuid))
+        effects = self._get_effects(association, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
 
-                user_key = (attr['organisationfunktionegenskaber'][0]
-                            ['brugervendtnoegle'])
-                association_type = rel['organisatoriskfunktionstype'][0]['uuid']
-                user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+            attr = effect[2]['attributter']
+            rel = effect[2]['relationer']
 
-                associations[uuid].append(
-                     {
-                         'uuid': uuid,
-                         'user': user_uuid,
-                         'unit': unit_uuid,
-                         'user_key': user_key,
-                         'association_type': association_type,
-                         'from_date': from_date,
-                         'to_date': to_date
-                     }
-                )
-        return associations
+            if rel['tilknyttedeenheder']:
+                unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+            else:
+                unit_uuid = None
+                logger.error('Error: Unable to find unit in {}'.format(uuid))
+
+            user_key = (attr['organisationfunktionegenskaber'][0]
+                        ['brugervendtnoegle'])
+            association_type = rel['organisatoriskfunktionstype'][0]['uuid']
+            user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+
+            associations[uuid].append(
+                 AssociationRecord(
+                     uuid=uuid,
+                     user=user_uuid,
+                     unit=unit_uuid,
+                     user_key=user_key,
+                     association_type=association_type,
+                     from_date=from_date,
+                     to_date=to_date
+                 )
+            )
 
     def _cache_lora_roles(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Rolle'}
+        return self._cache_lora_organisation_function('Rolle')
+
+    def _decode_role(self, role, roles):
         relevant = {
             'relationer': ('tilknyttedeenheder', 'tilknyttedebrugere',
                            'organisatoriskfunktionstype')
         }
-        url = '/organisation/organisationfunktion'
-        roles = {}
-        role_list = self._perform_lora_lookup(url, params, unit="role")
-        for role in tqdm(role_list, desc="Processing role", unit="role"):
-            uuid = role['id']
-            roles[uuid] = []
-
-            effects = self._get_effects(role, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
-                rel = effect[2]['relationer']
-                role_type = rel['organisatoriskfunktionstype'][0]['uuid']
-                user_uuid = rel['tilknyttedebrugere'][0]['uuid']
-                unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
 
-                roles[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'user': user_uuid,
-                        'unit': unit_uuid,
-                        'role_type': role_type,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+        uuid = role['id']
+        roles[uuid] = []
+
+        effects = self._get_effects(role, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
+            rel = effect[2]['relationer']
+            role_type = rel['organisatoriskfunktionstype'][0]['uuid']
+            user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+            unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+
+            roles[uuid].append(
+                RoleRecord(
+                    uuid=uuid,
+                    user=user_uuid,
+                    unit=unit_uuid,
+                    role_type=role_type,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-        return roles
+            )
 
     def _cache_lora_leaves(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Orlov'}
+        return self._cache_lora_organisation_function('Orlov')
+
+    def _decode_leave(self, leave, leaves):
         relevant = {
             'relationer': ('tilknyttedebrugere', 'organisatoriskfunktionstype'),
             'attributter': ('organisationfunktionegenskaber',)
         }
-        url = '/organisation/organisationfunktion'
-        leaves = {}
-        leave_list = self._perform_lora_lookup(url, params, unit="leave")
-        for leave in tqdm(leave_list, desc="Processing leave", unit="leave"):
-            uuid = leave['id']
-            leaves[uuid] = []
-            effects = self._get_effects(leave, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
-                attr = effect[2]['attributter']
-                rel = effect[2]['relationer']
-                user_key = (attr['organisationfunktionegenskaber'][0]
-                            ['brugervendtnoegle'])
-                leave_type = rel['organisatoriskfunktionstype'][0]['uuid']
-                user_uuid = rel['tilknyttedebrugere'][0]['uuid']
 
-                leaves[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'user': user_uuid,
-                        'user_key': user_key,
-                        'leave_type': leave_type,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+        uuid = leave['id']
+        leaves[uuid] = []
+        effects = self._get_effects(leave, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
+            attr = effect[2]['attributter']
+            rel = effect[2]['relationer']
+            user_key = (attr['organisationfunktionegenskaber'][0]
+                        ['brugervendtnoegle'])
+            leave_type = rel['organisatoriskfunktionstype'][0]['uuid']
+            user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+
+            leaves[uuid].append(
+                LeaveRecord(
+                    uuid=uuid,
+                    user=user_uuid,
+                    user_key=user_key,
+                    leave_type=leave_type,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-        return leaves
+            )
 
     def _cache_lora_it_connections(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'IT-system'}
-        url = '/organisation/organisationfunktion'
-        it_connection_list = self._perform_lora_lookup(url, params, unit="it connection")
-
-        it_connections = {}
-        for it_connection in tqdm(it_connection_list, desc="Processing it connection", unit="it connection"):
-            uuid = it_connection['id']
-            it_connections[uuid] = []
-
-            relevant = {
-                'relationer': ('tilknyttedeenheder', 'tilknyttedebrugere',
-                               'tilknyttedeitsystemer'),
-                'attributter': ('organisationfunktionegenskaber',)
-            }
+        return self._cache_lora_organisation_function('IT-system')
 
-            effects = self._get_effects(it_connection, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
-                user_key = (
-                    effect[2]['attributter']['organisationfunktionegenskaber']
-                    [0]['brugervendtnoegle']
-                )
+    def _decode_it_connection(self, it_connection, it_connections):
+        uuid = it_connection['id']
+        it_connections[uuid] = []
 
-                rel = effect[2]['relationer']
-                itsystem = rel['tilknyttedeitsystemer'][0]['uuid']
+        relevant = {
+            'relationer': ('tilknyttedeenheder', 'tilknyttedebrugere',
+                           'tilknyttedeitsystemer'),
+            'attributter': ('organisationfunktionegenskaber',)
+        }
 
-                if 'tilknyttedeenheder' in rel:
-                    unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
-                    user_uuid = None
-                else:
-                    user_uuid = rel['tilknyttedebrugere'][0]['uuid']
-                    unit_uuid = None
-
-                it_connections[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'user': user_uuid,
-                        'unit': unit_uuid,
-                        'username': user_key,
-                        'itsystem': itsystem,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+        effects = self._get_effects(it_connection, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
+            user_key = (
+                effect[2]['attributter']['organisationfunktionegenskaber']
+                [0]['brugervendtnoegle']
+            )
+
+            rel = effect[2]['relationer']
+            itsystem = rel['tilknyttedeitsystemer'][0]['uuid']
+
+            if 'tilknyttedeenheder' in rel:
+                unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+                user_uuid = None
+            else:
+                user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+                unit_uuid = None
+
+            it_connections[uuid].append(
+                ITConnectionRecord(
+                    uuid=uuid,
+                    user=user_uuid,
+                    unit=unit_uuid,
+                    username=user_key,
+                    itsystem=itsystem,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-        return it_connections
+            )
 
     def _cache_lora_kles(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'KLE'}
-        url = '/organisation/organisationfunktion'
-        kle_list = self._perform_lora_lookup(url, params, unit="KLE")
-        kles = {}
-        for kle in tqdm(kle_list, desc="Processing KLE", unit="KLE"):
-            uuid = kle['id']
-            kles[uuid] = []
-
-            relevant = {
-                'relationer': ('opgaver', 'tilknyttedeenheder',
-                               'organisatoriskfunktionstype'),
-                'attributter': ('organisationfunktionegenskaber',)
-            }
+        return self._cache_lora_organisation_function('KLE')
 
-            effects = self._get_effects(kle, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
+    def _decode_kle(self, kle, kles):
+        uuid = kle['id']
+        kles[uuid] = []
 
-                user_key = (
-                    effect[2]['attributter']['organisationfunktionegenskaber']
-                    [0]['brugervendtnoegle']
-                )
+        relevant = {
+            'relationer': ('opgaver', 'tilknyttedeenheder',
+                           'organisatoriskfunktionstype'),
+            'attributter': ('organisationfunktionegenskaber',)
+        }
 
-                rel = effect[2]['relationer']
-                unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
-                kle_number = rel['organisatoriskfunktionstype'][0]['uuid']
-
-                for aspekt in rel['opgaver']:
-                    kle_aspect = aspekt['uuid']
-                    kles[uuid].append(
-                        {
-                            'uuid': uuid,
-                            'unit': unit_uuid,
-                            'kle_number': kle_number,
-                            'kle_aspect': kle_aspect,
-                            'user_key': user_key,
-                            'from_date': from_date,
-                            'to_date': to_date
-                        }
+        effects = self._get_effects(kle, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
+
+            user_key = (
+                effect[2]['attributter']['organisationfunktionegenskaber']
+                [0]['brugervendtnoegle']
+            )
+
+            rel = effect[2]['relationer']
+            unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+            kle_number = rel['organisatoriskfunktionstype'][0]['uuid']
+
+            for aspekt in rel['opgaver']:
+                kle_aspect = aspekt['uuid']
+                kles[uuid].append(
+                    KLERecord(
+                        uuid=uuid,
+                        unit=unit_uuid,
+                        kle_number=kle_number,
+                        kle_aspect=kle_aspect,
+                        user_key=user_key,
+                        from_date=from_date,
+                        to_date=to_date
                     )
-        return kles
+                )
 
     def _cache_lora_related(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Relateret Enhed'}
-        url = '/organisation/organisationfunktion'
-        related_list = self._perform_lora_lookup(url, params, unit="related")
-        related = {}
-        for relate in tqdm(related_list, desc="Processing related", unit="related"):
-            uuid = relate['id']
-            related[uuid] = []
-
-            relevant = {
-                'relationer': ('tilknyttedeenheder',),
-                'attributter': ()
-            }
+        return self._cache_lora_organisation_function('Relateret Enhed')
 
-            effects = self._get_effects(relate, relevant)
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                if from_date is None and to_date is None:
-                    continue
+    def _decode_related(self, relate, related):
+        uuid = relate['id']
+        related[uuid] = []
+
+        relevant = {
+            'relationer': ('tilknyttedeenheder',),
+            'attributter': ()
+        }
 
-                rel = effect[2]['relationer']
-                unit1_uuid = rel['tilknyttedeenheder'][0]['uuid']
-                unit2_uuid = rel['tilknyttedeenheder'][1]['uuid']
-
-                related[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'unit1_uuid': unit1_uuid,
-                        'unit2_uuid': unit2_uuid,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+        effects = self._get_effects(relate, relevant)
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            if from_date is None and to_date is None:
+                continue
+
+            rel = effect[2]['relationer']
+            unit1_uuid = rel['tilknyttedeenheder'][0]['uuid']
+            unit2_uuid = rel['tilknyttedeenheder'][1]['uuid']
+
+            related[uuid].append(
+                RelatedRecord(
+                    uuid=uuid,
+                    unit1_uuid=unit1_uuid,
+                    unit2_uuid=unit2_uuid,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-        return related
+            )
 
     def _cache_lora_managers(self):
-        params = {'gyldighed': 'Aktiv', 'funktionsnavn': 'Leder'}
-        url = '/organisation/organisationfunktion'
-        manager_list = self._perform_lora_lookup(url, params, unit="manager")
-
-        managers = {}
-        for manager in tqdm(manager_list, desc="Processing manager", unit="manager"):
-            uuid = manager['id']
-            managers[uuid] = []
-            relevant = {
-                'relationer': ('opgaver', 'tilknyttedeenheder', 'tilknyttedebrugere',
-                               'organisatoriskfunktionstype')
-            }
+        return self._cache_lora_organisation_function('Leder')
 
-            if self.full_history:
-                effects = lora_utils.get_effects(manager['registreringer'][0],
-                                                 relevant=relevant,
-                                                 additional=self.additional)
-            else:
-                effects = lora_utils.get_effects(manager['registreringer'][0],
-                                                 relevant=self.additional,
-                                                 additional=relevant)
+    def _decode_manager(self, manager, managers):
+        uuid = manager['id']
+        managers[uuid] = []
+        relevant = {
+            'relationer': ('opgaver', 'tilknyttedeenheder', 'tilknyttedebrugere',
+                           'organisatoriskfunktionstype')
+        }
 
-            for effect in effects:
-                from_date, to_date = self._from_to_from_effect(effect)
-                rel = effect[2]['relationer']
-                try:
-                    user_uuid = rel['tilknyttedebrugere'][0]['uuid']
-                except:
-                    user_uuid = None
-                unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
-                manager_type = rel['organisatoriskfunktionstype'][0]['uuid']
-                manager_responsibility = []
-
-                for opgave in rel['opgaver']:
-                    if opgave['objekttype'] == 'lederniveau':
-                        manager_level = opgave['uuid']
-                    if opgave['objekttype'] == 'lederansvar':
-                        manager_responsibility.append(opgave['uuid'])
-
-                managers[uuid].append(
-                    {
-                        'uuid': uuid,
-                        'user': user_uuid,
-                        'unit': unit_uuid,
-                        'manager_type': manager_type,
-                        'manager_level': manager_level,
-                        'manager_responsibility': manager_responsibility,
-                        'from_date': from_date,
-                        'to_date': to_date
-                    }
+        if self.full_history:
+            effects = self._decoder.get_effects(manager['registreringer'][0],
+                                                relevant=relevant,
+                                                additional=self.additional)
+        else:
+            effects = self._decoder.get_effects(manager['registreringer'][0],
+                                                relevant=self.additional,
+                                                additional=relevant)
+
+        for effect in effects:
+            from_date, to_date = self._from_to_from_effect(effect)
+            rel = effect[2]['relationer']
+            try:
+                user_uuid = rel['tilknyttedebrugere'][0]['uuid']
+            except:
+                user_uuid = None
+            unit_uuid = rel['tilknyttedeenheder'][0]['uuid']
+            manager_type = rel['organisatoriskfunktionstype'][0]['uuid']
+            manager_responsibility = []
+
+            for opgave in rel['opgaver']:
+                if opgave['objekttype'] == 'lederniveau':
+                    manager_level = opgave['uuid']
+                if opgave['objekttype'] == 'lederansvar':
+                    manager_responsibility.append(opgave['uuid'])
+
+            managers[uuid].append(
+                ManagerRecord(
+                    uuid=uuid,
+                    user=user_uuid,
+                    unit=unit_uuid,
+                    manager_type=manager_type,
+                    manager_level=manager_level,
+                    manager_responsibility=manager_responsibility,
+                    from_date=from_date,
+                    to_date=to_date
                 )
-        return managers
+            )
 
     def calculate_primary_engagements(self):
         if self.full_history:
@@ -1003,12 +1035,16 @@ class LoraCache:
         logger.info('Total dar: {}, no-hit: {}'.format(total_dar, total_missing))
         return dar_cache
 
-    def populate_cache(self, dry_run=False, skip_associations=False):
+    def populate_cache(self, dry_run=False, skip_associations=False,
+                       single_scan=False):
         """
         Perform the actual data import.
         :param skip_associations: If associations are not needed, they can be
         skipped for increased performance.
         :param dry_run: For testing purposes it is possible to read from cache.
+        :param single_scan: Read all organisation functions in a single scan of
+        LoRa, rather than one scan per kind. This is faster, in particular for
+        full history, but holds all organisation functions in memory at once.
         """
         if self.full_history:
             facets_file = 'tmp/facets_historic.p'
@@ -1080,6 +1116,9 @@ class LoraCache:
         t = time.time()
         msg = 'Kørselstid: {:.1f}s, {} elementer, {:.0f}/s'
 
+        # All validities of the run are compared to the same point in time
+        self._decoder = EffectDecoder(self.full_history, self.skip_past)
+
         # Here we should activate read-only mode
         def read_facets():
             logger.info('Læs facetter')
@@ -1157,22 +1196,52 @@ class LoraCache:
             #with open(cache_file, 'wb') as f:
             #    pickle.dump(self.dar_cache, f, pickle.HIGHEST_PROTOCOL)
 
+        def read_organisation_functions():
+            logger.info('Læs organisationsfunktioner')
+            caches = self._cache_lora_organisation_functions(
+                skip_associations=skip_associations
+            )
+            for attribute, cache in caches.items():
+                setattr(self, attribute, cache)
+
+        def read_from_scan(attribute):
+            def read():
+                return getattr(self, attribute)
+            return read
+
+        # Readers of the organisation functions, by attribute
+        readers = {
+            'addresses': read_addresses,
+            'engagements': read_engagements,
+            'managers': read_managers,
+            'associations': read_associations,
+            'leaves': read_leaves,
+            'roles': read_roles,
+            'it_connections': read_it_connections,
+            'kles': read_kles,
+            'related': read_related,
+        }
+        if single_scan:
+            readers = {attribute: read_from_scan(attribute) for attribute in readers}
+
         tasks = []
         tasks.append((read_facets, facets_file))
         tasks.append((read_classes, classes_file))
         tasks.append((read_users, users_file))
         tasks.append((read_units, units_file))
-        tasks.append((read_addresses, addresses_file))
-        tasks.append((read_engagements, engagements_file))
-        tasks.append((read_managers, managers_file))
+        if single_scan:
+            tasks.append((read_organisation_functions, None))
+        tasks.append((readers['addresses'], addresses_file))
+        tasks.append((readers['engagements'], engagements_file))
+        tasks.append((readers['managers'], managers_file))
         if not skip_associations:
-            tasks.append((read_associations, associations_file))
-        tasks.append((read_leaves, leaves_file))
-        tasks.append((read_roles, roles_file))
+            tasks.append((readers['associations'], associations_file))
+        tasks.append((readers['leaves'], leaves_file))
+        tasks.append((readers['roles'], roles_file))
         tasks.append((read_itsystems, itsystems_file))
-        tasks.append((read_it_connections, it_connections_file))
-        tasks.append((read_kles, kles_file))
-        tasks.append((read_related, related_file))
+        tasks.append((readers['it_connections'], it_connections_file))
+        tasks.append((readers['kles'], kles_file))
+        tasks.append((readers['related'], related_file))
         tasks.append((read_dar, None))
 
         for task, filename in tqdm(tasks, desc="LoraCache", unit="task"):
@@ -1207,13 +1276,15 @@ def fetch_loracache() -> Tuple[LoraCache, LoraCache]:
 @click.command()
 @click.option("--historic/--no-historic", default=True, help="Do full historic export")
 @click.option("--resolve-dar/--no-resolve-dar", default=False, help="Resolve DAR addresses")
-def cli(historic, resolve_dar):
+@click.option("--single-scan/--no-single-scan", default=False,
+              help="Read all organisation functions in a single scan")
+def cli(historic, resolve_dar, single_scan):
     lc = LoraCache(
         full_history=historic,
         skip_past=True,
         resolve_dar=resolve_dar
     )
-    lc.populate_cache(dry_run=False)
+    lc.populate_cache(dry_run=False, single_scan=single_scan)
 
     logger.info('Now calcualate derived data')
     lc.calculate_derived_unit_data()
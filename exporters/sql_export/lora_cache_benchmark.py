@@ -0,0 +1,220 @@
+"""
+Microbenchmark of the processing in LoraCache, over synthetic LoRa objects.
+
+The LoRa lookups are replaced with generated registrations, so the benchmark
+runs offline and only measures the decoding of effects and the records built
+from them. For each object type, the run time and the memory retained by the
+resulting cache are reported.
+
+    python -m exporters.sql_export.lora_cache_benchmark --count 20000
+"""
+import gc
+import random
+import time
+import tracemalloc
+import uuid
+from unittest.mock import patch
+
+import click
+
+from exporters.sql_export.lora_cache import LoraCache
+
+DATES = [
+    "{}-{:02}-01 00:00:00+01".format(year, month)
+    for year in range(2010, 2030)
+    for month in range(1, 13)
+]
+
+
+def _periods(rng, count):
+    """Consecutive virkning periods, the last one open ended."""
+    dates = sorted(rng.sample(DATES, count))
+    ends = dates[1:] + ["infinity"]
+    return [{"from": start, "to": end} for start, end in zip(dates, ends)]
+
+
+def _uuids(rng, count):
+    return [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(count)]
+
+
+def synthetic_users(rng, count):
+    users = []
+    for user_uuid in _uuids(rng, count):
+        periods = _periods(rng, rng.randint(1, 4))
+        virkning = {"from": periods[0]["from"], "to": "infinity"}
+        users.append({
+            "id": user_uuid,
+            "registreringer": [{
+                "attributter": {
+                    "brugeregenskaber": [
+                        {"brugervendtnoegle": user_uuid, "virkning": virkning}
+                    ],
+                    "brugerudvidelser": [
+                        {"fornavn": "Fornavn {}".format(number),
+                         "efternavn": "Efternavn", "virkning": period}
+                        for number, period in enumerate(periods)
+                    ],
+                },
+                "relationer": {
+                    "tilknyttedepersoner": [
+                        {"urn": "urn:dk:cpr:person:0101011234",
+                         "virkning": virkning}
+                    ],
+                    "tilhoerer": [{"uuid": "org", "virkning": virkning}],
+                },
+                "tilstande": {
+                    "brugergyldighed": [
+                        {"gyldighed": "Aktiv", "virkning": virkning}
+                    ]
+                },
+            }],
+        })
+    return users
+
+
+def synthetic_engagements(rng, count, users, units, classes):
+    engagements = []
+    for engagement_uuid in _uuids(rng, count):
+        periods = _periods(rng, rng.randint(1, 6))
+        virkning = {"from": periods[0]["from"], "to": "infinity"}
+
+        def relation(uuid):
+            return [{"uuid": uuid, "virkning": virkning}]
+
+        engagements.append({
+            "id": engagement_uuid,
+            "registreringer": [{
+                "attributter": {
+                    "organisationfunktionegenskaber": [
+                        {"brugervendtnoegle": "12345",
+                         "funktionsnavn": "Engagement", "virkning": virkning}
+                    ],
+                    "organisationfunktionudvidelser": [
+                        {"fraktion": 1000, "udvidelse_1": "Udvidelse",
+                         "virkning": period}
+                        for period in periods
+                    ],
+                },
+                "tilstande": {
+                    "organisationfunktiongyldighed": [
+                        {"gyldighed": "Aktiv", "virkning": virkning}
+                    ]
+                },
+                "relationer": {
+                    "tilknyttedebrugere": relation(rng.choice(users)),
+                    "tilknyttedeenheder": [
+                        {"uuid": rng.choice(units), "virkning": period}
+                        for period in periods
+                    ],
+                    "organisatoriskfunktionstype": relation(rng.choice(classes)),
+                    "opgaver": relation(rng.choice(classes)),
+                    "primær": relation(rng.choice(classes)),
+                    "tilknyttedeorganisationer": relation("org"),
+                },
+            }],
+        })
+    return engagements
+
+
+def synthetic_addresses(rng, count, users, classes):
+    addresses = []
+    for address_uuid in _uuids(rng, count):
+        periods = _periods(rng, rng.randint(1, 3))
+        virkning = {"from": periods[0]["from"], "to": "infinity"}
+        addresses.append({
+            "id": address_uuid,
+            "registreringer": [{
+                "attributter": {
+                    "organisationfunktionegenskaber": [
+                        {"brugervendtnoegle": "-", "funktionsnavn": "Adresse",
+                         "virkning": virkning}
+                    ],
+                },
+                "relationer": {
+                    "tilknyttedebrugere": [
+                        {"uuid": rng.choice(users), "virkning": virkning}
+                    ],
+                    "adresser": [
+                        {"urn": "urn:magenta.dk:telefon:{}".format(number),
+                         "objekttype": "PHONE", "virkning": period}
+                        for number, period in enumerate(periods)
+                    ],
+                    "organisatoriskfunktionstype": [
+                        {"uuid": rng.choice(classes), "virkning": virkning}
+                    ],
+                    "tilknyttedeorganisationer": [
+                        {"uuid": "org", "virkning": virkning}
+                    ],
+                },
+            }],
+        })
+    return addresses
+
+
+class BenchmarkLoraCache(LoraCache):
+    def _load_settings(self):
+        return {}
+
+    def _read_org_uuid(self):
+        return "org"
+
+
+def measure(lc, method, objects):
+    """Run a _cache_lora_* method over objects.
+
+    :return: Tuple of the result, the run time and the retained memory in bytes.
+    """
+    with patch.object(lc, "_perform_lora_lookup", return_value=objects):
+        # Time and memory are measured in separate runs, as tracing the
+        # allocations slows everything down
+        gc.collect()
+        start = time.perf_counter()
+        method()
+        elapsed = time.perf_counter() - start
+
+        gc.collect()
+        tracemalloc.start()
+        result = method()
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, retained
+
+
+@click.command()
+@click.option("--count", default=10000, help="Number of objects of each type.")
+@click.option("--historic/--no-historic", default=True, help="Full history.")
+@click.option("--seed", default=0, help="Seed for the synthetic data.")
+def cli(count, historic, seed):
+    """Benchmark the LoraCache processing of synthetic LoRa objects."""
+    rng = random.Random(seed)
+    units = _uuids(rng, max(count // 20, 1))
+    classes = _uuids(rng, 50)
+    users = synthetic_users(rng, count)
+    user_uuids = [user["id"] for user in users]
+    objects = {
+        "_cache_lora_users": users,
+        "_cache_lora_engagements": synthetic_engagements(
+            rng, count, user_uuids, units, classes
+        ),
+        "_cache_lora_address": synthetic_addresses(rng, count, user_uuids, classes),
+    }
+
+    lc = BenchmarkLoraCache(resolve_dar=False, full_history=historic)
+    total_time = total_memory = 0
+    for name, lora_objects in objects.items():
+        # Results are kept alive, so memory is retained as in a real cache run
+        result, elapsed, retained = measure(lc, getattr(lc, name), lora_objects)
+        records = sum(len(validities) for validities in result.values())
+        click.echo("{:26} {:8} records {:7.2f}s {:8.1f} MiB".format(
+            name, records, elapsed, retained / 2 ** 20
+        ))
+        total_time += elapsed
+        total_memory += retained
+    click.echo("{:26} {:8} {:>7} {:7.2f}s {:8.1f} MiB".format(
+        "total", "", "", total_time, total_memory / 2 ** 20
+    ))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,149 @@
+import datetime
+import pickle
+import random
+import unittest
+
+import lora_utils
+from hypothesis import given
+from hypothesis.strategies import booleans, integers
+
+from exporters.sql_export.cache_records import EngagementRecord, UnitRecord
+from exporters.sql_export.effect_decoder import DEFAULT_TIMEZONE, EffectDecoder
+from exporters.sql_export.lora_cache_benchmark import (
+    _uuids,
+    synthetic_engagements,
+    synthetic_users,
+)
+
+ENGAGEMENT_RELEVANT = {
+    "relationer": (
+        "opgaver",
+        "tilknyttedeenheder",
+        "tilknyttedebrugere",
+        "organisatoriskfunktionstype",
+        "primær",
+    ),
+    "attributter": ("organisationfunktionegenskaber", "organisationfunktionudvidelser"),
+    "tilstande": ("organisationfunktiongyldighed",),
+}
+USER_RELEVANT = {
+    "attributter": ("brugeregenskaber", "brugerudvidelser"),
+    "relationer": ("tilknyttedepersoner", "tilhoerer"),
+    "tilstande": ("brugergyldighed",),
+}
+ADDITIONAL = {"relationer": ("tilknyttedeorganisationer", "tilhoerer")}
+
+NOW = datetime.datetime(2020, 6, 15, 12, tzinfo=DEFAULT_TIMEZONE)
+
+
+class TestEffectDecoder(unittest.TestCase):
+    @given(integers(min_value=0, max_value=2**32))
+    def test_get_effects_like_lora_utils(self, seed):
+        """The effects are identical to the ones from lora_utils."""
+        rng = random.Random(seed)
+        uuids = _uuids(rng, 5)
+        lora_objects = [(user, USER_RELEVANT) for user in synthetic_users(rng, 5)] + [
+            (engagement, ENGAGEMENT_RELEVANT)
+            for engagement in synthetic_engagements(rng, 5, uuids, uuids, uuids)
+        ]
+        decoder = EffectDecoder(full_history=True, skip_past=False)
+        for lora_object, relevant in lora_objects:
+            registration = lora_object["registreringer"][0]
+            expected = list(
+                lora_utils.get_effects(
+                    registration, relevant=relevant, additional=ADDITIONAL
+                )
+            )
+            actual = list(
+                decoder.get_effects(
+                    registration, relevant=relevant, additional=ADDITIONAL
+                )
+            )
+            self.assertEqual(actual, expected)
+
+    def test_from_to(self):
+        decoder = EffectDecoder(full_history=True, skip_past=False, now=NOW)
+        parse = decoder.parse_timestamp
+        effect = (parse("2019-01-01 00:00:00+01"), parse("2021-01-01 00:00:00+01"))
+        self.assertEqual(decoder.from_to(effect), ("2019-01-01", "2020-12-31"))
+        effect = (parse("2019-01-01 00:00:00+01"), parse("infinity"))
+        self.assertEqual(decoder.from_to(effect), ("2019-01-01", None))
+
+    @given(booleans(), booleans())
+    def test_from_to_now(self, full_history, skip_past):
+        """Validities are compared to the time given to the decoder."""
+        decoder = EffectDecoder(full_history, skip_past, now=NOW)
+        parse = decoder.parse_timestamp
+        past = (parse("2019-01-01 00:00:00+01"), parse("2020-01-01 00:00:00+01"))
+        current = (parse("2020-01-01 00:00:00+01"), parse("infinity"))
+        future = (parse("2021-01-01 00:00:00+01"), parse("infinity"))
+
+        self.assertEqual(decoder.from_to(current), ("2020-01-01", None))
+        if full_history and not skip_past:
+            self.assertEqual(decoder.from_to(past), ("2019-01-01", "2019-12-31"))
+        else:
+            self.assertEqual(decoder.from_to(past), (None, None))
+        if full_history:
+            self.assertEqual(decoder.from_to(future), ("2021-01-01", None))
+        else:
+            self.assertEqual(decoder.from_to(future), (None, None))
+
+
+class TestCacheRecords(unittest.TestCase):
+    def test_record_is_dict_like(self):
+        unit = UnitRecord(
+            uuid="unit",
+            user_key="bvn",
+            name="Enhed",
+            unit_type="type",
+            level=None,
+            parent=None,
+            from_date="2020-01-01",
+            to_date=None,
+        )
+        expected = {
+            "uuid": "unit",
+            "user_key": "bvn",
+            "name": "Enhed",
+            "unit_type": "type",
+            "level": None,
+            "parent": None,
+            "from_date": "2020-01-01",
+            "to_date": None,
+        }
+        self.assertEqual(unit, expected)
+        self.assertEqual(dict(unit), expected)
+        self.assertIsNone(unit.get("location"))
+        with self.assertRaises(KeyError):
+            unit["location"]
+
+        unit["location"] = "Kommune\\Enhed"
+        unit["extra"] = 1
+        self.assertEqual(unit["location"], "Kommune\\Enhed")
+        self.assertEqual(unit, dict(expected, location="Kommune\\Enhed", extra=1))
+
+    def test_record_pickle(self):
+        engagement = EngagementRecord(
+            uuid="eng",
+            user="user",
+            unit="unit",
+            fraction=None,
+            user_key="1",
+            engagement_type="type",
+            primary_type=None,
+            job_function="job",
+            extensions={"udvidelse_1": None},
+            from_date="2020-01-01",
+            to_date=None,
+        )
+        engagement["primary_boolean"] = True
+        unpickled = pickle.loads(pickle.dumps(engagement))
+        self.assertIsInstance(unpickled, EngagementRecord)
+        self.assertEqual(unpickled, engagement)
+
+    def test_record_interned(self):
+        unit_uuid = "".join(["un", "it"])
+        first = UnitRecord(uuid=unit_uuid, parent=None)
+        second = UnitRecord(uuid="".join(["u", "nit"]), parent=unit_uuid)
+        self.assertIs(first["uuid"], second["uuid"])
+        self.assertIs(first["uuid"], second["parent"])
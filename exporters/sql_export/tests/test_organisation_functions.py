@@ -0,0 +1,121 @@
+import json
+import pathlib
+import unittest
+from unittest.mock import patch
+
+from hypothesis import given
+from hypothesis.strategies import booleans
+
+from exporters.sql_export.lora_cache import ORGANISATION_FUNCTIONS, LoraCache
+
+DATA = pathlib.Path(__file__).parent / "data" / "organisationfunktion.json"
+
+
+class LoraCacheTest(LoraCache):
+    """Subclass to override methods with side-effects."""
+
+    def _load_settings(self):
+        """We want to avoid reading settings.json."""
+        return {"mox.base": "http://lora"}
+
+    def _read_org_uuid(self):
+        """We want to avoid MO lookups."""
+        return "00000000-0000-0000-0000-000000000001"
+
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class LoRaStub:
+    """Replays recorded organisationfunktion objects, like LoRa would."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.scans = []
+
+    def _matches(self, lora_object, funktionsnavn):
+        egenskaber = lora_object["registreringer"][0]["attributter"][
+            "organisationfunktionegenskaber"
+        ]
+        return any(
+            egenskab["funktionsnavn"] == funktionsnavn for egenskab in egenskaber
+        )
+
+    def get(self, url, params, hooks=None):
+        assert url == "http://lora/organisation/organisationfunktion"
+        objects = self.objects
+        if "funktionsnavn" in params:
+            objects = [
+                lora_object
+                for lora_object in objects
+                if self._matches(lora_object, params["funktionsnavn"])
+            ]
+        if "list" not in params:
+            self.scans.append(params.get("funktionsnavn"))
+            return StubResponse(
+                {"results": [[lora_object["id"] for lora_object in objects]]}
+            )
+        first = params["foersteresultat"]
+        page = objects[first : first + params["maximalantalresultater"]]
+        return StubResponse({"results": [page]})
+
+
+class TestOrganisationFunctions(unittest.TestCase):
+    def setUp(self):
+        self.stub = LoRaStub(json.loads(DATA.read_text()))
+
+    @given(booleans())
+    def test_single_scan_matches_per_method(self, full_history):
+        self.stub.scans = []
+        with patch("exporters.sql_export.lora_cache.requests.get", self.stub.get):
+            lc = LoraCacheTest(resolve_dar=False, full_history=full_history)
+            expected = {
+                attribute: getattr(lc, "_cache_lora_" + method)()
+                for attribute, method in [
+                    ("addresses", "address"),
+                    ("engagements", "engagements"),
+                    ("associations", "associations"),
+                    ("roles", "roles"),
+                    ("leaves", "leaves"),
+                    ("it_connections", "it_connections"),
+                    ("kles", "kles"),
+                    ("related", "related"),
+                    ("managers", "managers"),
+                ]
+            }
+            self.assertEqual(len(self.stub.scans), len(ORGANISATION_FUNCTIONS))
+
+            lc = LoraCacheTest(resolve_dar=False, full_history=full_history)
+            self.stub.scans = []
+            actual = lc._cache_lora_organisation_functions()
+            self.assertEqual(self.stub.scans, [None])
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(actual["addresses"]), 3)
+        self.assertEqual(len(actual["managers"]), 2)
+
+    def test_single_scan_skip_associations(self):
+        with patch("exporters.sql_export.lora_cache.requests.get", self.stub.get):
+            lc = LoraCacheTest(resolve_dar=False, full_history=True)
+            caches = lc._cache_lora_organisation_functions(skip_associations=True)
+        self.assertNotIn("associations", caches)
+        self.assertEqual(len(caches), len(ORGANISATION_FUNCTIONS) - 1)
+
+    def test_single_scan_dar_map(self):
+        """Addresses are registered for DAR lookup in the single scan."""
+        with patch("exporters.sql_export.lora_cache.requests.get", self.stub.get):
+            lc = LoraCacheTest(resolve_dar=False, full_history=True)
+            lc._cache_lora_organisation_functions()
+        self.assertEqual(
+            dict(lc.dar_map),
+            {
+                "00000000-0000-0000-0000-000000000190": [
+                    "00000000-0000-0000-0000-0000000003ea"
+                ]
+            },
+        )
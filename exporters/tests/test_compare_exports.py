@@ -0,0 +1,79 @@
+import csv
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import TestCase
+
+from exporters.compare_exports import ExportDiff, compare_exports
+
+fieldnames = ['Id', 'Navn', 'Afdeling']
+
+
+def write_csv(path, rows):
+    with open(path, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=';')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(zip(fieldnames, row)))
+
+
+class TestExportDiff(TestCase):
+    old_rows = [
+        {'Id': '1', 'Navn': 'A'},
+        {'Id': '2', 'Navn': 'B'},
+        {'Id': '2', 'Navn': 'B'},
+        {'Id': '3', 'Navn': 'C'},
+    ]
+    new_rows = [
+        {'Id': '4', 'Navn': 'D'},
+        {'Id': '3', 'Navn': 'X'},
+        {'Id': '2', 'Navn': 'B'},
+        {'Id': '1', 'Navn': 'A'},
+    ]
+
+    def test_keyed(self):
+        with ExportDiff('Id') as diff:
+            diff.load(self.old_rows, self.new_rows)
+            self.assertEqual(list(diff.removed()), [{'Id': '2', 'Navn': 'B'}])
+            self.assertEqual(list(diff.added()), [{'Id': '4', 'Navn': 'D'}])
+            self.assertEqual(
+                list(diff.changed()),
+                [('3', self.old_rows[3], self.new_rows[1], {'Navn': ['C', 'X']})],
+            )
+            self.assertEqual(
+                diff.summary(),
+                {'removed': 1, 'added': 1, 'changed': 1, 'identical': 2},
+            )
+
+    def test_unkeyed(self):
+        with ExportDiff() as diff:
+            diff.load(self.old_rows, self.new_rows)
+            self.assertEqual(
+                list(diff.removed()), [self.old_rows[2], self.old_rows[3]]
+            )
+            self.assertEqual(
+                list(diff.added()), [self.new_rows[0], self.new_rows[1]]
+            )
+            self.assertEqual(list(diff.changed()), [])
+
+
+class TestCompareExports(TestCase):
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lc_file = Path(tmp_dir) / 'lc.csv'
+            mo_file = Path(tmp_dir) / 'mo.csv'
+            write_csv(lc_file, [('1', 'A', 'X'), ('2', 'B', 'Y')])
+            write_csv(mo_file, [('2', 'B', 'Z'), ('1', 'A', 'X')])
+
+            output = StringIO()
+            summary = compare_exports(lc_file, mo_file, 'Id', output)
+
+        self.assertEqual(
+            summary, {'removed': 0, 'added': 0, 'changed': 1, 'identical': 1}
+        )
+        entries = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(
+            entries,
+            [{'type': 'changed', 'key': '2', 'changes': {'Afdeling': ['Y', 'Z']}}],
+        )
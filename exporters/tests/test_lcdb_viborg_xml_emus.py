@@ -0,0 +1,100 @@
+import io
+import unittest
+
+from sqlalchemy.orm import sessionmaker
+
+from exporters.emus import lcdb_viborg_xml_emus
+from exporters.sql_export.lc_for_jobs_db import get_engine
+from exporters.sql_export.sql_table_defs import (Adresse, Base, Bruger, Engagement,
+                                                 Enhed, ItForbindelse, ItSystem,
+                                                 Leder, LederAnsvar)
+
+settings = {
+    "MORA_ROOT_ORG_UNIT_UUID": "root",
+    "EMUS_RESPONSIBILITY_CLASS": "resp",
+    "EMUS_DISCARDED_JOB_FUNCTIONS": [],
+    "EMUS_ALLOWED_ENGAGEMENT_TYPES": ["etype"],
+    "EMUS_PHONE_PRIORITY": [],
+    "EMUS_EMAIL_PRIORITY": [],
+}
+
+
+class TestLcdbEmus(unittest.TestCase):
+    def setUp(self):
+        lcdb_viborg_xml_emus.engagement_counter.clear()
+        self.engine = get_engine(dbpath=":memory:")
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.session.add(ItSystem(uuid="ad", navn="Active Directory"))
+        self.add_unit("root", None)
+
+    def add_unit(self, uuid, parent, leder_uuid=None):
+        self.session.add(Enhed(uuid=uuid, navn="Enhed " + uuid,
+                               forældreenhed_uuid=parent, enhedstype_titel="t",
+                               leder_uuid=leder_uuid))
+
+    def add_employee(self, number, unit, bvn="1"):
+        uuid = "user%d" % number
+        self.session.add(Bruger(uuid=uuid, fornavn="Fornavn%d" % number,
+                                efternavn="Efternavn", cpr="%010d" % number,
+                                bvn=uuid))
+        self.session.add(Engagement(
+            uuid="eng%d" % number, bvn=bvn + str(number), bruger_uuid=uuid,
+            enhed_uuid=unit, engagementstype_uuid="etype",
+            engagementstype_titel="Ansat", stillingsbetegnelse_uuid="job",
+            stillingsbetegnelse_titel="Job",
+            primærtype_titel="primær", startdato="2020-01-01",
+        ))
+        self.session.add(ItForbindelse(
+            uuid="it%d" % number, it_system_uuid="ad", bruger_uuid=uuid,
+            brugernavn="login%d" % number, startdato="2020-01-01",
+            slutdato="9999-12-31",
+        ))
+        self.session.add(Adresse(
+            uuid="adr%d" % number, bruger_uuid=uuid, adressetype_scope="E-mail",
+            adressetype_bvn="email", adressetype_titel="Email",
+            værdi="%s@kommune.dk" % uuid,
+        ))
+        return uuid
+
+    def export(self):
+        self.session.commit()
+        emus_file = io.StringIO()
+        report = lcdb_viborg_xml_emus.main(emus_file, settings, engine=self.engine)
+        return emus_file.getvalue(), report.queries
+
+    def test_export(self):
+        self.add_unit("child", "root", leder_uuid="leder1")
+        self.add_unit("empty", "root")
+        manager = self.add_employee(1, "child")
+        self.add_employee(2, "child", bvn="9")  # hourly paid
+        self.session.add(Leder(uuid="leder1", bruger_uuid=manager,
+                               enhed_uuid="child", ledertype_titel="Chef",
+                               niveautype_titel="Niveau"))
+        self.session.add(LederAnsvar(leder_uuid="leder1", lederansvar_uuid="resp",
+                                     lederansvar_titel="Personale"))
+
+        xml, _ = self.export()
+        self.assertIn('<orgUnit id="root"', xml)
+        self.assertIn('<orgUnit id="child"', xml)
+        self.assertNotIn('<orgUnit id="empty"', xml)
+        self.assertLess(xml.index("<orgUnit"), xml.index("<employee"))
+        self.assertIn('<employee id="11" client="1"', xml)
+        self.assertNotIn('<employee id="92"', xml)
+        self.assertIn('<employee id="user1" client="540"', xml)
+        self.assertIn("<manager>user1</manager>", xml)
+        self.assertIn("<email>user1@kommune.dk</email>", xml)
+        self.assertIn("<username>login1</username>", xml)
+        self.assertTrue(xml.endswith("</employee>\n</OS2MO>"))
+
+    def test_constant_number_of_queries(self):
+        self.add_employee(1, "root")
+        _, few_queries = self.export()
+
+        lcdb_viborg_xml_emus.engagement_counter.clear()
+        for number in range(2, 20):
+            self.add_unit("unit%d" % number, "root")
+            self.add_employee(number, "unit%d" % number)
+        _, many_queries = self.export()
+
+        self.assertEqual(few_queries, many_queries)
@@ -0,0 +1,227 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from exporters.os2phonebook import os2phonebook_export
+from exporters.os2phonebook.os2phonebook_export import (
+    chunked,
+    cli,
+    push_to_os2phonebook,
+    run_queries,
+)
+from exporters.sql_export.sql_table_defs import Base, Bruger, Engagement, Enhed
+
+
+class TestChunked(TestCase):
+    entries = {str(number): number for number in range(5)}
+
+    def test_chunk_boundaries(self):
+        self.assertEqual(
+            [list(chunk) for chunk in chunked(self.entries, 2)],
+            [["0", "1"], ["2", "3"], ["4"]],
+        )
+        self.assertEqual(
+            [len(chunk) for chunk in chunked(dict(list(self.entries.items())[:4]), 2)],
+            [2, 2],
+        )
+        self.assertEqual(list(chunked(self.entries, 5)), [self.entries])
+        self.assertEqual(list(chunked(self.entries, 100)), [self.entries])
+        self.assertEqual(list(chunked(self.entries, 1))[-1], {"4": 4})
+
+    def test_no_chunk_size(self):
+        self.assertEqual(list(chunked(self.entries, 0)), [self.entries])
+        self.assertEqual(list(chunked(self.entries, None)), [self.entries])
+        self.assertEqual(list(chunked({}, 0)), [{}])
+        self.assertEqual(list(chunked({}, 2)), [])
+
+
+class TestRunQueries(TestCase):
+    def test_session_per_query(self):
+        sessions = []
+
+        class Session:
+            closed = False
+
+            def __init__(self):
+                sessions.append(self)
+
+            def close(self):
+                self.closed = True
+
+        results = run_queries(
+            Session,
+            {
+                "first": lambda session: ("first", session),
+                "second": lambda session: ("second", session),
+            },
+        )
+        self.assertEqual(list(results), ["first", "second"])
+        self.assertEqual(results["first"][0], "first")
+        self.assertIsNot(results["first"][1], results["second"][1])
+        self.assertEqual(len(sessions), 2)
+        self.assertTrue(all(session.closed for session in sessions))
+
+    def test_failing_query(self):
+        sessions = []
+
+        class Session:
+            def __init__(self):
+                self.closed = False
+                sessions.append(self)
+
+            def close(self):
+                self.closed = True
+
+        def fail(session):
+            raise ValueError("broken query")
+
+        with self.assertRaises(ValueError):
+            run_queries(Session, {"ok": lambda session: 1, "fail": fail})
+        self.assertTrue(all(session.closed for session in sessions))
+
+
+class PhonebookHandler(BaseHTTPRequestHandler):
+    """Records the pushed documents, rejecting any containing the key "bad"."""
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        payload = json.loads(self.rfile.read(length))
+        status = 500 if "bad" in payload else 200
+        self.server.received.append((self.path, payload, status))
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPushToOS2Phonebook(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PhonebookHandler)
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings = {
+            "exporters.os2phonebook_base_url": "http://127.0.0.1:{}/api/".format(
+                self.server.server_port
+            ),
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def received(self, path):
+        return [
+            (payload, status)
+            for received_path, payload, status in self.server.received
+            if received_path == path
+        ]
+
+    def test_chunks(self):
+        employees = {str(number): {"uuid": str(number)} for number in range(5)}
+        org_units = {"unit": {"uuid": "unit"}}
+        push_to_os2phonebook(self.settings, employees, org_units, 2)
+
+        employee_chunks = self.received("/api/load-employees")
+        self.assertEqual(len(employee_chunks), 3)
+        self.assertEqual(
+            sorted(key for payload, _ in employee_chunks for key in payload),
+            sorted(employees),
+        )
+        self.assertEqual(self.received("/api/load-org-units"), [(org_units, 200)])
+
+    def test_no_chunk_size(self):
+        employees = {str(number): {"uuid": str(number)} for number in range(5)}
+        push_to_os2phonebook(self.settings, employees, {}, 0)
+        self.assertEqual(self.received("/api/load-employees"), [(employees, 200)])
+        self.assertEqual(self.received("/api/load-org-units"), [({}, 200)])
+
+    def test_failing_chunk(self):
+        employees = {key: {"uuid": key} for key in ["a", "b", "bad", "c", "d"]}
+        with self.assertLogs("os2phonebook_export", "WARNING") as logs:
+            push_to_os2phonebook(self.settings, employees, {}, 2)
+        self.assertEqual(len(logs.records), 1)
+
+        # The other chunks are pushed regardless
+        self.assertEqual(
+            [
+                (list(payload), status)
+                for payload, status in self.received("/api/load-employees")
+            ],
+            [(["a", "b"], 200), (["bad", "c"], 500), (["d"], 200)],
+        )
+
+
+class TestGenerateJson(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            "sqlite:///{}".format(Path(self.directory.name) / "actualstate.db")
+        )
+        Base.metadata.create_all(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        session.add_all(
+            [
+                Enhed(uuid="unit", navn="Enhed", enhedstype_titel="Afdeling"),
+                Bruger(
+                    uuid="user",
+                    bvn="user",
+                    fornavn="Fornavn",
+                    efternavn="Efternavn",
+                    cpr="0101010101",
+                ),
+                Engagement(
+                    uuid="engagement",
+                    bruger_uuid="user",
+                    enhed_uuid="unit",
+                    bvn="1",
+                    engagementstype_titel="Ansat",
+                    stillingsbetegnelse_titel="Stilling",
+                ),
+            ]
+        )
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def generate_json(self, *args):
+        runner = CliRunner()
+        with runner.isolated_filesystem(), patch.object(
+            os2phonebook_export, "get_engine", return_value=self.engine
+        ), patch.object(
+            os2phonebook_export, "load_settings", return_value={"settings": True}
+        ), patch.object(
+            os2phonebook_export, "push_to_os2phonebook"
+        ) as push:
+            os.mkdir("tmp")
+            result = runner.invoke(cli, ["generate-json", *args])
+            employees = json.loads(Path("tmp/employees.json").read_text())
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(list(employees), ["user"])
+        return push, employees
+
+    def test_no_push(self):
+        push, _ = self.generate_json()
+        push.assert_not_called()
+
+    def test_push(self):
+        push, employees = self.generate_json("--push", "--chunk-size", "10")
+        settings, employee_map, org_unit_map, chunk_size = push.call_args.args
+        self.assertEqual(settings, {"settings": True})
+        self.assertEqual(employee_map, employees)
+        self.assertEqual(list(org_unit_map), ["unit"])
+        self.assertEqual(chunk_size, 10)
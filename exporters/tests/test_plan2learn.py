@@ -0,0 +1,316 @@
+import csv
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+
+from anytree import Node
+from more_itertools import flatten
+
+from exporters.plan2learn import plan2learn
+from exporters.plan2learn.plan2learn import (
+    CacheIndex,
+    export_bruger,
+    export_engagement,
+    export_leder,
+    export_organisation,
+    get_e_address,
+)
+from os2mo_helpers.mora_helpers import MoraHelper
+
+ALLOWED = plan2learn.allowed_engagement_types[0]
+OTHER = "other-engagement-type"
+ROOT, UNIT, NO_MANAGER, TOO_DEEP = "root", "unit", "no-manager", "too-deep"
+
+
+def engagement(uuid, user, unit, from_date, engagement_type=ALLOWED, **kwargs):
+    return dict(
+        uuid=uuid,
+        user=user,
+        unit=unit,
+        engagement_type=engagement_type,
+        job_function="job-" + uuid,
+        extensions={},
+        from_date=from_date,
+        **kwargs
+    )
+
+
+def address(uuid, scope, value, unit=None, user=None, adresse_type="type"):
+    return dict(
+        uuid=uuid,
+        scope=scope,
+        value=value,
+        unit=unit,
+        user=user,
+        adresse_type=adresse_type,
+        visibility=None,
+    )
+
+
+def unit(uuid, parent, level="level"):
+    return [dict(uuid=uuid, name="Enhed " + uuid, parent=parent, level=level)]
+
+
+def user(uuid, cpr):
+    return [dict(uuid=uuid, cpr=cpr, navn="Navn " + uuid)]
+
+
+def lora_caches():
+    """A current and a historic LoraCache with:
+
+    * "multi": a user with several engagements, in different units, with several
+      validities, and several addresses of each scope
+    * "single": a user with a single engagement and no addresses
+    * "other": a user with an engagement which is not of an allowed type
+    * the unit NO_MANAGER, which has no engagements, addresses or manager
+    """
+    classes = {
+        "level": {"title": "Afdelings-niveau"},
+        "deep": {
+            "title": plan2learn.SETTINGS["integrations.SD_Lon.import.too_deep"][0]
+        },
+        ALLOWED: {"title": "Ansat"},
+        OTHER: {"title": "Andet"},
+    }
+    classes.update(
+        {"job-e{}".format(number): {"title": "Stilling"} for number in range(1, 6)}
+    )
+    units = {
+        ROOT: unit(ROOT, None),
+        UNIT: unit(UNIT, ROOT),
+        NO_MANAGER: unit(NO_MANAGER, ROOT),
+        TOO_DEEP: unit(TOO_DEEP, UNIT, level="deep"),
+    }
+    users = {
+        "multi": user("multi", "0101010101"),
+        "single": user("single", "0202020202"),
+        "other": user("other", "0303030303"),
+    }
+    historic_engagements = {
+        "e1": [
+            engagement("e1", "multi", UNIT, "2000-01-01"),
+            engagement("e1", "multi", ROOT, "2010-01-01"),
+        ],
+        "e2": [engagement("e2", "single", UNIT, "2001-01-01")],
+        "e3": [engagement("e3", "multi", ROOT, "2002-01-01")],
+        "e4": [engagement("e4", "other", UNIT, "2003-01-01", engagement_type=OTHER)],
+        "e5": [engagement("e5", "multi", TOO_DEEP, "2004-01-01")],
+    }
+    engagements = {
+        uuid: [dict(validities[0], primary_boolean=uuid == "e1")]
+        for uuid, validities in historic_engagements.items()
+    }
+    historic_addresses = {
+        "a1": [
+            address("a1", "Telefon", "11111111", user="multi"),
+            address("a1", "Telefon", "11111112", user="multi"),
+        ],
+        "a2": [address("a2", "Telefon", "22222222", user="multi")],
+        "a3": [address("a3", "E-mail", "multi@example.com", user="multi")],
+        "a4": [address("a4", "E-mail", "other@example.com", user="other")],
+    }
+    addresses = {
+        "d1": [address("d1", "DAR", "Gammel Vej 1, 8000 Aarhus C", unit=ROOT)],
+        "d2": [address("d2", "DAR", "Ny Vej 2, 8200 Aarhus N", unit=ROOT)],
+        "d3": [address("d3", "Telefon", "33333333", unit=UNIT)],
+        "d4": [address("d4", "DAR", "Vejen 3, 8000 Aarhus C", unit=UNIT)],
+    }
+    lc = SimpleNamespace(
+        classes=classes,
+        units=units,
+        users=users,
+        engagements=engagements,
+        addresses=addresses,
+    )
+    lc_historic = SimpleNamespace(
+        engagements=historic_engagements, addresses=historic_addresses
+    )
+    return lc, lc_historic
+
+
+# The linear scans of the caches, which the index replaces
+
+
+def scan_engagements_by_unit(lc_historic, unit_uuid):
+    return [
+        engv
+        for engv in flatten(lc_historic.engagements.values())
+        if engv["unit"] == unit_uuid
+    ]
+
+
+def scan_engagements_by_user(lc_historic, user_uuid):
+    return [
+        eng for eng in lc_historic.engagements.values() if eng[0]["user"] == user_uuid
+    ]
+
+
+def scan_addresses(lc_historic, user_uuid, scope):
+    return [
+        address
+        for address in flatten(lc_historic.addresses.values())
+        if address["user"] == user_uuid and address["scope"] == scope
+    ]
+
+
+def scan_dar_address(lc, unit_uuid):
+    dar_address = None
+    for raw_address in lc.addresses.values():
+        if raw_address[0]["unit"] == unit_uuid:
+            if raw_address[0]["scope"] == "DAR":
+                dar_address = raw_address[0]["value"]
+    return dar_address
+
+
+class StubMoraHelper(MoraHelper):
+    """Only writes CSV files, and reads the managers of units."""
+
+    def __init__(self, managers):
+        self.export_ansi = False
+        self.managers = managers
+
+    def read_ou_manager(self, unit_uuid, inherit=True):
+        return self.managers.get(unit_uuid, {})
+
+
+class TestCacheIndex(TestCase):
+    def setUp(self):
+        self.lc, self.lc_historic = lora_caches()
+        self.index = CacheIndex(self.lc, self.lc_historic)
+        self.units = list(self.lc.units) + ["unknown"]
+        self.users = list(self.lc.users) + ["unknown"]
+
+    def test_lookups_match_scans(self):
+        for unit_uuid in self.units:
+            self.assertEqual(
+                self.index.engagements_by_unit[unit_uuid],
+                scan_engagements_by_unit(self.lc_historic, unit_uuid),
+            )
+            self.assertEqual(
+                self.index.dar_address_by_unit.get(unit_uuid),
+                scan_dar_address(self.lc, unit_uuid),
+            )
+        for user_uuid in self.users:
+            self.assertEqual(
+                self.index.engagements_by_user[user_uuid],
+                scan_engagements_by_user(self.lc_historic, user_uuid),
+            )
+            for scope in ("Telefon", "E-mail", "DAR"):
+                self.assertEqual(
+                    self.index.addresses_by_user_scope[(user_uuid, scope)],
+                    scan_addresses(self.lc_historic, user_uuid, scope),
+                )
+
+    def test_several_engagements(self):
+        self.assertEqual(
+            [eng[0]["uuid"] for eng in self.index.engagements_by_user["multi"]],
+            ["e1", "e3", "e5"],
+        )
+        self.assertEqual(
+            [engv["uuid"] for engv in self.index.engagements_by_unit[ROOT]],
+            ["e1", "e3"],
+        )
+        self.assertEqual(self.index.engagements_by_unit[NO_MANAGER], [])
+        self.assertEqual(
+            self.index.dar_address_by_unit[ROOT], "Ny Vej 2, 8200 Aarhus N"
+        )
+        self.assertNotIn(NO_MANAGER, self.index.dar_address_by_unit)
+
+    def test_get_e_address(self):
+        settings = {}
+        phone = get_e_address("multi", "Telefon", self.lc, self.index, settings)
+        self.assertEqual(phone["value"], "11111111")
+        self.assertEqual(
+            get_e_address("multi", "E-mail", self.lc, self.index, settings)["value"],
+            "multi@example.com",
+        )
+        self.assertEqual(
+            get_e_address("single", "Telefon", self.lc, self.index, settings), {}
+        )
+
+
+class TestExportFromCache(TestCase):
+    def setUp(self):
+        self.lc, self.lc_historic = lora_caches()
+        self.index = CacheIndex(self.lc, self.lc_historic)
+        root = Node(ROOT)
+        Node(NO_MANAGER, parent=root)
+        Node(TOO_DEEP, parent=Node(UNIT, parent=root))
+        self.nodes = {"root": root}
+        self.mh = StubMoraHelper(
+            {
+                ROOT: {"uuid": "multi", "Ansvar": "Direktør"},
+                UNIT: {"uuid": "single", "Ansvar": "Leder"},
+                TOO_DEEP: {"uuid": "other", "Ansvar": "Leder"},
+            }
+        )
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, exporter, *args, **kwargs):
+        filename = str(Path(self.directory.name) / "export.csv")
+        result = exporter(self.mh, *args, filename=filename, **kwargs)
+        with open(filename) as csvfile:
+            return result, list(csv.DictReader(csvfile, delimiter=";"))
+
+    def test_export(self):
+        brugere_rows = export_bruger(self.mh, self.nodes, self.lc, self.index)
+        self.assertEqual(
+            [(row["BrugerId"], row["Mobil"], row["E-mail"]) for row in brugere_rows],
+            [
+                ("multi", "11111111", "multi@example.com"),
+                ("single", "", ""),
+            ],
+        )
+
+        afdelinger, organisation_rows = self.export(
+            export_organisation, self.nodes, lc=self.lc, index=self.index
+        )
+        self.assertEqual(afdelinger, [ROOT, NO_MANAGER, UNIT])
+        self.assertEqual(
+            [
+                (row["AfdelingsID"], row["Gade"], row["Postnr"], row["By"])
+                for row in organisation_rows
+            ],
+            [
+                (ROOT, "Ny Vej 2", "8200", "Aarhus N"),
+                (NO_MANAGER, "", "", ""),
+                (UNIT, "Vejen 3", "8000", "Aarhus C"),
+            ],
+        )
+
+        brugere_rows, engagement_rows = self.export(
+            export_engagement,
+            eksporterede_afdelinger=afdelinger,
+            brugere_rows=brugere_rows,
+            lc=self.lc,
+            index=self.index,
+        )
+        self.assertEqual(
+            [
+                (
+                    row["EngagementId"],
+                    row["BrugerId"],
+                    row["AfdelingsId"],
+                    row["Primær"],
+                )
+                for row in engagement_rows
+            ],
+            [
+                ("e1", "multi", UNIT, "1"),
+                ("e3", "multi", ROOT, "0"),
+                ("e2", "single", UNIT, "0"),
+            ],
+        )
+        self.assertEqual([row["Stilling"] for row in brugere_rows], ["Stilling", None])
+
+        _, leder_rows = self.export(
+            export_leder, self.nodes, eksporterede_afdelinger=afdelinger
+        )
+        self.assertEqual(
+            [(row["BrugerId"], row["AfdelingsID"]) for row in leder_rows],
+            [("multi", ROOT), ("single", UNIT)],
+        )
@@ -1,6 +1,7 @@
 import datetime
 import json
 import logging
+import time
 from functools import partial
 from itertools import chain
 
@@ -12,7 +13,17 @@ from integrations.SD_Lon.sd_common import load_settings, mora_assert
 from integrations.SD_Lon.sd_common import sd_lookup as _sd_lookup
 from os2mo_helpers.mora_helpers import MoraHelper
 
-sd_lookup = partial(_sd_lookup, use_cache=False)
+RUN_START = time.time()
+
+
+def sd_lookup(url, params={}):
+    """Lookup in SD, only reusing responses fetched during this run.
+
+    SD must be read fresh on every run, but the unit tree walks read the same
+    departments and parents repeatedly, so responses are reused within the run.
+    """
+    return _sd_lookup(url, params, max_age=time.time() - RUN_START)
+
 
 LOG_LEVEL = logging.DEBUG
 LOG_FILE = "fix_sd_departments.log"
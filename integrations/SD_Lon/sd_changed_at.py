@@ -6,6 +6,8 @@ import pathlib
 import sqlite3
 import requests
 import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from operator import itemgetter
 from integrations.SD_Lon import sd_payloads
@@ -143,6 +145,18 @@ class ChangeAtSD:
     def _get_mora_helper(self, mora_base):
         return MoraHelper(hostname=mora_base, use_cache=False)
 
+    def set_date_range(self, from_date, to_date=None):
+        """Move the updater to a new date range, keeping its initialized state.
+
+        Used to process several days in a row without re-reading facets and
+        classes from MO for every day.
+        """
+        self.from_date = from_date
+        self.to_date = to_date
+        self.mo_person = None
+        self.mo_engagement = None
+        self.read_employment_changed.cache_clear()
+
     def _get_job_sync(self, settings):
         return JobIdSync(settings)
 
@@ -195,12 +209,15 @@ class ChangeAtSD:
 
         return employment_response
 
-    def read_person_changed(self):
+    def read_person_changed(self, from_date=None, to_date=None):
+        from_date = from_date or self.from_date
+        to_date = to_date or self.to_date
+
         deactivate_date = '31.12.9999'
-        if self.to_date:
-            deactivate_date = self.to_date.strftime('%d.%m.%Y')
+        if to_date:
+            deactivate_date = to_date.strftime('%d.%m.%Y')
         params = {
-            'ActivationDate': self.from_date.strftime('%d.%m.%Y'),
+            'ActivationDate': from_date.strftime('%d.%m.%Y'),
             'DeactivationDate': deactivate_date,
             'StatusActiveIndicator': 'true',
             'StatusPassiveIndicator': 'true',
@@ -213,6 +230,13 @@ class ChangeAtSD:
         person_changed = ensure_list(response.get('Person', []))
         return person_changed
 
+    def read_changes(self, from_date, to_date):
+        """Read both person and employment changes for a date range."""
+        return (
+            self.read_person_changed(from_date, to_date),
+            self.read_employment_changed(from_date, to_date),
+        )
+
     def read_person(self, cpr):
         params = {
             'EffectiveDate': self.from_date.strftime('%d.%m.%Y'),
@@ -227,12 +251,12 @@ class ChangeAtSD:
         person = ensure_list(response.get('Person', []))
         return person
 
-    def update_changed_persons(self, cpr=None):
+    def update_changed_persons(self, cpr=None, person_changed=None):
         # Ansættelser håndteres af update_employment, så vi tjekker for ændringer i
         # navn og opdaterer disse poster. Nye personer oprettes.
         if cpr is not None:
             person_changed = self.read_person(cpr)
-        else:
+        elif person_changed is None:
             person_changed = self.read_person_changed()
 
         logger.info('Number of changed persons: {}'.format(len(person_changed)))
@@ -999,9 +1023,10 @@ class ChangeAtSD:
                 continue
             self.edit_engagement(engagement)
 
-    def update_all_employments(self):
+    def update_all_employments(self, employments_changed=None):
         logger.info('Update all employments:')
-        employments_changed = self.read_employment_changed()
+        if employments_changed is None:
+            employments_changed = self.read_employment_changed()
         logger.info(
             'Update a total of {} employments'.format(
                 len(employments_changed)
@@ -1121,6 +1146,87 @@ def initialize_changed_at(from_date, run_db, force=False):
     _local_db_insert((from_date, from_date, 'Initial import: {}'))
 
 
+def merge_changes(changes):
+    """Merge changes for several days into an ordered event list per person.
+
+    :param changes: A list with a (person_changes, employment_changes) tuple per
+        day, ordered by day.
+    :return: Dict from cpr to a list of (day, kind, change) tuples ordered by day,
+        with person changes before employment changes within a day. Kind is
+        either 'person' or 'employment'.
+    """
+    events = defaultdict(list)
+    for day, (person_changes, employment_changes) in enumerate(changes):
+        for kind, day_changes in (
+            ('person', person_changes), ('employment', employment_changes)
+        ):
+            for change in day_changes:
+                cpr = change['PersonCivilRegistrationIdentifier']
+                events[cpr].append((day, kind, change))
+    return events
+
+
+def plan_catch_up(changes):
+    """Plan which changes to apply on each day of a catch-up run.
+
+    Person changes carry the complete name of the person, so a person change is
+    superseded if the same person changes again before any of their employments
+    are touched. Superseded person changes are skipped. The superseding change is
+    always on a later day, so it is still pending if the catch-up is interrupted.
+
+    :param changes: A list with a (person_changes, employment_changes) tuple per
+        day, ordered by day.
+    :return: A list with a (person_changes, employment_changes) tuple per day, in
+        the original order, but without the superseded person changes.
+    """
+    superseded = set()
+    for person_events in merge_changes(changes).values():
+        for (_, kind, change), (_, next_kind, _) in pairwise(person_events):
+            if kind == 'person' and next_kind == 'person':
+                superseded.add(id(change))
+
+    return [
+        (
+            [change for change in person_changes if id(change) not in superseded],
+            employment_changes,
+        )
+        for person_changes, employment_changes in changes
+    ]
+
+
+def catch_up_days(dates, workers):
+    """Apply the changes for several days using a single updater.
+
+    The changes for all days are fetched from SD concurrently up front, while
+    the days are applied in order, with a row in the run-db for each day.
+
+    :param dates: List of (from_date, to_date) tuples to catch up on.
+    :param workers: Number of concurrent requests against SD.
+    """
+    logger.info('Start ChangedAt module')
+    sd_updater = ChangeAtSD(*dates[0])
+
+    logger.info('Fetch changes for {} days'.format(len(dates)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        changes = list(
+            executor.map(lambda pair: sd_updater.read_changes(*pair), dates)
+        )
+
+    plan = plan_catch_up(changes)
+    for (from_date, to_date), (person_changes, employment_changes) in zip(dates, plan):
+        logger.info('Importing {} to {}'.format(from_date, to_date))
+        _local_db_insert((from_date, to_date, 'Running since {}'))
+        sd_updater.set_date_range(from_date, to_date)
+
+        logger.info('Update changed persons')
+        sd_updater.update_changed_persons(person_changed=person_changes)
+
+        logger.info('Update all employments')
+        sd_updater.update_all_employments(employments_changed=employment_changes)
+
+        _local_db_insert((from_date, to_date, 'Update finished: {}'))
+
+
 def gen_date_pairs(from_date: datetime, one_day: bool = False):
 
     def generate_date_tuples(from_date, to_date):
@@ -1142,7 +1248,11 @@ def gen_date_pairs(from_date: datetime, one_day: bool = False):
 @click.option('--force', is_flag=True, type=click.BOOL, default=False, help="Ignore previously unfinished runs")
 @click.option('--one-day', is_flag=True, type=click.BOOL, default=False,
               help="Only import changes for the next missing day")
-def changed_at(init, force, one_day):
+@click.option('--catch-up', is_flag=True, type=click.BOOL, default=False,
+              help="Fetch all missing days at once and apply them with one updater")
+@click.option('--workers', type=click.INT, default=4,
+              help="Number of concurrent requests against SD when catching up")
+def changed_at(init, force, one_day, catch_up, workers):
     """Tool to delta synchronize with MO with SD."""
     setup_logging()
 
@@ -1176,20 +1286,25 @@ def changed_at(init, force, one_day):
 
     dates = gen_date_pairs(from_date)
 
-    for from_date, to_date in dates:
-        logger.info('Importing {} to {}'.format(from_date, to_date))
-        _local_db_insert((from_date, to_date, 'Running since {}'))
+    if catch_up:
+        dates = list(dates)
+        if dates:
+            catch_up_days(dates, workers)
+    else:
+        for from_date, to_date in dates:
+            logger.info('Importing {} to {}'.format(from_date, to_date))
+            _local_db_insert((from_date, to_date, 'Running since {}'))
 
-        logger.info('Start ChangedAt module')
-        sd_updater = ChangeAtSD(from_date, to_date)
+            logger.info('Start ChangedAt module')
+            sd_updater = ChangeAtSD(from_date, to_date)
 
-        logger.info('Update changed persons')
-        sd_updater.update_changed_persons()
+            logger.info('Update changed persons')
+            sd_updater.update_changed_persons()
 
-        logger.info('Update all employments')
-        sd_updater.update_all_employments()
+            logger.info('Update all employments')
+            sd_updater.update_all_employments()
 
-        _local_db_insert((from_date, to_date, 'Update finished: {}'))
+            _local_db_insert((from_date, to_date, 'Update finished: {}'))
 
     logger.info('Program stopped.')
 
@@ -1,6 +1,5 @@
 import hashlib
 import logging
-import pickle
 import uuid
 from enum import Enum
 from functools import lru_cache, wraps
@@ -8,6 +7,7 @@ from pathlib import Path
 
 import requests
 import xmltodict
+from integrations.SD_Lon.sd_response_store import CachedSDResponse, SDResponseStore
 from ra_utils.load_settings import load_settings
 
 logger = logging.getLogger("sdCommon")
@@ -32,53 +32,45 @@ def sd_lookup_settings():
     return institution_identifier, sd_user, sd_password
 
 
-def _sd_lookup_cache(func):
-    def create_hex_digest(full_url, payload):
-        """Create a reproducible hex digest from url and payloads."""
-        hasher = hashlib.sha256()
-
-        for key, value in sorted(payload.items()):
-            hasher.update((str(key) + str(value)).encode())
-        hasher.update(full_url.encode())
-
-        return hasher.hexdigest()
+@lru_cache(maxsize=None)
+def sd_response_store():
+    """Open the shared SD response store, configured from settings."""
+    # We need a cache dir to exist before we can proceed
+    cache_dir = Path("tmp/")
+    if not cache_dir.is_dir():
+        raise Exception("Folder for temporary files does not exist")
 
-    def write_response(cache_file, response):
-        """Write response to disk."""
-        with open(str(cache_file), "wb") as f:
-            pickle.dump(response, f, pickle.HIGHEST_PROTOCOL)
+    settings = load_settings()
+    return SDResponseStore(
+        cache_dir / "sd_cache.db",
+        ttl=settings.get("integrations.SD_Lon.cache.ttl", 24 * 60 * 60),
+        max_entries=settings.get("integrations.SD_Lon.cache.max_entries"),
+        max_bytes=settings.get("integrations.SD_Lon.cache.max_bytes", 1024**3),
+    )
 
-    def read_response(cache_file):
-        """Read response from disk."""
-        with open(str(cache_file), "rb") as f:
-            response = pickle.load(f)
-        return response
 
+def _sd_lookup_cache(func):
     @wraps(func)
-    def wrapper(full_url, payload, auth, use_cache=True):
+    def wrapper(full_url, payload, auth, use_cache=True, max_age=None):
         # Short-circuit as noop, if no caching is requested
         if use_cache == False:
             return func(full_url, payload, auth)
 
-        # We need a cache dir to exist before we can proceed
-        cache_dir = Path("tmp/")
-        if not cache_dir.is_dir():
-            raise Exception("Folder for temporary files does not exist")
-
-        # Create digest and find filename
-        lookup_id = create_hex_digest(full_url, payload)
-        cache_file = Path("tmp/sd_" + lookup_id + ".p")
-
-        # If cache file was found, use it
-        if cache_file.is_file():
-            response = read_response(cache_file)
-            logger.info("This SD lookup was found in cache: {}".format(lookup_id))
-            print(full_url, "read from cache")
-        else:  # No cache
-            response = func(full_url, payload, auth)
-            write_response(cache_file, response)
-            print(full_url, "requested from SD")
-        return response
+        store = sd_response_store()
+        response = store.get(full_url, payload, max_age=max_age)
+        if response is not None:
+            logger.info("This SD lookup was found in cache: {}".format(full_url))
+            return response
+
+        response = func(full_url, payload, auth)
+        logger.info("This SD lookup was requested from SD: {}".format(full_url))
+        if response.status_code != 200:
+            return response
+        dict_response = xmltodict.parse(response.text)
+        # Do not cache error envelopes, they should be retried on the next lookup
+        if "Envelope" in dict_response:
+            return response
+        return store.put(full_url, payload, response.text, dict_response)
 
     return wrapper
 
@@ -96,11 +88,17 @@ def _sd_request(full_url, payload, auth):
     )
 
 
-def sd_lookup(url, params={}, use_cache=True):
+def sd_lookup(url, params={}, use_cache=True, max_age=None):
     """Fire a requests against SD.
 
     Utilizes _sd_request to fire the actual request, which in turn utilize
     _sd_lookup_cache for caching.
+
+    :param url: The SD endpoint to lookup, i.e. 'GetPerson20111201'.
+    :param params: Parameters for the lookup.
+    :param use_cache: Whether to use the SD response store.
+    :param max_age: Optional maximal age in seconds of cached responses to accept.
+    :return: The parsed SD response.
     """
     logger.info("Retrieve: {}".format(url))
     logger.debug("Params: {}".format(params))
@@ -115,10 +113,15 @@ def sd_lookup(url, params={}, use_cache=True):
     }
     payload.update(params)
     auth = (sd_user, sd_password)
-    response = _sd_request(full_url, payload, auth, use_cache=use_cache)
-    logger.debug("Response: {}".format(response.text))
+    response = _sd_request(
+        full_url, payload, auth, use_cache=use_cache, max_age=max_age
+    )
 
-    dict_response = xmltodict.parse(response.text)
+    # Responses from the store come pre-parsed, so we can skip parsing the XML
+    if isinstance(response, CachedSDResponse):
+        dict_response = response.parsed
+    else:
+        dict_response = xmltodict.parse(response.text)
 
     if url in dict_response:
         xml_response = dict_response[url]
@@ -9,11 +9,18 @@ import json
 import logging
 import pathlib
 import datetime
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain
 from anytree import Node
 
 from integrations import dawa_helper
 from integrations.ad_integration import ad_reader
 from integrations.SD_Lon.sd_common import sd_lookup
+from integrations.SD_Lon.sd_common import sd_response_store
 from integrations.SD_Lon.sd_common import generate_uuid
 from integrations.SD_Lon.sd_common import calc_employment_id
 from integrations.SD_Lon.sd_common import load_settings
@@ -25,6 +32,43 @@ LOG_FILE = 'mo_initial_import.log'
 logger = logging.getLogger('sdImport')
 
 
+def ensure_list(element):
+    if not isinstance(element, list):
+        return [element]
+    return element
+
+
+class PhaseTimer(object):
+    """Accumulate the wall time spent in each phase of an import.
+
+    Phases may be nested, in which case the time spent in the inner phase is not
+    counted towards the outer phase.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+
+    @contextmanager
+    def __call__(self, phase):
+        self.timings.setdefault(phase, 0.0)
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self._stack.pop()
+            self.timings[phase] += elapsed - inner
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def report(self):
+        lines = ['{}: {:.1f}s'.format(phase, timing)
+                 for phase, timing in self.timings.items()]
+        return 'Import timings: ' + ', '.join(lines)
+
+
 def get_import_date(settings):
     import_date_from = datetime.datetime.strptime(
         settings['integrations.SD_Lon.global_from_date'],
@@ -48,6 +92,14 @@ class SdImport(object):
         self.double_employment = []
         self.address_errors = {}
         self.manager_rows = manager_rows
+        self.timer = PhaseTimer()
+
+        # Index the manager rows by cpr and by department
+        self.manager_rows_by_cpr = defaultdict(list)
+        self.manager_rows_by_department = defaultdict(list)
+        for row in manager_rows:
+            self.manager_rows_by_cpr[row['cpr']].append(row)
+            self.manager_rows_by_department[row['afdeling'].upper()].append(row)
 
         self.importer = importer
 
@@ -80,11 +132,15 @@ class SdImport(object):
 
         self.nodes = {}  # Will be populated when org-tree is created
 
+        self.people = {}  # cpr -> SD person, populated by add_people
         self.org_only = org_only
         if not org_only:
-            self.add_people()
+            with self.timer('people'):
+                self.add_people()
 
-        self.info = self._read_department_info()
+        # department uuid -> SD department
+        with self.timer('departments'):
+            self.info = self._read_department_info()
 
         self._add_classes(manager_rows)
 
@@ -172,6 +228,27 @@ class SdImport(object):
             if response:
                 self.ad_people[cpr] = response
 
+    def _lookup_active_and_passive(self, url, params):
+        """Lookup active and passive persons in SD in parallel.
+
+        :param url: The SD endpoint to lookup.
+        :param params: Parameters for the lookup, except for the status indicators.
+        :return: A tuple with the list of active and the list of passive persons.
+        """
+        active_params = dict(params)
+        active_params['StatusActiveIndicator'] = 'true'
+        active_params['StatusPassiveIndicator'] = 'false'
+
+        passive_params = dict(params)
+        passive_params['StatusActiveIndicator'] = False
+        passive_params['StatusPassiveIndicator'] = True
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            active, passive = executor.map(
+                partial(sd_lookup, url), [active_params, passive_params]
+            )
+        return ensure_list(active['Person']), ensure_list(passive['Person'])
+
     def _read_department_info(self):
         """ Load all department details and store for later user."""
         department_info = {}
@@ -287,9 +364,8 @@ class SdImport(object):
                 date_to=None,
                 parent_ref=parent_uuid)
 
-            for row in self.manager_rows:
-                if row['afdeling'].upper() == user_key.upper():
-                    row['uuid'] = unit_id
+            for row in self.manager_rows_by_department[user_key.upper()]:
+                row['uuid'] = unit_id
 
         if 'ContactInformation' in info:
             if 'EmailAddressIdentifier' in info['ContactInformation']:
@@ -372,32 +448,20 @@ class SdImport(object):
     def add_people(self):
         """ Load all person details and store for later user """
         params = {
-            'StatusActiveIndicator': 'true',
-            'StatusPassiveIndicator': 'false',
             'ContactInformationIndicator': 'false',
             'PostalAddressIndicator': 'false',
             'EffectiveDate': self.import_date
         }
-        active_people = sd_lookup('GetPerson20111201', params)
-        if not isinstance(active_people['Person'], list):
-            active_people['Person'] = [active_people['Person']]
-
-        params['StatusActiveIndicator'] = False
-        params['StatusPassiveIndicator'] = True
-        passive_people = sd_lookup('GetPerson20111201', params)
-        if not isinstance(passive_people['Person'], list):
-            passive_people['Person'] = [passive_people['Person']]
-
-        people = active_people['Person']
-
-        cprs = []
-        for person in active_people['Person']:
-            cprs.append(person['PersonCivilRegistrationIdentifier'])
-        for person in passive_people['Person']:
-            if not person['PersonCivilRegistrationIdentifier'] in cprs:
-                people.append(person)
-
-        for person in people:
+        active_people, passive_people = self._lookup_active_and_passive(
+            'GetPerson20111201', params
+        )
+
+        # Active persons take precedence over passive persons with the same cpr
+        for person in chain(active_people, passive_people):
+            cpr = person['PersonCivilRegistrationIdentifier']
+            self.people.setdefault(cpr, person)
+
+        for person in self.people.values():
             cpr = person['PersonCivilRegistrationIdentifier']
             logger.info('Importing {}'.format(cpr))
             if cpr[-4:] == '0000':
@@ -457,18 +521,17 @@ class SdImport(object):
             'DeactivationDate': self.import_date,
             'UUIDIndicator': 'true'
         }
-        organisation = sd_lookup('GetOrganization20111201', params)
-        departments = organisation['Organization']['DepartmentReference']
+        with self.timer('departments'):
+            organisation = sd_lookup('GetOrganization20111201', params)
+            departments = organisation['Organization']['DepartmentReference']
 
-        for department in departments:
-            self._add_sd_department(department, sub_tree=sub_tree,
-                                    super_unit=super_unit)
-        self.nodes = self._create_org_tree_structure()
+            for department in departments:
+                self._add_sd_department(department, sub_tree=sub_tree,
+                                        super_unit=super_unit)
+            self.nodes = self._create_org_tree_structure()
 
     def create_employees(self):
         params = {
-            'StatusActiveIndicator': 'true',
-            'StatusPassiveIndicator': 'false',
             'DepartmentIndicator': 'true',
             'EmploymentStatusIndicator': 'true',
             'ProfessionIndicator': 'true',
@@ -479,21 +542,16 @@ class SdImport(object):
             'EffectiveDate': self.import_date
         }
         logger.info('Create employees')
-        active_people = sd_lookup('GetEmployment20111201', params)
-        if not isinstance(active_people['Person'], list):
-            active_people['Person'] = [active_people['Person']]
-
-        params['StatusActiveIndicator'] = False
-        params['StatusPassiveIndicator'] = True
-        passive_people = sd_lookup('GetEmployment20111201', params)
-        if not isinstance(passive_people['Person'], list):
-            passive_people['Person'] = [passive_people['Person']]
+        with self.timer('employments'):
+            active_people, passive_people = self._lookup_active_and_passive(
+                'GetEmployment20111201', params
+            )
 
-        self._create_employees(active_people)
-        self._create_employees(passive_people, skip_manager=True)
+            self._create_employees(active_people)
+            self._create_employees(passive_people, skip_manager=True)
 
     def _create_employees(self, persons, skip_manager=False):
-        for person in persons['Person']:
+        for person in persons:
             self.create_employee(person, skip_manager=skip_manager)
 
     def create_employee(self, person, skip_manager=False):
@@ -686,20 +744,21 @@ class SdImport(object):
                 # These job functions will normally (but necessarily)
                 #  correlate to a manager position
                 if job_position_id in ['1040', '1035', '1030']:
-                    self.importer.add_manager(
-                        employee=cpr,
-                        organisation_unit=unit,
-                        manager_level_ref='manager_' + job_position_id,
-                        address_uuid=None,  # Manager address is not used
-                        manager_type_ref='leder_type',
-                        responsibility_list=['Lederansvar'],
-                        date_from=date_from,
-                        date_to=date_to
-                    )
+                    with self.timer('managers'):
+                        self.importer.add_manager(
+                            employee=cpr,
+                            organisation_unit=unit,
+                            manager_level_ref='manager_' + job_position_id,
+                            address_uuid=None,  # Manager address is not used
+                            manager_type_ref='leder_type',
+                            responsibility_list=['Lederansvar'],
+                            date_from=date_from,
+                            date_to=date_to
+                        )
 
         if self.manager_rows and (not skip_manager):
-            for row in self.manager_rows:
-                if row['cpr'] == cpr:
+            with self.timer('managers'):
+                for row in self.manager_rows_by_cpr[cpr]:
                     if 'uuid' not in row:
                         logger.warning('NO UNIT: {}'.format(row['afdeling']))
                         continue
@@ -784,6 +843,8 @@ def full_import(org_only):
     )
     if not org_only:
         sd.create_employees()
+    sd_response_store().log_stats()
+    logger.info(sd.timer.report())
 
     importer.import_all()
 
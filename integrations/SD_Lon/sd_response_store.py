@@ -0,0 +1,223 @@
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger("sdCommon")
+
+
+def normalize_params(params):
+    """Create a canonical, order independent representation of request params.
+
+    Values are converted to strings the same way requests does it, and tuples and
+    lists (which requests sends as repeated parameters) are kept as lists.
+    """
+
+    def normalize_value(value):
+        if isinstance(value, (list, tuple)):
+            return [str(item) for item in value]
+        return str(value)
+
+    return json.dumps(
+        sorted((str(key), normalize_value(value)) for key, value in params.items())
+    )
+
+
+class CachedSDResponse:
+    """Response-like object returned by the store.
+
+    The raw XML body is kept compressed and only decompressed if `text` is read,
+    while `parsed` holds the `xmltodict` parse of the body, such that callers can
+    skip the XML parsing entirely.
+    """
+
+    status_code = 200
+
+    def __init__(self, body, parsed, from_cache):
+        self._body = body
+        self.parsed = parsed
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return zlib.decompress(self._body).decode("utf-8")
+
+
+class SDResponseStore:
+    """SQLite backed store of SD responses.
+
+    Entries are keyed by (endpoint, normalized params), and hold the compressed XML
+    body as well as the pickled parsed form of the response.
+
+    Entries older than `ttl` seconds are considered expired, and whenever the store
+    grows beyond `max_entries` or `max_bytes`, the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None, max_bytes=None):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                params TEXT NOT NULL,
+                body BLOB NOT NULL,
+                parsed BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (endpoint, params)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.purge_expired()
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def _is_expired(self, created, now, max_age):
+        limits = [limit for limit in (self.ttl, max_age) if limit is not None]
+        return any(created < now - limit for limit in limits)
+
+    def get(self, endpoint, params, max_age=None):
+        """Lookup a response in the store.
+
+        :param endpoint: The SD endpoint, i.e. the full url.
+        :param params: The request params.
+        :param max_age: Optional maximal age in seconds of acceptable entries,
+            in addition to the ttl of the store.
+        :return: A CachedSDResponse or None on cache miss.
+        """
+        key = (endpoint, normalize_params(params))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, parsed, size, created FROM responses "
+                "WHERE endpoint = ? AND params = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            body, parsed, size, created = row
+            if self._is_expired(created, now, max_age):
+                self.stats["expired"] += 1
+                self._delete(key, size)
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE endpoint = ? AND params = ?",
+                (now,) + key,
+            )
+            self._conn.commit()
+            self.stats["hits"] += 1
+            self.stats["bytes_read"] += size
+        return CachedSDResponse(
+            body, pickle.loads(zlib.decompress(parsed)), from_cache=True
+        )
+
+    def put(self, endpoint, params, text, parsed):
+        """Store a response, and evict old entries if the store is too large.
+
+        :param endpoint: The SD endpoint, i.e. the full url.
+        :param params: The request params.
+        :param text: The raw XML body.
+        :param parsed: The parsed form of the XML body.
+        :return: A CachedSDResponse wrapping the stored response.
+        """
+        key = (endpoint, normalize_params(params))
+        body = zlib.compress(text.encode("utf-8"))
+        parsed_blob = zlib.compress(pickle.dumps(parsed, pickle.HIGHEST_PROTOCOL))
+        size = len(body) + len(parsed_blob)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM responses WHERE endpoint = ? AND params = ?", key
+            ).fetchone()
+            if row is not None:
+                self._delete(key, row[0])
+            self._conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (body, parsed_blob, size, now, now),
+            )
+            self._entries += 1
+            self._bytes += size
+            self.stats["stores"] += 1
+            self.stats["bytes_written"] += size
+            self._evict()
+            self._conn.commit()
+        return CachedSDResponse(body, parsed, from_cache=False)
+
+    def _delete(self, key, size):
+        self._conn.execute(
+            "DELETE FROM responses WHERE endpoint = ? AND params = ?", key
+        )
+        self._entries -= 1
+        self._bytes -= size
+
+    def _too_large(self):
+        if self.max_entries is not None and self._entries > self.max_entries:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self):
+        """Evict the least recently used entries, until the store fits its limits."""
+        while self._too_large():
+            endpoint, params, size = self._conn.execute(
+                "SELECT endpoint, params, size FROM responses "
+                "ORDER BY accessed LIMIT 1"
+            ).fetchone()
+            self._delete((endpoint, params), size)
+            self.stats["evictions"] += 1
+
+    def purge_expired(self):
+        """Remove all expired entries from the store."""
+        if self.ttl is None:
+            return
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+            self.stats["purged"] += cursor.rowcount
+
+    def clear(self):
+        """Remove all entries from the store."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._entries = 0
+            self._bytes = 0
+
+    def log_stats(self):
+        hits = self.stats["hits"]
+        lookups = hits + self.stats["misses"] + self.stats["expired"]
+        logger.info(
+            "SD cache: {} lookups, {} hits ({:.0%}), {} stored, {} evicted, "
+            "{} entries / {} bytes on disk".format(
+                lookups,
+                hits,
+                hits / lookups if lookups else 0,
+                self.stats["stores"],
+                self.stats["evictions"],
+                self._entries,
+                self._bytes,
+            )
+        )
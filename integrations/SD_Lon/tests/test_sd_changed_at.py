@@ -6,7 +6,12 @@ import hypothesis.strategies as st
 from hypothesis import example, given
 from integrations.ad_integration.utils import AttrDict
 from integrations.SD_Lon.exceptions import JobfunctionSettingsIsWrongException
-from integrations.SD_Lon.sd_changed_at import ChangeAtSD, gen_date_pairs
+from integrations.SD_Lon.sd_changed_at import (
+    ChangeAtSD,
+    catch_up_days,
+    gen_date_pairs,
+    plan_catch_up,
+)
 from parameterized import parameterized
 from test_case import DipexTestCase
 
@@ -880,3 +885,57 @@ class Test_sd_changed_at(DipexTestCase):
                 ),
             ]
         )
+
+    def test_plan_catch_up(self):
+        def person(cpr, name):
+            return {"PersonCivilRegistrationIdentifier": cpr, "PersonGivenName": name}
+
+        def employment(cpr):
+            return {"PersonCivilRegistrationIdentifier": cpr, "Employment": []}
+
+        day_1 = ([person("1", "a"), person("2", "b"), person("3", "c")], [])
+        day_2 = ([person("1", "aa")], [employment("2")])
+        day_3 = ([person("1", "aaa"), person("2", "bb")], [])
+
+        plan = plan_catch_up([day_1, day_2, day_3])
+
+        # Person 1 changes name every day, only the last change is needed.
+        # Person 2 has an employment change in between, so both are applied.
+        self.assertEqual(
+            plan,
+            [
+                ([person("2", "b"), person("3", "c")], []),
+                ([], [employment("2")]),
+                ([person("1", "aaa"), person("2", "bb")], []),
+            ],
+        )
+
+    @patch("integrations.SD_Lon.sd_changed_at._local_db_insert")
+    @patch("integrations.SD_Lon.sd_changed_at.ChangeAtSD")
+    def test_catch_up_days(self, change_at_sd, local_db_insert):
+        days = [datetime(2021, 1, day) for day in range(1, 5)]
+        dates = list(zip(days, days[1:]))
+        sd_updater = change_at_sd.return_value
+        sd_updater.read_changes.side_effect = lambda from_date, to_date: (
+            [],
+            [{"PersonCivilRegistrationIdentifier": str(from_date.day)}],
+        )
+        applied = []
+        sd_updater.update_all_employments.side_effect = (
+            lambda employments_changed: applied.append(employments_changed)
+        )
+
+        catch_up_days(dates, workers=2)
+
+        # A single updater is initialized and reused for all days
+        change_at_sd.assert_called_once_with(*dates[0])
+        sd_updater.set_date_range.assert_has_calls([call(*pair) for pair in dates])
+        self.assertEqual(
+            applied,
+            [[{"PersonCivilRegistrationIdentifier": str(day)}] for day in (1, 2, 3)],
+        )
+        # Each day is recorded as running, then as finished in the run-db
+        self.assertEqual(
+            [args[0][:2] for args, _ in local_db_insert.call_args_list],
+            [pair for pair in dates for _ in range(2)],
+        )
@@ -0,0 +1,59 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from integrations.SD_Lon.sd_importer import PhaseTimer, SdImport
+
+
+def person(cpr, given_name):
+    return {
+        "PersonCivilRegistrationIdentifier": cpr,
+        "PersonGivenName": given_name,
+        "PersonSurnameName": "Testesen",
+    }
+
+
+def fake_sd_lookup(url, params):
+    if url == "GetDepartment20111201":
+        return {"Department": []}
+    if params["StatusActiveIndicator"] == "true":
+        return {"Person": [person("0101011234", "Aktiv"), person("0202021234", "B")]}
+    return {"Person": person("0101011234", "Passiv")}
+
+
+class TestSdImport(TestCase):
+    @patch("integrations.SD_Lon.sd_importer.sd_lookup", fake_sd_lookup)
+    @patch("integrations.SD_Lon.sd_importer.load_settings")
+    def test_add_people(self, load_settings):
+        load_settings.return_value = {
+            "municipality.name": "Kommune",
+            "municipality.code": 999,
+            "integrations.SD_Lon.global_from_date": "2020-01-01",
+        }
+        importer = MagicMock()
+        importer.check_if_exists.return_value = False
+
+        sd = SdImport(importer)
+
+        # Active persons take precedence over passive persons with the same cpr
+        self.assertEqual(list(sd.people), ["0101011234", "0202021234"])
+        self.assertEqual(sd.people["0101011234"]["PersonGivenName"], "Aktiv")
+        self.assertEqual(importer.add_employee.call_count, 2)
+        self.assertIn("people", sd.timer.timings)
+        self.assertIn("departments", sd.timer.timings)
+
+
+class TestPhaseTimer(TestCase):
+    @patch("integrations.SD_Lon.sd_importer.time.perf_counter")
+    def test_nested_phases(self, perf_counter):
+        perf_counter.side_effect = [0.0, 1.0, 3.0, 10.0, 11.0, 12.0]
+        timer = PhaseTimer()
+        with timer("employments"):
+            with timer("managers"):
+                pass
+        with timer("managers"):
+            pass
+
+        self.assertEqual(timer.timings, {"employments": 8.0, "managers": 3.0})
+        self.assertEqual(
+            timer.report(), "Import timings: employments: 8.0s, managers: 3.0s"
+        )
@@ -0,0 +1,85 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import xmltodict
+from integrations.SD_Lon.sd_common import sd_lookup
+from integrations.SD_Lon.sd_response_store import (
+    CachedSDResponse,
+    SDResponseStore,
+    normalize_params,
+)
+
+xml = "<GetPerson20111201><Person><Name>John</Name></Person></GetPerson20111201>"
+
+
+class TestSDResponseStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "sd_cache.db"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_normalize_params(self):
+        self.assertEqual(
+            normalize_params({"b": True, "a": ("01.01.2020",)}),
+            normalize_params({"a": ["01.01.2020"], "b": "True"}),
+        )
+
+    def test_roundtrip(self):
+        store = SDResponseStore(self.path)
+        self.assertIsNone(store.get("url", {"a": 1}))
+        store.put("url", {"a": 1}, xml, xmltodict.parse(xml))
+
+        response = SDResponseStore(self.path).get("url", {"a": "1"})
+        self.assertIsInstance(response, CachedSDResponse)
+        self.assertTrue(response.from_cache)
+        self.assertEqual(response.text, xml)
+        self.assertEqual(response.parsed, xmltodict.parse(xml))
+        self.assertEqual(store.stats["misses"], 1)
+        self.assertEqual(store.stats["stores"], 1)
+
+    def test_ttl(self):
+        store = SDResponseStore(self.path, ttl=60)
+        with patch("integrations.SD_Lon.sd_response_store.time.time") as now:
+            now.return_value = 1000
+            store.put("url", {}, xml, {})
+            now.return_value = 1030
+            self.assertIsNotNone(store.get("url", {}))
+            self.assertIsNone(store.get("url", {}, max_age=20))
+            store.put("url", {}, xml, {})
+            now.return_value = 1100
+            self.assertIsNone(store.get("url", {}))
+        self.assertEqual(store.stats["hits"], 1)
+        self.assertEqual(store.stats["expired"], 2)
+
+    def test_eviction(self):
+        store = SDResponseStore(self.path, max_entries=2)
+        store.put("url", {"a": 1}, xml, {})
+        store.put("url", {"a": 2}, xml, {})
+        store.get("url", {"a": 1})
+        store.put("url", {"a": 3}, xml, {})
+
+        self.assertEqual(store.stats["evictions"], 1)
+        self.assertIsNotNone(store.get("url", {"a": 1}))
+        self.assertIsNone(store.get("url", {"a": 2}))
+        self.assertIsNotNone(store.get("url", {"a": 3}))
+
+    @patch("integrations.SD_Lon.sd_common.sd_lookup_settings")
+    @patch("integrations.SD_Lon.sd_common.sd_response_store")
+    @patch("integrations.SD_Lon.sd_common.requests.get")
+    def test_sd_lookup_skips_network_and_parsing(self, get, store, settings):
+        settings.return_value = ("", "", "")
+        store.return_value = SDResponseStore(self.path)
+        get.return_value = MagicMock(status_code=200, text=xml)
+
+        first = sd_lookup("GetPerson20111201", {"a": 1})
+        with patch("integrations.SD_Lon.sd_common.xmltodict.parse") as parse:
+            second = sd_lookup("GetPerson20111201", {"a": 1})
+            parse.assert_not_called()
+
+        get.assert_called_once()
+        self.assertEqual(first, second)
+        self.assertEqual(second["Person"]["Name"], "John")
@@ -4,6 +4,7 @@ import click
 
 # from click_option_group import RequiredMutuallyExclusiveOptionGroup, optgroup
 from integrations.calculate_primary.common import LOGGER_NAME
+from integrations.calculate_primary.common import engagement_history_from_lora_cache
 
 
 def setup_logging():
@@ -38,6 +39,15 @@ def get_engagement_updater(integration):
     raise NotImplementedError("Unexpected integration: " + str(integration))
 
 
+def read_lora_cache_history(no_past):
+    from exporters.sql_export.lora_cache import LoraCache
+
+    print("Reading engagement history from LoRa...")
+    lc_historic = LoraCache(resolve_dar=False, full_history=True, skip_past=no_past)
+    lc_historic.populate_cache(dry_run=False, skip_associations=True)
+    return engagement_history_from_lora_cache(lc_historic, no_past=no_past)
+
+
 @click.command()
 @click.option(
     "--integration",
@@ -61,8 +71,27 @@ def get_engagement_updater(integration):
     "--recalculate-all", is_flag=True, type=click.BOOL, help="Recalculate all users"
 )
 @click.option("--recalculate-user", type=click.UUID, help="Recalculate one user")
+@click.option(
+    "--bulk",
+    is_flag=True,
+    type=click.BOOL,
+    help="Recalculate all users from a single read of the engagement history",
+)
+@click.option(
+    "--lora-cache",
+    is_flag=True,
+    type=click.BOOL,
+    help="Read the engagement history for --bulk from LoRa rather than MO",
+)
 def calculate_primary(
-    integration, dry_run, check_all, check_user, recalculate_all, recalculate_user
+    integration,
+    dry_run,
+    check_all,
+    check_user,
+    recalculate_all,
+    recalculate_user,
+    bulk,
+    lora_cache,
 ):
     """Tool to work with primary engagement(s)."""
     setup_logging()
@@ -80,7 +109,15 @@ def calculate_primary(
         updater.check_user(check_user)
     if recalculate_all:
         print("Recalculate all")
-        updater.recalculate_all(no_past=True)
+        if bulk:
+            engagement_history = None
+            if lora_cache:
+                engagement_history = read_lora_cache_history(no_past=True)
+            updater.recalculate_all_bulk(
+                no_past=True, engagement_history=engagement_history
+            )
+        else:
+            updater.recalculate_all(no_past=True)
     if recalculate_user:
         print("Recalculate user")
         updater.recalculate_user(recalculate_user)
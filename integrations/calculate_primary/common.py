@@ -1,6 +1,7 @@
 import datetime
 import logging
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache, partial
 from operator import itemgetter
 
@@ -9,6 +10,7 @@ from tqdm import tqdm
 
 from ra_utils.load_settings import load_settings
 from ra_utils.deprecation import deprecated
+from os2mo_helpers.details_writer import DetailsWriter
 from os2mo_helpers.mora_helpers import MoraHelper
 
 
@@ -38,6 +40,149 @@ def noop(*args, **kwargs):
     pass
 
 
+def calculate_validity(start, end):
+    """Construct engagement primarity validity from start and end date."""
+    to = datetime.datetime.strftime(
+        end - datetime.timedelta(days=1), "%Y-%m-%d"
+    )
+    # Sentinel value for infinity is usually 9999-12-30 / 9999-12-31.
+    # We assume anything above 9999-1-1 is sentinel value for infinity.
+    if end >= datetime.datetime(9999, 1, 1, 0, 0):
+        to = None
+    validity = {
+        "from": datetime.datetime.strftime(start, "%Y-%m-%d"),
+        "to": to,
+    }
+    return validity
+
+
+def edit_payload(engagement_uuid, primary_type_uuid, validity):
+    """Construct a MO payload, changing the primary type of an engagement."""
+    return {
+        "type": "engagement",
+        "uuid": engagement_uuid,
+        "data": {
+            "primary": {"uuid": primary_type_uuid},
+            "validity": validity
+        }
+    }
+
+
+def _from_date(validity):
+    fromdate = datetime.datetime.strptime(validity["from"], "%Y-%m-%d")
+    # Clamped like MoraHelper.find_cut_dates does
+    return max(fromdate, datetime.datetime(1930, 1, 1))
+
+
+def _to_date(validity):
+    """The day after the validity, or the sentinel value for infinity."""
+    if validity["to"]:
+        to = datetime.datetime.strptime(validity["to"], "%Y-%m-%d")
+        return to + datetime.timedelta(days=1)
+    return datetime.datetime(9999, 12, 30, 0, 0)
+
+
+def find_cut_dates(mo_engagements):
+    """Find dates with changes in an engagement history.
+
+    The in-memory equivalent of MoraHelper.find_cut_dates.
+
+    Args:
+        mo_engagements: The engagement history of a user, as read from MO.
+
+    Returns:
+        list: Sorted list of datetimes with changes in engagement history.
+    """
+    dates = set()
+    for engagement in mo_engagements:
+        dates.add(_from_date(engagement["validity"]))
+        dates.add(_to_date(engagement["validity"]))
+    return sorted(dates)
+
+
+def engagements_at(date, mo_engagements):
+    """Filter an engagement history to the engagements valid at date.
+
+    The in-memory equivalent of reading the engagements from MO at date.
+    """
+    return [
+        engagement for engagement in mo_engagements
+        if _from_date(engagement["validity"]) <= date < _to_date(engagement["validity"])
+    ]
+
+
+def coalesce_edits(edits):
+    """Merge edits of consecutive periods of the same engagement validity.
+
+    The primary of an engagement is decided per period between cut dates of the
+    user's engagements, so an engagement validity spanning several periods may
+    get an edit for each of them. Such edits with the same primary type are
+    merged into one.
+
+    Args:
+        edits: List of (engagement, primary_type_uuid, validity) tuples, where
+            engagement is the MO engagement validity being edited.
+
+    Returns:
+        list: The coalesced list of edits, in the same format.
+
+    Example:
+        >>> eng = {"uuid": "e", "validity": {"from": "2020-01-01", "to": None}}
+        >>> coalesce_edits([
+        ...     (eng, "p", {"from": "2020-01-01", "to": "2020-12-31"}),
+        ...     (eng, "p", {"from": "2021-01-01", "to": None}),
+        ... ])[0][2]
+        {'from': '2020-01-01', 'to': None}
+    """
+    coalesced = []
+    for engagement, primary_type_uuid, validity in edits:
+        if coalesced:
+            last_engagement, last_type, last_validity = coalesced[-1]
+            if (
+                last_engagement is engagement
+                and last_type == primary_type_uuid
+                and last_validity["to"] is not None
+                and _to_date(last_validity) == _from_date(validity)
+            ):
+                merged = {"from": last_validity["from"], "to": validity["to"]}
+                coalesced[-1] = (engagement, primary_type_uuid, merged)
+                continue
+        coalesced.append((engagement, primary_type_uuid, validity))
+    return coalesced
+
+
+def engagement_history_from_lora_cache(lc_historic, no_past=False):
+    """Convert the engagements of a full history LoraCache to MO engagements.
+
+    Args:
+        lc_historic: A populated LoraCache with full_history=True.
+        no_past: Leave out engagement validities which have ended.
+
+    Returns:
+        dict: Map from user UUID to the engagement history of the user, in the
+            format read from MO with only_primary=True.
+    """
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    history = {}
+    for validities in lc_historic.engagements.values():
+        for eng in validities:
+            if no_past and eng["to_date"] and eng["to_date"] < today:
+                continue
+            primary = {"uuid": eng["primary_type"]} if eng["primary_type"] else None
+            history.setdefault(eng["user"], []).append({
+                "uuid": eng["uuid"],
+                "user_key": eng["user_key"],
+                "fraction": eng["fraction"],
+                "primary": primary,
+                "engagement_type": {"uuid": eng["engagement_type"]},
+                "job_function": {"uuid": eng["job_function"]},
+                "org_unit": {"uuid": eng["unit"]},
+                "person": {"uuid": eng["user"]},
+                "validity": {"from": eng["from_date"], "to": eng["to_date"]},
+            })
+    return history
+
+
 class MOPrimaryEngagementUpdater(ABC):
     def __init__(self, settings=None, dry_run=False):
         self.settings = settings or load_settings()
@@ -349,14 +494,7 @@ class MOPrimaryEngagementUpdater(ABC):
 
         # At this point, we know that we have to update the engagement, thus we
         # construct an update payload and send it to MO.
-        payload = {
-            "type": "engagement",
-            "uuid": engagement["uuid"],
-            "data": {
-                "primary": {"uuid": primary_type_uuid},
-                "validity": validity
-            }
-        }
+        payload = edit_payload(engagement["uuid"], primary_type_uuid, validity)
         logger.debug("Edit payload: {}".format(payload))
 
         if not self.dry_run:
@@ -367,6 +505,54 @@ class MOPrimaryEngagementUpdater(ABC):
                 logger.warn("Attempted edit, but no change needed.")
         return True
 
+    def _prepare_engagements(self, user_uuid, no_past, mo_engagements):
+        """Filter engagements by our filters and ensure they all have a primary."""
+        def ensure_primary(engagement):
+            """Ensure that engagement has a primary field."""
+            # TODO: It would seem this happens for leaves, should we make a
+            #       special type for this?
+            # TODO: What does the above even mean? - Help?
+            if not engagement["primary"]:
+                engagement["primary"] = {"uuid": self.primary_types["non_primary"]}
+            return engagement
+
+        # Filter unwanted engagements
+        for filter_func in self.calculate_filters:
+            mo_engagements = filter(
+                partial(filter_func, user_uuid, no_past), mo_engagements
+            )
+        # Enrich engagements with primary, if required
+        mo_engagements = map(ensure_primary, mo_engagements)
+        return list(mo_engagements)
+
+    def _primary_types_for(self, user_uuid, mo_engagements):
+        """Decide the primary type of each of the engagements.
+
+        Args:
+            user_uuid: UUID of the user who owns the engagements.
+            mo_engagements: The engagements of the user at some date.
+
+        Returns:
+            Generator of 2-tuples: engagement, primary type UUID.
+        """
+        # Decide which of the mo_engagements is the primary one, and also what
+        # kind of primary it is, fixed_primary or just primary
+        try:
+            primary_uuid, primary_type_key = self._decide_primary(mo_engagements)
+        except NoPrimaryFound:
+            logger.warning(f"Unable to determine primary for {user_uuid}")
+            primary_uuid = None
+
+        for engagement in mo_engagements:
+            # As there can only be one primary engagement at the time, all
+            # engagements are non_primary by default.
+            primary_type_uuid = self.primary_types["non_primary"]
+            # Only the primary engagement is marked non_primary. The actual type
+            # is simply the one provided by _decide_primary.
+            if engagement['uuid'] == primary_uuid:
+                primary_type_uuid = self.primary_types[primary_type_key]
+            yield engagement, primary_type_uuid
+
     def recalculate_user(self, user_uuid, no_past=False):
         """(Re)calculate primary engagement for the entire history the user."""
 
@@ -375,42 +561,8 @@ class MOPrimaryEngagementUpdater(ABC):
 
             Also ensures that the 'primary' attribute is set on all engagements.
             """
-            def ensure_primary(engagement):
-                """Ensure that engagement has a primary field."""
-                # TODO: It would seem this happens for leaves, should we make a
-                #       special type for this?
-                # TODO: What does the above even mean? - Help?
-                if not engagement["primary"]:
-                    engagement["primary"] = {"uuid": self.primary_types["non_primary"]}
-                return engagement
-
-            # Fetch engagements
             mo_engagements = self._read_engagement(user_uuid, date)
-            # Filter unwanted engagements
-            for filter_func in self.calculate_filters:
-                mo_engagements = filter(
-                    partial(filter_func, user_uuid, no_past), mo_engagements
-                )
-            # Enrich engagements with primary, if required
-            mo_engagements = map(ensure_primary, mo_engagements)
-            mo_engagements = list(mo_engagements)
-
-            return mo_engagements
-
-        def calculate_validity(start, end):
-            """Construct engagement primarity validity from start and end date."""
-            to = datetime.datetime.strftime(
-                end - datetime.timedelta(days=1), "%Y-%m-%d"
-            )
-            # Sentinel value for infinity is usually 9999-12-30 / 9999-12-31.
-            # We assume anything above 9999-1-1 is sentinel value for infinity.
-            if end >= datetime.datetime(9999, 1, 1, 0, 0):
-                to = None
-            validity = {
-                "from": datetime.datetime.strftime(start, "%Y-%m-%d"),
-                "to": to,
-            }
-            return validity
+            return self._prepare_engagements(user_uuid, no_past, mo_engagements)
 
         logger.info("Calculate primary engagement: {}".format(user_uuid))
         number_of_edits = 0
@@ -428,26 +580,11 @@ class MOPrimaryEngagementUpdater(ABC):
             if len(mo_engagements) == 0:
                 continue
 
-            # Decide which of the mo_engagements is the primary one, and also what
-            # kind of primary it is, fixed_primary or just primary
-            try:
-                primary_uuid, primary_type_key = self._decide_primary(mo_engagements)
-            except NoPrimaryFound:
-                logger.warning(f"Unable to determine primary for {user_uuid}")
-                primary_uuid = None
-
             validity = calculate_validity(start, end)
 
             # Update the primary type of all engagements (if required)
-            for engagement in mo_engagements:
-                # As there can only be one primary engagement at the time, all
-                # engagements are non_primary by default.
-                primary_type_uuid = self.primary_types["non_primary"]
-                # Only the primary engagement is marked non_primary. The actual type
-                # is simply the one provided by _decide_primary.
-                if engagement['uuid'] == primary_uuid:
-                    primary_type_uuid = self.primary_types[primary_type_key]
-
+            primary_types = self._primary_types_for(user_uuid, mo_engagements)
+            for engagement, primary_type_uuid in primary_types:
                 changed = self._ensure_primary(
                     engagement, primary_type_uuid, validity
                 )
@@ -457,6 +594,125 @@ class MOPrimaryEngagementUpdater(ABC):
         return_dict = {user_uuid: number_of_edits}
         return return_dict
 
+    def _plan_user(self, user_uuid, mo_engagements, no_past=False):
+        """Plan the primary edits of a user, from the user's engagement history.
+
+        This is the in-memory equivalent of recalculate_user, which reads the
+        engagements from MO at every cut date, and edits them one by one.
+
+        Args:
+            user_uuid: UUID of the user.
+            mo_engagements: The full engagement history of the user, as read
+                from MO with read_all=True and only_primary=True.
+            no_past: Whether the past is left out of mo_engagements.
+
+        Returns:
+            list: The edits required, as (engagement, primary_type_uuid, validity)
+                tuples, one per engagement and period between cut dates.
+        """
+        edits = []
+        for start, end in pairwise(find_cut_dates(mo_engagements)):
+            active = self._prepare_engagements(
+                user_uuid, no_past, engagements_at(start, mo_engagements)
+            )
+            # No engagements, no primary, and thus nothing to do
+            if len(active) == 0:
+                continue
+
+            validity = calculate_validity(start, end)
+            for engagement, primary_type_uuid in self._primary_types_for(
+                user_uuid, active
+            ):
+                if engagement["primary"]["uuid"] != primary_type_uuid:
+                    edits.append((engagement, primary_type_uuid, validity))
+        return edits
+
+    def plan_all(self, engagement_history, no_past=False):
+        """Plan the primary edits of all users.
+
+        Args:
+            engagement_history: Map from user UUID to the full engagement history
+                of the user, see _read_engagement_history and
+                engagement_history_from_lora_cache.
+            no_past: Whether the past is left out of engagement_history.
+
+        Returns:
+            list: The edit payloads for MO, with the edits of consecutive periods
+                of an engagement merged.
+        """
+        plan = []
+        for user_uuid, mo_engagements in tqdm(engagement_history.items()):
+            try:
+                edits = self._plan_user(user_uuid, mo_engagements, no_past=no_past)
+            except MultipleFixedPrimaries:
+                print("{} has conflicting fixed primaries".format(user_uuid))
+                continue
+            except Exception as exp:
+                print("Exception while processing {}: {}".format(user_uuid, exp))
+                continue
+            plan.extend(
+                edit_payload(engagement["uuid"], primary_type_uuid, validity)
+                for engagement, primary_type_uuid, validity in coalesce_edits(edits)
+            )
+        return plan
+
+    def _read_engagement_history(self, no_past=False, concurrency=4):
+        """Read the full engagement history of all users from MO.
+
+        Returns:
+            dict: Map from user UUID to the engagement history of the user.
+        """
+        print("Reading all users from MO...")
+        user_uuids = list(map(itemgetter("uuid"), self.helper.read_all_users()))
+        print("OK")
+
+        def read_history(user_uuid):
+            return self.helper.read_user_engagements(
+                user=user_uuid,
+                read_all=True,
+                skip_past=no_past,
+                only_primary=True,
+                use_cache=False,
+            )
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            histories = executor.map(read_history, user_uuids)
+            return dict(zip(user_uuids, tqdm(histories, total=len(user_uuids))))
+
+    def recalculate_all_bulk(self, no_past=False, engagement_history=None,
+                             concurrency=4, chunk_size=100):
+        """Recalculate all users primary engagements, in bulk.
+
+        Rather than reading the engagements of every user at every cut date, the
+        full engagement history is read once, the primaries are decided in
+        memory, and only the required edits are sent to MO, in chunks.
+
+        Args:
+            no_past: Leave out the past.
+            engagement_history: The engagement history to use, e.g. from
+                engagement_history_from_lora_cache. By default it is read from MO.
+            concurrency: Number of requests to MO in flight at a time.
+            chunk_size: Number of edits per request to MO.
+
+        Returns:
+            list: The edit plan, see plan_all.
+        """
+        if engagement_history is None:
+            engagement_history = self._read_engagement_history(
+                no_past=no_past, concurrency=concurrency
+            )
+        plan = self.plan_all(engagement_history, no_past=no_past)
+        print("Total edits: {}".format(len(plan)))
+
+        if not self.dry_run and plan:
+            writer = DetailsWriter(
+                self.helper._mo_post, chunk_size=chunk_size, concurrency=concurrency
+            )
+            failed = writer.write("details/edit", plan)
+            if failed:
+                print("{} edits were rejected by MO".format(len(failed)))
+        return plan
+
     def check_all(self):
         """Check all users for the existence of primary engagements."""
         print("Reading all users from MO...")
@@ -0,0 +1,217 @@
+import copy
+import datetime
+import random
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from hypothesis import given
+import hypothesis.strategies as st
+
+from os2mo_helpers.mora_helpers import MoraHelper
+
+from ..common import (
+    MultipleFixedPrimaries,
+    coalesce_edits,
+    edit_payload,
+    engagement_history_from_lora_cache,
+    find_cut_dates,
+)
+from .test_primary import MOPrimaryEngagementUpdaterTest, engagements_at_date
+
+PRIMARY_TYPES = [
+    None,
+    "primary_uuid",
+    "non_primary_uuid",
+    "fixed_primary_uuid",
+    "special_primary_uuid",
+]
+
+
+def synthetic_history(seed, user_uuid="user"):
+    """Random engagement history of a user, with overlapping validities."""
+    rng = random.Random(seed)
+    history = []
+    for number in range(rng.randint(0, 4)):
+        engagement_uuid = "engagement_{}".format(number)
+        year = rng.randint(2000, 2010)
+        for _ in range(rng.randint(1, 3)):
+            from_date = datetime.date(year, rng.randint(1, 12), 1)
+            year = year + rng.randint(1, 3)
+            to_date = datetime.date(year, 1, 1) - datetime.timedelta(days=1)
+            if rng.random() < 0.2:
+                to_date = None
+            primary = rng.choice(PRIMARY_TYPES)
+            history.append({
+                "uuid": engagement_uuid,
+                "primary": {"uuid": primary} if primary else None,
+                "person": {"uuid": user_uuid},
+                "validity": {
+                    "from": from_date.isoformat(),
+                    "to": to_date.isoformat() if to_date else None,
+                },
+            })
+            if to_date is None:
+                break
+    return history
+
+
+class TestBulkPlan(TestCase):
+    def setUp(self):
+        self.updater = MOPrimaryEngagementUpdaterTest({"mora.base": "mora_base_url"})
+
+    def _recalculate_user(self, history):
+        """Run the per-user path against MO mocked by history.
+
+        Returns:
+            list: The payloads posted to MO.
+        """
+        mo_mock = MagicMock()
+        mo_mock.read_user_engagement.return_value = copy.deepcopy(history)
+        self.updater.helper.find_cut_dates.side_effect = (
+            lambda uuid, no_past: MoraHelper.find_cut_dates(mo_mock, uuid, no_past)
+        )
+        mo_history = copy.deepcopy(history)
+        self.updater._read_engagement = (
+            lambda user_uuid, date: engagements_at_date(date, mo_history)
+        )
+
+        self.updater.helper._mo_post.reset_mock()
+        self.updater.helper._mo_post.return_value = SimpleNamespace(status_code=200)
+        self.updater.recalculate_user("user")
+        return [
+            mo_call.args[1] for mo_call in self.updater.helper._mo_post.call_args_list
+        ]
+
+    @given(st.integers(min_value=0, max_value=2 ** 32))
+    def test_plan_matches_recalculate_user(self, seed):
+        """The planned edits are identical to the ones made per cut date."""
+        history = synthetic_history(seed)
+        try:
+            expected = self._recalculate_user(history)
+        except MultipleFixedPrimaries:
+            with self.assertRaises(MultipleFixedPrimaries):
+                self.updater._plan_user("user", copy.deepcopy(history))
+            return
+
+        edits = self.updater._plan_user("user", copy.deepcopy(history))
+        actual = [
+            edit_payload(engagement["uuid"], primary_type_uuid, validity)
+            for engagement, primary_type_uuid, validity in edits
+        ]
+        self.assertEqual(actual, expected)
+
+    @given(st.integers(min_value=0, max_value=2 ** 32))
+    def test_plan_all_coalesces(self, seed):
+        """The plan covers the same engagement days as the per-user edits."""
+        history = {"user": synthetic_history(seed)}
+        try:
+            expected = self._recalculate_user(history["user"])
+        except MultipleFixedPrimaries:
+            self.assertEqual(self.updater.plan_all(copy.deepcopy(history)), [])
+            return
+
+        plan = self.updater.plan_all(copy.deepcopy(history))
+        self.assertLessEqual(len(plan), len(expected))
+        self.assertEqual(
+            {
+                (payload["uuid"], payload["data"]["primary"]["uuid"], date)
+                for payload in plan
+                for date in _days(payload["data"]["validity"])
+            },
+            {
+                (payload["uuid"], payload["data"]["primary"]["uuid"], date)
+                for payload in expected
+                for date in _days(payload["data"]["validity"])
+            },
+        )
+
+    def test_find_cut_dates_like_mora_helper(self):
+        history = synthetic_history(42)
+        mo_mock = MagicMock()
+        mo_mock.read_user_engagement.return_value = history
+        self.assertEqual(
+            find_cut_dates(history), MoraHelper.find_cut_dates(mo_mock, "user")
+        )
+
+    def test_recalculate_all_bulk_dry_run(self):
+        self.updater.dry_run = True
+        self.updater.helper._mo_post.reset_mock()
+        history = {"user": [{
+            "uuid": "engagement",
+            "primary": None,
+            "person": {"uuid": "user"},
+            "validity": {"from": "2020-01-01", "to": None},
+        }]}
+        plan = self.updater.recalculate_all_bulk(engagement_history=history)
+        self.assertEqual(
+            plan,
+            [edit_payload(
+                "engagement", "primary_uuid", {"from": "2020-01-01", "to": None}
+            )],
+        )
+        self.updater.helper._mo_post.assert_not_called()
+
+
+def _days(validity):
+    """The dates of a validity, with the open end cut off in 2030."""
+    date = datetime.date.fromisoformat(validity["from"])
+    end = datetime.date.fromisoformat(validity["to"] or "2030-01-01")
+    while date <= end:
+        yield date
+        date += datetime.timedelta(days=1)
+
+
+class TestCoalesceEdits(TestCase):
+    def test_different_engagements_are_kept_apart(self):
+        first = {"uuid": "e"}
+        second = {"uuid": "e"}
+        edits = [
+            (first, "p", {"from": "2020-01-01", "to": "2020-12-31"}),
+            (second, "p", {"from": "2021-01-01", "to": None}),
+        ]
+        self.assertEqual(coalesce_edits(edits), edits)
+
+    def test_different_types_are_kept_apart(self):
+        eng = {"uuid": "e"}
+        edits = [
+            (eng, "p", {"from": "2020-01-01", "to": "2020-12-31"}),
+            (eng, "n", {"from": "2021-01-01", "to": None}),
+        ]
+        self.assertEqual(coalesce_edits(edits), edits)
+
+    def test_gaps_are_kept_apart(self):
+        eng = {"uuid": "e"}
+        edits = [
+            (eng, "p", {"from": "2020-01-01", "to": "2020-06-30"}),
+            (eng, "p", {"from": "2021-01-01", "to": None}),
+        ]
+        self.assertEqual(coalesce_edits(edits), edits)
+
+
+class TestLoraCacheHistory(TestCase):
+    def test_engagement_history_from_lora_cache(self):
+        record = {
+            "uuid": "engagement", "user": "user", "unit": "unit",
+            "fraction": None, "user_key": "1", "engagement_type": "type",
+            "primary_type": None, "job_function": "job", "extensions": {},
+            "from_date": "2000-01-01", "to_date": "2001-12-31",
+        }
+        current = dict(
+            record, primary_type="primary_uuid", from_date="2002-01-01", to_date=None
+        )
+        lc_historic = SimpleNamespace(engagements={"engagement": [record, current]})
+
+        history = engagement_history_from_lora_cache(lc_historic)
+        self.assertEqual(list(history), ["user"])
+        self.assertEqual(
+            [(eng["primary"], eng["validity"]) for eng in history["user"]],
+            [
+                (None, {"from": "2000-01-01", "to": "2001-12-31"}),
+                ({"uuid": "primary_uuid"}, {"from": "2002-01-01", "to": None}),
+            ],
+        )
+        self.assertEqual(history["user"][0]["org_unit"], {"uuid": "unit"})
+
+        history = engagement_history_from_lora_cache(lc_historic, no_past=True)
+        self.assertEqual(len(history["user"]), 1)
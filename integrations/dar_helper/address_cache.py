@@ -0,0 +1,299 @@
+"""
+Shared cache of DAR address lookups.
+
+Both DAR lookups by UUID (``dar_helper.sync_dar_fetch``) and DAWA address
+searches (``dawa_helper.dawa_lookup``) go through the resolver returned by
+``get_resolver``, such that only lookups missing from the cache reach the
+network. Lookups which found nothing are cached as well, for a shorter time.
+
+The resolver is configured in settings.json:
+
+    dar.cache_file: SQLite file of the cache, default tmp/dar_cache.db.
+    dar.cache_ttl: Seconds to keep found addresses, default one week.
+    dar.missing_ttl: Seconds to keep lookups which found nothing, default
+        one day.
+    dar.fixture_file: If set, addresses are resolved from this JSON file
+        rather than from DAWA, see FixtureResolver, and only cached in memory.
+        This allows running the importers and exporters without network
+        access.
+"""
+import json
+import logging
+import pathlib
+import re
+import sqlite3
+import time
+from collections import Counter
+from functools import lru_cache
+
+import requests
+from more_itertools import chunked
+
+logger = logging.getLogger("dar_helper")
+
+DEFAULT_CACHE_FILE = "tmp/dar_cache.db"
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MISSING_TTL = 24 * 3600
+
+# SQLite limits the number of parameters in a query
+_QUERY_CHUNK_SIZE = 500
+
+
+def dar_key(addrtype, dar_uuid):
+    """Cache key of a DAR lookup by UUID.
+
+    Example:
+        >>> dar_key("adresser", "0A3F50A0-4661-32B8-E044-0003BA298018")
+        'adresser:0a3f50a0-4661-32b8-e044-0003ba298018'
+    """
+    return "{}:{}".format(addrtype, str(dar_uuid).lower())
+
+
+def search_key(street_name, postal_code, adgangsadresse=False):
+    """Cache key of a DAWA search, normalized for case and whitespace.
+
+    Example:
+        >>> search_key(" Vestergade  1A", 8000)
+        'search:adresser:8000:vestergade 1a'
+        >>> search_key("Vestergade 1A", "8000 ") == search_key("vestergade 1a", 8000)
+        True
+    """
+    street_name = re.sub(r"\s+", " ", street_name).strip().casefold()
+    addrtype = "adgangsadresser" if adgangsadresse else "adresser"
+    return "search:{}:{}:{}".format(addrtype, str(postal_code).strip(), street_name)
+
+
+class AddressCache:
+    """SQLite backed key/value store with a time to live per entry.
+
+    Values are stored as JSON. An entry with the value None records that the
+    lookup found nothing, and is kept for ``missing_ttl`` seconds rather than
+    ``ttl`` seconds.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, missing_ttl=DEFAULT_MISSING_TTL):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                expires REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """Lookup the entries of keys.
+
+        :return: Dict from key to value for the keys with an entry which has not
+            expired. The value is None for lookups which found nothing.
+        """
+        now = time.time()
+        found = {}
+        for chunk in chunked(set(keys), _QUERY_CHUNK_SIZE):
+            query = "SELECT key, value FROM entries WHERE expires > ? AND key IN ({})"
+            rows = self._conn.execute(
+                query.format(", ".join("?" * len(chunk))), [now] + chunk
+            )
+            for key, value in rows:
+                found[key] = json.loads(value) if value is not None else None
+        return found
+
+    def put_many(self, entries):
+        """Store a dict from key to value, None meaning that nothing was found."""
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+            [
+                (key, None, now + self.missing_ttl)
+                if value is None
+                else (key, json.dumps(value), now + self.ttl)
+                for key, value in entries.items()
+            ],
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class AddressResolver:
+    """Interface of the backends looking up addresses."""
+
+    def fetch_dar(self, uuids, addrtype="adresser"):
+        """Lookup DAR UUIDs.
+
+        :param uuids: List of DAR UUIDs.
+        :param addrtype: 'adresser' or 'adgangsadresser'.
+        :return: Tuple of a dict from UUID to DAR reply, and the set of UUIDs
+            which were not found.
+        """
+        raise NotImplementedError
+
+    def search(self, street_name, postal_code, adgangsadresse=False):
+        """Search for an address.
+
+        :return: List of the DAR UUIDs of the hits.
+        """
+        raise NotImplementedError
+
+
+class DAWAResolver(AddressResolver):
+    """Lookup addresses in DAWA."""
+
+    def fetch_dar(self, uuids, addrtype="adresser"):
+        # Imported here, as dar_helper looks up addresses through this module
+        from integrations.dar_helper.dar_helper import sync_dar_fetch_uncached
+
+        return sync_dar_fetch_uncached(list(uuids), addrtype=addrtype)
+
+    def search(self, street_name, postal_code, adgangsadresse=False):
+        if adgangsadresse:
+            base = "https://dawa.aws.dk/adgangsadresser?"
+        else:
+            base = "https://dawa.aws.dk/adresser?strukur=mini"
+        params = "&postnr={}&q={}"
+        response = requests.get(base + params.format(postal_code, street_name))
+        response.raise_for_status()
+        return [hit["id"] for hit in response.json()]
+
+
+class FixtureResolver(AddressResolver):
+    """Lookup addresses in a local JSON file, without network access.
+
+    The file has the DAR replies by type and UUID, and the hits of searches:
+
+        {
+            "adresser": {"<uuid>": {"id": "<uuid>", "betegnelse": ...}},
+            "adgangsadresser": {"<uuid>": {...}},
+            "search": [
+                {"street_name": "Vestergade 1A", "postal_code": "8000",
+                 "adgangsadresse": false, "hits": ["<uuid>"]}
+            ]
+        }
+
+    Anything not in the file is not found.
+    """
+
+    def __init__(self, path):
+        fixture = json.loads(pathlib.Path(path).read_text())
+        self.addresses = {
+            dar_key(addrtype, dar_uuid): reply
+            for addrtype in ("adresser", "adgangsadresser")
+            for dar_uuid, reply in fixture.get(addrtype, {}).items()
+        }
+        self.searches = {
+            search_key(
+                entry["street_name"],
+                entry["postal_code"],
+                entry.get("adgangsadresse", False),
+            ): entry["hits"]
+            for entry in fixture.get("search", [])
+        }
+
+    def fetch_dar(self, uuids, addrtype="adresser"):
+        found = {}
+        missing = set()
+        for dar_uuid in uuids:
+            reply = self.addresses.get(dar_key(addrtype, dar_uuid))
+            if reply is None:
+                missing.add(dar_uuid)
+            else:
+                found[dar_uuid] = reply
+        return found, missing
+
+    def search(self, street_name, postal_code, adgangsadresse=False):
+        return self.searches.get(
+            search_key(street_name, postal_code, adgangsadresse), []
+        )
+
+
+class CachedResolver(AddressResolver):
+    """Put an AddressCache in front of another resolver."""
+
+    def __init__(self, resolver, cache):
+        self.resolver = resolver
+        self.cache = cache
+        self.stats = Counter()
+
+    def fetch_dar(self, uuids, addrtype="adresser"):
+        keys = {dar_key(addrtype, dar_uuid): dar_uuid for dar_uuid in uuids}
+        cached = self.cache.get_many(keys)
+
+        found = {}
+        missing = set()
+        for key, reply in cached.items():
+            if reply is None:
+                missing.add(keys[key])
+            else:
+                found[keys[key]] = reply
+
+        uncached = [dar_uuid for key, dar_uuid in keys.items() if key not in cached]
+        self.stats["hit"] += len(cached)
+        self.stats["miss"] += len(uncached)
+        if uncached:
+            fetched, not_found = self.resolver.fetch_dar(uncached, addrtype)
+            entries = {dar_key(addrtype, dar_uuid): None for dar_uuid in not_found}
+            entries.update(
+                (dar_key(addrtype, dar_uuid), reply)
+                for dar_uuid, reply in fetched.items()
+            )
+            self.cache.put_many(entries)
+            found.update(fetched)
+            missing.update(not_found)
+
+        logger.info(
+            "DAR {}: {} cached, {} looked up".format(
+                addrtype, len(cached), len(uncached)
+            )
+        )
+        return found, missing
+
+    def search(self, street_name, postal_code, adgangsadresse=False):
+        key = search_key(street_name, postal_code, adgangsadresse)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            self.stats["hit"] += 1
+            return cached[key] or []
+
+        self.stats["miss"] += 1
+        hits = self.resolver.search(street_name, postal_code, adgangsadresse)
+        # Searches without hits are cached as missing
+        self.cache.put_many({key: hits or None})
+        return hits
+
+
+def _load_settings():
+    # Imported here, as ra_utils is not needed for using the classes above
+    from ra_utils.load_settings import load_settings
+
+    try:
+        return load_settings()
+    except FileNotFoundError:
+        return {}
+
+
+@lru_cache(maxsize=None)
+def get_resolver():
+    """The cached resolver configured in settings.json, see the module docs."""
+    settings = _load_settings()
+    fixture_file = settings.get("dar.fixture_file")
+    if fixture_file:
+        resolver = FixtureResolver(fixture_file)
+        # Keep the fixture lookups apart from the cached DAWA lookups
+        cache_file = ":memory:"
+    else:
+        resolver = DAWAResolver()
+        cache_file = pathlib.Path(settings.get("dar.cache_file", DEFAULT_CACHE_FILE))
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache = AddressCache(
+        cache_file,
+        ttl=settings.get("dar.cache_ttl", DEFAULT_TTL),
+        missing_ttl=settings.get("dar.missing_ttl", DEFAULT_MISSING_TTL),
+    )
+    return CachedResolver(resolver, cache)
@@ -114,6 +114,27 @@ async def dar_fetch(uuids, addrtype="adresser", chunk_size=150, client=None):
 
 
 @async_to_sync
-async def sync_dar_fetch(uuids, addrtype="adresser", chunk_size=150):
+async def sync_dar_fetch_uncached(uuids, addrtype="adresser", chunk_size=150):
     """Syncronized version of dar_fetch."""
     return await dar_fetch(uuids, addrtype, chunk_size)
+
+
+def sync_dar_fetch(uuids, addrtype="adresser"):
+    """Lookup uuids in DAR, through the shared address cache.
+
+    Only the uuids which are not in the cache are looked up in DAR, see
+    address_cache.get_resolver.
+
+    Args:
+        uuids: List of DAR UUIDs.
+        addr_type: The address type to lookup.
+
+    Returns:
+        (dict, set):
+            dict: Map from UUID to DAR reply.
+            set: Set of UUIDs of entries which were not found.
+    """
+    # Imported here, as the address cache looks up addresses with the above
+    from integrations.dar_helper.address_cache import get_resolver
+
+    return get_resolver().fetch_dar(uuids, addrtype)
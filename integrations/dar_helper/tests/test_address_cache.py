@@ -0,0 +1,105 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from integrations import dawa_helper
+from integrations.dar_helper.address_cache import (
+    AddressCache, AddressResolver, CachedResolver, FixtureResolver, search_key
+)
+
+FOUND = "0a3f50a0-4661-32b8-e044-0003ba298018"
+MISSING = "0a3f50a0-0000-0000-0000-000000000000"
+REPLY = {"id": FOUND, "betegnelse": "Vestergade 1A, 8000 Aarhus C"}
+
+
+class CountingResolver(AddressResolver):
+    """Wraps a resolver, recording the lookups which reach it."""
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.lookups = []
+
+    def fetch_dar(self, uuids, addrtype="adresser"):
+        self.lookups.append((addrtype, sorted(uuids)))
+        return self.resolver.fetch_dar(uuids, addrtype)
+
+    def search(self, street_name, postal_code, adgangsadresse=False):
+        self.lookups.append((street_name, postal_code, adgangsadresse))
+        return self.resolver.search(street_name, postal_code, adgangsadresse)
+
+
+class TestAddressCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        fixture = Path(self.tmp.name) / "dar.json"
+        fixture.write_text(json.dumps({
+            "adresser": {FOUND: REPLY},
+            "search": [
+                {"street_name": "Vestergade 1A", "postal_code": "8000",
+                 "hits": [FOUND]},
+                {"street_name": "Vestergade 1", "postal_code": "8000",
+                 "adgangsadresse": True, "hits": [FOUND, MISSING]},
+            ],
+        }))
+        self.backend = CountingResolver(FixtureResolver(fixture))
+        self.cache_file = Path(self.tmp.name) / "cache.db"
+
+    def resolver(self, **kwargs):
+        cache = AddressCache(self.cache_file, **kwargs)
+        self.addCleanup(cache.close)
+        return CachedResolver(self.backend, cache)
+
+    def test_fetch_dar(self):
+        found, missing = self.resolver().fetch_dar([FOUND, MISSING])
+        self.assertEqual(found, {FOUND: REPLY})
+        self.assertEqual(missing, {MISSING})
+
+        # Both the found and the missing address are cached, also across runs
+        self.assertEqual(self.resolver().fetch_dar([FOUND, MISSING]), (found, missing))
+        self.assertEqual(self.backend.lookups, [("adresser", sorted([FOUND, MISSING]))])
+
+        # The cache is per address type
+        self.resolver().fetch_dar([FOUND], "adgangsadresser")
+        self.assertEqual(self.backend.lookups[-1], ("adgangsadresser", [FOUND]))
+
+    def test_ttl(self):
+        # Entries expire after the ttl of the cache storing them
+        self.resolver(missing_ttl=0).fetch_dar([FOUND, MISSING])
+        self.resolver().fetch_dar([FOUND, MISSING])
+        self.assertEqual(self.backend.lookups[-1], ("adresser", [MISSING]))
+        self.resolver().fetch_dar([FOUND, MISSING])
+        self.assertEqual(len(self.backend.lookups), 2)
+
+        cache = AddressCache(":memory:", ttl=0)
+        cache.put_many({"found": {"id": FOUND}, "missing": None})
+        self.assertEqual(cache.get_many(["found", "missing"]), {"missing": None})
+
+    def test_search(self):
+        resolver = self.resolver()
+        self.assertEqual(resolver.search("Vestergade 1A", 8000), [FOUND])
+        self.assertEqual(resolver.search(" vestergade  1a", "8000"), [FOUND])
+        self.assertEqual(resolver.search("Vestergade 2", 8000), [])
+        self.assertEqual(resolver.search("Vestergade 2", 8000), [])
+        self.assertEqual(
+            self.backend.lookups,
+            [("Vestergade 1A", 8000, False), ("Vestergade 2", 8000, False)],
+        )
+
+    def test_get_many(self):
+        cache = AddressCache(":memory:")
+        keys = [search_key("Vej {}".format(number), 8000) for number in range(1200)]
+        cache.put_many({key: [str(number)] for number, key in enumerate(keys)})
+        found = cache.get_many(keys + ["unknown"])
+        self.assertEqual(len(found), 1200)
+        self.assertEqual(found[keys[10]], ["10"])
+
+    def test_dawa_lookup(self):
+        with patch("integrations.dawa_helper.get_resolver", self.resolver):
+            # Unique hit
+            self.assertEqual(dawa_helper.dawa_lookup("Vestergade 1A", "8000"), FOUND)
+            # No hits, and retried without the letter, with multiple hits
+            self.assertIsNone(dawa_helper.dawa_lookup("Vestergade 1B", "8000"))
+        self.assertEqual(self.backend.lookups[-1], ("Vestergade 1", "8000", True))
@@ -1,44 +1,21 @@
-import pickle
-import pathlib
-import requests
+from integrations.dar_helper.address_cache import get_resolver
+
 
 def _dawa_request(street_name, postal_code, adgangsadresse=False,
-                  skip_letters=False, add_letter=False):
+                  skip_letters=False):
     """
-    Heper function to perform a request to DAWA and return the json object.
+    Heper function to search DAWA, through the shared address cache.
     :param streetname: Address street name.
     :param postal_code: Postal code part of the address.
     :param adgangsadresse: If true, search for adgangsadresser.
     :param skip_letters: If true, remove letters from the house number.
-    :return: The DAWA json object as a dictionary.
+    :return: List of the DAR UUIDs of the hits.
     """
-    if adgangsadresse:
-        base = 'https://dawa.aws.dk/adgangsadresser?'
-    else:
-        base = 'https://dawa.aws.dk/adresser?strukur=mini'
-    params = '&postnr={}&q={}'
-
     last_is_letter = (street_name[-1].isalpha() and
                       (not street_name[-2].isalpha()))
     if (skip_letters and last_is_letter):
         street_name = street_name[:-1]
-    full_url = base + params.format(postal_code, street_name)
-    path_url = full_url.replace('/', '_')
-
-    cache_dir = pathlib.Path('tmp/')
-    if not cache_dir.is_dir():
-        raise Exception('Folder for temporary files does not exist')
-    
-    try:
-        with open('tmp/' + path_url + '.p', 'rb') as f:
-            response = pickle.load(f)
-    except FileNotFoundError:
-        response = requests.get(full_url)
-        with open('tmp/' + path_url + '.p', 'wb') as f:
-            pickle.dump(response, f, pickle.HIGHEST_PROTOCOL)
-
-    dar_data = response.json()
-    return dar_data
+    return get_resolver().search(street_name, postal_code, adgangsadresse)
 
 
 def dawa_lookup(street_name, postal_code):
@@ -50,24 +27,24 @@ def dawa_lookup(street_name, postal_code):
     :return: DAWA UUID for the address, or None if it is not uniquely found.
     """
     dar_uuid = None
-    dar_data = _dawa_request(street_name, postal_code)
+    hits = _dawa_request(street_name, postal_code)
 
-    if len(dar_data) == 0:
+    if len(hits) == 0:
         # Found no hits, first attempt is to remove the letter
         # from the address
-        dar_data = _dawa_request(street_name, postal_code, skip_letters=True,
-                                 adgangsadresse=True)
-        if len(dar_data) == 1:
-            dar_uuid = dar_data[0]['id']
+        hits = _dawa_request(street_name, postal_code, skip_letters=True,
+                             adgangsadresse=True)
+        if len(hits) == 1:
+            dar_uuid = hits[0]
 
-    elif len(dar_data) == 1:
-        dar_uuid = dar_data[0]['id']
+    elif len(hits) == 1:
+        dar_uuid = hits[0]
 
     else:
         # Multiple results typically means we have found an
         # adgangsadresse
-        dar_data = _dawa_request(street_name, postal_code, adgangsadresse=True)
-        if len(dar_data) == 1:
-            dar_uuid = dar_data[0]['id']
+        hits = _dawa_request(street_name, postal_code, adgangsadresse=True)
+        if len(hits) == 1:
+            dar_uuid = hits[0]
 
     return dar_uuid
@@ -13,9 +13,14 @@ from sqlalchemy.orm import sessionmaker
 
 from exporters.sql_export.lc_for_jobs_db import get_engine
 from exporters.sql_export.sql_table_defs import KLE
+from integrations.kle.opgavefordeler_fetcher import (
+    OpgavefordelerFetcher,
+    ResponseCache,
+)
 
 from ra_utils.load_settings import load_settings
 from os2mo_data_import.helpers import MoraHelper
+from os2mo_helpers.details_writer import DetailsWriter, DetailsWriteError
 LOG_FILE = 'opgavefordeler.log'
 
 logger = logging.getLogger(__name__)
@@ -124,15 +129,42 @@ class OpgavefordelerImporter(KLEAnnotationIntegration):
         self.opgavefordeler_url = self.settings.get(
             "integrations.os2opgavefordeler.url"
         )
-        self.opgavefordeler_session = self._get_opgavefordeler_session(
+        self.opgavefordeler_fetcher = self._get_opgavefordeler_fetcher(
             token=self.settings.get("integrations.os2opgavefordeler.token")
         )
         self.lc_session = get_session(get_engine())
+        self.details_writer = DetailsWriter(
+            self._post_details,
+            chunk_size=self.settings.get(
+                "integrations.os2opgavefordeler.chunk_size", 100
+            ),
+            concurrency=self.settings.get(
+                "integrations.os2opgavefordeler.write_concurrency", 4
+            ),
+        )
 
-    def _get_opgavefordeler_session(self, token) -> requests.Session:
-        s = requests.Session()
-        s.headers.update({"Authorization": "Basic {}".format(token)})
-        return s
+    def _post_details(self, endpoint: str, payloads: list) -> requests.Response:
+        url = "{}/service/{}".format(self.mora_base, endpoint)
+        return self.mora_session.post(url, json=payloads, params={"force": 1})
+
+    def _get_opgavefordeler_fetcher(self, token) -> OpgavefordelerFetcher:
+        cache = ResponseCache(
+            self.settings.get(
+                "integrations.os2opgavefordeler.cache_file",
+                "opgavefordeler_cache.db",
+            )
+        )
+        return OpgavefordelerFetcher(
+            headers={"Authorization": "Basic {}".format(token)},
+            cache=cache,
+            concurrency=self.settings.get(
+                "integrations.os2opgavefordeler.concurrency", 8
+            ),
+            retries=self.settings.get("integrations.os2opgavefordeler.retries", 3),
+            max_age=self.settings.get(
+                "integrations.os2opgavefordeler.cache_max_age", 3600
+            ),
+        )
 
     def get_kle_info_from_opgavefordeler(self, kle_numbers: list) -> list:
         """Get all KLE-number info from OS2opgavefordeler
@@ -173,16 +205,16 @@ class OpgavefordelerImporter(KLEAnnotationIntegration):
         """
         logger.info("Fetching KLE info from OS2opgavefordeler")
         url = "{}/TopicRouter/api".format(self.opgavefordeler_url)
-        s = self.opgavefordeler_session
+        responses = self.opgavefordeler_fetcher.fetch(
+            [(url, {"kle": key}) for key in kle_numbers]
+        )
 
         unit_data = []
-        for key in kle_numbers:
-            try:
-                r = s.get(url, params={"kle": key})
-                r.raise_for_status()
-                unit_data.append(r.json())
-            except requests.exceptions.HTTPError:
+        for key, (status, data) in zip(kle_numbers, responses):
+            if status >= 400:
                 logger.warning("KLE number '{}' not found".format(key))
+                continue
+            unit_data.append(data)
 
         seen_keys = set()
         filtered = []
@@ -221,16 +253,16 @@ class OpgavefordelerImporter(KLEAnnotationIntegration):
         """
         logger.info("Fetching org unit info from OS2opgavefordeler")
         url = "{}/TopicRouter/api/ou/{}"
-        s = self.opgavefordeler_session
+        responses = self.opgavefordeler_fetcher.fetch(
+            [(url.format(self.opgavefordeler_url, uuid), None)
+             for uuid in org_units_uuids]
+        )
         org_unit_info = {}
-        for uuid in org_units_uuids:
-            try:
-                r = s.get(url.format(self.opgavefordeler_url, uuid))
-                r.raise_for_status()
-                org_unit_info[uuid] = r.json()
-                logger.debug("Adding {}".format(uuid))
-            except requests.exceptions.HTTPError:
+        for uuid, (status, data) in zip(org_units_uuids, responses):
+            if status >= 400:
                 continue
+            org_unit_info[uuid] = data
+            logger.debug("Adding {}".format(uuid))
 
         def filter_empty(item):
             info = item[1]
@@ -455,31 +487,22 @@ class OpgavefordelerImporter(KLEAnnotationIntegration):
 
         return deleted, new, updated
 
-    def handle_new(self, create_payloads: list):
-        """Create KLE org functions"""
+    def handle_new(self, create_payloads: list) -> list:
+        """Create KLE org functions, returning the failed payloads"""
 
         logger.info("{} new KLE objects".format(len(create_payloads)))
-        url = "{}/service/details/create".format(self.mora_base)
-
-        r = self.mora_session.post(url, json=create_payloads, params={"force": 1})
-        r.raise_for_status()
+        return self.details_writer.write("details/create", create_payloads)
 
-    def handle_update(self, edit_payloads: list):
-        """Edit existing KLE org functions"""
+    def handle_update(self, edit_payloads: list) -> list:
+        """Edit existing KLE org functions, returning the failed payloads"""
         logger.info("{} updated KLE objects".format(len(edit_payloads)))
-        url = "{}/service/details/edit".format(self.mora_base)
+        return self.details_writer.write("details/edit", edit_payloads)
 
-        r = self.mora_session.post(url, json=edit_payloads, params={"force": 1})
-        r.raise_for_status()
-
-    def handle_delete(self, delete_payloads: list):
-        """Terminate KLE org functions"""
+    def handle_delete(self, delete_payloads: list) -> list:
+        """Terminate KLE org functions, returning the failed payloads"""
 
         logger.info("{} KLE objects to be terminated".format(len(delete_payloads)))
-        url = "{}/service/details/terminate".format(self.mora_base)
-
-        r = self.mora_session.post(url, json=delete_payloads, params={"force": 1})
-        r.raise_for_status()
+        return self.details_writer.write("details/terminate", delete_payloads)
 
     def run(self):
         logger.info("Starting import")
@@ -490,9 +513,11 @@ class OpgavefordelerImporter(KLEAnnotationIntegration):
         # Generate a diff towards OS2mo
         deleted, new, updated = self.create_diff(ansvarlig, indsigt, udfoerende)
 
-        self.handle_new(new)
-        self.handle_update(updated)
-        self.handle_delete(deleted)
+        failed = self.handle_new(new)
+        failed += self.handle_update(updated)
+        failed += self.handle_delete(deleted)
+        if failed:
+            raise DetailsWriteError(failed)
 
         logger.info("Done")
 
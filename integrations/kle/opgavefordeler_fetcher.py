@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from os2mo_helpers.retry import RetryPolicy, raise_for_status
+
+logger = logging.getLogger(__name__)
+
+
+class FetchError(Exception):
+    """Raised when requests to OS2opgavefordeler keep failing."""
+
+
+def cache_key(url, params):
+    """Key of a request in the response cache, independent of param order.
+
+    Example:
+        >>> cache_key("url", {"b": 2, "a": "1"}) == cache_key("url", {"a": 1, "b": 2})
+        True
+    """
+    params = sorted((str(key), str(value)) for key, value in (params or {}).items())
+    return json.dumps([url, params])
+
+
+class ResponseCache:
+    """SQLite backed cache of OS2opgavefordeler responses.
+
+    Every response is stored as soon as it arrives, along with its ETag and
+    Last-Modified headers, which are used to revalidate the entry later on.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                body TEXT,
+                fetched REAL NOT NULL
+            )
+            """
+        )
+
+    def get(self, key):
+        """Lookup a response.
+
+        :return: A dict with the status, etag, last_modified, body and fetched
+            time of the response, or None on cache miss.
+        """
+        row = self._conn.execute(
+            "SELECT status, etag, last_modified, body, fetched FROM responses "
+            "WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("status", "etag", "last_modified", "body", "fetched"), row))
+
+    def put(self, key, status, etag=None, last_modified=None, body=None):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, status, etag, last_modified, body, time.time()),
+        )
+        self._conn.commit()
+
+    def touch(self, key):
+        """Mark an entry as revalidated."""
+        self._conn.execute(
+            "UPDATE responses SET fetched = ? WHERE key = ?", (time.time(), key)
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class OpgavefordelerFetcher:
+    """Fetch JSON from OS2opgavefordeler concurrently.
+
+    At most `concurrency` requests are in flight at a time. Requests failing
+    with a 5xx status or a connection error are retried with exponential
+    backoff. Responses are kept in the cache; entries younger than `max_age`
+    seconds are used as they are, so a rerun after a failure resumes where the
+    previous run stopped, while older entries are revalidated with
+    If-None-Match and If-Modified-Since.
+    """
+
+    def __init__(self, headers, cache, concurrency=8, retries=3, backoff=1.0,
+                 max_age=0):
+        self.headers = headers
+        self.cache = cache
+        self.concurrency = concurrency
+        self.retry = RetryPolicy(
+            attempts=retries + 1, backoff=backoff, logger=logger
+        )
+        self.max_age = max_age
+        self.stats = Counter()
+
+    async def _get(self, client, semaphore, url, params):
+        """Fetch a single url.
+
+        :return: A tuple of the status and the decoded JSON body, which is None
+            for error responses.
+        """
+        key = cache_key(url, params)
+        cached = self.cache.get(key)
+        if cached and cached["fetched"] > time.time() - self.max_age:
+            self.stats["fresh"] += 1
+            return cached["status"], _loads(cached["body"])
+
+        headers = {}
+        if cached and cached["status"] == 200:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            return await self.retry.run(
+                self._request, client, semaphore, url, params, headers, key, cached,
+                description="GET {} {}".format(url, params),
+            )
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.error("GET {} {} failed: {!r}".format(url, params, e))
+            self.stats["failed"] += 1
+            return None, None
+
+    async def _request(self, client, semaphore, url, params, headers, key, cached):
+        async with semaphore:
+            response = await client.get(url, params=params, headers=headers)
+            async with response:
+                status = response.status
+                if status == 304:
+                    self.stats["revalidated"] += 1
+                    self.cache.touch(key)
+                    return cached["status"], _loads(cached["body"])
+                if status >= 500:
+                    await raise_for_status(response)
+                body = await response.text() if status < 400 else None
+                self.cache.put(
+                    key,
+                    status,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    body,
+                )
+                self.stats["fetched"] += 1
+                return status, _loads(body)
+
+    async def _get_all(self, client, requests):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(
+            *[self._get(client, semaphore, url, params) for url, params in requests]
+        )
+
+    async def _fetch(self, requests):
+        async with ClientSession(
+            connector=TCPConnector(limit=self.concurrency),
+            headers=self.headers,
+            timeout=ClientTimeout(total=300),
+        ) as client:
+            return await self._get_all(client, requests)
+
+    def fetch(self, requests):
+        """Fetch a list of (url, params) requests.
+
+        :return: A list of (status, JSON body) tuples, in the order of the
+            requests. The body is None for error responses.
+        :raises FetchError: If any request failed after all retries. The
+            successful responses are cached, and a rerun will not request them
+            again while they are fresh.
+        """
+        results = asyncio.run(self._fetch(requests))
+        logger.info("OS2opgavefordeler requests: {}".format(dict(self.stats)))
+        if self.stats["failed"]:
+            raise FetchError(
+                "{} requests to OS2opgavefordeler failed".format(self.stats["failed"])
+            )
+        return results
+
+
+def _loads(body):
+    return json.loads(body) if body is not None else None
@@ -0,0 +1,93 @@
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from integrations.kle.opgavefordeler_fetcher import (
+    FetchError,
+    OpgavefordelerFetcher,
+    ResponseCache,
+)
+from os2mo_helpers.testing import FakeClient, FakeResponse
+
+
+class OpgavefordelerStub:
+    """Serves KLE numbers, failing the first request for 'flaky' and every
+    request for 'broken'. Answers 304 to requests with a matching ETag.
+    """
+
+    def __init__(self):
+        self.conditional = []
+        self.client = FakeClient(
+            self.respond,
+            key=lambda method, url, params, headers: params["kle"],
+            failures={"flaky": 1, "broken": None},
+        )
+
+    def respond(self, method, url, params, headers):
+        kle = params["kle"]
+        if headers.get("If-None-Match") == '"v1"':
+            self.conditional.append(kle)
+            return FakeResponse(304)
+        if kle == "missing":
+            return FakeResponse(404, "error")
+        return FakeResponse(200, {"kle": kle}, {"ETag": '"v1"'})
+
+
+class TestOpgavefordelerFetcher(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(Path(self.tmp_dir.name) / "cache.db")
+        self.stub = OpgavefordelerStub()
+        self.client = self.stub.client
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def fetch(self, keys, max_age=0):
+        fetcher = OpgavefordelerFetcher(
+            {}, self.cache, concurrency=2, retries=1, backoff=0, max_age=max_age
+        )
+        requests = [("url", {"kle": key}) for key in keys]
+        return asyncio.run(fetcher._get_all(self.client, requests)), fetcher.stats
+
+    def test_fetch_and_retry(self):
+        results, stats = self.fetch(["1", "flaky", "missing", "broken"])
+        self.assertEqual(
+            results,
+            [(200, {"kle": "1"}), (200, {"kle": "flaky"}), (404, None), (None, None)],
+        )
+        self.assertEqual(self.client.requests["flaky"], 2)
+        self.assertEqual(self.client.requests["broken"], 2)
+        self.assertEqual(stats["failed"], 1)
+
+    def test_rerun_uses_cache(self):
+        self.fetch(["1", "2"])
+        results, stats = self.fetch(["1", "2", "3"], max_age=60)
+        self.assertEqual(results[2], (200, {"kle": "3"}))
+        self.assertEqual(stats["fresh"], 2)
+        self.assertEqual(self.client.requests, {"1": 1, "2": 1, "3": 1})
+
+    def test_revalidation(self):
+        self.fetch(["1"])
+        later = time.time() + 120
+        with patch("integrations.kle.opgavefordeler_fetcher.time.time") as now:
+            now.return_value = later
+            results, stats = self.fetch(["1"], max_age=60)
+        self.assertEqual(results, [(200, {"kle": "1"})])
+        self.assertEqual(self.stub.conditional, ["1"])
+        self.assertEqual(stats["revalidated"], 1)
+
+    def test_fetch_raises_on_failure(self):
+        fetcher = OpgavefordelerFetcher({}, self.cache, retries=0, backoff=0)
+
+        async def fake_fetch(requests):
+            return await fetcher._get_all(self.client, requests)
+
+        with patch.object(fetcher, "_fetch", fake_fetch):
+            with self.assertRaises(FetchError):
+                fetcher.fetch([("url", {"kle": "1"}), ("url", {"kle": "broken"})])
+        self.assertIsNotNone(self.cache.get('["url", [["kle", "1"]]]'))
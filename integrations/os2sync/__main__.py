@@ -7,12 +7,13 @@
 
 import collections
 import datetime
+import hashlib
 import json
 import logging
 import pathlib
 from functools import partial
 
-from integrations.os2sync import config, lcdb_os2mo, os2mo, os2sync
+from integrations.os2sync import config, lcdb_os2mo, lora_changes, os2mo, os2sync
 
 logger = None  # set in main()
 
@@ -39,7 +40,16 @@ def log_mox_counters(counter):
         logger.info("    %s: %r", k, v)
 
 
-def sync_os2sync_orgunits(settings, counter, prev_date):
+def is_unchanged(changed, uuid, hash_url):
+    """Determine if an object can be skipped, as it is unchanged in MO since
+    the previous run and it was transferred by that run.
+    """
+    if changed is None or uuid in changed:
+        return False
+    return os2sync.last_xfer(hash_url) is not None
+
+
+def sync_os2sync_orgunits(settings, counter, prev_date, uploader, changed=None):
     logger.info("sync_os2sync_orgunits starting")
 
     logger.info("sync_os2sync_orgunits getting "
@@ -58,28 +68,39 @@ def sync_os2sync_orgunits(settings, counter, prev_date):
     if len(os2mo_uuids_present):
         for uuid in set(os2mo_uuids_past - os2mo_uuids_present):
             counter["Orgenheder som slettes i OS2Sync"] += 1
-            os2sync.delete_orgunit(uuid)
+            uploader.delete_orgunit(uuid)
 
     logger.info("sync_os2sync_orgunits upserting "
                 "organisational units in os2sync")
 
     allowed_unitids = []
     for i in os2mo_uuids_present:
+        hash_url = "/orgUnit/" + i
+        if is_unchanged(changed, i, hash_url):
+            counter["Orgenheder sprunget over (uændret)"] += 1
+            if os2sync.last_xfer(hash_url) == "upsert":
+                allowed_unitids.append(i)
+            continue
+
         sts_orgunit = os2mo.get_sts_orgunit(i)
+        counter["Orgenheder opbygget"] += 1
         if sts_orgunit:
             allowed_unitids.append(i)
             counter["Orgenheder som opdateres i OS2Sync"] += 1
-            os2sync.upsert_orgunit(sts_orgunit)
+            uploader.upsert_orgunit(sts_orgunit)
         elif settings["OS2SYNC_AUTOWASH"]:
             counter["Orgenheder som slettes i OS2Sync"] += 1
-            os2sync.delete_orgunit(i)
+            uploader.delete_orgunit(i)
 
+    # Units must be in place before the users are placed in them
+    uploader.flush()
     logger.info("sync_os2sync_orgunits done")
 
     return set(allowed_unitids)
 
 
-def sync_os2sync_users(settings, allowed_unitids, counter, prev_date):
+def sync_os2sync_users(settings, allowed_unitids, counter, prev_date, uploader,
+                       changed=None):
 
     logger.info("sync_os2sync_users starting")
 
@@ -99,29 +120,60 @@ def sync_os2sync_users(settings, allowed_unitids, counter, prev_date):
     if len(os2mo_uuids_present):
         for uuid in set(os2mo_uuids_past - os2mo_uuids_present):
             counter["Medarbejdere slettes i OS2Sync (del)"] += 1
-            os2sync.delete_user(uuid)
+            uploader.delete_user(uuid)
 
     # insert/overwrite all users from os2mo
     # maybe delete if user has no more positions
     logger.info("sync_os2sync_users upserting os2sync users")
 
     for i in os2mo_uuids_present:
+        if is_unchanged(changed, i, "/user/" + i):
+            counter["Medarbejdere sprunget over (uændret)"] += 1
+            continue
+
         # medarbejdere er allerede omfattet af autowash
         # fordi de ikke får nogen 'Positions' hvis de ikke
         # har en ansættelse i en af allowed_unitids
         sts_user = os2mo.get_sts_user(i, allowed_unitids)
+        counter["Medarbejdere opbygget"] += 1
 
         if not sts_user["Positions"]:
             counter["Medarbejdere slettes i OS2Sync (pos)"] += 1
-            os2sync.delete_user(i)
+            uploader.delete_user(i)
             continue
 
-        os2sync.upsert_user(sts_user)
+        uploader.upsert_user(sts_user)
         counter["Medarbejdere overført til OS2SYNC"] += 1
 
+    uploader.flush()
     logger.info("sync_os2sync_users done")
 
 
+def fingerprint(*values):
+    return hashlib.sha224(
+        json.dumps(values, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def changed_objects(settings, prev_date):
+    """Find the users and units, which may have changed since prev_date.
+
+    Everything is considered changed if the settings have changed since the
+    previous run, or if skipping unchanged objects is disabled.
+    """
+    settings_hash = fingerprint(
+        {k: v for k, v in settings.items() if k != "OS2MO_SAML_TOKEN"}
+    )
+    previous_settings_hash = os2sync.hash_cache.get("settings")
+    os2sync.hash_cache["settings"] = settings_hash
+    if not settings["OS2SYNC_SKIP_UNCHANGED"]:
+        return None, None
+    if previous_settings_hash != settings_hash:
+        logger.info("settings changed since previous run - all changed")
+        return None, None
+    return lora_changes.changed_since(prev_date)
+
+
 def main(settings):
     # set warning-level for all loggers
     global logger
@@ -142,8 +194,13 @@ def main(settings):
     if settings["OS2SYNC_USE_LC_DB"]:
         engine = lcdb_os2mo.get_engine()
         session = lcdb_os2mo.get_session(engine)
-        os2mo.get_sts_user = partial(lcdb_os2mo.get_sts_user, session)
-        os2mo.get_sts_orgunit = partial(lcdb_os2mo.get_sts_orgunit, session)
+        if settings["OS2SYNC_LC_DB_BULK"]:
+            bulk = lcdb_os2mo.LCDBBulk(session)
+            os2mo.get_sts_user = bulk.get_sts_user
+            os2mo.get_sts_orgunit = bulk.get_sts_orgunit
+        else:
+            os2mo.get_sts_user = partial(lcdb_os2mo.get_sts_user, session)
+            os2mo.get_sts_orgunit = partial(lcdb_os2mo.get_sts_orgunit, session)
 
     prev_date = datetime.datetime.now() - datetime.timedelta(days=1)
     hash_cache_file = pathlib.Path(settings["OS2SYNC_HASH_CACHE"])
@@ -165,8 +222,22 @@ def main(settings):
         ]
     settings["OS2MO_HAS_KLE"] = os2mo.has_kle()
 
-    orgunit_uuids = sync_os2sync_orgunits(settings, counter, prev_date)
-    sync_os2sync_users(settings, orgunit_uuids, counter, prev_date)
+    changed_users, changed_units = changed_objects(settings, prev_date)
+    uploader = os2sync.AsyncUploader(counter)
+
+    orgunit_uuids = sync_os2sync_orgunits(
+        settings, counter, prev_date, uploader, changed_units
+    )
+
+    # Users depend on the set of units in the tree
+    units_hash = fingerprint(sorted(orgunit_uuids))
+    if os2sync.hash_cache.get("allowed_unitids") != units_hash:
+        changed_users = None
+    os2sync.hash_cache["allowed_unitids"] = units_hash
+
+    sync_os2sync_users(
+        settings, orgunit_uuids, counter, prev_date, uploader, changed_users
+    )
 
     if hash_cache_file:
         hash_cache_file.write_text(json.dumps(os2sync.hash_cache, indent=4))
@@ -35,12 +35,17 @@ settings = {
     "OS2SYNC_API_URL": top_settings.get("os2sync.api_url", "http://localhost:8081"),
     "OS2SYNC_XFER_CPR": top_settings.get("os2sync.xfer_cpr", False),
     "OS2SYNC_USE_LC_DB": top_settings.get("os2sync.use_lc_db", False),
+    "OS2SYNC_LC_DB_BULK": top_settings.get("os2sync.lc_db_bulk", True),
     "OS2SYNC_PHONE_SCOPE_CLASSES": top_settings.get("os2sync.phone_scope_classes", []),
     "OS2SYNC_EMAIL_SCOPE_CLASSES": top_settings.get("os2sync.email_scope_classes", []),
     "OS2SYNC_IGNORED_UNIT_LEVELS": top_settings.get("os2sync.ignored.unit_levels", []),
     "OS2SYNC_IGNORED_UNIT_TYPES": top_settings.get("os2sync.ignored.unit_types", []),
     "OS2SYNC_AUTOWASH": top_settings.get("os2sync.autowash", False),
-    "OS2SYNC_TEMPLATES": top_settings.get("os2sync.templates", {})
+    "OS2SYNC_TEMPLATES": top_settings.get("os2sync.templates", {}),
+    "OS2SYNC_CONCURRENCY": top_settings.get("os2sync.concurrency", 8),
+    "OS2SYNC_RETRIES": top_settings.get("os2sync.retries", 3),
+    "OS2SYNC_SKIP_UNCHANGED": top_settings.get("os2sync.skip_unchanged", False),
+    "OS2SYNC_MOX_BASE": top_settings.get("mox.base", "http://localhost:8080"),
 }
 
 logformat = '%(levelname)s %(asctime)s %(name)s %(message)s'
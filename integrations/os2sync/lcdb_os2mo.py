@@ -6,6 +6,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import logging
+from collections import defaultdict
 from typing import Optional
 
 from more_itertools import flatten
@@ -86,13 +87,12 @@ def to_mo_employee(employee):
         uuid=or_none(employee.uuid),
     )
 
-def get_sts_user(session, uuid, allowed_unitids):
-    employee = session.query(Bruger).filter(Bruger.uuid == uuid).one()
-
+def _sts_user(uuid, employee, ad_user_key, lc_addresses, lc_engagements,
+              allowed_unitids):
     user = User(
         dict(
             uuid=uuid,
-            candidate_user_id=try_get_ad_user_key(session, uuid),
+            candidate_user_id=ad_user_key,
             person=Person(to_mo_employee(employee), settings=settings),
         ),
         settings=settings,
@@ -101,9 +101,7 @@ def get_sts_user(session, uuid, allowed_unitids):
     sts_user = user.to_json()
 
     addresses = []
-    for lc_address in session.query(
-        Adresse
-    ).filter(Adresse.bruger_uuid == uuid).all():
+    for lc_address in lc_addresses:
         address = {
             "address_type": {
                 "uuid": lc_address.adressetype_uuid,
@@ -116,9 +114,7 @@ def get_sts_user(session, uuid, allowed_unitids):
     os2mo.addresses_to_user(sts_user, addresses)
 
     engagements = []
-    for lc_engagement in session.query(
-        Engagement
-    ).filter(Engagement.bruger_uuid == uuid).all():
+    for lc_engagement in lc_engagements:
         engagements.append({
             "uuid": lc_engagement.uuid,
             "org_unit": {"uuid": lc_engagement.enhed_uuid},
@@ -130,6 +126,18 @@ def get_sts_user(session, uuid, allowed_unitids):
     return sts_user
 
 
+def get_sts_user(session, uuid, allowed_unitids):
+    employee = session.query(Bruger).filter(Bruger.uuid == uuid).one()
+    return _sts_user(
+        uuid,
+        employee,
+        try_get_ad_user_key(session, uuid),
+        session.query(Adresse).filter(Adresse.bruger_uuid == uuid).all(),
+        session.query(Engagement).filter(Engagement.bruger_uuid == uuid).all(),
+        allowed_unitids,
+    )
+
+
 top_per_unit = {}
 
 
@@ -141,6 +149,7 @@ def get_top_unit(session, lc_enhed):
     if top_unit:
         return top_unit
     branch = [lc_enhed.uuid]
+    top_unit = lc_enhed.uuid  # a unit without parent is its own top unit
 
     # walk as far up as necessary
     while lc_enhed.forældreenhed_uuid is not None:
@@ -192,36 +201,33 @@ def is_ignored(unit, settings):
         unit.enhedsniveau_uuid in settings["OS2SYNC_IGNORED_UNIT_LEVELS"])
 
 
-def get_sts_orgunit(session, uuid):
-    base = session.query(Enhed).filter(Enhed.uuid == uuid).one()
-
+def _sts_orgunit(base, get_top, itconnections, lc_addresses, lc_kles):
     if is_ignored(base, settings):
         logger.info("Ignoring %s (%s, %s)", base.uuid, base.enhedsniveau_titel,
                     base.enhedstype_titel)
         return None
 
-    top_unit = get_top_unit(session, base)
-    if top_unit != settings["OS2MO_TOP_UNIT_UUID"]:
+    if get_top() != settings["OS2MO_TOP_UNIT_UUID"]:
         # not part of right tree
         return None
 
+    itconnections = itconnections()
+    lc_addresses = lc_addresses()
+    lc_kles = lc_kles()
+
+    uuid = base.uuid
     sts_org_unit = {"ItSystemUuids": [], "Name": base.navn, "Uuid": uuid}
 
     if base.forældreenhed_uuid is not None:
         sts_org_unit["ParentOrgUnitUuid"] = base.forældreenhed_uuid
 
-    itconnections = session.query(ItForbindelse).filter(
-        ItForbindelse.enhed_uuid == uuid
-    ).all()
     os2mo.itsystems_to_orgunit(
         sts_org_unit,
         [{"itsystem": {"uuid": itf.it_system_uuid}} for itf in itconnections]
     )
 
     addresses = []
-    for lc_address in session.query(Adresse).filter(
-        Adresse.enhed_uuid == uuid
-    ).all():
+    for lc_address in lc_addresses:
         address = {
             "address_type": {
                 "uuid": lc_address.adressetype_uuid,
@@ -235,7 +241,6 @@ def get_sts_orgunit(session, uuid):
     os2mo.addresses_to_orgunit(sts_org_unit, addresses)
 
     mokles = {}
-    lc_kles = session.query(KLE).filter(KLE.enhed_uuid == uuid).all()
     for lc_kle in lc_kles:
         mokles[lc_kle.uuid] = {
             "kle_number": {"uuid": lc_kle.kle_nummer_uuid},
@@ -244,3 +249,114 @@ def get_sts_orgunit(session, uuid):
     os2mo.strip_truncate_and_warn(sts_org_unit, sts_org_unit)
 
     return sts_org_unit
+
+
+def get_sts_orgunit(session, uuid):
+    base = session.query(Enhed).filter(Enhed.uuid == uuid).one()
+
+    # The rows are passed as functions, such that they are only queried for
+    # units which are actually transferred
+    return _sts_orgunit(
+        base,
+        lambda: get_top_unit(session, base),
+        session.query(ItForbindelse).filter(ItForbindelse.enhed_uuid == uuid).all,
+        session.query(Adresse).filter(Adresse.enhed_uuid == uuid).all,
+        session.query(KLE).filter(KLE.enhed_uuid == uuid).all,
+    )
+
+
+def top_units(parents):
+    """Find the top unit of every unit in one traversal of the tree.
+
+    Args:
+        parents: A dictionary from unit uuid to parent unit uuid (or None).
+
+    Returns:
+        A dictionary from unit uuid to the uuid of its top unit.
+
+    Example:
+        >>> top_units({"a": None, "b": "a", "c": "b", "d": None})
+        {'a': 'a', 'b': 'a', 'c': 'a', 'd': 'd'}
+    """
+    top_per_uuid = {}
+    for uuid in parents:
+        branch = []
+        while uuid not in top_per_uuid:
+            branch.append(uuid)
+            parent = parents.get(uuid)
+            if parent is None:
+                top_unit = uuid
+                break
+            uuid = parent
+        else:
+            top_unit = top_per_uuid[uuid]
+        for buuid in branch:
+            top_per_uuid[buuid] = top_unit
+    return top_per_uuid
+
+
+def _group_by(rows, attribute):
+    groups = defaultdict(list)
+    for row in rows:
+        key = getattr(row, attribute)
+        if key is not None:
+            groups[key].append(row)
+    return groups
+
+
+class LCDBBulk:
+    """Build STS payloads for all users and units from a handful of queries.
+
+    Each table is read once, and the rows are grouped by user or unit uuid in
+    memory. The payloads are built by the same code as `get_sts_user` and
+    `get_sts_orgunit` from the same rows, so the output is identical.
+    """
+
+    def __init__(self, session):
+        def all_rows(model):
+            return session.query(model).order_by(model.id).all()
+
+        self.users = {row.uuid: row for row in all_rows(Bruger)}
+        self.units = {row.uuid: row for row in all_rows(Enhed)}
+        self.top_units = top_units(
+            {uuid: unit.forældreenhed_uuid for uuid, unit in self.units.items()}
+        )
+
+        addresses = all_rows(Adresse)
+        self.user_addresses = _group_by(addresses, "bruger_uuid")
+        self.unit_addresses = _group_by(addresses, "enhed_uuid")
+        self.engagements = _group_by(all_rows(Engagement), "bruger_uuid")
+        self.unit_itconnections = _group_by(all_rows(ItForbindelse), "enhed_uuid")
+        self.kles = _group_by(all_rows(KLE), "enhed_uuid")
+
+        ad_user_names = defaultdict(list)
+        for bruger_uuid, brugernavn in (
+            session.query(ItForbindelse.bruger_uuid, ItForbindelse.brugernavn)
+            .join(ItSystem, ItForbindelse.it_system_uuid == ItSystem.uuid)
+            .filter(ItSystem.navn == AD_it_system)
+            .order_by(ItForbindelse.id)
+        ):
+            ad_user_names[bruger_uuid].append(brugernavn)
+        self.ad_user_keys = {
+            uuid: names[0] for uuid, names in ad_user_names.items()
+            if len(names) == 1
+        }
+
+    def get_sts_user(self, uuid, allowed_unitids):
+        return _sts_user(
+            uuid,
+            self.users[uuid],
+            self.ad_user_keys.get(uuid),
+            self.user_addresses.get(uuid, []),
+            self.engagements.get(uuid, []),
+            allowed_unitids,
+        )
+
+    def get_sts_orgunit(self, uuid):
+        return _sts_orgunit(
+            self.units[uuid],
+            lambda: self.top_units.get(uuid),
+            lambda: self.unit_itconnections.get(uuid, []),
+            lambda: self.unit_addresses.get(uuid, []),
+            lambda: self.kles.get(uuid, []),
+        )
@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2018, Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Find the users and units in MO which may have changed since a given date.
+
+The registrations in LoRa carry a timestamp, and everything which shows up in an
+os2sync payload is stored on either the user, the unit or an organisation
+function pointing at them. An object is considered changed if it has a
+registration since `prev_date`, or if any of its validity periods starts or ends
+between `prev_date` and today, as that changes the present state without a new
+registration.
+"""
+import datetime
+import logging
+
+import requests
+
+from integrations.os2sync import config
+
+settings = config.settings
+logger = logging.getLogger(config.loggername)
+
+PAGE_SIZE = 5000
+
+
+def lora_objects(mox_base, resource, prev_date):
+    """Read all objects of a resource, with all registrations since prev_date."""
+    params = {
+        "bvn": "%",
+        "list": 1,
+        "registreretfra": prev_date,
+        "registrerettil": "infinity",
+        "virkningfra": "-infinity",
+        "virkningtil": "infinity",
+        "maximalantalresultater": PAGE_SIZE,
+        "foersteresultat": 0,
+    }
+    while True:
+        response = requests.get(mox_base + resource, params=params)
+        response.raise_for_status()
+        results = response.json()["results"]
+        objects = results[0] if results else []
+        yield from objects
+        if len(objects) < PAGE_SIZE:
+            break
+        params["foersteresultat"] += PAGE_SIZE
+
+
+def _virkninger(registrering):
+    for section in ("attributter", "tilstande", "relationer"):
+        for entries in registrering.get(section, {}).values():
+            for entry in entries:
+                if "virkning" in entry:
+                    yield entry["virkning"]
+
+
+def has_changed(lora_object, prev_date, today):
+    """Determine if a LoRa object may have changed since prev_date.
+
+    Example:
+        >>> registrering = {
+        ...     "fratidspunkt": {"tidsstempeldatotid": "2020-01-01T10:00:00+01:00"},
+        ...     "tilstande": {"organisationenhedgyldighed": [{
+        ...         "virkning": {"from": "2019-01-01 00:00:00+01",
+        ...                      "to": "2020-02-10 00:00:00+01"}}]},
+        ... }
+        >>> lora_object = {"registreringer": [registrering]}
+        >>> has_changed(lora_object, "2020-02-01", "2020-02-05")
+        False
+        >>> has_changed(lora_object, "2020-02-01", "2020-02-10")
+        True
+        >>> has_changed(lora_object, "2019-12-31", "2020-02-05")
+        True
+    """
+    for registrering in lora_object["registreringer"]:
+        registered = registrering["fratidspunkt"]["tidsstempeldatotid"]
+        if registered[:10] >= prev_date:
+            return True
+        for virkning in _virkninger(registrering):
+            for boundary in (virkning["from"], virkning["to"]):
+                if not boundary[:1].isdigit():
+                    # -infinity / infinity
+                    continue
+                if prev_date < boundary[:10] <= today:
+                    return True
+    return False
+
+
+def _related_uuids(lora_object, relation):
+    return {
+        rel["uuid"]
+        for registrering in lora_object["registreringer"]
+        for rel in registrering.get("relationer", {}).get(relation, [])
+        if rel.get("uuid")
+    }
+
+
+def changed_since(prev_date, mox_base=None):
+    """Find users and units which may have changed since prev_date.
+
+    Args:
+        prev_date: Date of the previous transfer, formatted as YYYY-MM-DD.
+        mox_base: Base url of LoRa.
+
+    Returns:
+        A tuple of sets of changed user uuids and changed unit uuids. Either of
+        them is None if all users or all units must be considered changed.
+    """
+    mox_base = mox_base or settings["OS2SYNC_MOX_BASE"]
+    today = datetime.date.today().strftime("%Y-%m-%d")
+
+    def changed(resource):
+        return [
+            lora_object for lora_object in lora_objects(mox_base, resource, prev_date)
+            if has_changed(lora_object, prev_date, today)
+        ]
+
+    # Titles of classes and it systems show up in every payload
+    for resource in ("/klassifikation/klasse", "/organisation/itsystem"):
+        if changed(resource):
+            logger.info("changes in %s since %s - all changed", resource, prev_date)
+            return None, None
+
+    users = {lora_object["id"] for lora_object in changed("/organisation/bruger")}
+    units = {
+        lora_object["id"]
+        for lora_object in changed("/organisation/organisationenhed")
+    }
+    # A change of a unit can move units in or out of the tree below the top unit
+    if units:
+        units = None
+
+    for function in changed("/organisation/organisationfunktion"):
+        users |= _related_uuids(function, "tilknyttedebrugere")
+        if units is not None:
+            units |= _related_uuids(function, "tilknyttedeenheder")
+
+    logger.info(
+        "changed since %s: %s users, %s units",
+        prev_date, len(users), "all" if units is None else len(units)
+    )
+    return users, units
@@ -6,13 +6,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
 import hashlib
 import json
 import logging
+import ssl
 
 import requests
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
 
 from integrations.os2sync import config
+from os2mo_helpers.retry import RetryPolicy, raise_for_status
 
 
 settings = config.settings
@@ -33,13 +37,26 @@ session.headers = {
 }
 
 
-def already_xferred(url, params, method):
+def _params_hash(params, method):
     if settings["OS2SYNC_API_URL"] == "stub":
-        params_hash = params
-    else:
-        params_hash = hashlib.sha224(
-            (json.dumps(params, sort_keys=True) + method).encode("utf-8")
-        ).hexdigest()
+        return params
+    return hashlib.sha224(
+        (json.dumps(params, sort_keys=True) + method).encode("utf-8")
+    ).hexdigest()
+
+
+def last_xfer(url):
+    """Return the method of the last transfer of url, or None if unknown
+    """
+    if url not in hash_cache:
+        return None
+    if hash_cache[url] == _params_hash({}, "delete"):
+        return "delete"
+    return "upsert"
+
+
+def already_xferred(url, params, method):
+    params_hash = _params_hash(params, method)
     if hash_cache.get(url) == params_hash:
         return True
     else:
@@ -132,3 +149,112 @@ def upsert_orgunit(org_unit):
         os2sync_post("{BASE}/orgUnit/", json=org_unit)
     else:
         logger.info("upsert orgunit %s - cached", org_unit["Uuid"])
+
+
+def _ssl_context(verify):
+    if verify is True:
+        return None
+    if not verify:
+        return False
+    return ssl.create_default_context(cafile=verify)
+
+
+class AsyncUploader:
+    """Send upserts and deletes to os2sync with bounded concurrency.
+
+    Requests are queued by the upsert_* and delete_* methods, which skip
+    anything already transferred according to the hash cache, and are sent by
+    `flush`. Requests failing with a 5xx status or a connection error are
+    retried with exponential backoff. If a request still fails, its entry is
+    removed from the hash cache, so it is sent again on the next run.
+    """
+
+    def __init__(self, counter, concurrency=None, retries=None, backoff=1.0):
+        self.counter = counter
+        self.concurrency = concurrency or settings["OS2SYNC_CONCURRENCY"]
+        retries = settings["OS2SYNC_RETRIES"] if retries is None else retries
+        self.retry = RetryPolicy(
+            attempts=retries + 1, backoff=backoff, logger=logger
+        )
+        self.queue = []
+
+    def _queue(self, kind, hash_url, method, url, payload=None):
+        params = {} if method == "delete" else payload
+        if already_xferred(hash_url, params, method):
+            logger.info("%s %s %s - cached", method, kind, hash_url)
+            self.counter["%s sprunget over (hash)" % kind] += 1
+            return
+        self.queue.append((kind, hash_url, method, os2sync_url(url), payload))
+
+    def delete_user(self, uuid):
+        self._queue("Medarbejdere", "/user/" + uuid, "delete", "{BASE}/user/" + uuid)
+
+    def upsert_user(self, user):
+        self._queue("Medarbejdere", "/user/" + user["Uuid"], "upsert",
+                    "{BASE}/user", user)
+
+    def delete_orgunit(self, uuid):
+        self._queue("Orgenheder", "/orgUnit/" + uuid, "delete",
+                    "{BASE}/orgUnit/" + uuid)
+
+    def upsert_orgunit(self, org_unit):
+        self._queue("Orgenheder", "/orgUnit/" + org_unit["Uuid"], "upsert",
+                    "{BASE}/orgUnit/", org_unit)
+
+    async def _request(self, client, semaphore, method, url, payload):
+        async with semaphore:
+            if method == "delete":
+                response = await client.delete(url)
+            else:
+                response = await client.post(url, json=payload)
+            async with response:
+                if method == "delete" and response.status == 404:
+                    logger.warning("delete %r :404", url)
+                    return
+                await raise_for_status(response)
+
+    async def _send(self, client, semaphore, kind, hash_url, method, url, payload):
+        try:
+            await self.retry.run(
+                self._request, client, semaphore, method, url, payload,
+                description="%s %s" % (method, url),
+            )
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.error("%s %s failed: %r", method, url, e)
+            hash_cache.pop(hash_url, None)
+            self.counter["%s fejlet" % kind] += 1
+            return
+        logger.info("%s %s", method, url)
+        self.counter["%s sendt" % kind] += 1
+
+    async def _send_all(self, client, queue):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[
+            self._send(client, semaphore, *request) for request in queue
+        ])
+
+    async def _flush(self, queue):
+        connector = TCPConnector(
+            limit=self.concurrency, ssl=_ssl_context(settings["OS2SYNC_CA_BUNDLE"])
+        )
+        async with ClientSession(
+            connector=connector,
+            headers=session.headers,
+            timeout=ClientTimeout(total=300),
+        ) as client:
+            await self._send_all(client, queue)
+
+    def flush(self):
+        """Send all queued requests, and wait for them to complete."""
+        queue, self.queue = self.queue, []
+        if not queue:
+            return
+        if settings["OS2SYNC_API_URL"] == "stub":
+            for kind, _, method, url, payload in queue:
+                if method == "delete":
+                    session.delete(url)
+                else:
+                    session.post(url, json=payload)
+                self.counter["%s sendt" % kind] += 1
+            return
+        asyncio.run(self._flush(queue))
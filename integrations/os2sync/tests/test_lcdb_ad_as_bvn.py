@@ -1,3 +1,4 @@
+import json
 import unittest
 from unittest.mock import patch
 
@@ -6,9 +7,10 @@ from sqlalchemy.orm import sessionmaker
 from constants import AD_it_system
 from exporters.sql_export.lc_for_jobs_db import get_engine
 from exporters.sql_export.sql_table_defs import Adresse, Base, Bruger, Engagement, \
-    ItForbindelse, ItSystem, Tilknytning
-from integrations.os2sync import config
-from integrations.os2sync.lcdb_os2mo import get_sts_user, try_get_ad_user_key
+    Enhed, ItForbindelse, ItSystem, KLE, Tilknytning
+from integrations.os2sync import config, lcdb_os2mo
+from integrations.os2sync.lcdb_os2mo import LCDBBulk, get_sts_orgunit, get_sts_user, \
+    try_get_ad_user_key
 
 
 class Tests_lc_db(unittest.TestCase):
@@ -157,3 +159,56 @@ class Tests_lc_db(unittest.TestCase):
                     }
         self.assertEqual(expected, get_sts_user(self.session, 'b1', []))
 
+
+    def setup_units(self):
+        """
+        setup a small tree of units below E1, and a unit outside the tree
+        """
+        for uuid, parent in [("E1", None), ("E2", "E1"), ("E3", "E2"),
+                             ("X1", None)]:
+            self.session.add(Enhed(
+                uuid=uuid,
+                navn="navn" + uuid,
+                forældreenhed_uuid=parent,
+                enhedstype_titel="type",
+            ))
+        adresse = Adresse(
+            uuid="A3",
+            enhed_uuid="E2",
+            adressetype_scope="Telefon",
+            adressetype_bvn="Telefon",
+            adressetype_titel="Telefon",
+            værdi="87654321",
+            synlighed_titel="",
+        )
+        self.session.add(adresse)
+        kle = KLE(
+            uuid="K1",
+            enhed_uuid="E3",
+            kle_aspekt_titel="Udførende",
+            kle_nummer_uuid="KN1",
+            kle_nummer_titel="00.01",
+        )
+        self.session.add(kle)
+        self.session.commit()
+
+    @patch.dict(config.settings, {'OS2SYNC_XFER_CPR': True,
+                                  'OS2MO_TOP_UNIT_UUID': 'E1',
+                                  'OS2MO_HAS_KLE': True})
+    def test_lcdb_bulk_identical(self):
+        self.setup_wide()
+        self.setup_units()
+        bulk = LCDBBulk(self.session)
+
+        for uuid in ["E3", "E2", "E1", "X1"]:
+            lcdb_os2mo.top_per_unit.clear()
+            expected = get_sts_orgunit(self.session, uuid)
+            self.assertEqual(json.dumps(expected),
+                             json.dumps(bulk.get_sts_orgunit(uuid)))
+        self.assertIsNotNone(bulk.get_sts_orgunit("E1"))
+        self.assertIsNone(bulk.get_sts_orgunit("X1"))
+
+        for uuid in ["b1", "b2"]:
+            expected = get_sts_user(self.session, uuid, ["E2", "E3"])
+            self.assertEqual(json.dumps(expected),
+                             json.dumps(bulk.get_sts_user(uuid, ["E2", "E3"])))
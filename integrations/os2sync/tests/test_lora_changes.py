@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import patch
+
+from integrations.os2sync import lora_changes
+
+PREV_DATE = "2020-02-01"
+OLD = "2019-01-01T10:00:00+01:00"
+NEW = "2020-02-02T10:00:00+01:00"
+
+
+def lora_object(uuid, registered=OLD, virkning=None, **relations):
+    registrering = {
+        "fratidspunkt": {"tidsstempeldatotid": registered},
+        "relationer": {
+            relation: [{"uuid": related} for related in related_uuids]
+            for relation, related_uuids in relations.items()
+        },
+    }
+    if virkning:
+        registrering["tilstande"] = {
+            "gyldighed": [{"virkning": {"from": virkning[0], "to": virkning[1]}}]
+        }
+    return {"id": uuid, "registreringer": [registrering]}
+
+
+class FakeResponse:
+    def __init__(self, results):
+        self.results = results
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"results": [self.results] if self.results else []}
+
+
+class FakeLoRa:
+    """Answers paged list requests with the objects of each resource."""
+
+    def __init__(self, **resources):
+        self.resources = resources
+        self.requests = []
+
+    def get(self, url, params):
+        resource = url[len("http://mox/"):].replace("/", "_")
+        self.requests.append((resource, params["foersteresultat"]))
+        objects = self.resources.get(resource, [])
+        first = params["foersteresultat"]
+        return FakeResponse(objects[first:first + params["maximalantalresultater"]])
+
+
+class TestChangedSince(unittest.TestCase):
+    def changed_since(self, **resources):
+        self.lora = FakeLoRa(**resources)
+        with patch.object(lora_changes.requests, "get", self.lora.get):
+            return lora_changes.changed_since(PREV_DATE, mox_base="http://mox")
+
+    def test_nothing_changed(self):
+        users, units = self.changed_since(
+            organisation_bruger=[lora_object("user")],
+            organisation_organisationenhed=[lora_object("unit")],
+        )
+        self.assertEqual((users, units), (set(), set()))
+
+    def test_registrations(self):
+        users, units = self.changed_since(
+            organisation_bruger=[
+                lora_object("old"), lora_object("new", registered=NEW)
+            ],
+            organisation_organisationfunktion=[
+                lora_object("old-function", tilknyttedebrugere=["old-user"]),
+                lora_object(
+                    "function",
+                    registered=NEW,
+                    tilknyttedebrugere=["function-user"],
+                    tilknyttedeenheder=["function-unit"],
+                ),
+            ],
+        )
+        self.assertEqual(users, {"new", "function-user"})
+        self.assertEqual(units, {"function-unit"})
+
+    def test_validity_boundary(self):
+        """A validity ending since the previous run changes the present state."""
+        users, _ = self.changed_since(
+            organisation_bruger=[
+                lora_object("ended", virkning=("2000-01-01", "2020-06-01")),
+                lora_object("ended-before", virkning=("2000-01-01", "2020-01-01")),
+                lora_object("open", virkning=("2000-01-01", "infinity")),
+            ],
+        )
+        self.assertEqual(users, {"ended"})
+
+    def test_changed_unit_changes_all_units(self):
+        users, units = self.changed_since(
+            organisation_organisationenhed=[lora_object("unit", registered=NEW)],
+            organisation_organisationfunktion=[
+                lora_object(
+                    "function",
+                    registered=NEW,
+                    tilknyttedebrugere=["user"],
+                    tilknyttedeenheder=["other-unit"],
+                ),
+            ],
+        )
+        self.assertEqual(users, {"user"})
+        self.assertIsNone(units)
+
+    def test_changed_class_changes_everything(self):
+        for resource in ("klassifikation_klasse", "organisation_itsystem"):
+            with self.subTest(resource=resource):
+                changed = self.changed_since(
+                    **{resource: [lora_object("changed", registered=NEW)]}
+                )
+                self.assertEqual(changed, (None, None))
+
+    @patch.object(lora_changes, "PAGE_SIZE", 2)
+    def test_paging(self):
+        users, _ = self.changed_since(
+            organisation_bruger=[
+                lora_object(str(number), registered=NEW) for number in range(4)
+            ],
+        )
+        self.assertEqual(users, {"0", "1", "2", "3"})
+        self.assertEqual(
+            [first for resource, first in self.lora.requests
+             if resource == "organisation_bruger"],
+            [0, 2, 4],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import unittest
+from unittest.mock import patch
+
+import integrations.os2sync.__main__ as os2sync_main
+from integrations.os2sync import lora_changes, os2mo, os2sync
+from integrations.os2sync.__main__ import (
+    changed_objects,
+    is_unchanged,
+    sync_os2sync_orgunits,
+    sync_os2sync_users,
+)
+from os2mo_helpers.testing import FakeClient, FakeResponse
+
+
+def respond(method, url, json=None):
+    """Rejects 'broken', and answers deletes with 404"""
+    if method == "DELETE":
+        return FakeResponse(404)
+    if json["Uuid"] == "broken":
+        return FakeResponse(400, "error")
+    return FakeResponse(200)
+
+
+def request_key(method, url, json=None):
+    return json["Uuid"] if json else url.rsplit("/", 1)[-1]
+
+
+class TestAsyncUploader(unittest.TestCase):
+    def setUp(self):
+        self.hash_cache = patch.dict(os2sync.hash_cache, clear=True)
+        self.hash_cache.start()
+
+    def tearDown(self):
+        self.hash_cache.stop()
+
+    def flush(self, users):
+        # Fails the first two requests for 'flaky'
+        self.client = FakeClient(respond, key=request_key, failures={"flaky": 2})
+        self.counter = collections.Counter()
+        uploader = os2sync.AsyncUploader(
+            self.counter, concurrency=2, retries=2, backoff=0
+        )
+        for user in users:
+            uploader.upsert_user(user)
+        uploader.delete_user("deleted")
+        asyncio.run(uploader._send_all(self.client, uploader.queue))
+
+    def test_retry_and_failure(self):
+        users = [{"Uuid": "ok"}, {"Uuid": "flaky"}, {"Uuid": "broken"}]
+        self.flush(users)
+        self.assertEqual(
+            self.client.requests,
+            {"ok": 1, "flaky": 3, "broken": 1, "deleted": 1},
+        )
+        # 404 on delete is not an error
+        self.assertEqual(self.counter["Medarbejdere sendt"], 3)
+        self.assertEqual(self.counter["Medarbejdere fejlet"], 1)
+        # Failed requests are sent again on next run
+        self.assertEqual(
+            set(os2sync.hash_cache), {"/user/ok", "/user/flaky", "/user/deleted"}
+        )
+
+        self.flush(users)
+        self.assertEqual(self.client.requests, {"broken": 1})
+        self.assertEqual(self.counter["Medarbejdere sprunget over (hash)"], 3)
+        self.assertEqual(os2sync.last_xfer("/user/ok"), "upsert")
+        self.assertEqual(os2sync.last_xfer("/user/deleted"), "delete")
+        self.assertIsNone(os2sync.last_xfer("/user/broken"))
+
+
+class FakeUploader(os2sync.AsyncUploader):
+    """Sends the queued requests to a FakeClient."""
+
+    def __init__(self, counter, client):
+        super().__init__(counter, concurrency=2, retries=0, backoff=0)
+        self.client = client
+
+    async def _flush(self, queue):
+        await self._send_all(self.client, queue)
+
+
+class TestIsUnchanged(unittest.TestCase):
+    def setUp(self):
+        self.hash_cache = patch.dict(os2sync.hash_cache, clear=True)
+        self.hash_cache.start()
+        self.addCleanup(self.hash_cache.stop)
+        # The logger is set up by main()
+        logger = patch.object(os2sync_main, "logger", os2sync.logger)
+        logger.start()
+        self.addCleanup(logger.stop)
+
+    def test_is_unchanged(self):
+        os2sync.already_xferred("/user/sent", {"Uuid": "sent"}, "upsert")
+        # Everything is changed
+        self.assertFalse(is_unchanged(None, "sent", "/user/sent"))
+        # Changed in MO
+        self.assertFalse(is_unchanged({"sent"}, "sent", "/user/sent"))
+        # Unchanged and transferred
+        self.assertTrue(is_unchanged({"other"}, "sent", "/user/sent"))
+        # Unchanged, but not transferred by the previous run
+        self.assertFalse(is_unchanged({"other"}, "new", "/user/new"))
+
+    def test_changed_objects(self):
+        settings = {"OS2SYNC_SKIP_UNCHANGED": True, "OS2MO_SAML_TOKEN": "a"}
+        with patch.object(
+            lora_changes, "changed_since", return_value=({"user"}, {"unit"})
+        ) as changed_since:
+            # The settings are unknown on the first run
+            self.assertEqual(changed_objects(settings, "2020-01-01"), (None, None))
+            # The token is not a part of the fingerprint
+            settings["OS2MO_SAML_TOKEN"] = "b"
+            self.assertEqual(
+                changed_objects(settings, "2020-01-01"), ({"user"}, {"unit"})
+            )
+            changed_since.assert_called_once_with("2020-01-01")
+
+            settings["OS2SYNC_XFER_CPR"] = True
+            self.assertEqual(changed_objects(settings, "2020-01-01"), (None, None))
+            settings["OS2SYNC_SKIP_UNCHANGED"] = False
+            self.assertEqual(changed_objects(settings, "2020-01-01"), (None, None))
+            changed_since.assert_called_once()
+
+
+class TestSync(unittest.TestCase):
+    settings = {"OS2SYNC_AUTOWASH": True}
+
+    def setUp(self):
+        self.hash_cache = patch.dict(os2sync.hash_cache, clear=True)
+        self.hash_cache.start()
+        self.addCleanup(self.hash_cache.stop)
+        # The logger is set up by main()
+        logger = patch.object(os2sync_main, "logger", os2sync.logger)
+        logger.start()
+        self.addCleanup(logger.stop)
+        self.built = []
+
+    def sync(self, function, *args, **kwargs):
+        self.client = FakeClient(respond, key=request_key)
+        self.counter = collections.Counter()
+        uploader = FakeUploader(self.counter, self.client)
+        return function(self.settings, *args, self.counter, "2020-01-01",
+                        uploader, **kwargs)
+
+    def get_sts_orgunit(self, uuid):
+        self.built.append(uuid)
+        # The unit 'deleted' is not in the tree
+        return None if uuid == "deleted" else {"Uuid": uuid}
+
+    def get_sts_user(self, uuid, allowed_unitids):
+        self.built.append(uuid)
+        return {"Uuid": uuid, "Positions": sorted(allowed_unitids)}
+
+    @patch.object(os2mo, "org_unit_uuids", lambda at=None: ["a", "deleted", "b"])
+    def test_skip_unchanged_units(self):
+        with patch.object(os2mo, "get_sts_orgunit", self.get_sts_orgunit):
+            allowed = self.sync(sync_os2sync_orgunits)
+            self.assertEqual(allowed, {"a", "b"})
+            self.assertEqual(self.client.requests, {"a": 1, "deleted": 1, "b": 1})
+            self.assertEqual(os2sync.last_xfer("/orgUnit/a"), "upsert")
+            self.assertEqual(os2sync.last_xfer("/orgUnit/deleted"), "delete")
+
+            # Only the changed unit is built, and only a new payload is sent
+            self.built = []
+            allowed = self.sync(sync_os2sync_orgunits, changed={"b"})
+            self.assertEqual(self.built, ["b"])
+            self.assertEqual(self.client.requests, {})
+            self.assertEqual(self.counter["Orgenheder sprunget over (uændret)"], 2)
+            self.assertEqual(self.counter["Orgenheder sprunget over (hash)"], 1)
+            # Units last deleted stay out of the tree
+            self.assertEqual(allowed, {"a", "b"})
+
+    @patch.object(os2mo, "user_uuids", lambda at=None: ["ok", "broken", "other"])
+    def test_failed_upload(self):
+        with patch.object(os2mo, "get_sts_user", self.get_sts_user):
+            # The failing user does not stop the others
+            self.sync(sync_os2sync_users, {"unit"})
+            self.assertEqual(self.client.requests, {"ok": 1, "broken": 1, "other": 1})
+            self.assertEqual(self.counter["Medarbejdere sendt"], 2)
+            self.assertEqual(self.counter["Medarbejdere fejlet"], 1)
+            self.assertIsNone(os2sync.last_xfer("/user/broken"))
+
+            # The failed user is built and sent again, though unchanged
+            self.built = []
+            self.sync(sync_os2sync_users, {"unit"}, changed=set())
+            self.assertEqual(self.built, ["broken"])
+            self.assertEqual(self.client.requests, {"broken": 1})
+            self.assertEqual(self.counter["Medarbejdere sprunget over (uændret)"], 2)
@@ -30,10 +30,24 @@ Then, you should be able to autocomplete subcommand names like this::
       sd_fixup.fixup_user  sd_importer.full_import  sd_importer.import_user
 
 Option names should also be autocompleted.
+
+Command index
+=============
+
+To avoid importing every DIPEX tool on startup, the commands found in each
+Python file are kept in ``.metacli_index.json`` next to this script. A file is
+only read and imported again once it is changed, and the module of a command is
+only imported when the command is run. Listing the commands, ``--help`` and
+autocompletion are served from the index alone.
+
+Modules which fail to import are not kept in the index, so they are imported
+again on every run, and their commands show up as soon as the missing
+dependencies are installed.
 """
 
 import importlib
 import inspect
+import json
 import logging
 import os
 import sys
@@ -47,8 +61,133 @@ from ra_utils.apply import apply
 
 ROOT_FOLDER = os.path.abspath(os.path.dirname(__file__))
 
+# Cache of the commands found in each Python file, keyed by the file path and
+# invalidated by the modification time and size of the file.
+INDEX_FILE = os.path.join(ROOT_FOLDER, '.metacli_index.json')
+INDEX_VERSION = 1
+
 logger = logging.getLogger(__name__)
 
+
+class LazyCommand(click.Command):
+    """
+    Stand-in for a Click command described by the command index. The module
+    defining the command is only imported once the command is run, so help
+    texts and completion of subcommand and option names are served without
+    importing anything.
+    """
+
+    def __init__(self, name: str, modpath: str, funcname: str, info: dict):
+        super().__init__(
+            name,
+            help=info['help'],
+            short_help=info['short_help'],
+            params=[_option_from_index(option) for option in info['options']],
+        )
+        self.modpath = modpath
+        self.funcname = funcname
+        self._command = None
+
+    def load(self) -> click.Command:
+        if self._command is None:
+            module = importlib.import_module(self.modpath)
+            self._command = getattr(module, self.funcname)
+            self._command.name = self.name  # set name for autocomplete
+        return self._command
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        if extra.get('resilient_parsing'):
+            # Shell completion, the options from the index will do
+            return super().make_context(info_name, args, parent=parent, **extra)
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+    def invoke(self, ctx: click.Context):
+        return self.load().invoke(ctx)
+
+
+def _option_from_index(option: dict) -> click.Option:
+    decls = list(option['opts'])
+    if option['secondary_opts']:
+        decls[-1] = '%s/%s' % (decls[-1], option['secondary_opts'][0])
+    return click.Option(
+        decls, is_flag=option['is_flag'], multiple=option['multiple'],
+        nargs=option['nargs'],
+    )
+
+
+def _command_info(cmd: click.Command) -> dict:
+    return {
+        'help': cmd.help,
+        'short_help': cmd.short_help,
+        'options': [
+            {
+                'opts': param.opts,
+                'secondary_opts': param.secondary_opts,
+                'is_flag': param.is_flag,
+                'multiple': param.multiple,
+                'nargs': param.nargs,
+            }
+            for param in cmd.params
+            # Option groups add an option without any names
+            if isinstance(param, click.Option) and param.opts
+        ],
+    }
+
+
+class CommandIndex:
+    """
+    The Click commands of each Python file in the repository. Files are only
+    read, and modules only imported, when they are not in the index or have
+    changed since the index was written. Entries of modules which failed to
+    import are never stored, as the failure may depend on the environment
+    rather than the file.
+    """
+
+    def __init__(self, path: str = INDEX_FILE):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path) as index_file:
+                index = json.load(index_file)
+            if index.get('version') == INDEX_VERSION:
+                self.entries = index['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            with open(self.path, 'w') as index_file:
+                json.dump({'version': INDEX_VERSION, 'files': self.entries},
+                          index_file)
+        except OSError as e:
+            logger.warning('failed to write command index %s (%r)', self.path, e)
+        self.changed = False
+
+    def get(self, path: str, get_entry: Callable[[], dict]) -> dict:
+        stat = os.stat(path)
+        signature = [stat.st_mtime_ns, stat.st_size]
+        entry = self.entries.get(path)
+        # Failed entries may be left by older versions of metacli
+        if entry is None or entry['signature'] != signature or 'error' in entry:
+            entry = get_entry()
+            if 'error' in entry:
+                if self.entries.pop(path, None) is not None:
+                    self.changed = True
+                return entry
+            entry['signature'] = signature
+            self.entries[path] = entry
+            self.changed = True
+        return entry
+
+    def prune(self, paths: List[str]):
+        for path in set(self.entries) - set(paths):
+            del self.entries[path]
+            self.changed = True
+
+
 class MetaCLI(click.MultiCommand):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -82,6 +221,12 @@ class MetaCLI(click.MultiCommand):
         else:
             ctx._command_map = {}
 
+        def walk(top):
+            for root, dirs, files in os.walk(top):
+                # Do not descend into virtualenvs
+                dirs[:] = [name for name in dirs if 'venv' not in name]
+                yield root, dirs, files
+
         def gen_root_and_file(it):
             for root, files in it:
                 for name in files:
@@ -100,7 +245,7 @@ class MetaCLI(click.MultiCommand):
             return filename.endswith('.py')
 
         # Generator of tuples of root and list of filenames
-        root_and_files = map(itemgetter(0, 2), os.walk(ROOT_FOLDER))
+        root_and_files = map(itemgetter(0, 2), walk(ROOT_FOLDER))
 
         # Generator of tuples of root and filename
         root_and_file = gen_root_and_file(root_and_files)
@@ -109,15 +254,27 @@ class MetaCLI(click.MultiCommand):
         root_and_file = filter(skip_virtualenv, root_and_file)
         root_and_file = filter(skip_ourselves, root_and_file)
         root_and_file = filter(skip_non_python, root_and_file)
-
-        # At this point, we only have Python files outside of the virtualenv
-        modules = map(apply(self._get_module_path), root_and_file)
-        modules = filter(None.__ne__, modules)
+        root_and_file = list(root_and_file)
+
+        # Look up the commands of each file in the index, updating it for
+        # new and changed files.
+        index = CommandIndex(INDEX_FILE)
+        paths = [os.path.join(root, name) for root, name in root_and_file]
+        entries = [
+            index.get(path, lambda: self._get_module_entry(root, name))
+            for path, (root, name) in zip(paths, root_and_file)
+        ]
+        index.prune(paths)
+        index.save()
 
         # Add one or more Click commands from each matching Python module to
         # the command map.
-        for modname, modpath in modules:
-            self._add_module_commands(ctx._command_map, modname, modpath)
+        for entry in entries:
+            if 'error' in entry:
+                logger.error('failed to import %s (exception: %s)',
+                             entry['modpath'], entry['error'])
+            elif entry['commands']:
+                self._add_module_commands(ctx._command_map, entry)
 
         return ctx._command_map
 
@@ -135,13 +292,28 @@ class MetaCLI(click.MultiCommand):
             modpath = f'{pypath}.{modname}'
             return modname, modpath
 
+    def _get_module_entry(self, root: str, name: str) -> dict:
+        module = self._get_module_path(root, name)
+        if module is None:
+            return {'commands': []}
+        modname, modpath = module
+        entry = {'modname': modname, 'modpath': modpath, 'commands': []}
+        try:
+            cmds = self._get_module_commands(modpath)
+        except Exception as e:
+            entry['error'] = repr(e)
+        else:
+            entry['commands'] = [
+                [funcname, _command_info(cmd)] for funcname, cmd in cmds
+            ]
+        return entry
+
     def _add_module_commands(
         self,
         command_map: Dict[str, click.Command],
-        modname: str,
-        modpath: str,
+        entry: dict,
     ):
-        cmds = self._get_module_commands(modpath)
+        modname, modpath, cmds = entry['modname'], entry['modpath'], entry['commands']
         if len(cmds) == 1:
             # There is exactly one command in the module.
             # Use the module name as subcommand name.
@@ -151,17 +323,15 @@ class MetaCLI(click.MultiCommand):
                 # Construct a new name by appending `.1`, etc.
                 cmdname = '%s.%d' % (modname, self._counter)
                 self._counter += 1
-            cmd = cmds[0][1]
-            cmd.name = cmdname  # set name for autocomplete
-            command_map[cmdname] = cmd
+            funcname, info = cmds[0]
+            command_map[cmdname] = LazyCommand(cmdname, modpath, funcname, info)
         else:
             # There are multiple commands in the module.
             # Command 'fixup_all' in 'sd_fixup' module is made available as
             # subcommand 'sd_fixup.fixup_all', etc.
-            for funcname, cmd in cmds:
+            for funcname, info in cmds:
                 cmdname = '%s.%s' % (modname, funcname)
-                cmd.name = cmdname  # set name for autocomplete
-                command_map[cmdname] = cmd
+                command_map[cmdname] = LazyCommand(cmdname, modpath, funcname, info)
 
     def _get_module_commands(self, modpath: str) -> List[Tuple[str, click.Command]]:
         @apply
@@ -171,13 +341,8 @@ class MetaCLI(click.MultiCommand):
                 and not isinstance(member, click.Group)
             )
 
-        try:
-            module = importlib.import_module(modpath)
-        except Exception as e:
-            logger.error('failed to import %s (exception: %r)', modpath, e)
-            return []
-        else:
-            return list(filter(is_click_command, inspect.getmembers(module)))
+        module = importlib.import_module(modpath)
+        return list(filter(is_click_command, inspect.getmembers(module)))
 
     def _add_to_sys_path(self):
         # TODO: This should not be necessary, but currently DIPEX code in some
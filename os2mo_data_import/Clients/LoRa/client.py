@@ -1,18 +1,17 @@
 import asyncio
 import logging
-from asyncio import Semaphore, as_completed, gather, run, sleep
+from asyncio import run, sleep
 from contextlib import asynccontextmanager
-from itertools import groupby, starmap
+from itertools import starmap
 from pprint import pprint
-from typing import Callable, Coroutine, Iterable, List, Optional, Tuple, Type
+from typing import Callable, Iterable, Optional, Type
 from uuid import UUID
 
 from aiohttp import ClientSession, TCPConnector
-from more_itertools import chunked
-from tqdm import tqdm
 
 from os2mo_data_import.Clients.LoRa.model import Facet, Klasse, Organisation
 from os2mo_data_import.Clients.LoRa.model_parts.interface import LoraObj
+from os2mo_data_import.Clients.pipeline import Journal, SubmissionPipeline
 from os2mo_data_import.Clients.util import uuid_to_str
 
 
@@ -28,11 +27,15 @@ class Client:
         session_factory: Callable[[], ClientSession] = lambda: ClientSession(
             connector=TCPConnector(limit=20)
         ),
-        chunk_size: int = 100,
+        concurrency: int = 20,
+        attempts: int = 5,
+        journal_path: Optional[str] = None,
         base_mox_url="http://localhost:8080",
     ):
         # connection logic
-        self.__chunk_size = chunk_size
+        self.__concurrency = concurrency
+        self.__attempts = attempts
+        self.__journal_path = journal_path
         self.__session_factory = session_factory
         self.__base_mox_url = base_mox_url
         self.__session: Optional[ClientSession] = None
@@ -120,67 +123,30 @@ class Client:
             ) as response:
                 response.raise_for_status()
 
-    async def __post_to_mox(
-        self, current_type: Type[LoraObj], data: Iterable[LoraObj]
-    ):
-        """
-        wrapper allows passing list of mox objs, for individual posting
-        :param current_type:
-        :param data:
-        :return:
-        """
-        await gather(
-            *map(
-                lambda obj: self.__post_single_to_mox(
-                    current_type=current_type, obj=obj
-                ),
-                data,
-            )
-        )
-
-    async def __submit(self, data: Iterable[LoraObj]):
-        """
-        maps the object appropriately to either MO or LoRa
-
-        :param data: An iterable of objects of the *same* type!
-        :return:
-        """
-
-        data = list(data)
-        current_type = type(data[0])
-
-        assert all([isinstance(obj, current_type) for obj in data])
-
-        if current_type in self.__mox_path_map:
-            await self.__post_to_mox(current_type, data)
-            return
-
-        raise TypeError(f"unknown type: {current_type}")
+    async def __send(self, obj: LoraObj):
+        current_type = type(obj)
+        if current_type not in self.__mox_path_map:
+            raise TypeError(f"unknown type: {current_type}")
+        await self.__post_single_to_mox(current_type=current_type, obj=obj)
 
     async def __submit_payloads(
         self, objs: Iterable[LoraObj], disable_progressbar=False
     ):
-        objs = list(objs)
-        groups = groupby(objs, lambda x: type(x).__name__)
-        chunked_groups: List[Tuple[str, Iterable[List[LoraObj]]]] = [
-            (type_name, list(chunked(objs, self.__chunk_size)))
-            for type_name, objs in groups
-        ]
-        chunked_tasks: List[Tuple[str, List[Coroutine]]] = [
-            (type_name, list(map(self.__submit, chunks)))
-            for type_name, chunks in chunked_groups
-        ]
-        if not chunked_tasks or all([not tasks for _, tasks in chunked_tasks]):
-            return
-        for key, tasks in chunked_tasks:
-            for f in tqdm(
-                as_completed(tasks),
-                total=len(tasks),
-                unit=f"chunk",
-                desc=key,
-                disable=disable_progressbar,
-            ):
-                await f
+        await self.__verify_session()
+        journal = None
+        if self.__journal_path is not None:
+            journal = Journal(self.__journal_path)
+        pipeline = SubmissionPipeline(
+            self.__send,
+            concurrency=self.__concurrency,
+            attempts=self.__attempts,
+            journal=journal,
+        )
+        try:
+            await pipeline.submit(objs, disable_progressbar=disable_progressbar)
+        finally:
+            if journal is not None:
+                journal.close()
 
 
 if __name__ == "__main__":
@@ -1,13 +1,11 @@
 import asyncio
-from asyncio import as_completed, gather, run, sleep
+from asyncio import run, sleep
 from contextlib import asynccontextmanager
-from itertools import groupby, starmap
-from typing import Callable, Coroutine, Iterable, List, Optional, Tuple, Type
+from itertools import starmap
+from typing import Callable, Iterable, Optional, Type
 from uuid import UUID
 
 from aiohttp import ClientSession, TCPConnector
-from more_itertools import chunked
-from tqdm import tqdm
 
 from os2mo_data_import.Clients.MO.model import (
     Address,
@@ -18,6 +16,7 @@ from os2mo_data_import.Clients.MO.model import (
     OrgUnit,
 )
 from os2mo_data_import.Clients.MO.model_parts.interface import MoObj
+from os2mo_data_import.Clients.pipeline import Journal, SubmissionPipeline
 from os2mo_data_import.Clients.util import uuid_to_str
 
 
@@ -36,11 +35,15 @@ class Client:
         session_factory: Callable[[], ClientSession] = lambda: ClientSession(
             connector=TCPConnector(limit=20)
         ),
-        chunk_size: int = 100,
+        concurrency: int = 20,
+        attempts: int = 5,
+        journal_path: Optional[str] = None,
         base_url="http://localhost:5000",
     ):
         # connection logic
-        self.__chunk_size = chunk_size
+        self.__concurrency = concurrency
+        self.__attempts = attempts
+        self.__journal_path = journal_path
         self.__session_factory = session_factory
         self.__base_url = base_url
         self.__session: Optional[ClientSession] = None
@@ -106,58 +109,30 @@ class Client:
         ) as response:
             response.raise_for_status()
 
-    async def __post_to_mo(self, current_type: Type[MoObj], data: Iterable[MoObj]):
-        await self.__verify_session()
-        await gather(
-            *[
-                self.__post_single_to_mo(current_type=current_type, obj=obj)
-                for obj in data
-            ]
-        )
-
-    async def __submit(self, data: Iterable[MoObj]):
-        """
-        maps the object appropriately to either MO or LoRa
-
-        :param data: An iterable of objects of the *same* type!
-        :return:
-        """
-
-        data = list(data)
-        current_type = type(data[0])
-
-        assert all([isinstance(obj, current_type) for obj in data])
-
-        if current_type in self.__mo_path_map:
-            await self.__post_to_mo(current_type, data)
-            return
-
-        raise TypeError(f"unknown type: {current_type}")
+    async def __send(self, obj: MoObj):
+        current_type = type(obj)
+        if current_type not in self.__mo_path_map:
+            raise TypeError(f"unknown type: {current_type}")
+        await self.__post_single_to_mo(current_type=current_type, obj=obj)
 
     async def __submit_payloads(
         self, objs: Iterable[MoObj], disable_progressbar=False
     ):
-        objs = list(objs)
-        groups = groupby(objs, lambda x: type(x).__name__)
-        chunked_groups: List[Tuple[str, Iterable[List[MoObj]]]] = [
-            (type_name, list(chunked(objs, self.__chunk_size)))
-            for type_name, objs in groups
-        ]
-        chunked_tasks: List[Tuple[str, List[Coroutine]]] = [
-            (type_name, list(map(self.__submit, chunks)))
-            for type_name, chunks in chunked_groups
-        ]
-        if not chunked_tasks or all([not tasks for _, tasks in chunked_tasks]):
-            return
-        for key, tasks in chunked_tasks:
-            for f in tqdm(
-                as_completed(tasks),
-                total=len(tasks),
-                unit=f"chunk",
-                desc=key,
-                disable=disable_progressbar,
-            ):
-                await f
+        await self.__verify_session()
+        journal = None
+        if self.__journal_path is not None:
+            journal = Journal(self.__journal_path)
+        pipeline = SubmissionPipeline(
+            self.__send,
+            concurrency=self.__concurrency,
+            attempts=self.__attempts,
+            journal=journal,
+        )
+        try:
+            await pipeline.submit(objs, disable_progressbar=disable_progressbar)
+        finally:
+            if journal is not None:
+                journal.close()
 
 
 if __name__ == "__main__":
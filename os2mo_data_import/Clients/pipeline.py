@@ -0,0 +1,102 @@
+"""
+Streaming submission of objects to MO and LoRa.
+
+The objects are pulled lazily from the input iterable, with at most
+``concurrency`` requests in flight at a time. Requests failing with a 5xx
+status, a connection error or a timeout are retried with jittered exponential
+backoff, while other errors fail the object right away. Objects without a UUID
+are never retried, as a create which failed that way may still have been
+written, and a retry would create a duplicate.
+
+Objects are submitted in runs of the same type, and a run is completed before
+the next one is started, as e.g. engagements may refer to the employees before
+them. If any object of a run fails, the submission stops after the run and a
+``SubmissionError`` listing the failed objects is raised.
+
+The UUIDs of the objects which were submitted successfully can be recorded in a
+``Journal``, such that a crashed import can be started over, skipping the
+objects which already landed. Objects without a UUID are submitted every time.
+"""
+import logging
+from itertools import groupby
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from os2mo_data_import.os2mo_helpers.retry import RetryPolicy
+from os2mo_data_import.os2mo_helpers.submission import Journal, submit_all
+
+logger = logging.getLogger("clients")
+
+
+class SubmissionError(Exception):
+    """Raised when some objects could not be submitted."""
+
+    def __init__(self, failed: List[Tuple[Any, str]]):
+        self.failed = failed
+        super().__init__(f"{len(failed)} objects could not be submitted")
+
+
+class SubmissionPipeline:
+    """Submit objects with bounded concurrency, retries and a journal.
+
+    :param send: Coroutine function submitting a single object, raising on
+        failure, e.g. an aiohttp request followed by ``raise_for_status``.
+    :param concurrency: Number of requests in flight at a time.
+    :param attempts: Number of attempts for transient errors, for objects with
+        a UUID.
+    :param backoff: Delay in seconds before the first retry, doubled for every
+        following retry.
+    :param max_backoff: Upper bound of the delay in seconds.
+    :param journal: Journal of the submitted objects, or None.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Any], Awaitable[None]],
+        concurrency: int = 20,
+        attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        journal: Optional[Journal] = None,
+    ):
+        self.__send = send
+        self.__concurrency = concurrency
+        # Full jitter, spreading out the retries of concurrent requests
+        self.__retry = RetryPolicy(
+            attempts=attempts,
+            backoff=backoff,
+            max_backoff=max_backoff,
+            jitter=True,
+            logger=logger,
+        )
+        self.__journal = journal
+
+    async def __send_with_retries(self, obj):
+        uuid = obj.get_uuid()
+        if uuid is None:
+            # Creating the object again could duplicate it
+            await self.__send(obj)
+            return
+        await self.__retry.run(
+            self.__send, obj, description=f"{type(obj).__name__} {uuid}"
+        )
+
+    async def submit(self, objs: Iterable, disable_progressbar: bool = False):
+        """Submit all objects.
+
+        :param objs: Iterable of objects, pulled lazily.
+        :param disable_progressbar: Do not show progress.
+        :raises SubmissionError: If some objects could not be submitted.
+        """
+        for type_name, group in groupby(objs, lambda obj: type(obj).__name__):
+            failed = await submit_all(
+                group,
+                self.__send_with_retries,
+                self.__concurrency,
+                journal=self.__journal,
+                get_uuid=lambda obj: obj.get_uuid(),
+                description=type_name,
+                disable_progressbar=disable_progressbar,
+                logger=logger,
+            )
+            if failed:
+                raise SubmissionError(failed)
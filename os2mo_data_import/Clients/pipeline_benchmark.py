@@ -0,0 +1,132 @@
+"""
+Benchmark of the submission of the MO client against a local stub server.
+
+The stub server accepts every request after a fixed latency, failing a share
+of them with a 503. The streaming submission of ``Client.load_mo_objs`` is
+compared with the previous approach, which read all objects into memory and
+gathered a request for each of them at once, without retries.
+
+    python -m os2mo_data_import.Clients.pipeline_benchmark --count 20000
+"""
+import asyncio
+import logging
+import random
+import time
+import tracemalloc
+from itertools import groupby
+from uuid import UUID
+
+import click
+from aiohttp import ClientSession, TCPConnector, web
+from more_itertools import chunked
+
+from os2mo_data_import.Clients.MO.client import Client
+from os2mo_data_import.Clients.MO.model import Employee
+from os2mo_data_import.Clients.util import uuid_to_str
+
+
+def stub_app(latency, failure_rate, seed):
+    rng = random.Random(seed)
+    counts = {"requests": 0, "failures": 0}
+
+    async def version(request):
+        return web.json_response({"mo_version": "stub"})
+
+    async def create(request):
+        await request.json()
+        await asyncio.sleep(latency)
+        counts["requests"] += 1
+        if rng.random() < failure_rate:
+            counts["failures"] += 1
+            raise web.HTTPServiceUnavailable()
+        return web.json_response("ok")
+
+    app = web.Application()
+    app.router.add_get("/version/", version)
+    app.router.add_post("/service/e/create", create)
+    app["counts"] = counts
+    return app
+
+
+def employees(count):
+    for number in range(count):
+        yield Employee(
+            uuid=UUID(int=number + 1), name="Medarbejder {}".format(number)
+        )
+
+
+async def eager_submit(base_url, objs, chunk_size=100):
+    """The submission before the pipeline, kept for comparison."""
+    async with ClientSession(connector=TCPConnector(limit=20)) as session:
+
+        async def post(obj):
+            async with session.post(
+                base_url + "/service/e/create",
+                json=uuid_to_str(obj.dict(by_alias=True)),
+            ) as response:
+                response.raise_for_status()
+
+        objs = list(objs)
+        for _, group in groupby(objs, lambda obj: type(obj).__name__):
+            chunks = list(chunked(group, chunk_size))
+            await asyncio.gather(
+                *[asyncio.gather(*map(post, chunk)) for chunk in chunks]
+            )
+
+
+async def streaming_submit(base_url, objs):
+    client = Client(base_url=base_url)
+    async with client.context():
+        await client.load_mo_objs(objs, disable_progressbar=True)
+
+
+async def run(method, count, latency, failure_rate, port):
+    app = stub_app(latency, failure_rate, seed=0)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    base_url = "http://127.0.0.1:{}".format(port)
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        error = None
+        try:
+            await method(base_url, employees(count))
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        await runner.cleanup()
+    return elapsed, peak, app["counts"], error
+
+
+@click.command()
+@click.option("--count", type=int, default=5000, help="Number of objects")
+@click.option("--latency", type=float, default=0.005, help="Seconds per request")
+@click.option("--failure-rate", type=float, default=0.0, help="Share of 503s")
+@click.option("--port", type=int, default=8765)
+def benchmark(count, latency, failure_rate, port):
+    logging.getLogger("clients").setLevel(logging.ERROR)
+    for name, method in [("eager", eager_submit), ("streaming", streaming_submit)]:
+        elapsed, peak, counts, error = asyncio.run(
+            run(method, count, latency, failure_rate, port)
+        )
+        click.echo(
+            "{:10} {:7.2f}s {:8.0f} obj/s {:7.1f} MiB peak, "
+            "{} requests, {} failed{}".format(
+                name,
+                elapsed,
+                count / elapsed,
+                peak / 2 ** 20,
+                counts["requests"],
+                counts["failures"],
+                ", aborted: {!r}".format(error) if error else "",
+            )
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,138 @@
+import asyncio
+import tempfile
+import unittest
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiohttp import ClientConnectionError, ClientResponseError, RequestInfo
+from yarl import URL
+
+from os2mo_data_import.Clients.pipeline import (
+    Journal,
+    SubmissionError,
+    SubmissionPipeline,
+)
+
+
+@dataclass(frozen=True)
+class Unit:
+    uuid: str
+
+    def get_uuid(self):
+        return self.uuid
+
+
+@dataclass(frozen=True)
+class Person:
+    uuid: str
+
+    def get_uuid(self):
+        return self.uuid
+
+
+def response_error(status):
+    request_info = RequestInfo(URL("http://mo/service/details/create"), "POST", {})
+    return ClientResponseError(request_info=request_info, history=(), status=status)
+
+
+class FakeServer:
+    """Records submissions, failing objects according to a script of errors."""
+
+    def __init__(self, errors=None):
+        self.errors = {key: list(value) for key, value in (errors or {}).items()}
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send(self, obj):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            errors = self.errors.get(obj.uuid)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append(obj.uuid)
+        finally:
+            self.in_flight -= 1
+
+
+def submit(pipeline, objs):
+    asyncio.run(pipeline.submit(objs, disable_progressbar=True))
+
+
+class TestSubmissionPipeline(unittest.TestCase):
+    def test_concurrency_is_bounded(self):
+        server = FakeServer()
+        pulled = []
+
+        def objs():
+            for number in range(50):
+                pulled.append(number)
+                # The input is pulled lazily, as room is made for the objects
+                self.assertLessEqual(len(pulled) - len(server.sent), 4)
+                yield Unit(str(number))
+
+        submit(SubmissionPipeline(server.send, concurrency=3), objs())
+        self.assertEqual(sorted(server.sent), sorted(map(str, range(50))))
+        self.assertEqual(server.max_in_flight, 3)
+
+    def test_transient_errors_are_retried(self):
+        server = FakeServer({
+            "a": [response_error(503), ClientConnectionError()],
+            "b": [asyncio.TimeoutError()],
+        })
+        pipeline = SubmissionPipeline(server.send, attempts=3, backoff=0)
+        submit(pipeline, [Unit("a"), Unit("b")])
+        self.assertEqual(sorted(server.sent), ["a", "b"])
+
+    def test_permanent_errors_are_not_retried(self):
+        server = FakeServer({
+            "a": [response_error(400)],
+            "b": [response_error(500)] * 2,
+        })
+        pipeline = SubmissionPipeline(server.send, attempts=2, backoff=0)
+        with self.assertRaises(SubmissionError) as context:
+            submit(pipeline, [Unit("a"), Unit("b"), Unit("c")])
+        failed = sorted(obj.uuid for obj, error in context.exception.failed)
+        self.assertEqual(failed, ["a", "b"])
+        self.assertEqual(server.sent, ["c"])
+        self.assertEqual(server.errors, {"a": [], "b": []})
+
+    def test_objects_without_uuid_are_not_retried(self):
+        server = FakeServer({None: [response_error(503)], "a": [response_error(503)]})
+        pipeline = SubmissionPipeline(server.send, attempts=3, backoff=0)
+        with self.assertRaises(SubmissionError) as context:
+            submit(pipeline, [Unit(None), Unit("a")])
+        self.assertEqual(
+            [obj.uuid for obj, error in context.exception.failed], [None]
+        )
+        self.assertEqual(server.sent, ["a"])
+
+    def test_stops_after_failing_type(self):
+        server = FakeServer({"unit": [response_error(400)]})
+        with self.assertRaises(SubmissionError):
+            submit(
+                SubmissionPipeline(server.send),
+                [Unit("unit"), Unit("other"), Person("person")],
+            )
+        self.assertEqual(server.sent, ["other"])
+
+    def test_journal_resumes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "journal"
+            objs = [Unit("a"), Unit("b"), Person("c"), Unit("d")]
+
+            server = FakeServer({"c": [response_error(400)]})
+            journal = Journal(path)
+            with self.assertRaises(SubmissionError):
+                submit(SubmissionPipeline(server.send, journal=journal), objs)
+            journal.close()
+            self.assertEqual(sorted(path.read_text().split()), ["a", "b"])
+
+            server = FakeServer()
+            journal = Journal(path)
+            submit(SubmissionPipeline(server.send, journal=journal), objs)
+            journal.close()
+            self.assertEqual(server.sent, ["c", "d"])
+            self.assertEqual(sorted(path.read_text().split()), ["a", "b", "c", "d"])
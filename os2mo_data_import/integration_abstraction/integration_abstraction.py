@@ -1,4 +1,5 @@
 import json
+import threading
 from requests import Session
 
 
@@ -12,6 +13,12 @@ class IntegrationAbstraction(object):
         self.end_marker = end_marker
         self.session = Session()
 
+        # Preloaded resources, see preload
+        self._preload_lock = threading.Lock()
+        self._index = {}
+        self._ambiguous = {}
+        self._raw_data = {}
+
     def _get_complete_object(self, resource, uuid):
         """ Return a complete LoRa object """
         response = self.session.get(url=self.mox_base + resource + '/' + uuid)
@@ -25,6 +32,15 @@ class IntegrationAbstraction(object):
         attributes = mox_object[uuid][0]['registreringer'][0]['attributter']
         return attributes
 
+    @staticmethod
+    def _extract_integration_data(attributes):
+        """ Return the raw integration data string from LoRa attributes """
+        data = None
+        for key in attributes.keys():
+            if key.find('egenskaber') > 0:
+                data = attributes[key][0].get('integrationsdata', None)
+        return data
+
     def _get_integration_data(self, resource, uuid):
         """
         Return the the raw integration data string, no interpretation
@@ -35,10 +51,10 @@ class IntegrationAbstraction(object):
         uuid of the object to be returned.
         :return: Raw integration data string.
         """
+        if (resource, uuid) in self._raw_data:
+            return self._raw_data[(resource, uuid)]
         attributes = self._get_attributes(resource, uuid)
-        for key in attributes.keys():
-            if key.find('egenskaber') > 0:
-                data = attributes[key][0].get('integrationsdata', None)
+        data = self._extract_integration_data(attributes)
         if data is not None:
             try:
                 json.loads(data)
@@ -72,6 +88,7 @@ class IntegrationAbstraction(object):
         response = self.session.patch(url=self.mox_base + resource +
                                       '/' + uuid, json=properties)
         response.raise_for_status()
+        self.index_object(resource, uuid, data)
         return response.json()
 
     def read_integration_data(self, resource, uuid):
@@ -139,7 +156,107 @@ class IntegrationAbstraction(object):
         self._set_integration_data(resource, uuid, integration_data_string)
         return True
 
+    def _reference_key(self, integration_data):
+        """
+        Return the json encoded reference of self.system_name in a raw
+        integration data string, or None if the system has no reference.
+        """
+        try:
+            structured_data = json.loads(integration_data)
+        except (TypeError, json.decoder.JSONDecodeError):
+            return None
+        if not isinstance(structured_data, dict):
+            return None
+        data = structured_data.get(self.system_name)
+        if not isinstance(data, str):
+            return None
+        end_pos = data.find(self.end_marker)
+        if end_pos == -1:
+            return None
+        return data[0:end_pos]
+
+    def _add_to_index(self, index, ambiguous, resource, uuid, data):
+        """
+        Add the raw integration data string of an object to an index from
+        reference to uuid. A reference held by more than one object is marked
+        as ambiguous, and a reference the object no longer holds is dropped.
+        """
+        previous = self._raw_data.get((resource, uuid))
+        self._raw_data[(resource, uuid)] = data
+        previous_key = self._reference_key(previous)
+        key = self._reference_key(data)
+        if previous_key not in (None, key) and index.get(previous_key) == uuid:
+            del index[previous_key]
+        if key is None:
+            return
+        if key in index and index[key] != uuid:
+            ambiguous.add(key)
+        index[key] = uuid
+
+    def index_object(self, resource, uuid, data):
+        """
+        Add a created or updated object to the index of a preloaded resource,
+        such that find_object can find it later in the same run. Nothing is
+        done if the resource is not preloaded.
+        :param resource:
+        Path of the service endpoint (str) e.g. /organisation/organisation
+        :param uuid: uuid of the object.
+        :param data: Integration data of the object, raw string or decoded.
+        """
+        if data is not None and not isinstance(data, str):
+            data = json.dumps(data)
+        with self._preload_lock:
+            if resource not in self._index:
+                return
+            self._add_to_index(self._index[resource], self._ambiguous[resource],
+                               resource, uuid, data)
+
+    def preload(self, resource, page_size=1000):
+        """
+        Read the integration data of all objects of a resource type, and build
+        an in-memory index from reference to uuid. Afterwards find_object and
+        reading of integration data for this resource are answered from memory,
+        rather than a full-text search in LoRa per object.
+        :param resource:
+        Path of the service endpoint (str) e.g. /organisation/organisation
+        :param page_size: Number of objects to read per request.
+        """
+        with self._preload_lock:
+            if resource in self._index:
+                return
+            index = {}
+            ambiguous = set()
+            url = self.mox_base + resource
+            offset = 0
+            while True:
+                params = {
+                    'bvn': '%',
+                    'list': 1,
+                    'maximalantalresultater': page_size,
+                    'foersteresultat': offset
+                }
+                response = self.session.get(url=url, params=params)
+                response.raise_for_status()
+                results = response.json()['results']
+                objects = results[0] if results else []
+                for mox_object in objects:
+                    uuid = mox_object['id']
+                    attributes = mox_object['registreringer'][0]['attributter']
+                    data = self._extract_integration_data(attributes)
+                    self._add_to_index(index, ambiguous, resource, uuid, data)
+                if len(objects) < page_size:
+                    break
+                offset += page_size
+            self._ambiguous[resource] = ambiguous
+            self._index[resource] = index
+
     def find_object(self, resource, key):
+        if resource in self._index:
+            key_string = json.dumps(key)
+            if key_string in self._ambiguous[resource]:
+                raise Exception('Inconsistent integration data!')
+            return self._index[resource].get(key_string)
+
         url = self.mox_base + resource + '?integrationsdata=%25{}%25'
 
         # key_string = repr(key[1:-1]) + self.end_marker
@@ -103,13 +103,18 @@ class ImportHelper(object):
         For more information see:
 
         :class:`os2mo_data_import.utilities.ImportUtility`
+
+    :param int workers: Number of organisation units or employees to import
+        concurrently
+
+    :param int detail_batch_size: Number of details to create per request to MO
     """
 
     def __init__(self, system_name="Import", end_marker="_|-STOP",
                  mox_base="http://localhost:8080", mora_base="http://localhost:5000",
                  store_integration_data=False, create_defaults=True,
                  seperate_names=False, demand_consistent_uuids=True,
-                 ImportUtility=ImportUtility):
+                 ImportUtility=ImportUtility, workers=4, detail_batch_size=100):
 
         self.seperate_names = seperate_names
         mora_type_config(mox_base=mox_base,
@@ -123,7 +128,9 @@ class ImportHelper(object):
             system_name=system_name,
             end_marker=end_marker,
             demand_consistent_uuids=demand_consistent_uuids,
-            store_integration_data=store_integration_data
+            store_integration_data=store_integration_data,
+            workers=workers,
+            detail_batch_size=detail_batch_size
         )
         # TODO: store_integration_data could be passed to ImportUtility by passing
         # the actual self.ia object
@@ -556,34 +563,6 @@ class ImportHelper(object):
                 user_key=user_key
             )
 
-    def import_organisation_units_recursively(self, reference, org_unit):
-        """
-        Begin importing all the organisation unit objects
-        from the map recursively.
-        Organisation units without a parent reference
-        automatically become "root" units.
-
-        :param str reference: Reference to organisation_unit
-        :param object org_unit: The OrganisationUnitType object
-        """
-        # Insert parents first!
-        parent_ref = org_unit.parent_ref
-
-        if parent_ref and parent_ref not in self.store.inserted_org_unit_map:
-            parent_unit = self.organisation_units.get(parent_ref)
-
-            # Insert parent first
-            self.import_organisation_units_recursively(parent_ref, parent_unit)
-
-        # Now insert actual units
-        details = self.organisation_unit_details.get(reference)
-
-        self.store.import_org_unit(
-            reference=reference,
-            organisation_unit=org_unit,
-            details=details
-        )
-
     def _import_unit_from_integration_data(self, reference):
         ou_res = 'organisation/organisationenhed'
         klasse_res = 'klassifikation/klasse'
@@ -649,6 +628,32 @@ class ImportHelper(object):
         for identifier, itsystem in self.itsystems.items():
             self.store.import_itsystem(identifier, itsystem)
 
+    def _org_unit_levels(self):
+        """
+        Group the organisation units by their depth in the tree, such that
+        the parents of the units in a level are all in earlier levels.
+
+        :return: List of lists of organisation unit references
+        """
+        depths = {}
+
+        def depth(reference):
+            if reference not in depths:
+                parent_ref = self.organisation_units[reference].parent_ref
+                if parent_ref in self.organisation_units:
+                    depths[reference] = depth(parent_ref) + 1
+                else:
+                    depths[reference] = 0
+            return depths[reference]
+
+        levels = []
+        for reference in self.organisation_units:
+            level = depth(reference)
+            while len(levels) <= level:
+                levels.append([])
+            levels[level].append(reference)
+        return levels
+
     def _import_org_units(self):
         re_run = True
         while re_run:
@@ -663,18 +668,30 @@ class ImportHelper(object):
                 if self.test_org_unit_refs(identifier, org_unit):
                     re_run = True
 
-        for identifier, org_unit in self.organisation_units.items():
-            self.import_organisation_units_recursively(identifier, org_unit)
+        def import_org_unit(identifier):
+            self.store.import_org_unit(
+                reference=identifier,
+                organisation_unit=self.organisation_units[identifier],
+                details=self.organisation_unit_details.get(identifier)
+            )
+
+        # All units in a level can be imported concurrently, as their parents
+        # have been imported with the previous levels.
+        for level in self._org_unit_levels():
+            self.store.run_concurrently(import_org_unit, level)
+        self.store.flush_details()
 
     def _import_employees(self):
-        for identifier, employee in self.employees.items():
-            details = self.employee_details.get(identifier)
+        def import_employee(identifier):
             self.store.import_employee(
                 reference=identifier,
-                employee=employee,
-                details=details
+                employee=self.employees[identifier],
+                details=self.employee_details.get(identifier)
             )
 
+        self.store.run_concurrently(import_employee, list(self.employees))
+        self.store.flush_details()
+
     def import_all(self):
         """
         The import method begins importing all objects
@@ -7,12 +7,16 @@
 #
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4, UUID
 from urllib.parse import urljoin
 from requests import Session, HTTPError
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 
 from integration_abstraction.integration_abstraction import IntegrationAbstraction
+from os2mo_helpers.details_writer import write_bisecting
 
 from os2mo_data_import.mora_data_types import (
     OrganisationUnitType,
@@ -35,6 +39,72 @@ SAML_TOKEN = os.environ.get('SAML_TOKEN', None)
 logger = logging.getLogger("moImporterUtilities")
 
 
+class DetailBatcher(object):
+    """
+    Write-behind batcher for detail payloads.
+
+    Detail payloads are collected and sent to MO in lists of up to
+    batch_size payloads, as MO's details endpoints accepts lists.
+    Call flush to send the remaining payloads.
+
+    Batches are sent by ``write_bisecting``, such that a payload rejected by MO
+    does not fail the rest of its batch. The error of the first payload which
+    could not be written is raised after the rest of the batch has been sent.
+
+    :param callable insert: Function taking a resource and a list of payloads
+    :param str resource: The MO resource to send the payloads to
+    :param int batch_size: Number of payloads per request
+    """
+
+    def __init__(self, insert, resource="service/details/create", batch_size=100):
+        self.insert = insert
+        self.resource = resource
+        self.batch_size = batch_size
+
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, payloads):
+        """
+        Add payloads to the batch, sending full batches to MO.
+
+        :param list payloads: Detail payloads
+        """
+        with self.lock:
+            self.pending.extend(payloads)
+            if len(self.pending) < self.batch_size:
+                return
+            batches = [
+                self.pending[start:start + self.batch_size]
+                for start in range(0, len(self.pending), self.batch_size)
+            ]
+            # Keep the last incomplete batch for later
+            if len(batches[-1]) < self.batch_size:
+                self.pending = batches.pop()
+            else:
+                self.pending = []
+
+        for batch in batches:
+            self._send(batch)
+
+    def flush(self):
+        """Send all pending payloads to MO."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch):
+        logger.info('Sending {} details to {}'.format(len(batch), self.resource))
+
+        def send(payloads):
+            self.insert(resource=self.resource, data=payloads)
+
+        failed = write_bisecting(send, batch, self.resource)
+        if failed:
+            raise failed[0][1]
+
+
 class ImportUtility(object):
     """
     ImportUtility
@@ -45,7 +115,7 @@ class ImportUtility(object):
 
     def __init__(self, system_name, end_marker, mox_base, mora_base,
                  demand_consistent_uuids, store_integration_data=False,
-                 dry_run=False):
+                 dry_run=False, workers=4, detail_batch_size=100):
 
         # Import Params
         self.demand_consistent_uuids = demand_consistent_uuids
@@ -57,15 +127,24 @@ class ImportUtility(object):
         self.mox_base = mox_base
         self.mora_base = mora_base
 
-        # Session
+        # Session, shared by all workers
+        self.workers = workers
         self.session = Session()
+        adapter = HTTPAdapter(pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Details are created in batches, see flush_details
+        self.details_batcher = DetailBatcher(
+            insert=self.insert_mora_data,
+            batch_size=detail_batch_size
+        )
 
         # Placeholder for UUID import
         self.organisation_uuid = None
 
         # Existing UUIDS
-        # TODO: More elegant version of this please
-        self.existing_uuids = []
+        self.existing_uuids = set()
 
         # UUID map
         self.inserted_organisation = {}
@@ -78,6 +157,25 @@ class ImportUtility(object):
         # Deprecated
         self.dry_run = dry_run
 
+    def run_concurrently(self, function, items):
+        """
+        Call function on every item, using up to self.workers threads.
+
+        :param callable function: Function taking a single item
+        :param iterable items: The items
+        :returns: List of results, in the order of the items
+        """
+        if self.workers <= 1:
+            return list(map(function, items))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, items))
+
+    def flush_details(self):
+        """
+        Create all details which are still pending in the batcher.
+        """
+        self.details_batcher.flush()
+
     def import_organisation(self, reference, organisation):
         """
         Convert organisation to OIO formatted post data
@@ -115,6 +213,7 @@ class ImportUtility(object):
             data=payload,
             uuid=organisation_uuid
         )
+        self._index_object(resource, self.organisation_uuid, integration_data)
 
         # Global validity
         self.date_from = organisation.date_from
@@ -155,6 +254,7 @@ class ImportUtility(object):
             data=payload,
             uuid=klassifikation_uuid
         )
+        self._index_object(resource, self.klassifikation_uuid, integration_data)
 
         return self.klassifikation_uuid
 
@@ -197,6 +297,9 @@ class ImportUtility(object):
             data=payload,
             uuid=facet_uuid
         )
+        self._index_object(
+            resource, self.inserted_facet_map[reference], integration_data
+        )
 
         return self.inserted_facet_map[reference]
 
@@ -260,6 +363,7 @@ class ImportUtility(object):
         )
         assert(uuid is None or import_uuid == str(klasse_uuid))
         self.inserted_klasse_map[reference] = import_uuid
+        self._index_object(resource, import_uuid, integration_data)
 
         return self.inserted_klasse_map[reference]
 
@@ -302,6 +406,9 @@ class ImportUtility(object):
             data=payload,
             uuid=itsystem_uuid
         )
+        self._index_object(
+            resource, self.inserted_itsystem_map[reference], integration_data
+        )
 
         return self.inserted_itsystem_map[reference]
 
@@ -360,6 +467,9 @@ class ImportUtility(object):
             payload=payload,
             encode_integration=False
         )
+        # A re-import moves the payload into payload['data']
+        mox_resource = resource
+        integration_data = payload.copy()
 
         if 'uuid' in payload:
             if payload['uuid'] in self.existing_uuids:
@@ -395,6 +505,7 @@ class ImportUtility(object):
 
         # Add to the inserted map
         self.inserted_org_unit_map[reference] = uuid
+        self._index_object(mox_resource, uuid, integration_data)
 
         data = {}
         data['address'] = self._get_detail(uuid, 'address', object_type='ou')
@@ -434,10 +545,7 @@ class ImportUtility(object):
                 self._terminate_details(item['uuid'], 'address')
         if re_import in ('YES', 'NEW'):
             logger.info('Re-import unit: {}'.format(re_import))
-            self.insert_mora_data(
-                resource="service/details/create",
-                data=details_payload
-            )
+            self.details_batcher.add(details_payload)
 
         return uuid
 
@@ -485,6 +593,7 @@ class ImportUtility(object):
 
         # Add uuid to the inserted employee map
         self.inserted_employee_map[reference] = uuid
+        self._index_object(mox_resource, uuid, integration_data)
 
         data = {}
         data['it'] = self._get_detail(uuid, 'it')
@@ -565,10 +674,7 @@ class ImportUtility(object):
                 self._terminate_employee(uuid)
 
             if re_import in ('YES', 'NEW', 'UPDATE'):
-                self.insert_mora_data(
-                    resource="service/details/create",
-                    data=additional_payload
-                )
+                self.details_batcher.add(additional_payload)
 
         return uuid
 
@@ -617,6 +723,7 @@ class ImportUtility(object):
             if not uuid:
                 if self.store_integration_data:
                     klasse_res = 'klassifikation/klasse'
+                    self.ia.preload(klasse_res)
                     uuid = self.ia.find_object(klasse_res, getattr(detail, check_value))
                 else:
                     # print('Detail: {}, check_value: {}'.format(detail, check_value))
@@ -689,6 +796,9 @@ class ImportUtility(object):
         # be able to make a list of objects that has disappeared
 
         if self.store_integration_data:
+            # All objects of the resource type are read once, and later lookups
+            # are answered from memory
+            self.ia.preload(resource)
             uuid = self.ia.find_object(resource, reference)
             if uuid:
                 if 'uuid' in payload:
@@ -697,7 +807,7 @@ class ImportUtility(object):
                     else:
                         payload['uuid'] = uuid
                 payload['uuid'] = uuid
-                self.existing_uuids.append(uuid)
+                self.existing_uuids.add(uuid)
 
             payload['integration_data'] = self.ia.integration_data_payload(
                 resource,
@@ -707,6 +817,23 @@ class ImportUtility(object):
             )
         return payload
 
+    def _index_object(self, resource, uuid, payload):
+        """
+        Add an imported object to the preloaded integration data, such that
+        it is found by _integration_data for the rest of the import.
+
+        :param resource:
+        LoRa resource URL.
+
+        :param uuid:
+        The uuid of the imported object.
+
+        :param payload:
+        The payload returned by _integration_data for the object.
+        """
+        if self.store_integration_data and 'integration_data' in payload:
+            self.ia.index_object(resource, uuid, payload['integration_data'])
+
     def insert_mox_data(self, resource, data, uuid=None):
 
         service_url = urljoin(
@@ -785,12 +912,12 @@ class ImportUtility(object):
                 except ValueError:
                     raise Exception('Unable to read uuid')
             else:
-                raise HTTPError("Inserting mora data failed")
+                raise HTTPError("Inserting mora data failed", response=response)
         elif response.status_code not in (200, 201):
             logger.error(
                 'MO post. Response: {}, data'.format(response.text, data)
             )
-            raise HTTPError("Inserting mora data failed")
+            raise HTTPError("Inserting mora data failed", response=response)
         else:
             uuid = response.json()
         return uuid
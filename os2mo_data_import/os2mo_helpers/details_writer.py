@@ -0,0 +1,135 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Chunked writer for MO's bulk details endpoints
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger("mora-helper")
+
+
+class DetailsWriteError(Exception):
+    """Raised when some payloads could not be written to MO."""
+
+    def __init__(self, failed):
+        self.failed = failed
+        super().__init__("{} payloads were rejected by MO".format(len(failed)))
+
+
+def is_rejected(error):
+    """Whether MO rejected a request with a 4xx status."""
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500
+
+
+def write_bisecting(send, payloads, description=""):
+    """
+    Send a list of payloads, isolating the payloads rejected by MO.
+
+    If MO rejects the payloads with a 4xx status, they are split in halves which
+    are sent again, until the rejected payloads are isolated. MO validates every
+    payload of a request before writing any of them, so a rejected request has
+    not been written at all. Requests failing with a 5xx status or a connection
+    error may have been partially written, and fail all their payloads without
+    retrying them.
+
+    :param send: Function taking a list of payloads, raising
+        ``requests.RequestException`` if they could not be written.
+    :param description: Description of the payloads for the log.
+    :return: List of (payload, exception) tuples for the payloads which could
+        not be written.
+    """
+    try:
+        send(payloads)
+    except requests.RequestException as error:
+        if len(payloads) == 1 or not is_rejected(error):
+            return [(payload, error) for payload in payloads]
+        logger.warning(
+            "{}: {} rejected a chunk of {} payloads, splitting it".format(
+                description, error.response.status_code, len(payloads)
+            )
+        )
+        middle = len(payloads) // 2
+        return write_bisecting(send, payloads[:middle], description) + (
+            write_bisecting(send, payloads[middle:], description)
+        )
+    return []
+
+
+class DetailsWriter:
+    """
+    Write detail payloads to one of MO's ``details/*`` endpoints.
+
+    The payloads are sent in chunks of ``chunk_size``, with ``concurrency``
+    chunks in flight at a time. Each chunk is written by ``write_bisecting``,
+    such that a payload rejected by MO does not fail the rest of its chunk.
+
+    :param post: Function taking an endpoint and a list of payloads, returning
+        a ``requests.Response``, e.g. ``MoraHelper._mo_post``.
+    :param chunk_size: Number of payloads per request.
+    :param concurrency: Number of requests in flight at a time.
+    """
+
+    def __init__(self, post, chunk_size=100, concurrency=4):
+        self.post = post
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    def write(self, endpoint, payloads):
+        """
+        Write all payloads, logging progress per chunk.
+
+        :param endpoint: The details endpoint, e.g. ``details/create``.
+        :param payloads: List of payloads.
+        :return: List of (payload, error) tuples for the payloads which could
+            not be written.
+        """
+        chunks = [
+            payloads[start:start + self.chunk_size]
+            for start in range(0, len(payloads), self.chunk_size)
+        ]
+        logger.info(
+            "{}: writing {} payloads in {} chunks".format(
+                endpoint, len(payloads), len(chunks)
+            )
+        )
+
+        def write_chunk(number, chunk):
+            failed = self._write(endpoint, chunk)
+            logger.info(
+                "{}: chunk {}/{} done, {} of {} payloads written".format(
+                    endpoint, number, len(chunks), len(chunk) - len(failed),
+                    len(chunk)
+                )
+            )
+            return failed
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = executor.map(write_chunk, range(1, len(chunks) + 1), chunks)
+            failed = [item for result in results for item in result]
+
+        for payload, error in failed:
+            logger.error("{}: {} failed: {}".format(endpoint, payload, error))
+        return failed
+
+    def _write(self, endpoint, chunk):
+        def send(payloads):
+            response = self.post(endpoint, payloads)
+            if not response.ok:
+                raise requests.HTTPError(
+                    "{} {}".format(response.status_code, response.text),
+                    response=response,
+                )
+
+        return [
+            (payload, repr(e) if e.response is None else str(e))
+            for payload, e in write_bisecting(send, chunk, endpoint)
+        ]
@@ -20,11 +20,15 @@ from anytree import Node
 from more_itertools import only
 from retrying import retry
 
+from os2mo_helpers.request_metrics import hooks
+
 SAML_TOKEN = os.environ.get("SAML_TOKEN", None)
 PRIMARY_RESPONSIBILITY = "Personale: ansættelse/afskedigelse"
 
 logger = logging.getLogger("mora-helper")
 
+MORA_HOOKS = hooks("mora")
+
 
 class MoraHelper:
     def __init__(
@@ -151,7 +155,7 @@ class MoraHelper:
             return_dict = self.cache[cache_id]
         else:
             if SAML_TOKEN is None:
-                response = requests.get(full_url, params=params)
+                response = requests.get(full_url, params=params, hooks=MORA_HOOKS)
                 if response.status_code == 401:
                     msg = "Missing SAML token"
                     logger.error(msg)
@@ -159,7 +163,9 @@ class MoraHelper:
                 return_dict = response.json()
             else:
                 header = {"SESSION": SAML_TOKEN}
-                response = requests.get(full_url, headers=header, params=params)
+                response = requests.get(
+                    full_url, headers=header, params=params, hooks=MORA_HOOKS
+                )
                 if response.status_code == 401:
                     msg = "SAML token not accepted"
                     logger.error(msg)
@@ -184,7 +190,9 @@ class MoraHelper:
             header = None
 
         full_url = self.host + url
-        response = requests.post(full_url, headers=header, params=params, json=payload)
+        response = requests.post(
+            full_url, headers=header, params=params, json=payload, hooks=MORA_HOOKS
+        )
         return response
 
     def check_connection(self):
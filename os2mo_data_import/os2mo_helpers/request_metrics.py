@@ -0,0 +1,118 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Count and time the HTTP requests made to MO and LoRa
+
+Requests made with ``hooks=hooks(client)`` are recorded in ``REQUEST_METRICS``,
+by the number of responses per status code and a histogram of their latency.
+The latency is ``response.elapsed``, the time from sending the request until
+the response headers are parsed.
+
+When ``JOB_METRICS_REQUESTS_DIR`` is set, as it is for jobs run by
+``tools/job_metrics.py``, the metrics of the process are written to a JSON
+file in that directory when the process exits.
+"""
+import atexit
+import json
+import os
+import pathlib
+import threading
+from bisect import bisect_left
+
+# Upper bounds in seconds of the latency histogram, the last bucket is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS_DIR_ENV = "JOB_METRICS_REQUESTS_DIR"
+
+
+def empty_client():
+    return {"responses": {}, "buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0}
+
+
+def merge(metrics):
+    """Sum the metrics of several processes, as returned by ``to_dict``.
+
+    Example:
+        >>> first = RequestMetrics()
+        >>> first.observe("mora", 200, 0.02)
+        >>> second = RequestMetrics()
+        >>> second.observe("mora", 404, 0.2)
+        >>> merged = merge([first.to_dict(), second.to_dict()])
+        >>> merged["mora"]["responses"]
+        {'200': 1, '404': 1}
+        >>> merged["mora"]["buckets"][:6]
+        [0, 0, 1, 0, 0, 1]
+    """
+    merged = {}
+    for process in metrics:
+        for client, observed in process.items():
+            total = merged.setdefault(client, empty_client())
+            responses = total["responses"]
+            for status, count in observed["responses"].items():
+                responses[status] = responses.get(status, 0) + count
+            total["buckets"] = [
+                count + extra
+                for count, extra in zip(total["buckets"], observed["buckets"])
+            ]
+            total["sum"] += observed["sum"]
+    return merged
+
+
+class RequestMetrics:
+    """Thread safe record of responses and their latency, by client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def observe(self, client, status, seconds):
+        with self._lock:
+            observed = self._clients.setdefault(client, empty_client())
+            status = str(status)
+            observed["responses"][status] = observed["responses"].get(status, 0) + 1
+            observed["buckets"][bisect_left(BUCKETS, seconds)] += 1
+            observed["sum"] += seconds
+
+    def hook(self, client):
+        """Response hook for requests, recording the responses as client."""
+
+        def record(response, *args, **kwargs):
+            self.observe(client, response.status_code, response.elapsed.total_seconds())
+
+        return record
+
+    def to_dict(self):
+        with self._lock:
+            return json.loads(json.dumps(self._clients))
+
+    def write(self, directory):
+        """Write the metrics of this process to directory, unless empty."""
+        metrics = self.to_dict()
+        if metrics:
+            path = pathlib.Path(directory) / "{}.json".format(os.getpid())
+            path.write_text(json.dumps(metrics))
+
+
+REQUEST_METRICS = RequestMetrics()
+
+
+def hooks(client):
+    """Hooks argument for requests, recording the responses in REQUEST_METRICS.
+
+    :param client: Name of the service requested, e.g. ``"mora"`` or ``"lora"``.
+    """
+    return {"response": [REQUEST_METRICS.hook(client)]}
+
+
+def _write_at_exit():
+    directory = os.environ.get(REQUESTS_DIR_ENV)
+    if directory:
+        REQUEST_METRICS.write(directory)
+
+
+atexit.register(_write_at_exit)
@@ -0,0 +1,113 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Retries of asynchronous requests with exponential backoff
+"""
+import asyncio
+import logging
+import random
+
+from aiohttp import ClientError, ClientResponseError
+
+logger = logging.getLogger("mora-helper")
+
+
+def is_transient(error):
+    """
+    Whether a request failing with error should be retried.
+
+    Responses with a 5xx status, connection errors and timeouts are transient,
+    while other errors, e.g. responses with a 4xx status, are not.
+    """
+    if isinstance(error, ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (ClientError, asyncio.TimeoutError))
+
+
+async def raise_for_status(response):
+    """
+    Raise ClientResponseError for a response with an error status.
+
+    Unlike ``response.raise_for_status``, the message of the error is the body
+    of the response, which usually tells why the request failed.
+    """
+    if response.status >= 400:
+        raise ClientResponseError(
+            response.request_info,
+            response.history,
+            status=response.status,
+            message=await response.text(),
+            headers=response.headers,
+        )
+
+
+class RetryPolicy:
+    """
+    Run coroutine functions, retrying them when they fail with a transient
+    error.
+
+    The delay before the n'th retry is ``backoff * 2 ** (n - 1)``, at most
+    ``max_backoff``. With ``jitter``, the delay is drawn uniformly between 0 and
+    that, spreading out the retries of concurrent requests.
+
+    :param attempts: Number of attempts, including the first one.
+    :param backoff: Delay in seconds before the first retry.
+    :param max_backoff: Upper bound of the delay in seconds, or None.
+    :param jitter: Whether to draw the delays at random.
+    :param retry_on: Predicate telling whether an exception should be retried.
+    :param logger: Logger of the retries.
+    """
+
+    def __init__(self, attempts=5, backoff=0.5, max_backoff=None, jitter=False,
+                 retry_on=is_transient, logger=logger):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+        self.logger = logger
+
+    def delay(self, attempt):
+        """
+        Delay in seconds after the failure of attempt, counted from 0.
+
+        Example:
+            >>> policy = RetryPolicy(backoff=1, max_backoff=5)
+            >>> [policy.delay(attempt) for attempt in range(4)]
+            [1, 2, 4, 5]
+        """
+        delay = self.backoff * 2 ** attempt
+        if self.max_backoff is not None:
+            delay = min(self.max_backoff, delay)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    async def run(self, function, *args, description=None):
+        """
+        Await ``function(*args)``, retrying it on transient errors.
+
+        :param description: Description of the request for the log, by default
+            the name of the function.
+        :return: The result of the first successful attempt.
+        :raises: The error of the last attempt, or the first error which is not
+            transient.
+        """
+        for attempt in range(self.attempts):
+            try:
+                return await function(*args)
+            except Exception as error:
+                if attempt + 1 == self.attempts or not self.retry_on(error):
+                    raise
+                delay = self.delay(attempt)
+                self.logger.warning(
+                    "{} failed: {}, retrying in {:.2f}s".format(
+                        description or function.__name__, error, delay
+                    )
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,103 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Bounded concurrent submission of objects, with a journal of the submitted ones
+"""
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+
+from tqdm import tqdm
+
+logger = logging.getLogger("mora-helper")
+
+
+class Journal:
+    """Append-only file of the UUIDs of submitted objects.
+
+    :param path: The file, created if it does not exist.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.done = set()
+        if self.path.exists():
+            self.done = set(filter(None, self.path.read_text().splitlines()))
+        self.__file = None
+
+    def __contains__(self, uuid) -> bool:
+        return str(uuid) in self.done
+
+    def record(self, uuid):
+        if self.__file is None:
+            self.__file = self.path.open("a")
+        self.__file.write(f"{uuid}\n")
+        # Flush every line, such that the journal survives a crash
+        self.__file.flush()
+        self.done.add(str(uuid))
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+async def submit_all(
+    objs: Iterable,
+    send: Callable[[Any], Awaitable[None]],
+    concurrency: int,
+    journal: Optional[Journal] = None,
+    get_uuid: Callable[[Any], Optional[str]] = lambda obj: obj,
+    description: str = "",
+    disable_progressbar: bool = False,
+    logger: logging.Logger = logger,
+) -> List[Tuple[Any, str]]:
+    """Await ``send(obj)`` for every object, with bounded concurrency.
+
+    The objects are pulled lazily from objs, as room is made for them. Objects
+    whose UUID is in the journal are skipped, and the UUIDs of the objects sent
+    successfully are recorded in it. Objects without a UUID are sent every time.
+
+    :param concurrency: Number of objects being sent at a time.
+    :param get_uuid: Function returning the UUID of an object, or None.
+    :param description: Description of the objects for the progress bar and log.
+    :return: The objects which could not be sent, with the repr of their error.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    failed: List[Tuple[Any, str]] = []
+    pending = set()
+    skipped = 0
+
+    async def send_one(obj, uuid):
+        try:
+            await send(obj)
+        except Exception as error:
+            logger.error(f"{description}: unable to send {uuid}: {error}")
+            failed.append((obj, repr(error)))
+            return
+        if journal is not None and uuid is not None:
+            journal.record(uuid)
+
+    progress = tqdm(objs, unit="obj", desc=description, disable=disable_progressbar)
+    for obj in progress:
+        uuid = get_uuid(obj)
+        if journal is not None and uuid is not None and uuid in journal:
+            skipped += 1
+            continue
+        # Do not pull the next object until there is room for it
+        await semaphore.acquire()
+        task = asyncio.create_task(send_one(obj, uuid))
+        task.add_done_callback(lambda _: semaphore.release())
+        task.add_done_callback(pending.discard)
+        pending.add(task)
+    await asyncio.gather(*pending)
+
+    if skipped:
+        logger.info(f"{description}: skipped {skipped} journaled objects")
+    return failed
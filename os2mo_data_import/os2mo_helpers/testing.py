@@ -0,0 +1,88 @@
+#
+# Copyright (c) Magenta ApS
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+"""
+Stand-ins for aiohttp clients, for testing code sending requests
+"""
+import json
+from collections import Counter
+
+from aiohttp import RequestInfo
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+
+class FakeResponse:
+    """Stand-in for ``aiohttp.ClientResponse``."""
+
+    request_info = None
+    history = ()
+
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def text(self):
+        if isinstance(self.body, str):
+            return self.body
+        return json.dumps(self.body)
+
+    async def json(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeClient:
+    """
+    Stand-in for ``aiohttp.ClientSession``, answering requests with respond.
+
+    The requests are counted per key, e.g. the object a request is about, in
+    ``requests``. The first requests for a key can be failed with a 503 status
+    to test retries.
+
+    :param respond: Function taking the method, url and keyword arguments of
+        a request, returning a FakeResponse.
+    :param key: Function taking the same arguments, returning the key of the
+        request. The url by default.
+    :param failures: Dictionary from key to the number of requests for the key
+        to fail, or None to fail every request.
+    """
+
+    def __init__(self, respond, key=None, failures=None):
+        self.respond = respond
+        self.key = key or (lambda method, url, **kwargs: url)
+        self.failures = failures or {}
+        self.requests = Counter()
+
+    async def request(self, method, url, **kwargs):
+        key = self.key(method, url, **kwargs)
+        self.requests[key] += 1
+        response = None
+        if key in self.failures:
+            failures = self.failures[key]
+            if failures is None or self.requests[key] <= failures:
+                response = FakeResponse(503, "error")
+        if response is None:
+            response = self.respond(method, url, **kwargs)
+        headers = CIMultiDictProxy(CIMultiDict(kwargs.get("headers") or {}))
+        response.request_info = RequestInfo(URL(url), method, headers, URL(url))
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from os2mo_helpers.details_writer import DetailsWriter
+
+
+class FakeMO:
+    """Rejects any request containing a negative payload."""
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, endpoint, payloads):
+        self.requests.append(list(payloads))
+        if payloads == ["down"]:
+            raise requests.ConnectionError("down")
+        status_code = 400 if any(payload < 0 for payload in payloads) else 201
+        return MagicMock(ok=status_code < 400, status_code=status_code, text="")
+
+
+class DetailsWriterTests(unittest.TestCase):
+    def test_chunks(self):
+        mo = FakeMO()
+        writer = DetailsWriter(mo.post, chunk_size=3, concurrency=2)
+
+        self.assertEqual(writer.write("details/create", list(range(7))), [])
+        self.assertEqual(sorted(mo.requests), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_bisect(self):
+        mo = FakeMO()
+        writer = DetailsWriter(mo.post, chunk_size=4, concurrency=1)
+
+        failed = writer.write("details/create", [1, -2, 3, 4, 5, 6, 7, -8])
+        self.assertEqual([payload for payload, error in failed], [-2, -8])
+        self.assertEqual(
+            mo.requests,
+            [
+                [1, -2, 3, 4], [1, -2], [1], [-2], [3, 4],
+                [5, 6, 7, -8], [5, 6], [7, -8], [7], [-8],
+            ],
+        )
+
+    def test_connection_error(self):
+        mo = FakeMO()
+        writer = DetailsWriter(mo.post, chunk_size=1)
+
+        failed = writer.write("details/edit", ["down"])
+        self.assertEqual(failed, [("down", "ConnectionError('down')")])
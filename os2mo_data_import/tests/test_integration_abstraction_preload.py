@@ -0,0 +1,95 @@
+import json
+import unittest
+from unittest.mock import MagicMock
+
+from integration_abstraction import IntegrationAbstraction
+
+
+def mox_object(uuid, integration_data):
+    return {
+        'id': uuid,
+        'registreringer': [{
+            'attributter': {
+                'klasseegenskaber': [
+                    {'integrationsdata': json.dumps(integration_data)}
+                ]
+            }
+        }]
+    }
+
+
+class PreloadTests(unittest.TestCase):
+    def setUp(self):
+        self.ia = IntegrationAbstraction('http://mox', 'system', 'STOP')
+        pages = [
+            [
+                mox_object('uuid-1', {'system': '"ref1"STOP'}),
+                mox_object('uuid-2', {'system': '"ref2"STOP', 'other': '1STOP'}),
+            ],
+            [
+                mox_object('uuid-3', {'other': '"ref3"STOP'}),
+                mox_object('uuid-4', {'system': '"ref2"STOP'}),
+            ],
+            [],
+        ]
+        self.ia.session = MagicMock()
+        self.ia.session.get.return_value.json.side_effect = [
+            {'results': [page]} for page in pages
+        ]
+
+    def test_find_object_from_index(self):
+        resource = 'klassifikation/klasse'
+        self.ia.preload(resource, page_size=2)
+        self.ia.preload(resource, page_size=2)
+        self.assertEqual(self.ia.session.get.call_count, 3)
+        offsets = [
+            call.kwargs['params']['foersteresultat']
+            for call in self.ia.session.get.call_args_list
+        ]
+        self.assertEqual(offsets, [0, 2, 4])
+
+        self.assertEqual(self.ia.find_object(resource, 'ref1'), 'uuid-1')
+        self.assertIsNone(self.ia.find_object(resource, 'ref3'))
+        with self.assertRaises(Exception):
+            self.ia.find_object(resource, 'ref2')
+        self.assertEqual(
+            self.ia.integration_data_payload(resource, 'new', 'uuid-1',
+                                             encode=False),
+            {'system': '"new"STOP'}
+        )
+        self.assertEqual(self.ia.session.get.call_count, 3)
+
+    def test_index_created_object(self):
+        resource = 'klassifikation/klasse'
+        self.ia.preload(resource, page_size=2)
+        self.ia.index_object(resource, 'uuid-5',
+                             {'system': '"ref5"STOP', 'other': '2STOP'})
+        self.assertEqual(self.ia.find_object(resource, 'ref5'), 'uuid-5')
+        self.assertEqual(
+            self.ia.integration_data_payload(resource, 'new', 'uuid-5',
+                                             encode=False),
+            {'system': '"new"STOP', 'other': '2STOP'}
+        )
+
+        # A changed reference is moved to the new one
+        self.ia.index_object(resource, 'uuid-5',
+                             json.dumps({'system': '"ref6"STOP'}))
+        self.assertIsNone(self.ia.find_object(resource, 'ref5'))
+        self.assertEqual(self.ia.find_object(resource, 'ref6'), 'uuid-5')
+        self.assertEqual(self.ia.session.get.call_count, 3)
+
+    def test_created_object_ambiguity(self):
+        resource = 'klassifikation/klasse'
+        self.ia.preload(resource, page_size=2)
+        self.ia.index_object(resource, 'uuid-1', {'system': '"ref1"STOP'})
+        self.assertEqual(self.ia.find_object(resource, 'ref1'), 'uuid-1')
+
+        self.ia.index_object(resource, 'uuid-5', {'system': '"ref1"STOP'})
+        with self.assertRaisesRegex(Exception, 'Inconsistent integration data'):
+            self.ia.find_object(resource, 'ref1')
+
+    def test_index_without_preload(self):
+        resource = 'klassifikation/klasse'
+        self.ia.index_object(resource, 'uuid-5', {'system': '"ref5"STOP'})
+        self.assertNotIn((resource, 'uuid-5'), self.ia._raw_data)
+        self.ia.session.get.assert_not_called()
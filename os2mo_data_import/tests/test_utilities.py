@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import MagicMock
+
+from requests import HTTPError, Response
+
+from os2mo_data_import import ImportHelper
+from os2mo_data_import.mox_data_types import Itsystem
+from os2mo_data_import.utilities import DetailBatcher, ImportUtility
+
+
+class DetailBatcherTests(unittest.TestCase):
+    def test_batches(self):
+        insert = MagicMock()
+        batcher = DetailBatcher(insert=insert, batch_size=3)
+
+        batcher.add([1, 2])
+        insert.assert_not_called()
+
+        batcher.add([3, 4, 5, 6, 7])
+        self.assertEqual(
+            [call.kwargs["data"] for call in insert.call_args_list],
+            [[1, 2, 3], [4, 5, 6]],
+        )
+
+        batcher.flush()
+        self.assertEqual(insert.call_args.kwargs["data"], [7])
+        self.assertEqual(
+            insert.call_args.kwargs["resource"], "service/details/create"
+        )
+
+        insert.reset_mock()
+        batcher.flush()
+        insert.assert_not_called()
+
+    def rejecting_insert(self, status_code, bad):
+        """Insert rejecting any batch containing bad, recording what was written."""
+        written = []
+
+        def insert(resource, data):
+            if bad in data:
+                response = Response()
+                response.status_code = status_code
+                raise HTTPError("Inserting mora data failed", response=response)
+            written.extend(data)
+
+        return insert, written
+
+    def test_rejected_batch_is_split(self):
+        insert, written = self.rejecting_insert(400, bad=5)
+        batcher = DetailBatcher(insert=MagicMock(side_effect=insert), batch_size=8)
+
+        with self.assertRaises(HTTPError):
+            batcher.add(list(range(8)))
+        self.assertEqual(sorted(written), [0, 1, 2, 3, 4, 6, 7])
+        # 8 -> 4 + 4 -> 2 + 2 -> 1 + 1
+        self.assertEqual(batcher.insert.call_count, 7)
+
+    def test_server_error_is_not_split(self):
+        insert, written = self.rejecting_insert(500, bad=5)
+        batcher = DetailBatcher(insert=MagicMock(side_effect=insert), batch_size=8)
+
+        with self.assertRaises(HTTPError):
+            batcher.add(list(range(8)))
+        self.assertEqual(written, [])
+        self.assertEqual(batcher.insert.call_count, 1)
+
+
+class OrgUnitLevelTests(unittest.TestCase):
+    def test_levels(self):
+        importer = ImportHelper(create_defaults=False)
+        importer.add_organisation(identifier="org", user_key="org")
+        for identifier, parent_ref in [
+            ("leaf", "child"),
+            ("child", "root"),
+            ("root", None),
+            ("other_root", None),
+            ("other_child", "other_root"),
+        ]:
+            importer.add_organisation_unit(
+                identifier=identifier,
+                type_ref="type",
+                date_from="1930-01-01",
+                parent_ref=parent_ref,
+            )
+
+        self.assertEqual(
+            importer._org_unit_levels(),
+            [["root", "other_root"], ["child", "other_child"], ["leaf"]],
+        )
+
+
+class IntegrationDataTests(unittest.TestCase):
+    def setUp(self):
+        self.utility = ImportUtility(
+            system_name="test",
+            end_marker="STOP",
+            mox_base="http://mox",
+            mora_base="http://mo",
+            demand_consistent_uuids=False,
+            store_integration_data=True,
+        )
+        # Set by import_organisation
+        self.utility.organisation_uuid = "org"
+        self.utility.date_from = "1930-01-01"
+        self.utility.date_to = "infinity"
+        # Nothing exists in LoRa before the import
+        self.utility.ia.session = MagicMock()
+        self.utility.ia.session.get.return_value.json.return_value = {
+            "results": []
+        }
+        self.utility.session = MagicMock()
+        self.utility.session.post.return_value.status_code = 201
+        self.utility.session.post.return_value.json.return_value = {"uuid": "uuid-1"}
+        self.utility.session.put.return_value.status_code = 200
+        self.utility.session.put.return_value.json.return_value = {"uuid": "uuid-1"}
+
+    def test_created_object_is_found(self):
+        self.utility.import_itsystem("system", Itsystem(system_name="System"))
+        self.utility.session.post.assert_called_once()
+
+        # The second import updates the object created by the first
+        self.utility.import_itsystem("system", Itsystem(system_name="System"))
+        self.utility.session.post.assert_called_once()
+        self.assertEqual(
+            self.utility.session.put.call_args.kwargs["url"],
+            "http://mox/organisation/itsystem/uuid-1",
+        )
+        self.utility.ia.session.get.assert_called_once()
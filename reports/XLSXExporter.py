@@ -1,4 +1,4 @@
-from operator import itemgetter
+from typing import Iterable, List, Sequence
 
 import xlsxwriter
 import xlsxwriter.worksheet
@@ -10,34 +10,60 @@ class XLSXExporter:
     Accepts data in lists of lists where first lists contains the title of the columns, eg:
     [["Navn", "Email", "Tilknytningstype", "Enhed"]
     ["Fornavn Efternavn", "email@example.com", "Formand", "Enhed"]]
+
+    The data may also be any iterable of rows, e.g. a generator or a query, which is
+    written in a single pass. With a workbook from :code:`new_workbook`, every row is
+    flushed to disk as it is written, so the memory used does not grow with the
+    number of rows.
     """
 
     def __init__(self, xlsx_file: str):
         self.xlsx_file = xlsx_file
 
+    def new_workbook(self) -> xlsxwriter.Workbook:
+        """Create a workbook writing the rows of its sheets straight to disk.
+
+        The sheets of the workbook must be written one at a time with :code:`add_sheet`.
+        """
+        return xlsxwriter.Workbook(self.xlsx_file, {"constant_memory": True})
+
     @staticmethod
-    def write_rows(worksheet: xlsxwriter.worksheet.Worksheet, data: list):
+    def write_rows(worksheet: xlsxwriter.worksheet.Worksheet, data: Iterable[Sequence]):
         for index, row in enumerate(data):
             worksheet.write_row(index, 0, row)
 
     @staticmethod
-    def get_column_width(data, field: int):
-        data = filter(itemgetter(field), data)
-        field_length = max(len(row[field]) for row in data)
-        return field_length
+    def update_column_widths(widths: List[int], row: Sequence) -> List[int]:
+        """Widen the columns to fit the values of row.
 
-    def add_sheet(self, workbook, sheet: str, data: list):
-        worksheet = workbook.add_worksheet(name=sheet)
-        worksheet.autofilter(0, 0, len(data), len(data[0]) - 1)
+        Example:
+            >>> XLSXExporter.update_column_widths([4, 5], ("Navn Navnesen", None))
+            [13, 5]
+        """
+        return [
+            max(width, len(str(value))) if value else width
+            for width, value in zip(widths, row)
+        ]
 
-        for index in range(len(data[0])):
-            worksheet.set_column(
-                index,
-                index,
-                width=self.get_column_width(data, index),
-            )
+    def add_sheet(self, workbook, sheet: str, data: Iterable[Sequence]):
+        worksheet = workbook.add_worksheet(name=sheet)
 
         bold = workbook.add_format({"bold": 1})
         worksheet.set_row(0, cell_format=bold)
 
-        self.write_rows(worksheet, data)
+        rows = iter(data)
+        header = next(rows)
+        worksheet.write_row(0, 0, header)
+        widths = self.update_column_widths([0] * len(header), header)
+
+        # The column widths and autofilter are written in front of the rows, when
+        # the workbook is closed, so they can be set after the rows are written
+        row_count = 1
+        for index, row in enumerate(rows, start=1):
+            worksheet.write_row(index, 0, row)
+            widths = self.update_column_widths(widths, row)
+            row_count = index + 1
+
+        worksheet.autofilter(0, 0, row_count, len(header) - 1)
+        for index, width in enumerate(widths):
+            worksheet.set_column(index, index, width=width)
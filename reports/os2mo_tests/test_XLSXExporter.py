@@ -67,3 +67,56 @@ class Tests_xlxs(unittest.TestCase):
                 "123456-1234",
             ],
         )
+
+
+class Tests_streaming(unittest.TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+        self.xlsfilename = f.name
+
+    def rows(self, count):
+        yield ("Navn", "Nummer", "Email")
+        for number in range(count):
+            yield ("Fornavn Efternavn {}".format(number), number, None)
+
+    def test_generator_in_constant_memory(self):
+        excel = XLSXExporter(self.xlsfilename)
+        workbook = excel.new_workbook()
+        excel.add_sheet(workbook, "Ansatte", self.rows(1000))
+        excel.add_sheet(workbook, "Tom", self.rows(0))
+        workbook.close()
+
+        wb = load_workbook(filename=self.xlsfilename)
+        ws = wb["Ansatte"]
+        rows = list(ws.values)
+        self.assertEqual(rows, list(self.rows(1000)))
+        self.assertTrue(ws["A1"].font.b)
+        self.assertEqual(ws.auto_filter.ref, "A1:C1002")
+        # Widths as set, plus the padding of the cell margins
+        self.assertAlmostEqual(ws.column_dimensions["A"].width, 21.7109375)
+        self.assertAlmostEqual(ws.column_dimensions["B"].width, 6.7109375)
+        self.assertEqual(list(wb["Tom"].values), [("Navn", "Nummer", "Email")])
+
+    def test_same_sheet_as_lists(self):
+        """Streaming writes the same sheet as writing lists in memory."""
+        streamed = load_workbook(self.write(self.rows(10), constant_memory=True))
+        in_memory = load_workbook(
+            self.write(list(self.rows(10)), constant_memory=False)
+        )
+        for ws in (streamed.active, in_memory.active):
+            self.assertEqual(list(ws.values), list(self.rows(10)))
+        self.assertEqual(
+            streamed.active.auto_filter.ref, in_memory.active.auto_filter.ref
+        )
+        for column in "ABC":
+            self.assertEqual(
+                streamed.active.column_dimensions[column].width,
+                in_memory.active.column_dimensions[column].width,
+            )
+
+    def write(self, data, constant_memory):
+        f = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+        workbook = xlsxwriter.Workbook(f.name, {"constant_memory": constant_memory})
+        XLSXExporter(f.name).add_sheet(workbook, "Ark", data)
+        workbook.close()
+        return f.name
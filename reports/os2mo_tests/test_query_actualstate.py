@@ -17,8 +17,10 @@ from reports.query_actualstate import (
     get_engine,
     list_employees,
     list_MED_members,
+    org_hierarchy,
     sessionmaker,
     set_of_org_units,
+    user_addresses,
 )
 from reports.XLSXExporter import XLSXExporter
 
@@ -143,7 +145,9 @@ class Tests_db(unittest.TestCase):
 
     def test_MED_data(self):
         hoved_enhed = self.session.query(Enhed).all()
-        data = list_MED_members(self.session, {"løn": "LØN-org", "MED": "Hoved-MED"})
+        data = list(
+            list_MED_members(self.session, {"løn": "LØN-org", "MED": "Hoved-MED"})
+        )
         self.assertEqual(
             data[0],
             (
@@ -184,9 +188,52 @@ class Tests_db(unittest.TestCase):
         alle_enheder = set_of_org_units(self.session, "Hoved-MED")
         self.assertEqual(alle_enheder, set(["E2", "E3"]))
 
+    def test_org_hierarchy(self):
+        hierarchy = org_hierarchy(self.session)
+        self.assertIs(org_hierarchy(self.session), hierarchy)
+        self.assertEqual(hierarchy.descendants("E2"), {"E3"})
+        self.assertEqual(hierarchy.descendants("E3"), set())
+
+    def test_user_addresses(self):
+        # The secret address sorts first, and would be picked if not excluded
+        for uuid, titel, værdi, synlighed in [
+            ("A3", "AD-Email", "c@email.dk", None),
+            ("A4", "AD-Email", "b@email.dk", "Offentlig"),
+            ("A5", "AD-Email", "a@email.dk", "Hemmelig"),
+            ("A6", "AD-Telefonnummer", "22222222", None),
+            ("A7", "AD-Telefonnummer", "11111111", "Hemmelig"),
+            ("A8", "Email", "0@email.dk", None),
+        ]:
+            self.session.add(
+                Adresse(
+                    uuid=uuid,
+                    bruger_uuid="b2",
+                    adressetype_scope="TEXT",
+                    adressetype_bvn=titel,
+                    adressetype_titel=titel,
+                    værdi=værdi,
+                    synlighed_titel=synlighed,
+                )
+            )
+        self.session.commit()
+
+        Adresser = user_addresses(
+            self.session, email="AD-Email", telefon="AD-Telefonnummer"
+        )
+        rows = self.session.query(
+            Adresser.c.bruger_uuid, Adresser.c.email, Adresser.c.telefon
+        ).order_by(Adresser.c.bruger_uuid)
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [
+                ("b1", "AD-email@email.dk", "12345678"),
+                ("b2", "b@email.dk", "22222222"),
+            ],
+        )
+
     def test_EMP_data(self):
         hoved_enhed = self.session.query(Enhed).all()
-        data = list_employees(self.session, "LØN-org")
+        data = list(list_employees(self.session, "LØN-org"))
         self.assertEqual(
             data[0],
             ("Navn", "cpr", "AD-Email", "AD-Telefonnummer", "Enhed", "Stilling"),
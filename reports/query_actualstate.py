@@ -5,9 +5,11 @@
 # Program to fetch data from an actualstate sqlitedatabase, written for creating excel-reports with XLSXExporte.py
 # See customers/Frederikshavn/Frederikshavn_reports.py for an example
 
-import xlsxwriter
+from collections import defaultdict
+from typing import Iterable, Iterator, Sequence
+
 from more_itertools import prepend
-from sqlalchemy import case, literal_column, or_
+from sqlalchemy import case, func, literal_column, or_
 from sqlalchemy.orm import Bundle, sessionmaker
 
 from exporters.sql_export.lc_for_jobs_db import get_engine
@@ -21,62 +23,81 @@ from exporters.sql_export.sql_table_defs import (
 from reports.XLSXExporter import XLSXExporter
 
 
-def set_of_org_units(session, org_name: str) -> set:
-    """Find all uuids of org_units under the organisation  :code:`org_name`. """
+class OrgHierarchy:
+    """Index of the org unit tree, read from the database with a single query."""
 
-    hoved_enhed = session.query(Enhed.uuid).filter(Enhed.navn == org_name).one()[0]
-    # Find all children of the unit and collect in a set
-    def find_children(enheder):
-        """Return a set of children under :code:`enheder`."""
-        under_enheder = (
-            session.query(Enhed.uuid)
-            .filter(Enhed.forældreenhed_uuid.in_(enheder))
-            .all()
-        )
-        # query returns a list of tuples like [(uuid2,),(uuid2,)], so extract the first item in each.
-        return set(enheder[0] for enheder in under_enheder)
+    def __init__(self, session):
+        self.children = defaultdict(list)
+        for uuid, parent_uuid in session.query(Enhed.uuid, Enhed.forældreenhed_uuid):
+            self.children[parent_uuid].append(uuid)
 
-    under_enheder = find_children(set([hoved_enhed]))
-    alle_enheder = under_enheder
-    # Update the set with any new units
-    while under_enheder:
-        under_enheder = find_children(under_enheder)
-        alle_enheder.update(under_enheder)
+    def descendants(self, uuid: str) -> set:
+        """Return the uuids of all units below :code:`uuid`."""
+        found = set()
+        stack = [uuid]
+        while stack:
+            for child in self.children[stack.pop()]:
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
 
-    return alle_enheder
 
+def org_hierarchy(session) -> OrgHierarchy:
+    """Return the org unit tree, built once per session."""
+    if "org_hierarchy" not in session.info:
+        session.info["org_hierarchy"] = OrgHierarchy(session)
+    return session.info["org_hierarchy"]
 
-def list_MED_members(session, org_names: dict) -> list:
-    """Lists all "tilknyntninger" to an organisation.
 
-    Returns a list of tuples with titles as first element and data on members in subsequent tuples
-    [("Navn", "Email", "Tilknytningstype", "Enhed"),
-     ("Fornavn Efternavn", "email@example.com", "Formand", "Enhed")]
+def set_of_org_units(session, org_name: str) -> set:
+    """Find all uuids of org_units under the organisation  :code:`org_name`."""
+
+    hoved_enhed = session.query(Enhed.uuid).filter(Enhed.navn == org_name).one()[0]
+    return org_hierarchy(session).descendants(hoved_enhed)
+
+
+def user_addresses(session, **address_types):
+    """Subquery of one non-secret address per user and address type.
+
+    The keyword arguments map column names of the subquery to address type
+    titles, e.g. :code:`user_addresses(session, email="AD-Email")` has the
+    columns :code:`bruger_uuid` and :code:`email`.
     """
-    alle_enheder = set_of_org_units(session, org_names["løn"])
-    alle_MED_enheder = set_of_org_units(session, org_names["MED"])
-    Emails = (
-        session.query(Adresse.værdi, Adresse.bruger_uuid)
+    columns = [
+        func.min(case((Adresse.adressetype_titel == titel, Adresse.værdi))).label(name)
+        for name, titel in address_types.items()
+    ]
+    return (
+        session.query(Adresse.bruger_uuid, *columns)
         .filter(
-            Adresse.adressetype_titel == "AD-Email",
-            or_(
-                Adresse.synlighed_titel == None,
-                Adresse.synlighed_titel != "Hemmelig",
-            ),
-        )
-        .subquery()
-    )
-    Phonenr = (
-        session.query(Adresse.værdi, Adresse.bruger_uuid)
-        .filter(
-            Adresse.adressetype_titel == "AD-Telefonnummer",
+            Adresse.bruger_uuid != None,
+            Adresse.adressetype_titel.in_(address_types.values()),
             or_(
                 Adresse.synlighed_titel == None,
                 Adresse.synlighed_titel != "Hemmelig",
             ),
         )
+        .group_by(Adresse.bruger_uuid)
         .subquery()
     )
+
+
+# Number of rows read from the database at a time
+YIELD_PER = 1000
+
+
+def list_MED_members(session, org_names: dict) -> Iterator[Sequence]:
+    """Lists all "tilknyntninger" to an organisation.
+
+    Returns an iterator of tuples with titles as first element and data on members in subsequent tuples.
+    The members are read from the database as the iterator is consumed
+    [("Navn", "Email", "Tilknytningstype", "Enhed"),
+     ("Fornavn Efternavn", "email@example.com", "Formand", "Enhed")]
+    """
+    alle_enheder = set_of_org_units(session, org_names["løn"])
+    alle_MED_enheder = set_of_org_units(session, org_names["MED"])
+    Adresser = user_addresses(session, email="AD-Email", telefon="AD-Telefonnummer")
     eng_unit = (
         session.query(Enhed.navn, Engagement.bruger_uuid).filter(
             Enhed.uuid == Engagement.enhed_uuid,
@@ -88,8 +109,8 @@ def list_MED_members(session, org_names: dict) -> list:
     query = (
         session.query(
             Bruger.fornavn + " " + Bruger.efternavn,
-            Emails.c.værdi,
-            Phonenr.c.værdi,
+            Adresser.c.email,
+            Adresser.c.telefon,
             Tilknytning.tilknytningstype_titel,
             Enhed.navn,
             eng_unit.c.navn,
@@ -99,65 +120,40 @@ def list_MED_members(session, org_names: dict) -> list:
             Tilknytning.enhed_uuid.in_(alle_MED_enheder),
             Tilknytning.bruger_uuid == Bruger.uuid,
         )
-        .join(Emails, Emails.c.bruger_uuid == Bruger.uuid, isouter=True)
-        .join(Phonenr, Phonenr.c.bruger_uuid == Bruger.uuid, isouter=True)
+        .join(Adresser, Adresser.c.bruger_uuid == Bruger.uuid, isouter=True)
         .join(eng_unit, eng_unit.c.bruger_uuid == Bruger.uuid)
         .order_by(Bruger.efternavn)
     )
-    data = query.all()
-    data = list(
-        prepend(
-            (
-                "Navn",
-                "Email",
-                "Telefonnummer",
-                "Tilknytningstype",
-                "Tilknytningsenhed",
-                "Ansættelsesenhed",
-            ),
-            data,
-        )
+    return prepend(
+        (
+            "Navn",
+            "Email",
+            "Telefonnummer",
+            "Tilknytningstype",
+            "Tilknytningsenhed",
+            "Ansættelsesenhed",
+        ),
+        query.yield_per(YIELD_PER),
     )
-    return data
 
 
-def list_employees(session, org_name: str) -> list:
+def list_employees(session, org_name: str) -> Iterator[Sequence]:
     """Lists all employees in organisation.
 
-    Returns a list of tuples with titles as first element and data on employees in subsequent tuples
+    Returns an iterator of tuples with titles as first element and data on employees in subsequent tuples.
+    The employees are read from the database as the iterator is consumed
     [(Navn", "cpr", "Email", "Telefon", "Enhed", "Stilling"),
      ("Fornavn Efternavn", 0123456789,  "email@example.com", "12345678", "Enhedsnavn", "Stillingsbetegnelse")]
     """
     alle_enheder = set_of_org_units(session, org_name)
 
-    Emails = (
-        session.query(Adresse.værdi, Adresse.bruger_uuid)
-        .filter(
-            Adresse.adressetype_titel == "AD-Email",
-            or_(
-                Adresse.synlighed_titel == None,
-                Adresse.synlighed_titel != "Hemmelig",
-            ),
-        )
-        .subquery()
-    )
-    Phonenr = (
-        session.query(Adresse.værdi, Adresse.bruger_uuid)
-        .filter(
-            Adresse.adressetype_titel == "AD-Telefonnummer",
-            or_(
-                Adresse.synlighed_titel == None,
-                Adresse.synlighed_titel != "Hemmelig",
-            ),
-        )
-        .subquery()
-    )
+    Adresser = user_addresses(session, email="AD-Email", telefon="AD-Telefonnummer")
     query = (
         session.query(
             Bruger.fornavn + " " + Bruger.efternavn,
             Bruger.cpr,
-            Emails.c.værdi,
-            Phonenr.c.værdi,
+            Adresser.c.email,
+            Adresser.c.telefon,
             Enhed.navn,
             Engagement.stillingsbetegnelse_titel,
         )
@@ -166,19 +162,21 @@ def list_employees(session, org_name: str) -> list:
             Engagement.enhed_uuid.in_(alle_enheder),
             Engagement.bruger_uuid == Bruger.uuid,
         )
-        .join(Emails, Emails.c.bruger_uuid == Bruger.uuid, isouter=True)
-        .join(Phonenr, Phonenr.c.bruger_uuid == Bruger.uuid, isouter=True)
+        .join(Adresser, Adresser.c.bruger_uuid == Bruger.uuid, isouter=True)
         .order_by(Bruger.efternavn)
     )
-    data = query.all()
-    data = list(
-        prepend(
-            ("Navn", "cpr", "AD-Email", "AD-Telefonnummer", "Enhed", "Stilling"),
-            data,
-        )
+    return prepend(
+        ("Navn", "cpr", "AD-Email", "AD-Telefonnummer", "Enhed", "Stilling"),
+        query.yield_per(YIELD_PER),
     )
 
-    return data
+
+def write_report(data: Iterable[Sequence], sheetname: str, xlsx_file: str):
+    """Write the rows of a report to an excel file, as they are read."""
+    excel = XLSXExporter(xlsx_file)
+    workbook = excel.new_workbook()
+    excel.add_sheet(workbook, sheetname, data)
+    workbook.close()
 
 
 def run_report(reporttype, sheetname: str, org_name: str, xlsx_file: str):
@@ -189,7 +187,4 @@ def run_report(reporttype, sheetname: str, org_name: str, xlsx_file: str):
     data = reporttype(session, org_name)
 
     # write data as excel file
-    workbook = xlsxwriter.Workbook(xlsx_file)
-    excel = XLSXExporter(xlsx_file)
-    excel.add_sheet(workbook, sheetname, data)
-    workbook.close()
+    write_report(data, sheetname, xlsx_file)
@@ -0,0 +1,157 @@
+"""
+Benchmark of the memory used writing a large report from the actual state database.
+
+A synthetic actual state database is written with an engagement and two addresses
+for each of ``--rows`` employees. The employee report of ``query_actualstate`` is
+then written from it in a child process, streaming the rows to a constant memory
+workbook, and the peak RSS of the child is checked against ``--max-rss-mib``.
+With ``--eager``, the report is also written as before, reading all rows into a
+list and keeping the workbook in memory, for comparison.
+
+    python -m reports.xlsx_benchmark run --rows 500000
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import xlsxwriter
+from more_itertools import chunked
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from exporters.sql_export.lc_for_jobs_db import get_engine
+from exporters.sql_export.sql_table_defs import (
+    Adresse,
+    Base,
+    Bruger,
+    Engagement,
+    Enhed,
+)
+from reports.query_actualstate import list_employees, write_report
+from reports.XLSXExporter import XLSXExporter
+
+ORG_NAME = "LØN-org"
+UNITS = 100
+
+
+def _employees(count):
+    for number in range(count):
+        user = "bruger-{}".format(number)
+        unit = "enhed-{}".format(number % UNITS)
+        yield (
+            dict(uuid=user, bvn=user, fornavn="Fornavn {}".format(number),
+                 efternavn="Efternavn {}".format(number % 1000),
+                 cpr="{:010}".format(number)),
+            dict(uuid="engagement-{}".format(number), bruger_uuid=user,
+                 enhed_uuid=unit, bvn=str(number), engagementstype_titel="Ansat",
+                 primærtype_titel="Ansat", stillingsbetegnelse_titel="Stilling"),
+            [
+                dict(uuid="{}-{}".format(titel, number), bruger_uuid=user,
+                     værdi=værdi, adressetype_bvn=titel, adressetype_scope="",
+                     adressetype_titel=titel, synlighed_titel="Offentlig")
+                for titel, værdi in [
+                    ("AD-Email", "{}@example.com".format(user)),
+                    ("AD-Telefonnummer", "{:08}".format(number)),
+                ]
+            ],
+        )
+
+
+def populate(dbpath: Path, rows: int):
+    """Write the synthetic actual state database."""
+    engine = get_engine(dbpath=dbpath)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.execute(insert(Enhed), [
+        dict(uuid="root", navn=ORG_NAME, enhedstype_titel="Enhed")
+    ] + [
+        dict(uuid="enhed-{}".format(number), navn="Enhed {}".format(number),
+             enhedstype_titel="Enhed", forældreenhed_uuid="root")
+        for number in range(UNITS)
+    ])
+    for chunk in chunked(_employees(rows), 10000):
+        users, engagements, addresses = zip(*chunk)
+        session.execute(insert(Bruger), list(users))
+        session.execute(insert(Engagement), list(engagements))
+        session.execute(insert(Adresse), [a for pair in addresses for a in pair])
+    session.commit()
+    session.close()
+
+
+def run_child(dbpath: Path, xlsx_file: Path, mode: str):
+    """Write the report in a child process, returning its run time and peak RSS."""
+    start = time.monotonic()
+    child = subprocess.Popen([
+        sys.executable, "-m", "reports.xlsx_benchmark", "write",
+        "--db", str(dbpath), "--xlsx-file", str(xlsx_file), "--mode", mode,
+    ])
+    # Unlike getrusage, wait4 reports the peak RSS of this child alone
+    _, status, rusage = os.wait4(child.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise click.ClickException("Writing the {} report failed".format(mode))
+    # In kilobytes on Linux
+    return time.monotonic() - start, rusage.ru_maxrss / 1024
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--db", "dbpath", type=click.Path(), required=True)
+@click.option("--xlsx-file", type=click.Path(), required=True)
+@click.option("--mode", type=click.Choice(["streaming", "eager"]), required=True)
+def write(dbpath, xlsx_file, mode):
+    """Write the employee report from the database."""
+    session = sessionmaker(bind=get_engine(dbpath=dbpath), autoflush=False)()
+    data = list_employees(session, ORG_NAME)
+    if mode == "streaming":
+        write_report(data, "Ansatte", xlsx_file)
+        return
+    # As before streaming, all rows and the workbook in memory
+    workbook = xlsxwriter.Workbook(xlsx_file)
+    XLSXExporter(xlsx_file).add_sheet(workbook, "Ansatte", list(data))
+    workbook.close()
+
+
+@cli.command()
+@click.option("--rows", type=int, default=500000, show_default=True)
+@click.option("--max-rss-mib", type=int, default=150, show_default=True,
+              help="Limit of the peak RSS of streaming the report")
+@click.option("--eager/--no-eager", default=False,
+              help="Also write the report with all rows in memory")
+def run(rows, max_rss_mib, eager):
+    """Benchmark the memory used writing a report of ROWS employees."""
+    with tempfile.TemporaryDirectory() as directory:
+        dbpath = Path(directory) / "actualstate"
+        start = time.monotonic()
+        populate(dbpath, rows)
+        click.echo("Populated {} employees in {:.1f}s".format(
+            rows, time.monotonic() - start
+        ))
+
+        modes = ["streaming", "eager"] if eager else ["streaming"]
+        results = {}
+        for mode in modes:
+            xlsx_file = Path(directory) / "{}.xlsx".format(mode)
+            seconds, rss = run_child(dbpath, xlsx_file, mode)
+            results[mode] = rss
+            click.echo("{:>9}: {:6.1f}s, peak RSS {:7.1f} MiB, {:5.1f} MiB file".format(
+                mode, seconds, rss, xlsx_file.stat().st_size / 2 ** 20
+            ))
+
+    if results["streaming"] > max_rss_mib:
+        raise click.ClickException(
+            "Peak RSS {:.1f} MiB above the limit of {} MiB".format(
+                results["streaming"], max_rss_mib
+            )
+        )
+
+
+if __name__ == "__main__":
+    cli()
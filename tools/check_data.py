@@ -1,26 +1,62 @@
-import requests
-
-from ra_utils.load_settings import load_settings
-from tools.data_fixers.find_duplicate_users import check_duplicate_cpr
-from tools.data_fixers.class_tools import find_duplicates_classes
-
-
-def main():
+import json
+
+import click
+
+from tools.consistency_checks import CHECKS, run_checks, snapshot_from_sql
+
+
+def read_snapshot(source):
+    if source == "sql":
+        from exporters.sql_export.lc_for_jobs_db import get_engine
+
+        return snapshot_from_sql(get_engine())
+
+    from exporters.sql_export.lora_cache import LoraCache
+
+    lc = LoraCache(resolve_dar=False, full_history=False)
+    lc.populate_cache(dry_run=False, skip_associations=True)
+    return lc
+
+
+@click.command()
+@click.option(
+    "--source",
+    type=click.Choice(["lora-cache", "sql"]),
+    default="lora-cache",
+    help="Read the data from LoRa, or from the lc-for-jobs actual state database",
+)
+@click.option(
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="File to write the findings to as JSON, by default stdout",
+)
+@click.option(
+    "--check",
+    "checks",
+    type=click.Choice(list(CHECKS)),
+    multiple=True,
+    help="Check to run, may be repeated. By default all checks are run",
+)
+@click.option(
+    "--fail-on",
+    type=click.Choice(list(CHECKS)),
+    multiple=True,
+    default=["duplicate_classes", "duplicate_cpr"],
+    show_default=True,
+    help="Checks whose findings make the run fail",
+)
+def main(source, output, checks, fail_on):
     """Run checks on MO data"""
-
-    settings = load_settings()
-    mox_base = settings.get("mox.base", "http://localhost:8080/")
-    mora_base = settings.get("mora.base", "http://localhost:5000/")
-
-    session = requests.Session()
-
-    dup = find_duplicates_classes(session=session, mox_base=mox_base)
-    if dup:
-        raise Exception("There are duplicate classes")
-
-    common_cpr = check_duplicate_cpr(mora_base=mora_base)
-    if common_cpr:
-        raise Exception("There are multiple users with the same CPR-number")
+    findings = run_checks(read_snapshot(source), checks)
+    json.dump(findings, output, indent=2, sort_keys=True)
+    output.write("\n")
+
+    failed = [name for name in fail_on if findings.get(name)]
+    for name, found in findings.items():
+        click.echo(f"{name}: {len(found)} findings", err=True)
+    if failed:
+        raise click.ClickException("Checks failed: " + ", ".join(failed))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""
+Consistency checks of the data in MO, run in memory on a single snapshot.
+
+The snapshot is either a populated LoraCache, or read from the actual state
+database of lc-for-jobs with ``snapshot_from_sql``. In both cases it has the
+shape of LoraCache: ``facets`` and ``classes`` are dicts from UUID to a dict,
+while ``users``, ``units``, ``engagements``, ``managers`` and ``addresses`` are
+dicts from UUID to a list of validities.
+
+Every check is a function taking the snapshot and returning a list of
+findings, each a JSON serializable dict. The checks build their own hash
+indexes, so each of them is a linear scan of the snapshot. They are registered
+in ``CHECKS`` and run together by ``run_checks``.
+"""
+from collections import defaultdict
+from itertools import combinations
+from operator import itemgetter
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from sqlalchemy.orm import sessionmaker
+
+from exporters.sql_export.sql_table_defs import (
+    Adresse,
+    Bruger,
+    Engagement,
+    Enhed,
+    Facet,
+    Klasse,
+    Leder,
+)
+
+
+def _overlaps(first: dict, second: dict) -> bool:
+    """Whether two validities overlap, a to_date of None meaning infinity.
+
+    Example:
+        >>> _overlaps({"from_date": "2020-01-01", "to_date": "2020-12-31"},
+        ...           {"from_date": "2020-12-31", "to_date": None})
+        True
+        >>> _overlaps({"from_date": "2020-01-01", "to_date": "2020-12-30"},
+        ...           {"from_date": "2020-12-31", "to_date": None})
+        False
+    """
+    return (first["to_date"] is None or second["from_date"] <= first["to_date"]) and (
+        second["to_date"] is None or first["from_date"] <= second["to_date"]
+    )
+
+
+def _overlapping_pairs(validities: List[dict]) -> List[tuple]:
+    """Find the pairs of overlapping validities, sorted by from_date."""
+    validities = sorted(validities, key=itemgetter("from_date"))
+    return [
+        (first, second)
+        for first, second in combinations(validities, 2)
+        if _overlaps(first, second)
+    ]
+
+
+def _validity(record: dict) -> dict:
+    return {"from": record["from_date"], "to": record["to_date"]}
+
+
+def check_duplicate_cpr(snapshot) -> List[dict]:
+    """Find CPR numbers shared by several users."""
+    users_by_cpr = defaultdict(set)
+    for uuid, validities in snapshot.users.items():
+        for user in validities:
+            users_by_cpr[user["cpr"]].add(uuid)
+    # The CPR numbers themselves are left out of the report on purpose
+    return [
+        {"users": sorted(uuids)}
+        for uuids in users_by_cpr.values()
+        if len(uuids) > 1
+    ]
+
+
+def check_duplicate_classes(snapshot) -> List[dict]:
+    """Find classes in the same facet whose user keys only differ by case."""
+    classes_by_key = defaultdict(list)
+    for uuid, klasse in snapshot.classes.items():
+        key = (klasse["facet"], klasse["user_key"].lower())
+        classes_by_key[key].append({"uuid": uuid, "title": klasse["title"]})
+    return [
+        {
+            "facet": facet,
+            "facet_user_key": snapshot.facets.get(facet, {}).get("user_key"),
+            "user_key": user_key,
+            "classes": sorted(classes, key=itemgetter("uuid")),
+        }
+        for (facet, user_key), classes in classes_by_key.items()
+        if len(classes) > 1
+    ]
+
+
+def check_duplicate_managers(snapshot) -> List[dict]:
+    """Find users managing the same unit several times at the same time."""
+    managers_by_unit_user = defaultdict(list)
+    for uuid, validities in snapshot.managers.items():
+        for manager in validities:
+            # Vacant manager positions are not duplicates of each other
+            if manager["user"] is None:
+                continue
+            managers_by_unit_user[(manager["unit"], manager["user"])].append(
+                manager
+            )
+
+    findings = []
+    for (unit, user), managers in managers_by_unit_user.items():
+        pairs = [
+            (first, second)
+            for first, second in _overlapping_pairs(managers)
+            if first["uuid"] != second["uuid"]
+        ]
+        if pairs:
+            uuids = {manager["uuid"] for pair in pairs for manager in pair}
+            findings.append(
+                {"unit": unit, "user": user, "managers": sorted(uuids)}
+            )
+    return findings
+
+
+def check_overlapping_engagements(snapshot) -> List[dict]:
+    """Find engagements overlapping themselves or a namesake.
+
+    The validities of an engagement must not overlap each other, and a user
+    must not have several engagements with the same user key at the same time.
+    """
+    findings = []
+    engagements_by_user_key = defaultdict(list)
+    for uuid, validities in snapshot.engagements.items():
+        for first, second in _overlapping_pairs(validities):
+            findings.append(
+                {
+                    "reason": "overlapping validities",
+                    "user": first["user"],
+                    "engagements": [uuid],
+                    "validities": [_validity(first), _validity(second)],
+                }
+            )
+        for engagement in validities:
+            key = (engagement["user"], engagement["user_key"])
+            engagements_by_user_key[key].append(engagement)
+
+    for (user, user_key), engagements in engagements_by_user_key.items():
+        for first, second in _overlapping_pairs(engagements):
+            if first["uuid"] == second["uuid"]:
+                continue
+            findings.append(
+                {
+                    "reason": "same user key",
+                    "user": user,
+                    "user_key": user_key,
+                    "engagements": [first["uuid"], second["uuid"]],
+                    "validities": [_validity(first), _validity(second)],
+                }
+            )
+    return findings
+
+
+def check_orphaned_parents(snapshot) -> List[dict]:
+    """Find units whose parent does not exist."""
+    findings = []
+    for uuid, validities in snapshot.units.items():
+        for unit in validities:
+            parent = unit["parent"]
+            if parent is not None and parent not in snapshot.units:
+                findings.append(
+                    {"unit": uuid, "parent": parent, "validity": _validity(unit)}
+                )
+    return findings
+
+
+def check_dangling_address_types(snapshot) -> List[dict]:
+    """Find addresses whose address type is not a class."""
+    return [
+        {
+            "address": uuid,
+            "address_type": address["adresse_type"],
+            "user": address["user"],
+            "unit": address["unit"],
+            "validity": _validity(address),
+        }
+        for uuid, validities in snapshot.addresses.items()
+        for address in validities
+        if address["adresse_type"] not in snapshot.classes
+    ]
+
+
+CHECKS: Dict[str, Callable] = {
+    "duplicate_cpr": check_duplicate_cpr,
+    "duplicate_classes": check_duplicate_classes,
+    "duplicate_managers": check_duplicate_managers,
+    "overlapping_engagements": check_overlapping_engagements,
+    "orphaned_parents": check_orphaned_parents,
+    "dangling_address_types": check_dangling_address_types,
+}
+
+
+def run_checks(snapshot, checks=None) -> Dict[str, List[dict]]:
+    """Run the checks on the snapshot.
+
+    :param snapshot: LoraCache or snapshot from ``snapshot_from_sql``.
+    :param checks: Names of the checks to run, by default all of ``CHECKS``.
+    :return: Dict from the name of each check to its findings.
+    """
+    checks = checks or list(CHECKS)
+    return {name: CHECKS[name](snapshot) for name in checks}
+
+
+def snapshot_from_sql(engine):
+    """Read a snapshot from an actual state database, see lc_for_jobs_db."""
+    session = sessionmaker(bind=engine)()
+
+    def group(rows):
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[row["uuid"]].append(row)
+        return dict(grouped)
+
+    def validity(row):
+        return {"from_date": row.startdato, "to_date": row.slutdato}
+
+    try:
+        return SimpleNamespace(
+            facets={row.uuid: {"user_key": row.bvn} for row in session.query(Facet)},
+            classes={
+                row.uuid: {
+                    "user_key": row.bvn,
+                    "title": row.titel,
+                    "facet": row.facet_uuid,
+                }
+                for row in session.query(Klasse)
+            },
+            users=group(
+                dict(uuid=row.uuid, cpr=row.cpr, **validity(row))
+                for row in session.query(Bruger)
+            ),
+            units=group(
+                dict(uuid=row.uuid, parent=row.forældreenhed_uuid, **validity(row))
+                for row in session.query(Enhed)
+            ),
+            engagements=group(
+                dict(
+                    uuid=row.uuid,
+                    user=row.bruger_uuid,
+                    unit=row.enhed_uuid,
+                    user_key=row.bvn,
+                    **validity(row),
+                )
+                for row in session.query(Engagement)
+            ),
+            managers=group(
+                dict(
+                    uuid=row.uuid,
+                    user=row.bruger_uuid,
+                    unit=row.enhed_uuid,
+                    **validity(row),
+                )
+                for row in session.query(Leder)
+            ),
+            addresses=group(
+                dict(
+                    uuid=row.uuid,
+                    user=row.bruger_uuid,
+                    unit=row.enhed_uuid,
+                    adresse_type=row.adressetype_uuid,
+                    **validity(row),
+                )
+                for row in session.query(Adresse)
+            ),
+        )
+    finally:
+        session.close()
@@ -448,7 +448,9 @@ for module in tools/job-runner.d/*.sh; do
     source $module 
 done
 
-prometrics-git
+# jobs run by the job scheduler or measured by tools/job_metrics.py are run
+# by job-runner.sh themselves
+[ -z "${JOB_SCHEDULER_DIR}" -a -z "${JOB_METRICS_JOB}" ] && prometrics-git
 
 # imports are typically interdependent: -e
 imports(){
@@ -625,6 +627,30 @@ reports(){
     fi
 }
 
+# imports, exports and reports run concurrently by tools/job_scheduler.py
+# in the order of the dependencies declared there - all are skipped if the
+# backup is in error, as imports depend on backup
+scheduled_jobs(){
+    export JOB_SCHEDULER_DIR=$(mktemp -d)
+    ${VENV}/bin/python3 -m tools.job_scheduler \
+        --workers ${JOB_SCHEDULER_WORKERS:=4} \
+        --backup-ok ${BACKUP_OK} \
+        --status-file ${DIPEXAR}/tmp/job-scheduler-status.json \
+        --env-file ${JOB_SCHEDULER_DIR}/status.env
+    local STATUS=$?
+
+    # collect the files to back up from the jobs
+    [ -f "${JOB_SCHEDULER_DIR}/back_up_after_jobs" ] \
+        && BACK_UP_AFTER_JOBS+=($(cat "${JOB_SCHEDULER_DIR}/back_up_after_jobs"))
+    [ -f "${JOB_SCHEDULER_DIR}/back_up_and_truncate" ] \
+        && BACK_UP_AND_TRUNCATE+=($(cat "${JOB_SCHEDULER_DIR}/back_up_and_truncate"))
+    # sets IMPORTS_OK, EXPORTS_OK and REPORTS_OK
+    [ -f "${JOB_SCHEDULER_DIR}/status.env" ] && source "${JOB_SCHEDULER_DIR}/status.env"
+    rm -r "${JOB_SCHEDULER_DIR}"
+    unset JOB_SCHEDULER_DIR
+    return $STATUS
+}
+
 pre_truncate_logfiles(){
     # logfiles are truncated before each run as 
     [ -f "udvalg.log" ] && truncate -s 0 "udvalg.log" 
@@ -811,9 +837,13 @@ if [ "${JOB_RUNNER_MODE}" == "running" -a "$#" == "0" ]; then
 
         pre_backup
         run-job sanity_check_mo_data || echo Sanity check failed
-        run-job imports && IMPORTS_OK=true
-        run-job exports && EXPORTS_OK=true
-        run-job reports && REPORTS_OK=true
+        if [ "${RUN_JOB_SCHEDULER}" == "true" ]; then
+            run-job scheduled_jobs
+        else
+            run-job imports && IMPORTS_OK=true
+            run-job exports && EXPORTS_OK=true
+            run-job reports && REPORTS_OK=true
+        fi
         echo
         show_status
         post_backup
@@ -827,8 +857,25 @@ if [ "${JOB_RUNNER_MODE}" == "running" -a "$#" == "0" ]; then
      
 elif [ "${JOB_RUNNER_MODE}" == "running" ]; then
     if [ -n "$(grep $1\(\) $0)" ]; then
+        if [ -n "${JOB_METRICS_DIR}" -a -z "${JOB_METRICS_JOB}" ]; then
+            # run the job again, measuring its resource usage
+            exec ${VENV}/bin/python3 -m tools.job_metrics --job $1 \
+                --textfile-dir ${JOB_METRICS_DIR} \
+                ${CRON_LOG_PROM_API:+--pushgateway ${CRON_LOG_PROM_API}} \
+                -- bash ${DIPEXAR}/tools/job-runner.sh $1
+        fi
         echo running single job function
         run-job $1
+        JOB_STATUS=$?
+        if [ -n "${JOB_SCHEDULER_DIR}" ]; then
+            # hand the files to back up to the job-runner running the scheduler
+            printf "%s\n" "${BACK_UP_AFTER_JOBS[@]}" >> ${JOB_SCHEDULER_DIR}/back_up_after_jobs
+            printf "%s\n" "${BACK_UP_AND_TRUNCATE[@]}" >> ${JOB_SCHEDULER_DIR}/back_up_and_truncate
+        fi
+        exit ${JOB_STATUS}
+    else
+        echo no such job function: $1
+        exit 1
     fi
 elif [ "${JOB_RUNNER_MODE}" == "sourced" ]; then
     # export essential functions
@@ -0,0 +1,198 @@
+"""
+Run a job and export its resource usage as Prometheus metrics.
+
+The job is run as a child process, and when it is done the following metrics
+are written in the Prometheus text format to ``<textfile-dir>/<job>.prom``,
+for the textfile collector of node_exporter. They can also be pushed to the
+pushgateway, next to the start and end times pushed by run-job:
+
+* Wall time, and user and system CPU time of the job.
+* Peak resident set size of the job, its largest process that is.
+* Number of HTTP responses from MO and LoRa by status code, and a histogram of
+  their latency, as recorded by ``os2mo_helpers.request_metrics`` in the
+  requests of ``MoraHelper`` and ``LoraCache``.
+
+The CPU times and peak RSS are those of the terminated children of this
+process, as reported by ``getrusage``. Processes started by the job count as
+well, as long as they are waited for.
+
+job-runner.sh runs single jobs through this module when
+``crontab.JOB_METRICS_DIR`` is set, which includes every job run by the job
+scheduler, see ``tools/job_scheduler.py``.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+import click
+import requests
+
+from os2mo_helpers.request_metrics import BUCKETS, REQUESTS_DIR_ENV, merge
+
+# Set for the job, such that job-runner.sh knows that it is being measured
+JOB_ENV = "JOB_METRICS_JOB"
+
+
+@dataclass
+class JobMetrics:
+    job: str
+    returncode: int
+    end_time: float
+    wall_seconds: float
+    user_seconds: float
+    system_seconds: float
+    max_rss_bytes: int
+    requests: Dict[str, dict] = field(default_factory=dict)
+
+
+def run_job(job: str, command: List[str]) -> JobMetrics:
+    """Run command as job, and measure it.
+
+    The output of the job is not captured.
+    """
+    with tempfile.TemporaryDirectory() as requests_dir:
+        env = dict(os.environ, **{REQUESTS_DIR_ENV: requests_dir, JOB_ENV: job})
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.monotonic()
+        returncode = subprocess.run(command, env=env).returncode
+        wall_seconds = time.monotonic() - start
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        request_metrics = merge(
+            json.loads(path.read_text()) for path in Path(requests_dir).iterdir()
+        )
+
+    return JobMetrics(
+        job=job,
+        returncode=returncode,
+        end_time=time.time(),
+        wall_seconds=wall_seconds,
+        user_seconds=after.ru_utime - before.ru_utime,
+        system_seconds=after.ru_stime - before.ru_stime,
+        # In kilobytes on Linux
+        max_rss_bytes=after.ru_maxrss * 1024,
+        requests=request_metrics,
+    )
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def _format_bound(bound: float) -> str:
+    """Format a histogram bucket bound, as the Prometheus client does.
+
+    Example:
+        >>> [_format_bound(bound) for bound in (0.005, 1.0, 10.0)]
+        ['0.005', '1.0', '10.0']
+    """
+    return repr(float(bound))
+
+
+def to_textfile(metrics: JobMetrics) -> str:
+    """Format the metrics of a job in the Prometheus text format."""
+    job = _labels(dipex_job=metrics.job)
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{suffix}{{{labels}}} {value}"
+                     for suffix, labels, value in samples)
+
+    for name, description, value in [
+        ("mo_job_end_time", "Unixtime for job end time", metrics.end_time),
+        ("mo_job_return_code", "Return code of job", metrics.returncode),
+        ("mo_job_wall_seconds", "Wall time of job", metrics.wall_seconds),
+        ("mo_job_user_cpu_seconds", "User CPU time of job", metrics.user_seconds),
+        ("mo_job_system_cpu_seconds", "System CPU time of job",
+         metrics.system_seconds),
+        ("mo_job_max_rss_bytes", "Peak resident set size of the processes of job",
+         metrics.max_rss_bytes),
+    ]:
+        metric(name, "gauge", description, [("", job, value)])
+
+    clients = sorted(metrics.requests.items())
+    metric(
+        "mo_job_http_responses",
+        "gauge",
+        "Number of HTTP responses by client and status code",
+        [
+            ("", _labels(dipex_job=metrics.job, client=client, code=code), count)
+            for client, observed in clients
+            for code, count in sorted(observed["responses"].items())
+        ],
+    )
+
+    samples = []
+    for client, observed in clients:
+        cumulative = 0
+        bounds = [_format_bound(bound) for bound in BUCKETS] + ["+Inf"]
+        for bound, count in zip(bounds, observed["buckets"]):
+            cumulative += count
+            labels = _labels(dipex_job=metrics.job, client=client, le=bound)
+            samples.append(("_bucket", labels, cumulative))
+        labels = _labels(dipex_job=metrics.job, client=client)
+        samples.append(("_sum", labels, observed["sum"]))
+        samples.append(("_count", labels, cumulative))
+    metric(
+        "mo_job_http_request_duration_seconds",
+        "histogram",
+        "Latency of HTTP requests by client",
+        samples,
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(metrics: JobMetrics, directory) -> Path:
+    """Write the metrics to directory, replacing the file atomically."""
+    path = Path(directory) / f"{metrics.job}.prom"
+    temporary = path.with_suffix(".prom.tmp")
+    temporary.write_text(to_textfile(metrics))
+    os.replace(temporary, path)
+    return path
+
+
+def push(metrics: JobMetrics, pushgateway: str):
+    """Push the metrics to the pushgateway, in the group of the job."""
+    try:
+        response = requests.post(
+            f"{pushgateway}/{metrics.job}", data=to_textfile(metrics), timeout=2
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        click.echo(f"Unable to push job metrics: {e}", err=True)
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option("--job", required=True, help="Name of the job")
+@click.option(
+    "--textfile-dir",
+    type=click.Path(file_okay=False, exists=True),
+    required=True,
+    help="Directory to write the metrics to, as <job>.prom",
+)
+@click.option("--pushgateway", help="URL of a pushgateway to push the metrics to")
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED)
+def cli(job, textfile_dir, pushgateway, command):
+    """Run COMMAND as job, and export its resource usage as Prometheus metrics."""
+    metrics = run_job(job, list(command))
+    write_textfile(metrics, textfile_dir)
+    if pushgateway:
+        push(metrics, pushgateway)
+    # As the shell reports jobs killed by a signal
+    returncode = metrics.returncode
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == "__main__":
+    cli()
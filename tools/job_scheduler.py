@@ -0,0 +1,358 @@
+"""
+Run the jobs of job-runner.sh concurrently, in the order of their dependencies.
+
+job-runner.sh runs every enabled job in sequence. Most exports and reports only
+read MO or the lc-for-jobs database, so they need not wait for each other.
+Here every job declares what it must run after, and which shared resources it
+must not use concurrently with other jobs, e.g. the LoraCache pickle files in
+tmp/. Jobs are then run as soon as their dependencies are done, with at most
+``workers`` jobs at a time.
+
+The dependencies follow the sequence of job-runner.sh:
+
+* Imports run one at a time in the order of ``JOBS``, and a failed import
+  stops the following imports, as imports are typically interdependent.
+* Exports and reports run after all imports, and only if they all succeeded.
+* A job is skipped if a job it runs after has failed or was skipped. Jobs it
+  runs after, which are not enabled, are ignored.
+* Every job is skipped if the backup before the jobs failed, as the imports
+  depend on it.
+
+Jobs are enabled by the same ``crontab.RUN_*`` settings as in job-runner.sh,
+and every job is run through ``job-runner.sh <job>``, such that the logging,
+prometheus metrics and backup lists of run-job are kept. The output of every
+job is printed as a block, when the job is done.
+
+When done, the scheduler writes the status of every job as JSON, and the
+IMPORTS_OK, EXPORTS_OK and REPORTS_OK variables for job-runner.sh to source.
+"""
+import json
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+from ra_utils.load_settings import load_settings
+
+JOB_RUNNER_COMMAND = ("bash", "tools/job-runner.sh", "{job}")
+
+IMPORTS = "imports"
+EXPORTS = "exports"
+REPORTS = "reports"
+
+# Shared resources
+LORA_CACHE = "lora-cache"  # The pickle files of LoraCache in tmp/
+AD = "ad"  # Jobs writing to AD
+STS_ORGANISATION = "sts-organisation"  # Jobs writing to STS Organisation
+
+
+@dataclass(frozen=True)
+class Job:
+    """A job of job-runner.sh.
+
+    :param name: Name of the job function in job-runner.sh.
+    :param phase: IMPORTS, EXPORTS or REPORTS.
+    :param switch: The crontab setting enabling the job, without the prefix.
+    :param after: Names of jobs which must be done before this job.
+    :param locks: Resources which may only be used by one job at a time.
+    :param required: Whether a failure fails the phase of the job.
+    :param command: Command to run, by default the job of job-runner.sh.
+    """
+
+    name: str
+    phase: str
+    switch: str
+    after: Tuple[str, ...] = ()
+    locks: Tuple[str, ...] = ()
+    required: bool = True
+    command: Optional[Tuple[str, ...]] = None
+
+
+JOBS = [
+    Job("imports_mox_db_clear", IMPORTS, "RUN_MOX_DB_CLEAR"),
+    Job("imports_test_ad_connectivity", IMPORTS, "RUN_CHECK_AD_CONNECTIVITY"),
+    Job("imports_test_sd_connectivity", IMPORTS, "RUN_CHECK_SD_CONNECTIVITY"),
+    Job("imports_test_opus_connectivity", IMPORTS, "RUN_CHECK_OPUS_CONNECTIVITY"),
+    Job("imports_sd_fix_departments", IMPORTS, "RUN_SD_FIX_DEPARTMENTS"),
+    Job("imports_sd_changed_at", IMPORTS, "RUN_SD_CHANGED_AT"),
+    Job("imports_sd_update_primary", IMPORTS, "RUN_SD_UPDATE_PRIMARY"),
+    Job("imports_opus_diff_import", IMPORTS, "RUN_OPUS_DIFF_IMPORT"),
+    Job("imports_ad_sync", IMPORTS, "RUN_AD_SYNC"),
+    Job("imports_ballerup_apos", IMPORTS, "RUN_BALLERUP_APOS"),
+    Job("imports_ballerup_udvalg", IMPORTS, "RUN_BALLERUP_UDVALG"),
+    Job("imports_ad_group_into_mo", IMPORTS, "RUN_AD_GROUP_INTO_MO"),
+    Job("imports_kle_online", IMPORTS, "RUN_KLE_ONLINE"),
+    Job("imports_opgavefordeler", IMPORTS, "RUN_OPGAVEFORDELER"),
+    Job("imports_dummy", IMPORTS, "RUN_IMPORTS_DUMMY"),
+    Job(
+        "exports_lc_for_jobs_db", EXPORTS, "RUN_LC_FOR_JOBS_DB_EXPORT",
+        locks=(LORA_CACHE,),
+    ),
+    Job(
+        "exports_actual_state_export", EXPORTS, "RUN_ACTUAL_STATE_EXPORT",
+        locks=(LORA_CACHE,),
+    ),
+    Job(
+        "exports_historic_sql_export", EXPORTS, "RUN_HISTORIC_SQL_EXPORT",
+        locks=(LORA_CACHE,),
+    ),
+    Job(
+        "exports_os2sync", EXPORTS, "RUN_OS2SYNC",
+        after=("exports_lc_for_jobs_db",), locks=(STS_ORGANISATION,),
+    ),
+    Job(
+        "exports_mox_stsorgsync", EXPORTS, "RUN_MOX_STS_ORGSYNC",
+        locks=(STS_ORGANISATION,),
+    ),
+    Job("exports_queries_ballerup", EXPORTS, "RUN_QUERIES_BALLERUP"),
+    Job(
+        "exports_viborg_emus", EXPORTS, "RUN_EXPORT_EMUS",
+        after=("exports_lc_for_jobs_db",),
+    ),
+    Job(
+        "exports_viborg_eksterne", EXPORTS, "RUN_EXPORTS_VIBORG_EKSTERNE",
+        locks=(LORA_CACHE,),
+    ),
+    Job(
+        "exports_os2phonebook_export", EXPORTS, "RUN_EXPORTS_OS2MO_PHONEBOOK",
+        after=("exports_lc_for_jobs_db",),
+    ),
+    Job(
+        "exports_sync_mo_uuid_to_ad", EXPORTS, "RUN_EXPORTS_MO_UUID_TO_AD",
+        locks=(AD,),
+    ),
+    Job("exports_cpr_uuid", EXPORTS, "RUN_CPR_UUID"),
+    Job(
+        "exports_ad_life_cycle", EXPORTS, "RUN_EXPORTS_AD_LIFE_CYCLE",
+        after=("exports_sync_mo_uuid_to_ad",), locks=(AD, LORA_CACHE),
+    ),
+    Job(
+        "exports_mo_to_ad_sync", EXPORTS, "RUN_EXPORTS_MO_TO_AD_SYNC",
+        after=("exports_ad_life_cycle",), locks=(AD, LORA_CACHE),
+    ),
+    Job(
+        "exports_mox_rollekatalog", EXPORTS, "RUN_MOX_ROLLE",
+        after=("exports_cpr_uuid",),
+    ),
+    Job(
+        "exports_plan2learn", EXPORTS, "RUN_PLAN2LEARN",
+        locks=(LORA_CACHE,),
+    ),
+    Job("exports_test", EXPORTS, "RUN_EXPORTS_TEST"),
+    Job("exports_dummy", EXPORTS, "RUN_EXPORTS_DUMMY"),
+    Job("reports_sd_db_overview", REPORTS, "RUN_SD_DB_OVERVIEW"),
+    Job(
+        "reports_opus_db_overview", REPORTS, "RUN_OPUS_DB_OVERVIEW",
+        required=False,
+    ),
+    Job("reports_viborg_managers", REPORTS, "RUN_VIBORG_MANAGERS"),
+    Job(
+        "reports_frederikshavn", REPORTS, "RUN_REPORTS_FREDERIKSHAVN",
+        after=("exports_lc_for_jobs_db",),
+    ),
+    Job("reports_csv", REPORTS, "RUN_REPORTS_CSV"),
+    Job("reports_dummy", REPORTS, "RUN_REPORTS_DUMMY"),
+]
+
+
+def _isoformat(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+@dataclass
+class JobResult:
+    status: str  # success, failed or skipped
+    returncode: Optional[int] = None
+    start: Optional[float] = None
+    end: Optional[float] = None
+    output: str = field(default="", repr=False)
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "returncode": self.returncode,
+            "start": _isoformat(self.start),
+            "end": _isoformat(self.end),
+            "seconds": self.end - self.start if self.start else None,
+        }
+
+
+def enabled_jobs(jobs: List[Job], settings: dict) -> List[Job]:
+    """The jobs switched on by their crontab setting."""
+    return [job for job in jobs if settings.get("crontab." + job.switch) is True]
+
+
+def dependencies(jobs: List[Job]) -> Dict[str, List[str]]:
+    """Find the jobs which each of the jobs must run after.
+
+    Example:
+        >>> jobs = [Job("i1", IMPORTS, "I1"), Job("i2", IMPORTS, "I2"),
+        ...         Job("e1", EXPORTS, "E1"), Job("e2", EXPORTS, "E2",
+        ...         after=("e1", "not_enabled"))]
+        >>> dependencies(jobs)
+        {'i1': [], 'i2': ['i1'], 'e1': ['i1', 'i2'], 'e2': ['i1', 'i2', 'e1']}
+    """
+    names = {job.name for job in jobs}
+    imports = [job.name for job in jobs if job.phase == IMPORTS]
+    found = {}
+    for job in jobs:
+        if job.phase == IMPORTS:
+            after = imports[: imports.index(job.name)]
+        else:
+            after = list(imports)
+        after += [name for name in job.after if name in names]
+        found[job.name] = after
+    return found
+
+
+class Scheduler:
+    """Run jobs in the order of their dependencies, concurrently.
+
+    :param jobs: The enabled jobs.
+    :param workers: Number of jobs to run at a time.
+    :param command: The command to run a job, where ``{job}`` is replaced by
+        the name of the job. Not used for jobs with a command of their own.
+    :param echo: Function printing the output of the jobs.
+    :param backup_ok: Whether the backup before the jobs succeeded.
+    """
+
+    def __init__(
+        self, jobs, workers=4, command=JOB_RUNNER_COMMAND, echo=print, backup_ok=True
+    ):
+        self.jobs = {job.name: job for job in jobs}
+        self.after = dependencies(jobs)
+        self.workers = workers
+        self.command = command
+        self.echo = echo
+        self.backup_ok = backup_ok
+
+    def _run_job(self, job: Job) -> JobResult:
+        command = job.command or [
+            part.format(job=job.name) for part in self.command
+        ]
+        start = time.time()
+        process = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        status = "success" if process.returncode == 0 else "failed"
+        return JobResult(
+            status, process.returncode, start, time.time(), process.stdout
+        )
+
+    def _is_blocked(self, name, results):
+        return any(
+            results[dependency].status != "success"
+            for dependency in self.after[name]
+        )
+
+    def run(self) -> Dict[str, JobResult]:
+        """Run all jobs.
+
+        :return: Dict from job name to its result, in the order of the jobs.
+        """
+        if not self.backup_ok:
+            self.echo("ERROR: backup is in error - skipping all jobs")
+            return {name: JobResult("skipped") for name in self.jobs}
+
+        results: Dict[str, JobResult] = {}
+        waiting = list(self.jobs)
+        running = {}
+        locked = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while waiting or running:
+                progress = False
+                for name in list(waiting):
+                    job = self.jobs[name]
+                    if any(dependency not in results
+                           for dependency in self.after[name]):
+                        continue
+                    if self._is_blocked(name, results):
+                        waiting.remove(name)
+                        results[name] = JobResult("skipped")
+                        self.echo(f"Skipping {name}, as a job before it failed")
+                        progress = True
+                        continue
+                    if len(running) >= self.workers:
+                        break
+                    if locked.intersection(job.locks):
+                        continue
+                    waiting.remove(name)
+                    locked.update(job.locks)
+                    self.echo(f"Starting {name}")
+                    running[executor.submit(self._run_job, job)] = job
+                    progress = True
+
+                if not running:
+                    # Skipped jobs may unblock others, otherwise we are stuck
+                    if not progress:
+                        raise ValueError(f"Cyclic dependencies between {waiting}")
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    locked.difference_update(job.locks)
+                    result = future.result()
+                    results[job.name] = result
+                    self.echo(
+                        f"----- {job.name}: {result.status} "
+                        f"({result.end - result.start:.0f}s) -----"
+                    )
+                    self.echo(result.output.rstrip())
+
+        return {name: results[name] for name in self.jobs}
+
+    def phase_status(self, results: Dict[str, JobResult]) -> Dict[str, bool]:
+        """Find the IMPORTS_OK, EXPORTS_OK and REPORTS_OK of job-runner.sh."""
+        def phase_ok(phase):
+            return all(
+                results[name].status == "success"
+                for name, job in self.jobs.items()
+                if job.phase == phase and job.required
+            )
+
+        imports_ok = self.backup_ok and phase_ok(IMPORTS)
+        return {
+            "IMPORTS_OK": imports_ok,
+            "EXPORTS_OK": imports_ok and phase_ok(EXPORTS),
+            "REPORTS_OK": imports_ok and phase_ok(REPORTS),
+        }
+
+
+@click.command()
+@click.option("--workers", type=int, default=4, show_default=True,
+              help="Number of jobs to run at a time")
+@click.option("--status-file", type=click.Path(dir_okay=False), required=True,
+              help="File to write the status of every job to, as JSON")
+@click.option("--env-file", type=click.Path(dir_okay=False), required=True,
+              help="File to write the status of the phases to, for bash")
+@click.option("--backup-ok", type=bool, default=True, show_default=True,
+              help="Whether the backup before the jobs succeeded")
+def cli(workers, status_file, env_file, backup_ok):
+    """Run the enabled jobs of job-runner.sh concurrently."""
+    jobs = enabled_jobs(JOBS, load_settings())
+    scheduler = Scheduler(jobs, workers=workers, backup_ok=backup_ok)
+    results = scheduler.run()
+
+    Path(status_file).write_text(
+        json.dumps(
+            {name: result.to_dict() for name, result in results.items()}, indent=2
+        )
+    )
+    phases = scheduler.phase_status(results)
+    Path(env_file).write_text(
+        "".join(f"{key}={str(value).lower()}\n" for key, value in phases.items())
+    )
+    for name, result in results.items():
+        click.echo(f"{name}: {result.status}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -14,14 +14,14 @@ log_file = pathlib.Path.cwd() / 'mo_integrations.log_initial_import'
 log_text = log_file.read_text()
 
 pos = 0
-managers = []
+managers = set()
 double_managers = []
 while pos > -1:
     pos = log_text.find('Manager ', pos + 1)
     end = log_text.find('\n', pos)
     manager = log_text[pos:end]
     if manager not in managers:
-        managers.append(manager)
+        managers.add(manager)
     else:
         double_managers.append(manager)
 
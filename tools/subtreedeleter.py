@@ -1,26 +1,43 @@
-import asyncio
-import itertools
-import sys
-import typing
-import urllib.parse
-from queue import Queue
-from typing import List
+"""
+Delete an organisational unit, all units below it and optionally their functions.
+
+The deletion is planned before anything is deleted. The current unit tree and the
+organisation functions referring to units of the subtree are read in bulk, either
+by paged scans of LoRa, or from the historic LoraCache snapshot in tmp/. The plan
+deletes the functions first, and then the units a level at a time, leaves before
+their parents.
+
+The plan is executed with at most ``connections`` requests in flight at a time.
+Requests failing with a 5xx status, a connection error or a timeout are retried
+with jittered exponential backoff. If any deletion of a step fails, the following
+steps are not started, such that no unit is deleted before the units below it.
+With a journal, the UUIDs of the deleted objects are recorded, such that an
+interrupted run can be started over, skipping the objects already deleted.
+"""
+import datetime
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import aiohttp
 import click
-import requests
-import tqdm
-from more_itertools import flatten, one
 from mox_helpers.utils import async_to_sync
-from tqdm.asyncio import tqdm
+from os2mo_helpers.retry import RetryPolicy
+from os2mo_helpers.submission import Journal, submit_all
 
 from ra_utils.load_settings import load_settings
 
+logger = logging.getLogger("subtreedeleter")
+
+UNIT_PATH = "organisation/organisationenhed"
+FUNCTION_PATH = "organisation/organisationfunktion"
 
 all_functionnames = [
     "Engagement",
     "Leder",
-    "Addresse",
+    "Adresse",
     "Tilknytning",
     "Rolle",
     "KLE",
@@ -30,125 +47,299 @@ all_functionnames = [
 ]
 
 
-class SubtreeDeleter:
-    def __init__(self, session, subtree_uuid, connections: int = 4):
-        self.session = session
-        settings = load_settings()
-        self.mora_base = settings.get("mora.base")
-        self.mox_base = settings.get("mox.base")
-        self.sem = asyncio.Semaphore(connections)
+class DeletionError(Exception):
+    """Raised when some objects could not be deleted."""
 
-    async def get_org_uuid(self):
-        async with self.session.get(f"{self.mora_base}/service/o/") as r:
-            r.raise_for_status()
-            r = await r.json()
-            return one(r)["uuid"]
+    def __init__(self, failed: List[Tuple[str, str]]):
+        self.failed = failed
+        super().__init__(f"{len(failed)} objects could not be deleted")
 
-    async def get_tree(self, org_uuid):
-        async with self.session.get(
-            f"{self.mora_base}/service/o/{org_uuid}/ou/tree"
-        ) as r:
-            r.raise_for_status()
-            return await r.json()
 
-    async def get_associated_org_func(
-        self, org_unit_uuid: str, funktionsnavn: str = None
-    ):
-        url = f"{self.mox_base}/organisation/organisationfunktion?tilknyttedeenheder={org_unit_uuid}&virkningfra=-infinity&virkningtil=infinity"
-        if funktionsnavn:
-            funktionsnavn = urllib.parse.quote(funktionsnavn)
-            url += f"&funktionsnavn={funktionsnavn}"
-        async with self.session.get(url) as r:
-            r.raise_for_status()
-            r = await r.json()
-            return one(r["results"])
-
-    @staticmethod
-    def find_subtree(subtree_uuid: str, trees: typing.List[dict]):
-        queue = Queue()
-        for tree in trees:
-            queue.put(tree)
-
-        while not queue.empty():
-            tree = queue.get()
-            if tree["uuid"] == subtree_uuid:
-                return tree
-            if tree.get("children"):
-                for child in tree.get("children"):
-                    queue.put(child)
+def subtree_levels(
+    parents: Dict[str, Optional[str]], subtree_uuid: str
+) -> List[List[str]]:
+    """Find the units of a subtree, a level at a time from the top.
+
+    :param parents: The parent of every unit.
+    :param subtree_uuid: The unit at the top of the subtree.
 
+    Example:
+        >>> subtree_levels({"a": None, "b": "a", "c": "b", "d": "a", "e": None}, "a")
+        [['a'], ['b', 'd'], ['c']]
+    """
+    if subtree_uuid not in parents:
         raise click.ClickException("{} not found".format(subtree_uuid))
+    children = defaultdict(list)
+    for uuid, parent in parents.items():
+        children[parent].append(uuid)
 
-    def get_tree_uuids(self, tree: dict):
-        uuids = [tree["uuid"]]
-        children = tree.get("children")
-        if children:
-            for subtree in tree["children"]:
-                uuids += self.get_tree_uuids(subtree)
-        return uuids
+    levels = []
+    level = [subtree_uuid]
+    seen = set(level)
+    while level:
+        levels.append(sorted(level))
+        level = [
+            child for uuid in level for child in children[uuid] if child not in seen
+        ]
+        seen.update(level)
+    return levels
 
-    async def get_associated_org_funcs(
-        self, unit_uuids: List[str], funktionsnavne: List[str] = []
-    ):
-        if funktionsnavne == []:
-            return await tqdm.gather(
-                self.get_associated_org_func(uuid) for uuid in unit_uuids
-            )
-        return await tqdm.gather(
-            self.get_associated_org_func(uuid, f)
-            for uuid in unit_uuids
-            for f in funktionsnavne
+
+@dataclass
+class Plan:
+    """The objects to delete.
+
+    :param levels: The units of the subtree a level at a time, from the top.
+    :param functions: The organisation functions to delete, by funktionsnavn.
+    """
+
+    levels: List[List[str]]
+    functions: Dict[str, List[str]]
+
+    def steps(self) -> List[Tuple[str, str, List[str]]]:
+        """Return the steps of the plan, as description, LoRa path and UUIDs."""
+        steps = []
+        functions = sorted(uuid for uuids in self.functions.values() for uuid in uuids)
+        if functions:
+            steps.append(("organisation functions", FUNCTION_PATH, functions))
+        for depth, level in reversed(list(enumerate(self.levels))):
+            steps.append((f"units at depth {depth}", UNIT_PATH, level))
+        return steps
+
+    def describe(self) -> str:
+        lines = []
+        for number, (description, path, uuids) in enumerate(self.steps(), start=1):
+            lines.append(f"{number}. Delete {len(uuids)} {description} ({path})")
+            if path == FUNCTION_PATH:
+                for name, uuids in sorted(self.functions.items()):
+                    lines.append(f"     {name}: {len(uuids)}")
+        total = sum(len(uuids) for _, _, uuids in self.steps())
+        lines.append(f"In total {total} objects")
+        return "\n".join(lines)
+
+
+def _function_filter(delete_functions: bool, keep_functions: Iterable[str]):
+    keep = set(keep_functions)
+    return lambda funktionsnavn: delete_functions and funktionsnavn not in keep
+
+
+def plan_from_lora_cache(
+    lc, subtree_uuid: str, delete_functions: bool, keep_functions: Iterable[str] = ()
+) -> Plan:
+    """Plan the deletion from a populated, historic LoraCache."""
+    from exporters.sql_export.lora_cache import ORGANISATION_FUNCTIONS
+
+    today = datetime.date.today().isoformat()
+
+    def is_current(record):
+        return record["from_date"] <= today and (
+            record["to_date"] is None or today <= record["to_date"]
         )
 
-    async def deleter(self, path, uuid):
-        url = f"{self.mox_base}/{path}/{uuid}"
-        async with self.sem:
-            async with self.session.delete(url) as r:
-                r.raise_for_status()
-                return await r.json()
+    parents = {}
+    for uuid, validities in lc.units.items():
+        for unit in filter(is_current, validities):
+            parents[uuid] = unit["parent"]
+    levels = subtree_levels(parents, subtree_uuid)
+    subtree = set().union(*levels)
+
+    functions = defaultdict(list)
+    delete = _function_filter(delete_functions, keep_functions)
+    for funktionsnavn, (attribute, _, _) in ORGANISATION_FUNCTIONS.items():
+        if not delete(funktionsnavn) or not hasattr(lc, attribute):
+            continue
+        for uuid, validities in getattr(lc, attribute).items():
+            units = {
+                record.get(key)
+                for record in validities
+                for key in ("unit", "unit1_uuid", "unit2_uuid")
+            }
+            if units & subtree:
+                functions[funktionsnavn].append(uuid)
+    return Plan(levels, dict(functions))
 
-    async def delete_from_lora(self, uuids, path):
-        return await tqdm.gather(self.deleter(path, uuid) for uuid in uuids)
 
-    async def run(
-        self, subtree_uuid: str, delete_functions: bool, keep_functions: List[str] = []
+class SubtreeDeleter:
+    """Plan and execute the deletion of a subtree in LoRa.
+
+    :param session: The aiohttp session.
+    :param mox_base: The URL of LoRa.
+    :param connections: Number of requests in flight at a time.
+    :param attempts: Number of attempts for transient errors.
+    :param backoff: Delay in seconds before the first retry, doubled for every
+        following retry.
+    :param max_backoff: Upper bound of the delay in seconds.
+    :param journal: Journal of the deleted objects, or None.
+    :param page_size: Number of objects per page when reading LoRa.
+    """
+
+    def __init__(
+        self,
+        session,
+        mox_base: str,
+        connections: int = 4,
+        attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        journal: Optional[Journal] = None,
+        page_size: int = 1000,
     ):
-        org_uuid = await self.get_org_uuid()
-        tree = await self.get_tree(org_uuid)
-        subtree = self.find_subtree(subtree_uuid, tree)
+        self.session = session
+        self.mox_base = mox_base
+        self.connections = connections
+        # Full jitter, spreading out the retries of concurrent requests
+        self.retry = RetryPolicy(
+            attempts=attempts,
+            backoff=backoff,
+            max_backoff=max_backoff,
+            jitter=True,
+            logger=logger,
+        )
+        self.journal = journal
+        self.page_size = page_size
 
-        print("Deleting subtree for {}".format(subtree_uuid))
-        unit_uuids = self.get_tree_uuids(subtree)
-        await self.delete_from_lora(unit_uuids, "organisation/organisationenhed")
+    async def _with_retries(self, request, *args):
+        return await self.retry.run(request, *args, description=f"{args}")
 
-        if delete_functions:
-            print("Deleting associated org functions for subtree".format(subtree_uuid))
-            funktionsnavne = []
-            if keep_functions:
-                funktionsnavne = [f for f in all_functionnames if f not in keep_functions]
-            org_func_uuids = await self.get_associated_org_funcs(
-                unit_uuids, funktionsnavne=funktionsnavne
+    async def _get(self, path: str, params: dict) -> list:
+        async with self.session.get(f"{self.mox_base}/{path}", params=params) as r:
+            r.raise_for_status()
+            results = (await r.json())["results"]
+            return results[0] if results else []
+
+    async def read_all(self, path: str, params: dict):
+        """Read all objects of a LoRa search, a page at a time."""
+        params = dict(params, list=1, maximalantalresultater=self.page_size)
+        first = 0
+        while True:
+            page = await self._with_retries(
+                self._get, path, dict(params, foersteresultat=first)
             )
-            await self.delete_from_lora(
-                flatten(org_func_uuids), "organisation/organisationfunktion"
+            if not page:
+                return
+            for lora_object in page:
+                yield lora_object
+            first += self.page_size
+
+    async def read_parents(self) -> Dict[str, Optional[str]]:
+        """Read the current parent of every unit."""
+        today = datetime.date.today().isoformat()
+        params = {
+            "bvn": "%",
+            "virkningfra": today + " 00:00:00",
+            "virkningtil": today + " 00:00:01",
+        }
+        parents = {}
+        async for unit in self.read_all(UNIT_PATH, params):
+            overordnet = unit["registreringer"][0]["relationer"].get("overordnet", [])
+            parents[unit["id"]] = overordnet[0]["uuid"] if overordnet else None
+        return parents
+
+    async def read_functions(self, subtree: Set[str], delete) -> Dict[str, List[str]]:
+        """Read the functions referring to units of subtree, in a single scan.
+
+        :param subtree: The UUIDs of the units of the subtree.
+        :param delete: Whether to delete functions of a funktionsnavn.
+        """
+        params = {"bvn": "%", "virkningfra": "-infinity", "virkningtil": "infinity"}
+        functions = defaultdict(list)
+        async for function in self.read_all(FUNCTION_PATH, params):
+            registrering = function["registreringer"][0]
+            egenskaber = registrering["attributter"]["organisationfunktionegenskaber"]
+            funktionsnavn = egenskaber[0]["funktionsnavn"]
+            units = {
+                relation.get("uuid")
+                for relation in registrering["relationer"].get("tilknyttedeenheder", [])
+            }
+            if delete(funktionsnavn) and units & subtree:
+                functions[funktionsnavn].append(function["id"])
+        return dict(functions)
+
+    async def plan(
+        self,
+        subtree_uuid: str,
+        delete_functions: bool,
+        keep_functions: Iterable[str] = (),
+    ) -> Plan:
+        """Plan the deletion by paged scans of LoRa."""
+        levels = subtree_levels(await self.read_parents(), subtree_uuid)
+        functions = {}
+        if delete_functions:
+            functions = await self.read_functions(
+                set().union(*levels), _function_filter(delete_functions, keep_functions)
             )
+        return Plan(levels, functions)
+
+    async def _delete(self, path: str, uuid: str):
+        async with self.session.delete(f"{self.mox_base}/{path}/{uuid}") as r:
+            r.raise_for_status()
+
+    async def delete_all(self, path: str, uuids: List[str], description: str = ""):
+        """Delete the objects, raising DeletionError if any of them failed."""
+        failed = await submit_all(
+            uuids,
+            partial(self._with_retries, self._delete, path),
+            self.connections,
+            journal=self.journal,
+            description=description,
+            logger=logger,
+        )
+        if failed:
+            raise DeletionError(failed)
 
-        print("Done")
+    async def execute(self, plan: Plan):
+        for description, path, uuids in plan.steps():
+            await self.delete_all(path, uuids, description)
 
 
 @async_to_sync
 async def subtreedeleter_helper(
-    org_unit_uuid: str, delete_functions: bool = False, keep_functions: List[str] = [], connections: int = 4
+    org_unit_uuid: str,
+    delete_functions: bool = False,
+    keep_functions: List[str] = [],
+    connections: int = 4,
+    source: str = "lora",
+    dry_run: bool = False,
+    journal_path: Optional[str] = None,
+    attempts: int = 5,
 ) -> None:
     settings = load_settings()
     api_token = settings.get("crontab.SAML_TOKEN")
     timeout = aiohttp.ClientTimeout(total=None)
+    journal = Journal(journal_path) if journal_path else None
     async with aiohttp.ClientSession(timeout=timeout) as session:
         session.headers.update({"session": api_token})
-        deleter = SubtreeDeleter(session, org_unit_uuid, connections=connections)
-        await deleter.run(
-            org_unit_uuid, delete_functions, keep_functions=keep_functions
+        deleter = SubtreeDeleter(
+            session,
+            settings.get("mox.base"),
+            connections=connections,
+            attempts=attempts,
+            journal=journal,
         )
+        if source == "lora-cache":
+            from exporters.sql_export.lora_cache import LoraCache
+
+            lc = LoraCache(resolve_dar=False, full_history=True)
+            lc.populate_cache(
+                dry_run=True,
+                skip_associations="Tilknytning" in keep_functions,
+            )
+            plan = plan_from_lora_cache(
+                lc, org_unit_uuid, delete_functions, keep_functions
+            )
+        else:
+            plan = await deleter.plan(org_unit_uuid, delete_functions, keep_functions)
+
+        print("Deleting subtree for {}".format(org_unit_uuid))
+        print(plan.describe())
+        if dry_run:
+            return
+        try:
+            await deleter.execute(plan)
+        finally:
+            if journal is not None:
+                journal.close()
+    print("Done")
 
 
 @click.command()
@@ -171,9 +362,42 @@ async def subtreedeleter_helper(
 @click.option(
     "--connections",
     default=4,
-    help="The amount of concurrent requests made to OS2mo",
+    help="The amount of concurrent requests made to LoRa",
+)
+@click.option(
+    "--source",
+    type=click.Choice(["lora", "lora-cache"]),
+    default="lora",
+    help=(
+        "Read the subtree and functions from LoRa, "
+        "or from the historic LoraCache pickles in tmp/"
+    ),
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Print the plan without deleting anything"
+)
+@click.option(
+    "--journal",
+    type=click.Path(dir_okay=False),
+    help=(
+        "File of deleted UUIDs, which are skipped when the deletion is run again"
+    ),
 )
-def main(org_unit_uuid, delete_functions, keep, connections):
+@click.option(
+    "--attempts",
+    default=5,
+    help="Number of attempts of deletions failing with transient errors",
+)
+def main(
+    org_unit_uuid,
+    delete_functions,
+    keep,
+    connections,
+    source,
+    dry_run,
+    journal,
+    attempts,
+):
     """Delete an organisational unit and all units below.
 
     Given the uuid of an org_unit this will delete the unit and all units below it. Optionally also deletes organisationfunctions such as engagements, KLE and addresses.
@@ -181,7 +405,21 @@ def main(org_unit_uuid, delete_functions, keep, connections):
     Example:
         venv/bin/python tools/subtreedeleter.py --org-unit-uuid=c9b4c61f-1d38-5f6a-2c9e-d001e7cf6bd0 --delete-functions --keep=Leder --keep=KLE
     """
-    subtreedeleter_helper(org_unit_uuid, delete_functions, keep_functions=keep, connections=connections)
+    try:
+        subtreedeleter_helper(
+            org_unit_uuid,
+            delete_functions,
+            keep_functions=keep,
+            connections=connections,
+            source=source,
+            dry_run=dry_run,
+            journal_path=journal,
+            attempts=attempts,
+        )
+    except DeletionError as error:
+        raise click.ClickException(
+            "{}, see the log. Nothing above them was deleted".format(error)
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+import json
+import unittest
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from exporters.sql_export.sql_table_defs import (
+    Adresse,
+    Base,
+    Bruger,
+    Engagement,
+    Enhed,
+    Facet,
+    Klasse,
+    Leder,
+)
+from tools.consistency_checks import CHECKS, run_checks, snapshot_from_sql
+
+
+def validity(from_date="2020-01-01", to_date=None):
+    return {"from_date": from_date, "to_date": to_date}
+
+
+def fixture_cache():
+    """LoraCache shaped snapshot with one of every kind of finding."""
+    return SimpleNamespace(
+        facets={"engagement_type": {"user_key": "engagement_type"}},
+        classes={
+            "class1": {"user_key": "Ansat", "title": "Ansat",
+                       "facet": "engagement_type"},
+            "class2": {"user_key": "ansat", "title": "ansat",
+                       "facet": "engagement_type"},
+            "class3": {"user_key": "ansat", "title": "Ansat", "facet": "other"},
+            "email": {"user_key": "Email", "title": "Email", "facet": "address"},
+        },
+        users={
+            "user1": [dict(uuid="user1", cpr="0101011234", **validity())],
+            "user2": [dict(uuid="user2", cpr="0101011234", **validity())],
+            "user3": [
+                dict(uuid="user3", cpr="0202021234",
+                     **validity("2019-01-01", "2019-12-31")),
+                dict(uuid="user3", cpr="0202021234", **validity()),
+            ],
+        },
+        units={
+            "root": [dict(uuid="root", parent=None, **validity())],
+            "child": [dict(uuid="child", parent="root", **validity())],
+            "orphan": [dict(uuid="orphan", parent="gone", **validity())],
+        },
+        engagements={
+            "eng1": [
+                dict(uuid="eng1", user="user1", unit="root", user_key="1",
+                     **validity("2020-01-01", "2020-12-31")),
+                dict(uuid="eng1", user="user1", unit="root", user_key="1",
+                     **validity("2020-06-01", None)),
+            ],
+            "eng2": [dict(uuid="eng2", user="user3", unit="root", user_key="2",
+                          **validity("2020-01-01", "2020-12-31"))],
+            "eng3": [dict(uuid="eng3", user="user3", unit="child", user_key="2",
+                          **validity("2020-12-31", None))],
+            "eng4": [dict(uuid="eng4", user="user3", unit="child", user_key="2",
+                          **validity("2021-01-01", None))],
+        },
+        managers={
+            "man1": [dict(uuid="man1", user="user1", unit="root", **validity())],
+            "man2": [dict(uuid="man2", user="user1", unit="root",
+                          **validity("2021-01-01", None))],
+            "man3": [dict(uuid="man3", user="user1", unit="child", **validity())],
+            "vacant1": [dict(uuid="vacant1", user=None, unit="child", **validity())],
+            "vacant2": [dict(uuid="vacant2", user=None, unit="child", **validity())],
+        },
+        addresses={
+            "addr1": [dict(uuid="addr1", user="user1", unit=None,
+                           adresse_type="email", **validity())],
+            "addr2": [dict(uuid="addr2", user=None, unit="root",
+                           adresse_type="deleted", **validity())],
+        },
+    )
+
+
+EXPECTED = {
+    "duplicate_cpr": [{"users": ["user1", "user2"]}],
+    "duplicate_classes": [
+        {
+            "facet": "engagement_type",
+            "facet_user_key": "engagement_type",
+            "user_key": "ansat",
+            "classes": [
+                {"uuid": "class1", "title": "Ansat"},
+                {"uuid": "class2", "title": "ansat"},
+            ],
+        }
+    ],
+    "duplicate_managers": [
+        {"unit": "root", "user": "user1", "managers": ["man1", "man2"]}
+    ],
+    "overlapping_engagements": [
+        {
+            "reason": "overlapping validities",
+            "user": "user1",
+            "engagements": ["eng1"],
+            "validities": [
+                {"from": "2020-01-01", "to": "2020-12-31"},
+                {"from": "2020-06-01", "to": None},
+            ],
+        },
+        {
+            "reason": "same user key",
+            "user": "user3",
+            "user_key": "2",
+            "engagements": ["eng2", "eng3"],
+            "validities": [
+                {"from": "2020-01-01", "to": "2020-12-31"},
+                {"from": "2020-12-31", "to": None},
+            ],
+        },
+        {
+            "reason": "same user key",
+            "user": "user3",
+            "user_key": "2",
+            "engagements": ["eng3", "eng4"],
+            "validities": [
+                {"from": "2020-12-31", "to": None},
+                {"from": "2021-01-01", "to": None},
+            ],
+        },
+    ],
+    "orphaned_parents": [
+        {
+            "unit": "orphan",
+            "parent": "gone",
+            "validity": {"from": "2020-01-01", "to": None},
+        }
+    ],
+    "dangling_address_types": [
+        {
+            "address": "addr2",
+            "address_type": "deleted",
+            "user": None,
+            "unit": "root",
+            "validity": {"from": "2020-01-01", "to": None},
+        }
+    ],
+}
+
+
+def fixture_database(cache):
+    """Write the fixture cache to an in-memory actual state database."""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    def dates(row):
+        return {"startdato": row["from_date"], "slutdato": row["to_date"]}
+
+    session.add_all(
+        Facet(uuid=uuid, bvn=facet["user_key"]) for uuid, facet in cache.facets.items()
+    )
+    session.add_all(
+        Klasse(uuid=uuid, bvn=klasse["user_key"], titel=klasse["title"],
+               facet_uuid=klasse["facet"], facet_bvn="")
+        for uuid, klasse in cache.classes.items()
+    )
+    for validities in cache.users.values():
+        session.add_all(
+            Bruger(uuid=user["uuid"], bvn="", cpr=user["cpr"], **dates(user))
+            for user in validities
+        )
+    for validities in cache.units.values():
+        session.add_all(
+            Enhed(uuid=unit["uuid"], navn="", forældreenhed_uuid=unit["parent"],
+                  enhedstype_titel="", **dates(unit))
+            for unit in validities
+        )
+    for validities in cache.engagements.values():
+        session.add_all(
+            Engagement(uuid=eng["uuid"], bruger_uuid=eng["user"],
+                       enhed_uuid=eng["unit"], bvn=eng["user_key"],
+                       engagementstype_titel="", stillingsbetegnelse_titel="",
+                       **dates(eng))
+            for eng in validities
+        )
+    for validities in cache.managers.values():
+        session.add_all(
+            Leder(uuid=manager["uuid"], bruger_uuid=manager["user"],
+                  enhed_uuid=manager["unit"], ledertype_titel="",
+                  niveautype_titel="", **dates(manager))
+            for manager in validities
+        )
+    for validities in cache.addresses.values():
+        session.add_all(
+            Adresse(uuid=address["uuid"], bruger_uuid=address["user"],
+                    enhed_uuid=address["unit"],
+                    adressetype_uuid=address["adresse_type"],
+                    adressetype_bvn="", adressetype_scope="",
+                    adressetype_titel="", **dates(address))
+            for address in validities
+        )
+    session.commit()
+    return engine
+
+
+class TestConsistencyChecks(unittest.TestCase):
+    maxDiff = None
+
+    def test_checks(self):
+        findings = run_checks(fixture_cache())
+        self.assertEqual(findings, EXPECTED)
+        self.assertEqual(json.loads(json.dumps(findings)), EXPECTED)
+
+    def test_single_check(self):
+        findings = run_checks(fixture_cache(), ["orphaned_parents"])
+        self.assertEqual(list(findings), ["orphaned_parents"])
+
+    def test_consistent(self):
+        cache = fixture_cache()
+        cache.units = {"root": cache.units["root"]}
+        self.assertEqual(CHECKS["orphaned_parents"](cache), [])
+
+    def test_snapshot_from_sql(self):
+        cache = fixture_cache()
+        snapshot = snapshot_from_sql(fixture_database(cache))
+        self.assertEqual(run_checks(snapshot), EXPECTED)
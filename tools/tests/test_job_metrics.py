@@ -0,0 +1,94 @@
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from tools.job_metrics import run_job, to_textfile, write_textfile
+
+DUMMY_JOB = """
+import sys
+import time
+
+import requests
+
+from os2mo_helpers.request_metrics import hooks
+
+memory = bytearray(64 * 1024 * 1024)
+start = time.process_time()
+while time.process_time() - start < 0.2:
+    pass
+for path in ["/found"] * 3 + ["/missing"]:
+    requests.get(sys.argv[1] + path, hooks=hooks("mora"))
+requests.get(sys.argv[1] + "/found", hooks=hooks("lora"))
+sys.exit(3)
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == "/found" else 404)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestJobMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.url = "http://127.0.0.1:{}".format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_dummy_job(self):
+        metrics = run_job("exports_dummy", [sys.executable, "-c", DUMMY_JOB, self.url])
+        self.assertEqual(metrics.returncode, 3)
+        self.assertGreaterEqual(metrics.user_seconds + metrics.system_seconds, 0.2)
+        self.assertGreaterEqual(metrics.wall_seconds, 0.2)
+        self.assertGreaterEqual(metrics.max_rss_bytes, 64 * 1024 * 1024)
+        self.assertEqual(
+            {client: observed["responses"]
+             for client, observed in metrics.requests.items()},
+            {"mora": {"200": 3, "404": 1}, "lora": {"200": 1}},
+        )
+        self.assertEqual(sum(metrics.requests["mora"]["buckets"]), 4)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_textfile(metrics, directory)
+            self.assertEqual(path.name, "exports_dummy.prom")
+            self.assertEqual([p.name for p in Path(directory).iterdir()],
+                             ["exports_dummy.prom"])
+            lines = path.read_text().splitlines()
+        self.assertIn('mo_job_return_code{dipex_job="exports_dummy"} 3', lines)
+        self.assertIn(
+            'mo_job_http_responses'
+            '{dipex_job="exports_dummy",client="mora",code="404"} 1',
+            lines,
+        )
+        self.assertIn(
+            'mo_job_http_request_duration_seconds_bucket'
+            '{dipex_job="exports_dummy",client="mora",le="+Inf"} 4',
+            lines,
+        )
+        self.assertIn(
+            'mo_job_http_request_duration_seconds_count'
+            '{dipex_job="exports_dummy",client="lora"} 1',
+            lines,
+        )
+
+    def test_job_without_requests(self):
+        metrics = run_job("reports_dummy", ["true"])
+        self.assertEqual(metrics.returncode, 0)
+        self.assertEqual(metrics.requests, {})
+        textfile = to_textfile(metrics)
+        self.assertIn("# TYPE mo_job_wall_seconds gauge", textfile)
+        self.assertNotIn("mo_job_http_responses{", textfile)
@@ -0,0 +1,157 @@
+import unittest
+
+from tools.job_scheduler import (
+    EXPORTS,
+    IMPORTS,
+    JOBS,
+    REPORTS,
+    Job,
+    Scheduler,
+    dependencies,
+    enabled_jobs,
+)
+
+
+def sleeper(name, phase, seconds, exit_code=0, **kwargs):
+    """Job sleeping for seconds, then exiting with exit_code."""
+    command = ("sh", "-c", f"sleep {seconds}; echo {name}; exit {exit_code}")
+    return Job(name, phase, "RUN_" + name.upper(), command=command, **kwargs)
+
+
+def run(jobs, workers=4):
+    scheduler = Scheduler(jobs, workers=workers, echo=lambda line: None)
+    return scheduler.run(), scheduler
+
+
+def max_running(results):
+    """The largest number of jobs running at the same time."""
+    events = sorted(
+        [(result.start, 1) for result in results.values()]
+        + [(result.end, -1) for result in results.values()]
+    )
+    running = highest = 0
+    for _, change in events:
+        running += change
+        highest = max(highest, running)
+    return highest
+
+
+class TestJobScheduler(unittest.TestCase):
+    def assertBefore(self, results, first, second):
+        self.assertLessEqual(results[first].end, results[second].start)
+
+    def assertOverlap(self, results, first, second):
+        self.assertLess(results[first].start, results[second].end)
+        self.assertLess(results[second].start, results[first].end)
+
+    def test_independent_jobs_run_concurrently(self):
+        jobs = [
+            sleeper("import", IMPORTS, 0.2),
+            sleeper("export1", EXPORTS, 0.5),
+            sleeper("export2", EXPORTS, 0.5),
+            sleeper("report", REPORTS, 0.5),
+        ]
+        results, _ = run(jobs)
+        self.assertOverlap(results, "export1", "export2")
+        self.assertOverlap(results, "export1", "report")
+        self.assertOverlap(results, "export2", "report")
+        for name in ("export1", "export2", "report"):
+            self.assertBefore(results, "import", name)
+            self.assertEqual(results[name].status, "success")
+            self.assertEqual(results[name].output, name + "\n")
+
+    def test_worker_limit(self):
+        jobs = [sleeper(f"export{number}", EXPORTS, 0.3) for number in range(4)]
+        results, _ = run(jobs, workers=2)
+        self.assertEqual(max_running(results), 2)
+
+    def test_imports_run_in_sequence(self):
+        jobs = [sleeper(f"import{number}", IMPORTS, 0.1) for number in range(3)]
+        results, _ = run(jobs)
+        self.assertBefore(results, "import0", "import1")
+        self.assertBefore(results, "import1", "import2")
+
+    def test_after_and_locks(self):
+        jobs = [
+            sleeper("lc_db", EXPORTS, 0.3, locks=("lora-cache",)),
+            sleeper("sql", EXPORTS, 0.3, locks=("lora-cache",)),
+            sleeper("emus", EXPORTS, 0.1, after=("lc_db",)),
+            sleeper("other", EXPORTS, 0.1),
+        ]
+        results, _ = run(jobs)
+        self.assertBefore(results, "lc_db", "emus")
+        self.assertBefore(results, "lc_db", "sql")
+        self.assertOverlap(results, "other", "lc_db")
+
+    def test_failures(self):
+        jobs = [
+            sleeper("import1", IMPORTS, 0, exit_code=3),
+            sleeper("import2", IMPORTS, 0),
+            sleeper("export", EXPORTS, 0),
+        ]
+        results, scheduler = run(jobs)
+        self.assertEqual(
+            {name: result.status for name, result in results.items()},
+            {"import1": "failed", "import2": "skipped", "export": "skipped"},
+        )
+        self.assertEqual(results["import1"].returncode, 3)
+        self.assertEqual(
+            scheduler.phase_status(results),
+            {"IMPORTS_OK": False, "EXPORTS_OK": False, "REPORTS_OK": False},
+        )
+
+    def test_failed_export_only_skips_dependents(self):
+        jobs = [
+            sleeper("lc_db", EXPORTS, 0, exit_code=1),
+            sleeper("emus", EXPORTS, 0, after=("lc_db",)),
+            sleeper("os2sync", EXPORTS, 0),
+            sleeper("report", REPORTS, 0, required=False, exit_code=1),
+        ]
+        results, scheduler = run(jobs)
+        self.assertEqual(
+            {name: result.status for name, result in results.items()},
+            {"lc_db": "failed", "emus": "skipped", "os2sync": "success",
+             "report": "failed"},
+        )
+        self.assertEqual(
+            scheduler.phase_status(results),
+            {"IMPORTS_OK": True, "EXPORTS_OK": False, "REPORTS_OK": True},
+        )
+
+    def test_failed_backup_skips_everything(self):
+        jobs = [sleeper("import", IMPORTS, 0), sleeper("export", EXPORTS, 0)]
+        for jobs in (jobs, jobs[1:]):
+            scheduler = Scheduler(jobs, echo=lambda line: None, backup_ok=False)
+            results = scheduler.run()
+            self.assertEqual(
+                {result.status for result in results.values()}, {"skipped"}
+            )
+            self.assertEqual(
+                scheduler.phase_status(results),
+                {"IMPORTS_OK": False, "EXPORTS_OK": False, "REPORTS_OK": False},
+            )
+
+    def test_cyclic_dependencies(self):
+        jobs = [
+            sleeper("first", EXPORTS, 0, after=("second",)),
+            sleeper("second", EXPORTS, 0, after=("first",)),
+        ]
+        with self.assertRaises(ValueError):
+            run(jobs)
+
+    def test_job_table(self):
+        """The jobs refer to jobs and settings which exist."""
+        names = [job.name for job in JOBS]
+        self.assertEqual(len(names), len(set(names)))
+        for job in JOBS:
+            self.assertTrue(set(job.after) <= set(names))
+        settings = {"crontab." + job.switch: True for job in JOBS}
+        settings["crontab.RUN_MOX_DB_CLEAR"] = False
+        enabled = enabled_jobs(JOBS, settings)
+        self.assertEqual(len(enabled), len(JOBS) - 1)
+        # The job table has no cycles
+        after = dependencies(JOBS)
+        position = {name: index for index, name in enumerate(names)}
+        for name, before in after.items():
+            for dependency in before:
+                self.assertLess(position[dependency], position[name])
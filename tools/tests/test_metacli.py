@@ -0,0 +1,173 @@
+import importlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import click
+from click.testing import CliRunner
+
+import metacli
+
+COMMAND = """
+import click
+{imports}
+
+@click.command()
+@click.option("--name", help="Name to greet")
+@click.option("--shout/--no-shout")
+def {funcname}(name, shout):
+    \"\"\"{help}\"\"\"
+    click.echo("hello {{}}".format(name))
+"""
+
+
+class TestCommandIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Unique package name, as imported modules stay in sys.modules
+        self.package = "metacli_test_{}".format(id(self))
+        self.root = Path(self.directory.name)
+        (self.root / self.package).mkdir()
+        self.index_file = self.root / "index.json"
+        sys.path.insert(0, self.directory.name)
+        patches = [
+            patch.object(metacli, "ROOT_FOLDER", self.directory.name),
+            patch.object(metacli, "INDEX_FILE", str(self.index_file)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.imported = []
+        get_module_commands = metacli.MetaCLI._get_module_commands
+
+        def spy(cli, modpath):
+            self.imported.append(modpath.rsplit(".", 1)[-1])
+            return get_module_commands(cli, modpath)
+
+        p = patch.object(metacli.MetaCLI, "_get_module_commands", spy)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        for name in list(sys.modules):
+            if name.startswith(self.package):
+                del sys.modules[name]
+        self.directory.cleanup()
+
+    def write_module(self, name, content):
+        path = self.root / self.package / (name + ".py")
+        path.write_text(content)
+        importlib.invalidate_caches()
+        return path
+
+    def write_command(self, name, help="Greet someone", imports=""):
+        return self.write_module(
+            name, COMMAND.format(imports=imports, funcname="greet", help=help)
+        )
+
+    def commands(self):
+        """Build the command map as a fresh run of metacli would."""
+        self.imported = []
+        cli = metacli.MetaCLI()
+        ctx = click.Context(cli)
+        return {name: cli.get_command(ctx, name) for name in cli.list_commands(ctx)}
+
+    def index(self):
+        return json.loads(self.index_file.read_text())["files"]
+
+    def test_build_index(self):
+        self.write_command("hello")
+        self.write_module("plain", "VALUE = 1\n")
+
+        commands = self.commands()
+        self.assertEqual(list(commands), ["hello"])
+        self.assertEqual(self.imported, ["hello"])
+        self.assertEqual(commands["hello"].help, "Greet someone")
+        self.assertEqual(
+            [param.opts for param in commands["hello"].params],
+            [["--name"], ["--shout"]],
+        )
+
+        index = self.index()
+        self.assertEqual(len(index), 2)
+        entry = index[str(self.root / self.package / "hello.py")]
+        self.assertEqual(entry["modpath"], self.package + ".hello")
+        self.assertEqual([funcname for funcname, _ in entry["commands"]], ["greet"])
+
+    def test_cache_hit(self):
+        self.write_command("hello")
+        self.commands()
+        del sys.modules[self.package + ".hello"]
+
+        commands = self.commands()
+        self.assertEqual(self.imported, [])
+        self.assertNotIn(self.package + ".hello", sys.modules)
+        self.assertEqual(commands["hello"].help, "Greet someone")
+
+        # The module is imported when the command is run
+        result = CliRunner().invoke(metacli.MetaCLI(), ["hello", "--name", "index"])
+        self.assertEqual(result.output, "hello index\n")
+
+    def test_invalidation(self):
+        path = self.write_command("hello")
+        self.write_command("bye")
+        self.commands()
+
+        # A changed file is imported again
+        self.write_command("hello", help="Greet someone else")
+        os.utime(path, ns=(0, 0))
+        del sys.modules[self.package + ".hello"]
+        commands = self.commands()
+        self.assertEqual(self.imported, ["hello"])
+        self.assertEqual(commands["hello"].help, "Greet someone else")
+
+        # A removed file is removed from the index
+        path.unlink()
+        self.assertEqual(list(self.commands()), ["bye"])
+        self.assertEqual(len(self.index()), 1)
+
+    def test_failed_import_is_not_cached(self):
+        imports = "from {}.dependency import VALUE".format(self.package)
+        self.write_command("hello", imports=imports)
+        with self.assertLogs(metacli.logger, "ERROR"):
+            self.assertEqual(self.commands(), {})
+        self.assertFalse(self.index_file.exists())
+
+        # Still failing, the import is attempted again
+        with self.assertLogs(metacli.logger, "ERROR"):
+            self.commands()
+        self.assertEqual(self.imported, ["hello"])
+
+        # Once the dependency is installed, the command is found
+        self.write_module("dependency", "VALUE = 1\n")
+        self.assertEqual(list(self.commands()), ["hello"])
+        self.assertEqual(len(self.index()), 2)
+
+    def test_previously_failed_entry_is_dropped(self):
+        path = self.write_command("hello")
+        stat = path.stat()
+        # An index written before failed imports were left out
+        self.index_file.write_text(
+            json.dumps(
+                {
+                    "version": metacli.INDEX_VERSION,
+                    "files": {
+                        str(path): {
+                            "modname": "hello",
+                            "modpath": self.package + ".hello",
+                            "commands": [],
+                            "error": "ModuleNotFoundError()",
+                            "signature": [stat.st_mtime_ns, stat.st_size],
+                        }
+                    },
+                }
+            )
+        )
+        self.assertEqual(list(self.commands()), ["hello"])
+        self.assertEqual(self.imported, ["hello"])
+        self.assertNotIn("error", self.index()[str(path)])
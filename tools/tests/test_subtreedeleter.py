@@ -0,0 +1,244 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from tools.subtreedeleter import (
+    FUNCTION_PATH,
+    UNIT_PATH,
+    DeletionError,
+    Journal,
+    Plan,
+    SubtreeDeleter,
+    plan_from_lora_cache,
+)
+
+ORG = "org"
+SUBTREE = "unit-1"
+
+
+def generate_tree(depth=4, children=3):
+    """Units below the organisation, where unit-1 has a subtree of depth levels."""
+    parents = {"unit-0": ORG, SUBTREE: ORG, "unit-0-0": "unit-0"}
+    level = [SUBTREE]
+    for _ in range(depth):
+        level = [
+            f"{parent}-{number}" for parent in level for number in range(children)
+        ]
+        for uuid in level:
+            parents[uuid] = uuid.rsplit("-", 1)[0]
+    return parents
+
+
+def generate_functions(parents):
+    functions = {}
+    for unit in parents:
+        for funktionsnavn in ("Engagement", "Adresse", "KLE"):
+            functions[f"{funktionsnavn}-{unit}"] = (funktionsnavn, [unit])
+    functions["Relateret Enhed-1"] = ("Relateret Enhed", ["unit-0", "unit-1-2-2"])
+    return functions
+
+
+class LoRaStub:
+    """Serves a unit tree and functions, recording deletions.
+
+    A unit must not be deleted before the units below it, and the functions
+    referring to it. With snapshot, the deleted objects are still listed.
+    """
+
+    def __init__(self, parents, functions, errors=None, snapshot=False):
+        self.parents = parents
+        self.snapshot = snapshot
+        self.functions = functions
+        self.errors = {
+            uuid: list(statuses) for uuid, statuses in (errors or {}).items()
+        }
+        self.deleted = []
+        self.deletes = 0
+        self.violations = []
+
+    def listed(self, uuid):
+        return self.snapshot or uuid not in self.deleted
+
+    def page(self, request, objects):
+        first = int(request.query["foersteresultat"])
+        size = int(request.query["maximalantalresultater"])
+        return web.json_response({"results": [objects[first:first + size]]})
+
+    async def units(self, request):
+        return self.page(request, [
+            {"id": uuid,
+             "registreringer": [{"relationer": {"overordnet": [{"uuid": parent}]}}]}
+            for uuid, parent in self.parents.items() if self.listed(uuid)
+        ])
+
+    async def functions_(self, request):
+        assert request.query["virkningfra"] == "-infinity"
+        return self.page(request, [
+            {"id": uuid,
+             "registreringer": [{
+                 "attributter": {"organisationfunktionegenskaber": [
+                     {"funktionsnavn": funktionsnavn}
+                 ]},
+                 "relationer": {
+                     "tilknyttedeenheder": [{"uuid": unit} for unit in units]
+                 },
+             }]}
+            for uuid, (funktionsnavn, units) in self.functions.items()
+            if self.listed(uuid)
+        ])
+
+    async def delete(self, request):
+        self.deletes += 1
+        uuid = request.match_info["uuid"]
+        await asyncio.sleep(0.001)
+        statuses = self.errors.get(uuid)
+        if statuses:
+            return web.Response(status=statuses.pop(0))
+        if request.match_info["path"] == "organisationenhed":
+            children = [
+                child for child, parent in self.parents.items()
+                if parent == uuid and child not in self.deleted
+            ]
+            functions = [
+                function for function, (_, units) in self.functions.items()
+                if uuid in units and function not in self.deleted
+            ]
+            if children or functions:
+                self.violations.append(uuid)
+        self.deleted.append(uuid)
+        return web.json_response({"uuid": uuid})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/" + UNIT_PATH, self.units)
+        app.router.add_get("/" + FUNCTION_PATH, self.functions_)
+        app.router.add_delete("/organisation/{path}/{uuid}", self.delete)
+        return app
+
+
+class TestSubtreeDeleter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.parents = generate_tree()
+        self.functions = generate_functions(self.parents)
+        self.subtree = {uuid for uuid in self.parents if uuid.startswith(SUBTREE)}
+        self.journal_dir = tempfile.TemporaryDirectory()
+        self.journal_path = Path(self.journal_dir.name) / "journal"
+
+    async def asyncTearDown(self):
+        self.journal_dir.cleanup()
+
+    async def run_deleter(self, stub, execute=True, keep=(), **kwargs):
+        runner = web.AppRunner(stub.app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                deleter = SubtreeDeleter(
+                    session, f"http://127.0.0.1:{port}", connections=8,
+                    backoff=0, page_size=50, **kwargs
+                )
+                plan = await deleter.plan(SUBTREE, True, keep)
+                if execute:
+                    await deleter.execute(plan)
+                return plan
+        finally:
+            await runner.cleanup()
+
+    async def test_plan(self):
+        stub = LoRaStub(self.parents, self.functions)
+        plan = await self.run_deleter(stub, execute=False, keep=["KLE"])
+        self.assertEqual([len(level) for level in plan.levels], [1, 3, 9, 27, 81])
+        self.assertEqual(set().union(*plan.levels), self.subtree)
+        self.assertEqual(
+            {name: len(uuids) for name, uuids in plan.functions.items()},
+            {"Engagement": 121, "Adresse": 121, "Relateret Enhed": 1},
+        )
+        self.assertEqual(
+            [description for description, _, _ in plan.steps()],
+            ["organisation functions"]
+            + [f"units at depth {depth}" for depth in (4, 3, 2, 1, 0)],
+        )
+        self.assertIn("In total 364 objects", plan.describe())
+        self.assertEqual(stub.deleted, [])
+
+    async def test_delete_leaves_before_parents(self):
+        # Transient errors are retried
+        errors = {"unit-1-0": [503, 502], "Engagement-unit-1-2-1": [500]}
+        stub = LoRaStub(self.parents, self.functions, errors)
+        await self.run_deleter(stub)
+        self.assertEqual(stub.violations, [])
+        deleted_functions = {
+            uuid for uuid, (_, units) in self.functions.items()
+            if set(units) & self.subtree
+        }
+        self.assertEqual(set(stub.deleted), self.subtree | deleted_functions)
+        self.assertEqual(len(stub.deleted), len(set(stub.deleted)))
+        self.assertEqual(stub.deletes, len(stub.deleted) + 3)
+
+    async def test_resume_from_journal(self):
+        # A unit which cannot be deleted stops the deletion of its ancestors
+        stub = LoRaStub(self.parents, self.functions, {"unit-1-2-2-0": [400]})
+        with self.assertRaises(DeletionError) as context:
+            await self.run_deleter(stub, journal=Journal(self.journal_path))
+        self.assertEqual([uuid for uuid, _ in context.exception.failed],
+                         ["unit-1-2-2-0"])
+        self.assertIn("unit-1-2-2-1", stub.deleted)
+        self.assertNotIn("unit-1-2-2", stub.deleted)
+        self.assertNotIn(SUBTREE, stub.deleted)
+        self.assertEqual(stub.violations, [])
+
+        # Run again with the same journal, against a LoRa which still lists the
+        # deleted objects, so only the journal keeps them from being deleted again
+        journal = Journal(self.journal_path)
+        rerun = LoRaStub(self.parents, self.functions, snapshot=True)
+        rerun.deleted = list(stub.deleted)
+        await self.run_deleter(rerun, journal=journal)
+        self.assertEqual(rerun.violations, [])
+        # The failed unit at depth 3, and the units above it
+        self.assertEqual(rerun.deletes, 1 + 9 + 3 + 1)
+        self.assertEqual(set(rerun.deleted) & self.subtree, self.subtree)
+
+    def test_plan_from_lora_cache(self):
+        def validity(**record):
+            return dict(from_date="2000-01-01", to_date=None, **record)
+
+        lc = SimpleNamespace(
+            units={
+                uuid: [validity(uuid=uuid, parent=None if parent == ORG else parent)]
+                for uuid, parent in self.parents.items()
+            },
+            engagements={
+                uuid: [validity(uuid=uuid, unit=units[0])]
+                for uuid, (name, units) in self.functions.items()
+                if name == "Engagement"
+            },
+            kles={
+                uuid: [validity(uuid=uuid, unit=units[0])]
+                for uuid, (name, units) in self.functions.items() if name == "KLE"
+            },
+            related={
+                "Relateret Enhed-1": [validity(unit1_uuid="unit-0",
+                                               unit2_uuid="unit-1-2-2")]
+            },
+        )
+        # A unit moved out of the subtree in the past
+        lc.units["unit-0-0"].insert(
+            0, dict(uuid="unit-0-0", parent=SUBTREE, from_date="1999-01-01",
+                    to_date="1999-12-31")
+        )
+        plan = plan_from_lora_cache(lc, SUBTREE, True, keep_functions=["KLE"])
+        self.assertEqual(set().union(*plan.levels), self.subtree)
+        self.assertEqual(
+            {name: len(uuids) for name, uuids in plan.functions.items()},
+            {"Engagement": 121, "Relateret Enhed": 1},
+        )
+        plan = plan_from_lora_cache(lc, SUBTREE, False)
+        self.assertEqual(plan.functions, {})
+        self.assertEqual(Plan(plan.levels, {}).steps()[0][1], UNIT_PATH)